@@ -33,6 +33,9 @@ import logging
 from concurrent.futures import ThreadPoolExecutor
 import sys
 
+# Subcomandos da linha de comando não interativa do cnes_automator_fast.py
+SUBCOMANDOS_CLI = ('fetch', 'run', 'merge', 'combine', 'resume', 'bench')
+
 # Configuração de logging para acompanhar o progresso
 logging.basicConfig(
     level=logging.INFO,
@@ -764,7 +767,20 @@ class CNESMacrorregiaeMerger:
 def main():
     """
     Função principal do script - Processamento integrado ASSÍNCRONO de códigos CNES com mesclagem de macrorregião
+    
+    Com um subcomando (fetch, run, merge, combine, resume, bench), delega para a linha de
+    comando não interativa do cnes_automator_fast.py; outros argumentos são recusados
     """
+    if len(sys.argv) > 1:
+        if sys.argv[1] not in SUBCOMANDOS_CLI:
+            print(f"❌ Argumento não reconhecido: {sys.argv[1]}")
+            print(f"Uso: python cnes_automator.py [{' | '.join(SUBCOMANDOS_CLI)}] ... "
+                  f"(sem argumentos, modo interativo)")
+            sys.exit(2)
+        import cnes_automator_fast
+        cnes_automator_fast.main()
+        return
+    
     print("🏥 AUTOMATIZADOR DA API CNES - VERSÃO ASSÍNCRONA OTIMIZADA")
     print("🔗 Consulta detalhada por código de estabelecimento")
     print("🛠️ Correções: Processamento paralelo, otimizações de velocidade")
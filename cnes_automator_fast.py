@@ -10,7 +10,7 @@ OTIMIZAÇÕES IMPLEMENTADAS:
 - Processamento assíncrono com requisições simultâneas
 - Sistema de loading em tempo real com ETA
 - Pool de conexões otimizado
-- Backup incremental dos dados
+- Journal de checkpoint para retomar execuções interrompidas
 
 Autor: Script Automatizado
 Data: 2025
@@ -22,142 +22,284 @@ import asyncio
 import aiohttp
 import time
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Tuple
+import random
+import sqlite3
+import hashlib
+import tempfile
+import codecs
+import csv
+import glob
+import shutil
+import subprocess
+import zlib
+import bisect
+import collections
+import math
+import io
+import re
+import queue
+import atexit
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+from typing import List, Dict, Any, Tuple, Optional
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import sys
+import argparse
+
+# Substituições de emojis por equivalentes ASCII (usadas apenas no Windows)
+EMOJI_SUBSTITUICOES = {
+    '🏥': '[HOSPITAL]',
+    '📂': '[FOLDER]',
+    '✅': '[OK]',
+    '❌': '[ERROR]',
+    '🚀': '[ROCKET]',
+    '⚡': '[LIGHTNING]',
+    '📦': '[PACKAGE]',
+    '🔗': '[LINK]',
+    '🛠️': '[TOOLS]',
+    '🗺️': '[MAP]',
+    '📊': '[CHART]',
+    '⏱️': '[TIMER]',
+    '🔮': '[CRYSTAL]',
+    '📋': '[CLIPBOARD]',
+    '📁': '[FILE]',
+    '📈': '[GRAPH]',
+    '💾': '[DISK]',
+    '🔄': '[REFRESH]',
+    '🎉': '[PARTY]',
+    '⚠️': '[WARNING]',
+    '🗑️': '[TRASH]',
+    '🧩': '[SHARDS]',
+    '📡': '[METRICS]'
+}
+
+# Alguns emojis têm dois caracteres (ex.: '⚠️' = U+26A0 + U+FE0F), por isso uma única regex
+# com as alternativas mais longas primeiro, compilada uma vez, em vez de str.translate
+_EMOJI_PADRAO = re.compile('|'.join(
+    re.escape(emoji) for emoji in sorted(EMOJI_SUBSTITUICOES, key=len, reverse=True)
+))
+
+def _substituir_emoji(correspondencia: re.Match) -> str:
+    return EMOJI_SUBSTITUICOES[correspondencia.group(0)]
 
 def safe_log_message(message: str) -> str:
     """
     Sanitiza mensagens de log para compatibilidade com Windows
     Remove emojis problemáticos em sistemas que não suportam UTF-8
     """
-    if os.name == 'nt':  # Windows
-        # Substitui emojis por equivalentes ASCII
-        emoji_replacements = {
-            '🏥': '[HOSPITAL]',
-            '📂': '[FOLDER]',
-            '✅': '[OK]',
-            '❌': '[ERROR]',
-            '🚀': '[ROCKET]',
-            '⚡': '[LIGHTNING]',
-            '📦': '[PACKAGE]',
-            '🔗': '[LINK]',
-            '🛠️': '[TOOLS]',
-            '🗺️': '[MAP]',
-            '📊': '[CHART]',
-            '⏱️': '[TIMER]',
-            '🔮': '[CRYSTAL]',
-            '📋': '[CLIPBOARD]',
-            '📁': '[FILE]',
-            '📈': '[GRAPH]',
-            '💾': '[DISK]',
-            '🔄': '[REFRESH]',
-            '🎉': '[PARTY]',
-            '⚠️': '[WARNING]',
-            '🗑️': '[TRASH]'
-        }
-        
-        for emoji, replacement in emoji_replacements.items():
-            message = message.replace(emoji, replacement)
+    if os.name == 'nt' and not message.isascii():  # Windows
+        # Substitui emojis por equivalentes ASCII numa única passada
+        message = _EMOJI_PADRAO.sub(_substituir_emoji, message)
     
     return message
 
+def configurar_log_em_fila(logger: logging.Logger, *handlers: logging.Handler) -> QueueListener:
+    """
+    Liga os handlers ao logger através de uma fila: o logger só enfileira o registro e a
+    escrita em arquivo/console acontece numa thread separada, fora do caminho quente.
+    A thread é encerrada (descarregando a fila) ao final do programa.
+    
+    Args:
+        logger (logging.Logger): Logger que recebe o QueueHandler
+        *handlers (logging.Handler): Handlers de destino, já com formatter
+        
+    Returns:
+        QueueListener: Listener iniciado
+    """
+    fila_logs = queue.SimpleQueue()
+    handler_fila = QueueHandler(fila_logs)
+    # A formatação completa fica com os handlers de destino
+    handler_fila.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler_fila)
+    
+    listener = QueueListener(fila_logs, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 # Configuração de logging para acompanhar o progresso
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('cnes_automator.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+FORMATO_LOG = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+if not logging.getLogger().handlers:
+    logging.getLogger().setLevel(logging.INFO)
+    _handlers_log = [logging.FileHandler('cnes_automator.log', encoding='utf-8'), logging.StreamHandler()]
+    for _handler in _handlers_log:
+        _handler.setFormatter(FORMATO_LOG)
+    configurar_log_em_fila(logging.getLogger(), *_handlers_log)
 
 class ProgressTracker:
     """
     Classe para rastrear e exibir progresso em tempo real - VERSÃO APRIMORADA
+    
+    - update() só guarda os contadores e consulta o relógio: o custo é constante, não importa
+      quantas vezes seja chamado. Taxa, ETA, exibição e observadores são calculados no máximo
+      uma vez por intervalo
+    - A velocidade é uma média móvel exponencial (EWMA) da taxa de cada intervalo, com
+      constante de tempo de alguns segundos: acompanha a velocidade recente e o ETA reage a
+      mudanças (ex.: API ficando lenta), sem oscilar a cada resposta
+    - Em terminal (TTY), mostra a barra numa linha reescrita com '\r'; com a saída redirecionada
+      (cron, arquivo de log), registra uma linha estruturada (chave=valor) a cada intervalo maior
+    - Observadores (callbacks) recebem um dict com o estado a cada intervalo e no final
     """
     
-    def __init__(self, total_items: int, description: str = "Processando"):
+    INTERVALO_TERMINAL = 0.3
+    INTERVALO_LOG = 15.0
+    
+    def __init__(self, total_items: int, description: str = "Processando", interativo: Optional[bool] = None,
+                 intervalo: Optional[float] = None, constante_tempo: float = 5.0,
+                 observadores: Optional[List[Any]] = None):
+        """
+        Args:
+            total_items (int): Total de itens
+            description (str): Descrição exibida
+            interativo (bool): Barra no terminal (True) ou linhas de log (False)
+                (padrão: conforme sys.stdout seja um terminal)
+            intervalo (float): Segundos entre atualizações da exibição (padrão: 0.3 no terminal, 15 no log)
+            constante_tempo (float): Constante de tempo da EWMA da velocidade, em segundos
+            observadores (List[Callable[[Dict[str, Any]], None]]): Callbacks chamados com o
+                estado do progresso (ver estado())
+        """
         self.total_items = total_items
         self.processed_items = 0
         self.description = description
         self.start_time = time.time()
-        self.last_update = 0
         self.success_count = 0
         self.error_count = 0
-        self.last_rates = []  # Para calcular velocidade média dos últimos segundos
+        self.current_batch = None
+        self.total_batches = None
         
+        if interativo is None:
+            try:
+                interativo = sys.stdout.isatty()
+            except (AttributeError, ValueError):
+                interativo = False
+        self.interativo = interativo
+        self.intervalo = intervalo if intervalo is not None else (
+            self.INTERVALO_TERMINAL if interativo else self.INTERVALO_LOG
+        )
+        self.constante_tempo = constante_tempo
+        self.observadores = list(observadores or [])
+        
+        self._inicio = time.monotonic()
+        self._proxima_exibicao = self._inicio + self.intervalo
+        self._ultimo_instante = self._inicio
+        self._ultimos_processados = 0
+        self.taxa_ewma: Optional[float] = None
+        self._concluido = False
+    
+    def adicionar_observador(self, observador):
+        """
+        Registra um callback chamado com estado() a cada intervalo e ao final
+        """
+        self.observadores.append(observador)
+    
     def update(self, processed: int, current_batch: int = None, total_batches: int = None, 
                success_count: int = None, error_count: int = None):
         """
-        Atualiza o progresso e exibe informações detalhadas
+        Atualiza o progresso; a exibição e os observadores são atualizados no máximo uma vez por intervalo
         """
         self.processed_items = processed
-        current_time = time.time()
         
         # Atualiza contadores se fornecidos
         if success_count is not None:
             self.success_count = success_count
         if error_count is not None:
             self.error_count = error_count
+        if current_batch is not None:
+            self.current_batch = current_batch
+            self.total_batches = total_batches
         
-        # Atualiza a cada 0.3 segundos para feedback mais frequente
-        if current_time - self.last_update < 0.3 and processed < self.total_items:
+        agora = time.monotonic()
+        if agora >= self._proxima_exibicao or processed >= self.total_items:
+            self._proxima_exibicao = agora + self.intervalo
+            self._atualizar_taxa(agora)
+            self._exibir()
+    
+    def _atualizar_taxa(self, agora: float):
+        """
+        Atualiza a EWMA com a taxa desde o último cálculo; o peso da nova medida depende do
+        tempo decorrido (1 - e^(-dt/τ)), então intervalos irregulares não distorcem a média
+        """
+        decorrido = agora - self._ultimo_instante
+        if decorrido <= 0:
             return
-            
-        self.last_update = current_time
-        
-        # Calcula estatísticas
-        elapsed_time = current_time - self.start_time
-        remaining_items = self.total_items - processed
-        
-        if elapsed_time > 0:
-            current_rate = processed / elapsed_time
-            
-            # Mantém histórico das últimas 10 medições para velocidade mais estável
-            self.last_rates.append(current_rate)
-            if len(self.last_rates) > 10:
-                self.last_rates.pop(0)
-            
-            # Velocidade média das últimas medições
-            avg_rate = sum(self.last_rates) / len(self.last_rates)
-            
-            if avg_rate > 0:
-                eta_seconds = remaining_items / avg_rate
-                eta = str(timedelta(seconds=int(eta_seconds)))
-            else:
-                eta = "Calculando..."
+        taxa = (self.processed_items - self._ultimos_processados) / decorrido
+        if self.taxa_ewma is None:
+            self.taxa_ewma = taxa
         else:
-            avg_rate = 0
-            eta = "Calculando..."
+            peso = 1 - math.exp(-decorrido / self.constante_tempo)
+            self.taxa_ewma += peso * (taxa - self.taxa_ewma)
+        self._ultimo_instante = agora
+        self._ultimos_processados = self.processed_items
+    
+    def estado(self) -> Dict[str, Any]:
+        """
+        Estado atual do progresso (o que os observadores recebem)
+        """
+        decorrido = time.monotonic() - self._inicio
+        restantes = max(0, self.total_items - self.processed_items)
+        taxa = self.taxa_ewma or 0.0
+        return {
+            'descricao': self.description,
+            'processados': self.processed_items,
+            'total': self.total_items,
+            'percentual': round(self.processed_items / self.total_items * 100, 1) if self.total_items else 100.0,
+            'sucessos': self.success_count,
+            'erros': self.error_count,
+            'lote': self.current_batch,
+            'total_lotes': self.total_batches,
+            'taxa_instantanea': round(taxa, 2),
+            'taxa_media': round(self.processed_items / decorrido, 2) if decorrido > 0 else 0.0,
+            'eta_segundos': round(restantes / taxa, 1) if taxa > 0 else None,
+            'decorrido_segundos': round(decorrido, 1),
+            'concluido': self._concluido
+        }
+    
+    def _notificar(self, estado: Dict[str, Any]):
+        for observador in self.observadores:
+            try:
+                observador(estado)
+            except Exception as e:
+                logging.warning(safe_log_message(f"⚠️ Observador de progresso falhou: {e}"))
+    
+    def _exibir(self):
+        estado = self.estado()
+        self._notificar(estado)
+        eta = str(timedelta(seconds=int(estado['eta_segundos']))) if estado['eta_segundos'] is not None else None
         
-        # Calcula porcentagem
-        percentage = (processed / self.total_items) * 100
+        if not self.interativo:
+            # Uma linha por intervalo, fácil de filtrar (grep/awk) em logs de execuções agendadas
+            logging.info(safe_log_message(
+                f"{self.description} | processados={estado['processados']}/{estado['total']} "
+                f"percentual={estado['percentual']} taxa={estado['taxa_instantanea']}/s eta={eta or '-'} "
+                f"sucessos={estado['sucessos']} erros={estado['erros']}"
+            ))
+            return
+        
+        processed = self.processed_items
         
         # Cria barra de progresso mais detalhada
         bar_length = 40
-        filled_length = int(bar_length * processed // self.total_items)
+        filled_length = int(bar_length * processed // self.total_items) if self.total_items else bar_length
         bar = '█' * filled_length + '░' * (bar_length - filled_length)
         
         # Formata informações do lote se fornecidas
         batch_info = ""
-        if current_batch is not None and total_batches is not None:
-            batch_info = f" | Lote {current_batch}/{total_batches}"
+        if self.current_batch is not None and self.total_batches is not None:
+            batch_info = f" | Lote {self.current_batch}/{self.total_batches}"
         
         # Informações de sucesso/erro
         status_info = ""
         if self.success_count > 0 or self.error_count > 0:
             status_info = f" | ✅ {self.success_count} ❌ {self.error_count}"
         
-        # Estimativa de tempo formatada
-        eta_display = eta if eta != "Calculando..." else "⏳ Calc..."
-        
         # Monta a linha de progresso detalhada
         progress_line = (
             f"\r{self.description}: |{bar}| "
-            f"{processed:,}/{self.total_items:,} ({percentage:.1f}%) "
-            f"| Restam: {remaining_items:,} | {avg_rate:.1f}/s | ETA: {eta_display}{batch_info}{status_info}"
+            f"{processed:,}/{self.total_items:,} ({estado['percentual']:.1f}%) "
+            f"| Restam: {self.total_items - processed:,} | {estado['taxa_instantanea']:.1f}/s "
+            f"| ETA: {eta or '⏳ Calc...'}{batch_info}{status_info}"
         )
         
         # Limita o tamanho da linha para evitar problemas no terminal
@@ -176,8 +318,17 @@ class ProgressTracker:
         """
         Finaliza o progresso com estatísticas detalhadas
         """
-        elapsed_time = time.time() - self.start_time
+        elapsed_time = time.monotonic() - self._inicio
         rate = self.total_items / elapsed_time if elapsed_time > 0 else 0
+        self._concluido = True
+        self._notificar(self.estado())
+        
+        if not self.interativo:
+            logging.info(safe_log_message(
+                f"{self.description} | concluido total={self.total_items} tempo={elapsed_time:.1f}s "
+                f"taxa_media={rate:.1f}/s sucessos={self.success_count} erros={self.error_count}"
+            ))
+            return
         
         print(f"\n✅ {self.description} concluído!")
         print(f"📊 Total processado: {self.total_items:,}")
@@ -193,647 +344,6678 @@ class ProgressTracker:
 
 class DateTimeEncoder(json.JSONEncoder):
     """
-    Encoder customizado para serializar objetos datetime
+    Encoder customizado para serializar objetos datetime e EstabelecimentoCNES (como em para_dict())
     """
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.isoformat()
+        if isinstance(obj, EstabelecimentoCNES):
+            return obj.para_dict()
         return super().default(obj)
 
-class CNESAPIAutomator:
+class JSONCodec:
     """
-    Classe principal para automatizar consultas na API CNES - VERSÃO ASSÍNCRONA OTIMIZADA
+    Serialização JSON com o backend mais rápido instalado: orjson, msgspec ou o módulo json
+    da biblioteca padrão (sempre disponível).
+    
+    Em qualquer backend a saída é UTF-8 sem escapes de caracteres não-ASCII, datetimes viram
+    ISO 8601 (nativamente no orjson/msgspec, via DateTimeEncoder no json) e, com indentação,
+    o layout é o mesmo de json.dumps(..., indent=2). Valores que o backend rápido não aceita
+    (ex.: inteiros acima de 64 bits ou chaves não-string no orjson) são serializados pelo json.
+    A única diferença de bytes conhecida são floats em notação exponencial (1e16 x 1e+16).
     """
     
-    def __init__(self, concurrent_requests: int = 10, delay_between_batches: float = 0.5):
+    BACKENDS = ('orjson', 'msgspec', 'json')
+    
+    def __init__(self, backend: Optional[str] = None):
         """
-        Inicializa o automatizador assíncrono
-        
         Args:
-            concurrent_requests (int): Número de requisições simultâneas (padrão: 10)
-            delay_between_batches (float): Tempo de espera entre lotes (padrão: 0.5s)
+            backend (str): 'orjson', 'msgspec' ou 'json' (padrão: o primeiro instalado)
         """
-        self.base_url = "https://apidadosabertos.saude.gov.br/cnes/estabelecimentos"
-        self.concurrent_requests = concurrent_requests
-        self.delay_between_batches = delay_between_batches
+        if backend is None:
+            backend = next(nome for nome in self.BACKENDS if self.disponivel(nome))
+        elif backend not in self.BACKENDS:
+            raise ValueError(f"Backend JSON inválido: {backend}")
+        elif not self.disponivel(backend):
+            raise ValueError(f"Backend JSON não instalado: {backend}")
         
-        # Headers para as requisições
-        self.headers = {
-            'User-Agent': 'CNES-Automator/2.0-AsyncOptimized-WithProgress',
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
+        self.backend = backend
+        if backend == 'orjson':
+            import orjson
+            self._orjson = orjson
+        elif backend == 'msgspec':
+            import msgspec
+            self._msgspec = msgspec
+            self._encoder = msgspec.json.Encoder()
+            self._decoder = msgspec.json.Decoder()
+    
+    @staticmethod
+    def disponivel(backend: str) -> bool:
+        """
+        Indica se o backend pode ser importado
+        """
+        if backend == 'json':
+            return True
+        try:
+            __import__(backend)
+            return True
+        except ImportError:
+            return False
+    
+    def loads(self, dados: Any) -> Any:
+        """
+        Desserializa JSON de bytes ou str. Erros de sintaxe levantam ValueError
+        """
+        if self.backend == 'orjson':
+            return self._orjson.loads(dados)
+        if self.backend == 'msgspec':
+            return self._decoder.decode(dados)
+        return json.loads(dados)
+    
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        """
+        Serializa para bytes UTF-8: compacto (sem espaços) ou com indentação de 2 espaços
+        """
+        try:
+            if self.backend == 'orjson':
+                return self._orjson.dumps(obj, option=self._orjson.OPT_INDENT_2 if indent else 0)
+            if self.backend == 'msgspec':
+                dados = self._encoder.encode(obj)
+                return self._msgspec.json.format(dados, indent=2) if indent else dados
+        except (TypeError, ValueError, OverflowError):
+            pass
         
-        # Estatísticas da execução
-        self.stats = {
-            'total_requisicoes': 0,
-            'sucessos': 0,
-            'erros': 0,
-            'codigos_invalidos': 0,
-            'erros_conexao': 0,
-            'inicio_execucao': None,
-            'fim_execucao': None
-        }
+        if indent:
+            texto = json.dumps(obj, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
+        else:
+            texto = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), cls=DateTimeEncoder)
+        return texto.encode('utf-8')
+
+# Codec usado em todos os caminhos de leitura/escrita (ver definir_backend_json)
+CODEC_JSON = JSONCodec()
 
-    def carregar_codigos_cnes(self, arquivo_entrada: str) -> List[str]:
+def definir_backend_json(backend: Optional[str]):
+    """
+    Troca o backend JSON usado pelo script (None = o mais rápido instalado)
+    """
+    global CODEC_JSON
+    CODEC_JSON = JSONCodec(backend)
+
+class TokenBucketRateLimiter:
+    """
+    Limitador de taxa no formato token bucket: garante uma média de requisições por segundo,
+    permitindo rajadas curtas de até `capacidade` requisições
+    """
+    
+    def __init__(self, taxa_por_segundo: float, capacidade: Optional[float] = None):
         """
-        Carrega a lista de códigos CNES de um arquivo JSON
-        
         Args:
-            arquivo_entrada (str): Caminho para o arquivo JSON com os códigos
-            
-        Returns:
-            List[str]: Lista de códigos CNES
+            taxa_por_segundo (float): Taxa alvo de requisições por segundo
+            capacidade (float): Tamanho máximo da rajada (padrão: 1 segundo de taxa, mínimo 1)
         """
-        logging.info(safe_log_message(f"📂 Carregando códigos CNES do arquivo: {arquivo_entrada}"))
+        if taxa_por_segundo <= 0:
+            raise ValueError("A taxa de requisições por segundo deve ser positiva")
         
-        try:
-            with open(arquivo_entrada, 'r', encoding='utf-8') as arquivo:
-                dados = json.load(arquivo)
-            
-            # Extrai os códigos CNES do arquivo
-            codigos = []
-            
-            # Se for uma lista de objetos com campo 'codigo_cnes'
-            if isinstance(dados, list):
-                for item in dados:
-                    if isinstance(item, dict) and 'codigo_cnes' in item:
-                        codigos.append(str(item['codigo_cnes']))
-                    elif isinstance(item, (str, int)):
-                        codigos.append(str(item))
-            
-            # Se for um objeto com campo 'estabelecimentos'
-            elif isinstance(dados, dict):
-                if 'estabelecimentos' in dados:
-                    for estabelecimento in dados['estabelecimentos']:
-                        if 'codigo_cnes' in estabelecimento:
-                            codigos.append(str(estabelecimento['codigo_cnes']))
-                elif 'codigo_cnes' in dados:
-                    codigos.append(str(dados['codigo_cnes']))
-                elif 'codigos' in dados:
-                    codigos.extend([str(codigo) for codigo in dados['codigos']])
-            
-            # Remove duplicatas e códigos vazios
-            codigos = list(set([codigo for codigo in codigos if codigo.strip()]))
-            
-            logging.info(safe_log_message(f"✅ Carregados {len(codigos)} códigos CNES únicos"))
-            
-            if not codigos:
-                raise ValueError("Nenhum código CNES válido encontrado no arquivo")
-            
-            return codigos
-            
-        except Exception as e:
-            logging.error(safe_log_message(f"❌ Erro ao carregar arquivo: {e}"))
-            raise
-
-    async def consultar_estabelecimento_async(self, session: aiohttp.ClientSession, codigo_cnes: str) -> Tuple[bool, Dict[str, Any]]:
+        self.taxa_por_segundo = taxa_por_segundo
+        self.capacidade = capacidade if capacidade is not None else max(taxa_por_segundo, 1.0)
+        self.tokens = self.capacidade
+        self.ultimo_abastecimento = time.monotonic()
+        self.tempo_total_espera = 0.0
+        self._lock = None
+    
+    def _abastecer(self):
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.ultimo_abastecimento) * self.taxa_por_segundo)
+        self.ultimo_abastecimento = agora
+    
+    async def adquirir(self):
         """
-        Consulta um estabelecimento específico na API CNES de forma assíncrona
-        
-        Args:
-            session (aiohttp.ClientSession): Sessão HTTP assíncrona
-            codigo_cnes (str): Código CNES do estabelecimento
-            
-        Returns:
-            Tuple[bool, Dict]: (sucesso, dados_ou_erro)
+        Aguarda até haver um token disponível e o consome (ordem de chegada preservada)
         """
-        url = f"{self.base_url}/{codigo_cnes}"
+        # Criado sob demanda para ficar associado ao event loop em execução
+        if self._lock is None:
+            self._lock = asyncio.Lock()
         
-        try:
-            # Incrementa contador de requisições
-            self.stats['total_requisicoes'] += 1
-            
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
-                if response.status == 200:
-                    try:
-                        dados = await response.json()
-                        
-                        # Adiciona metadados ao estabelecimento
-                        if isinstance(dados, dict):
-                            dados['_metadata'] = {
-                                'consultado_em': datetime.now().isoformat(),
-                                'codigo_cnes_consultado': codigo_cnes,
-                                'url_consultada': url
-                            }
-                        
-                        self.stats['sucessos'] += 1
-                        return True, dados
-                        
-                    except Exception as json_error:
-                        erro = {
-                            'codigo_cnes': codigo_cnes,
-                            'erro': 'Resposta não é um JSON válido',
-                            'status_code': response.status,
-                            'detalhes': str(json_error)
-                        }
-                        self.stats['erros'] += 1
-                        return False, erro
-                        
-                elif response.status == 404:
-                    erro = {
-                        'codigo_cnes': codigo_cnes,
-                        'erro': 'Código CNES não encontrado',
-                        'status_code': 404,
-                        'url_consultada': url
-                    }
-                    self.stats['codigos_invalidos'] += 1
-                    return False, erro
-                    
-                else:
-                    erro = {
-                        'codigo_cnes': codigo_cnes,
-                        'erro': f'Erro HTTP {response.status}',
-                        'status_code': response.status,
-                        'url_consultada': url
-                    }
-                    self.stats['erros'] += 1
-                    return False, erro
-                    
-        except asyncio.TimeoutError:
-            erro = {
-                'codigo_cnes': codigo_cnes,
-                'erro': 'Timeout na requisição',
-                'detalhes': 'A requisição demorou mais que 15 segundos',
-                'url_consultada': url
-            }
-            self.stats['erros_conexao'] += 1
-            return False, erro
-            
-        except Exception as e:
-            erro = {
-                'codigo_cnes': codigo_cnes,
-                'erro': 'Erro inesperado',
-                'detalhes': str(e),
-                'url_consultada': url
-            }
-            self.stats['erros'] += 1
-            return False, erro
+        async with self._lock:
+            self._abastecer()
+            if self.tokens < 1:
+                espera = (1 - self.tokens) / self.taxa_por_segundo
+                self.tempo_total_espera += espera
+                await asyncio.sleep(espera)
+                self._abastecer()
+            self.tokens -= 1
+    
+    def tentar_adquirir(self) -> bool:
+        """
+        Consome um token se houver um disponível agora, sem esperar nem furar a fila de quem espera
+        """
+        if self._lock is not None and self._lock.locked():
+            return False
+        self._abastecer()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'requisicoes_por_segundo_alvo': self.taxa_por_segundo,
+            'capacidade_rajada': self.capacidade,
+            'tempo_total_espera_segundos': round(self.tempo_total_espera, 2)
+        }
 
-    async def processar_lote_codigos(self, session: aiohttp.ClientSession, codigos_lote: List[str]) -> List[Tuple[bool, Dict[str, Any]]]:
+class AdaptiveConcurrencyController:
+    """
+    Controla quantas requisições podem estar em andamento ao mesmo tempo (AIMD).
+    
+    - Aumento aditivo: a cada janela de respostas (do tamanho do limite atual) com alta taxa
+      de 2xx/404 e latência estável, o limite sobe em 1
+    - Redução multiplicativa: respostas 429/5xx e timeouts multiplicam o limite por
+      `fator_reducao`, no máximo uma vez por janela de latência
+    
+    Com `adaptativo=False` funciona como um semáforo comum de tamanho fixo.
+    """
+    
+    def __init__(self, limite_inicial: int, limite_minimo: int = 1, limite_maximo: Optional[int] = None,
+                 adaptativo: bool = True, fator_reducao: float = 0.5, taxa_sucesso_minima: float = 0.95,
+                 tolerancia_latencia: float = 1.5):
         """
-        Processa um lote de códigos CNES de forma assíncrona
+        Args:
+            limite_inicial (int): Concorrência inicial
+            limite_minimo (int): Menor concorrência permitida
+            limite_maximo (int): Maior concorrência permitida (padrão: limite_inicial)
+            adaptativo (bool): Se False, o limite nunca muda
+            fator_reducao (float): Fator multiplicativo aplicado em sinais de congestionamento
+            taxa_sucesso_minima (float): Fração mínima de respostas saudáveis na janela para aumentar
+            tolerancia_latencia (float): Quanto a latência média da janela pode exceder a
+                latência de referência e ainda ser considerada estável
         """
-        tarefas = []
-        for codigo in codigos_lote:
-            tarefa = self.consultar_estabelecimento_async(session, codigo)
-            tarefas.append(tarefa)
+        self.limite_maximo = max(limite_maximo if limite_maximo is not None else limite_inicial, limite_inicial)
+        self.limite_minimo = max(1, min(limite_minimo, limite_inicial))
+        self.limite = float(limite_inicial)
+        self.limite_inicial = limite_inicial
+        self.adaptativo = adaptativo
+        self.fator_reducao = fator_reducao
+        self.taxa_sucesso_minima = taxa_sucesso_minima
+        self.tolerancia_latencia = tolerancia_latencia
         
-        # Executa todas as tarefas do lote simultaneamente
-        resultados = await asyncio.gather(*tarefas, return_exceptions=True)
+        self.em_uso = 0
+        self.latencia_referencia = None
+        self.ultima_reducao = 0.0
+        self.aumentos = 0
+        self.reducoes = 0
+        self.limite_minimo_observado = limite_inicial
+        self.limite_maximo_observado = limite_inicial
         
-        # Processa exceções
-        resultados_limpos = []
-        for i, resultado in enumerate(resultados):
-            if isinstance(resultado, Exception):
-                erro = {
-                    'codigo_cnes': codigos_lote[i],
-                    'erro': 'Exceção durante processamento',
-                    'detalhes': str(resultado)
-                }
-                resultados_limpos.append((False, erro))
-            else:
-                resultados_limpos.append(resultado)
+        # Janela atual de observações
+        self._janela_total = 0
+        self._janela_saudaveis = 0
+        self._janela_soma_latencia = 0.0
+        self._condicao = None
+        # Esperas de ocupar_com_prioridade, atendidas antes das requisições comuns
+        self._prioritarias = 0
+    
+    @staticmethod
+    def sinal_congestionamento(status: Optional[int]) -> bool:
+        """
+        Indica se o resultado de uma requisição sinaliza sobrecarga da API
         
-        return resultados_limpos
-
-    def salvar_backup_incremental(self, estabelecimentos: List[Dict], erros: List[Dict], arquivo_backup: str):
+        Args:
+            status (Optional[int]): Status HTTP, ou None para timeout/erro de conexão
+        """
+        return status is None or status == 429 or status >= 500
+    
+    def _obter_condicao(self) -> asyncio.Condition:
+        if self._condicao is None:
+            self._condicao = asyncio.Condition()
+        return self._condicao
+    
+    async def __aenter__(self):
+        condicao = self._obter_condicao()
+        async with condicao:
+            await condicao.wait_for(lambda: self.em_uso + self._prioritarias < int(self.limite))
+            self.em_uso += 1
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.liberar()
+    
+    def tentar_ocupar(self) -> bool:
+        """
+        Ocupa uma vaga se houver uma livre agora, sem esperar (liberada depois com liberar());
+        como no `async with`, as vagas reservadas a ocupar_com_prioridade não contam como livres
         """
-        Salva backup incremental dos dados durante o processamento
+        if self.em_uso + self._prioritarias >= int(self.limite):
+            return False
+        self.em_uso += 1
+        return True
+    
+    async def ocupar_com_prioridade(self):
+        """
+        Ocupa a próxima vaga que abrir, à frente das requisições comuns que estão esperando
+        (liberada depois com liberar())
         """
+        condicao = self._obter_condicao()
+        self._prioritarias += 1
         try:
-            dados_backup = {
-                'timestamp_backup': datetime.now().isoformat(),
-                'estabelecimentos_processados': len(estabelecimentos),
-                'erros_encontrados': len(erros),
-                'estabelecimentos': estabelecimentos,
-                'erros': erros
-            }
-            
-            with open(arquivo_backup, 'w', encoding='utf-8') as arquivo:
-                json.dump(dados_backup, arquivo, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
-                
-        except Exception as e:
-            logging.warning(f"⚠️ Erro ao salvar backup: {e}")
-
-    async def processar_lista_codigos(self, codigos_cnes: List[str]) -> Dict[str, Any]:
+            async with condicao:
+                await condicao.wait_for(lambda: self.em_uso < int(self.limite))
+                self.em_uso += 1
+        finally:
+            self._prioritarias -= 1
+            # As requisições comuns retidas por esta espera voltam a disputar as vagas
+            async with condicao:
+                condicao.notify_all()
+    
+    async def liberar(self):
         """
-        Processa uma lista de códigos CNES de forma assíncrona otimizada com loading em tempo real
+        Devolve uma vaga ocupada com `async with`, tentar_ocupar() ou ocupar_com_prioridade()
+        """
+        # Descontada antes de aguardar a condição, para que um cancelamento não vaze a vaga
+        self.em_uso -= 1
+        condicao = self._obter_condicao()
+        async with condicao:
+            if self._prioritarias:
+                # A espera prioritária pode não estar entre as primeiras da fila
+                condicao.notify_all()
+            else:
+                # Libera quantas vagas o limite (possivelmente aumentado) permitir
+                condicao.notify(max(int(self.limite) - self.em_uso, 0))
+    
+    def registrar_resposta(self, status: Optional[int], latencia: float):
+        """
+        Alimenta o controlador com o resultado de uma requisição
         
         Args:
-            codigos_cnes (List[str]): Lista de códigos CNES para consultar
-            
-        Returns:
-            Dict[str, Any]: Dados consolidados com estabelecimentos e erros
+            status (Optional[int]): Status HTTP, ou None para timeout/erro de conexão
+            latencia (float): Latência da requisição em segundos
         """
-        # Exibe informações iniciais detalhadas
-        print("=" * 60)
-        print("🚀 CNES AUTOMATOR - PROCESSAMENTO ASSÍNCRONO OTIMIZADO")
-        print("=" * 60)
-        print(f"📋 Total de códigos CNES: {len(codigos_cnes):,}")
-        print(f"⚡ Requisições simultâneas: {self.concurrent_requests}")
-        print(f"⏱️ Delay entre lotes: {self.delay_between_batches}s")
-        
-        # Calcula estimativa inicial
-        estimativa_tempo = len(codigos_cnes) / (self.concurrent_requests * (1/self.delay_between_batches))
-        print(f"🔮 Tempo estimado: ~{estimativa_tempo:.1f}s ({timedelta(seconds=int(estimativa_tempo))})")
+        if not self.adaptativo:
+            return
         
-        # Divide os códigos em lotes
-        lotes = []
-        for i in range(0, len(codigos_cnes), self.concurrent_requests):
-            lote = codigos_cnes[i:i + self.concurrent_requests]
-            lotes.append(lote)
+        agora = time.monotonic()
         
-        print(f"📦 Dividido em {len(lotes)} lotes")
-        print("=" * 60)
+        if self.sinal_congestionamento(status):
+            # Reduz no máximo uma vez por janela de latência, pois as falhas de uma mesma
+            # rajada chegam quase juntas e não devem derrubar o limite várias vezes
+            janela_latencia = self.latencia_referencia or latencia
+            if agora - self.ultima_reducao >= janela_latencia:
+                self.limite = max(float(self.limite_minimo), self.limite * self.fator_reducao)
+                self.ultima_reducao = agora
+                self.reducoes += 1
+                self.limite_minimo_observado = min(self.limite_minimo_observado, int(self.limite))
+            self._reiniciar_janela()
+            return
         
-        logging.info(safe_log_message(f"🚀 Iniciando processamento assíncrono de {len(codigos_cnes)} códigos CNES"))
-        logging.info(safe_log_message(f"⚡ Configuração: {self.concurrent_requests} requisições simultâneas"))
+        self._janela_total += 1
+        self._janela_saudaveis += 1 if status < 400 or status == 404 else 0
+        self._janela_soma_latencia += latencia
         
-        self.stats['inicio_execucao'] = datetime.now().isoformat()
+        if self._janela_total < max(int(self.limite), 1):
+            return
         
-        # Estruturas para armazenar resultados
-        estabelecimentos_validos = []
-        erros_encontrados = []
+        latencia_media = self._janela_soma_latencia / self._janela_total
+        taxa_saudavel = self._janela_saudaveis / self._janela_total
         
-        # Arquivo de backup incremental
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        arquivo_backup = f"cnes_backup_{timestamp}.json"
+        if self.latencia_referencia is None or latencia_media < self.latencia_referencia:
+            self.latencia_referencia = latencia_media
+        else:
+            # Acompanha lentamente mudanças duradouras na latência da API
+            self.latencia_referencia = self.latencia_referencia * 0.95 + latencia_media * 0.05
         
-        logging.info(safe_log_message(f"📦 Dividido em {len(lotes)} lotes para processamento"))
+        latencia_estavel = latencia_media <= self.latencia_referencia * self.tolerancia_latencia
+        if taxa_saudavel >= self.taxa_sucesso_minima and latencia_estavel and self.limite < self.limite_maximo:
+            self.limite = min(float(self.limite_maximo), self.limite + 1)
+            self.aumentos += 1
+            self.limite_maximo_observado = max(self.limite_maximo_observado, int(self.limite))
+        
+        self._reiniciar_janela()
+    
+    def _reiniciar_janela(self):
+        self._janela_total = 0
+        self._janela_saudaveis = 0
+        self._janela_soma_latencia = 0.0
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'adaptativa': self.adaptativo,
+            'limite_inicial': self.limite_inicial,
+            'limite_final': int(self.limite),
+            'limite_minimo': self.limite_minimo,
+            'limite_maximo': self.limite_maximo,
+            'menor_limite_atingido': self.limite_minimo_observado,
+            'maior_limite_atingido': self.limite_maximo_observado,
+            'aumentos': self.aumentos,
+            'reducoes': self.reducoes,
+            'latencia_referencia_ms': round(self.latencia_referencia * 1000, 1) if self.latencia_referencia else None
+        }
+
+class AdaptiveTimeout:
+    """
+    Timeout por requisição calculado a partir das latências recentes, em vez de um valor fixo:
+        
+        timeout = percentil(janela) * multiplicador, limitado a [piso, teto]
+    
+    Com p99 de 800 ms, uma requisição travada libera sua vaga em ~2,4 s em vez de 15 s. As
+    requisições cortadas não entram no percentil (a latência delas é desconhecida), mas se a
+    fração de cortes entre as respostas recentes passar de `taxa_cortes_maxima`, a API ficou
+    lenta de verdade e o timeout dobra a cada recálculo, até o teto. Até juntar
+    `amostras_minimas` latências, e com `adaptativo=False`, o timeout é o teto.
+    
+    A tentativa seguinte a um corte usa o dobro do timeout (por corte anterior), para que uma
+    resposta só um pouco mais lenta que o normal não seja cortada de novo.
+    
+    O mesmo recálculo guarda em `referencia_hedge` o `percentil_hedge` da janela, usado como
+    atraso das requisições duplicadas (ver HedgePolicy).
+    """
+    
+    __slots__ = ('piso', 'teto', 'percentil', 'multiplicador', 'amostras_minimas', 'taxa_cortes_maxima',
+                 'adaptativo', 'percentil_hedge', 'referencia_hedge', '_janela', '_cortes_recentes', '_atual',
+                 '_desde_calculo', 'cortes')
+    
+    # Registros entre dois recálculos do percentil (ordenar a janela a cada resposta é desnecessário)
+    RECALCULAR_A_CADA = 10
+    
+    def __init__(self, piso: float = 2.0, teto: float = 15.0, percentil: float = 0.99,
+                 multiplicador: float = 3.0, janela: int = 500, amostras_minimas: int = 20,
+                 taxa_cortes_maxima: float = 0.05, adaptativo: bool = True, percentil_hedge: float = 0.95):
+        """
+        Args:
+            piso (float): Menor timeout em segundos
+            teto (float): Maior timeout em segundos (o timeout fixo com adaptativo=False)
+            percentil (float): Percentil da janela usado como referência (0-1)
+            multiplicador (float): Folga aplicada sobre o percentil
+            janela (int): Quantidade de latências recentes consideradas
+            amostras_minimas (int): Latências necessárias antes de sair do teto
+            taxa_cortes_maxima (float): Fração de cortes nas respostas recentes acima da qual o
+                timeout passa a dobrar
+            adaptativo (bool): Se False, o timeout é sempre o teto
+            percentil_hedge (float): Percentil da janela guardado em referencia_hedge (0-1)
+        """
+        if piso <= 0 or teto < piso:
+            raise ValueError("Timeouts inválidos: é preciso 0 < piso <= teto")
+        self.piso = piso
+        self.teto = teto
+        self.percentil = percentil
+        self.multiplicador = multiplicador
+        self.amostras_minimas = amostras_minimas
+        self.taxa_cortes_maxima = taxa_cortes_maxima
+        self.adaptativo = adaptativo
+        self.percentil_hedge = percentil_hedge
+        self.referencia_hedge: Optional[float] = None
+        self._janela = collections.deque(maxlen=janela)
+        # 1 para cada resposta recente cortada pelo timeout, 0 para as concluídas
+        self._cortes_recentes = collections.deque(maxlen=janela)
+        self._atual = teto
+        self._desde_calculo = 0
+        self.cortes = 0
+    
+    def registrar(self, latencia: float, cortada: bool = False):
+        """
+        Alimenta a janela com a duração de uma requisição concluída ou cortada pelo timeout
+        """
+        if cortada:
+            self.cortes += 1
+        else:
+            self._janela.append(latencia)
+        self._cortes_recentes.append(1 if cortada else 0)
+        self._desde_calculo += 1
+        if self._desde_calculo >= self.RECALCULAR_A_CADA:
+            self._recalcular()
+    
+    def valor_percentil(self, percentil: float) -> Optional[float]:
+        """
+        Percentil (0-1) das latências da janela, ou None sem amostras suficientes
+        """
+        return self._percentil_ordenadas(self._ordenar_janela(), percentil)
+    
+    def _ordenar_janela(self) -> Optional[List[float]]:
+        if len(self._janela) < self.amostras_minimas:
+            return None
+        return sorted(self._janela)
+    
+    @staticmethod
+    def _percentil_ordenadas(ordenadas: Optional[List[float]], percentil: float) -> Optional[float]:
+        if ordenadas is None:
+            return None
+        return ordenadas[min(len(ordenadas) - 1, int(percentil * len(ordenadas)))]
+    
+    def _recalcular(self):
+        self._desde_calculo = 0
+        # Uma única ordenação serve ao timeout e ao hedge
+        ordenadas = self._ordenar_janela()
+        self.referencia_hedge = self._percentil_ordenadas(ordenadas, self.percentil_hedge)
+        if not self.adaptativo:
+            return
+        if sum(self._cortes_recentes) > self.taxa_cortes_maxima * len(self._cortes_recentes):
+            self._atual = min(self.teto, self._atual * 2)
+            return
+        referencia = self._percentil_ordenadas(ordenadas, self.percentil)
+        if referencia is not None:
+            self._atual = min(self.teto, max(self.piso, referencia * self.multiplicador))
+    
+    def calcular(self, cortes_anteriores: int = 0) -> float:
+        """
+        Timeout da próxima tentativa, em segundos
+        
+        Args:
+            cortes_anteriores (int): Tentativas do mesmo código/página já cortadas pelo timeout
+        """
+        return min(self.teto, self._atual * (2 ** cortes_anteriores))
+    
+    def resumo(self) -> Dict[str, Any]:
+        referencia = self.valor_percentil(self.percentil)
+        return {
+            'adaptativo': self.adaptativo,
+            'piso_segundos': self.piso,
+            'teto_segundos': self.teto,
+            'percentil': self.percentil,
+            'multiplicador': self.multiplicador,
+            'timeout_atual_segundos': round(self._atual, 3),
+            'percentil_observado_ms': round(referencia * 1000, 1) if referencia is not None else None,
+            'amostras': len(self._janela),
+            'cortes': self.cortes
+        }
+
+class CircuitBreaker:
+    """
+    Disjuntor em volta das requisições à API, com três estados:
+    
+    - fechado: as requisições passam e o resultado de cada uma entra numa janela móvel; se a
+      fração de falhas (429/5xx, timeouts e erros de conexão) na janela chegar a
+      `taxa_erro_limite`, o disjuntor abre
+    - aberto: nenhuma requisição é despachada durante `pausa_segundos`
+    - meio_aberto: passada a pausa, uma única requisição de sonda é liberada; se ela responder,
+      o disjuntor fecha e o despacho volta ao normal, senão reabre com o dobro da pausa (até
+      `pausa_maxima_segundos`)
+    
+    As requisições que chegam enquanto o disjuntor não está fechado esperam em aguardar_vez.
+    Se ele ficar aberto por mais de `tempo_maximo_aberto_segundos` sem uma sonda bem-sucedida,
+    o disjuntor desiste (`esgotado`): quem espera em aguardar_desistencia é avisado para
+    encerrar a execução. Com `habilitado=False` o disjuntor nunca abre.
+    """
+    
+    __slots__ = ('taxa_erro_limite', 'amostras_minimas', 'pausa_inicial', 'pausa_maxima', 'tempo_maximo_aberto',
+                 'habilitado', 'estado', 'pausa_segundos', 'reabre_em', 'aberto_desde', 'esgotado', '_janela',
+                 '_mudanca', '_desistencia', 'aberturas', 'sondas', 'sondas_falhas', 'tempo_aberto')
+    
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    MEIO_ABERTO = 'meio_aberto'
+    
+    def __init__(self, taxa_erro_limite: float = 0.5, janela: int = 50, amostras_minimas: int = 20,
+                 pausa_segundos: float = 5.0, pausa_maxima_segundos: float = 60.0,
+                 tempo_maximo_aberto_segundos: float = 300.0, habilitado: bool = True):
+        """
+        Args:
+            taxa_erro_limite (float): Fração de falhas na janela que abre o disjuntor (0-1)
+            janela (int): Quantidade de respostas recentes consideradas
+            amostras_minimas (int): Respostas necessárias na janela antes de poder abrir
+            pausa_segundos (float): Tempo aberto antes da primeira sonda
+            pausa_maxima_segundos (float): Maior pausa depois de sondas que falharam
+            tempo_maximo_aberto_segundos (float): Tempo aberto sem sonda bem-sucedida após o qual
+                o disjuntor desiste
+            habilitado (bool): Se False, o disjuntor fica sempre fechado
+        """
+        if not 0 < taxa_erro_limite <= 1:
+            raise ValueError("A taxa de erro do disjuntor deve estar entre 0 e 1")
+        if pausa_segundos <= 0:
+            raise ValueError("A pausa do disjuntor deve ser positiva")
+        if tempo_maximo_aberto_segundos < pausa_segundos:
+            raise ValueError("O tempo máximo aberto do disjuntor deve ser pelo menos a pausa")
+        self.taxa_erro_limite = taxa_erro_limite
+        self.amostras_minimas = min(amostras_minimas, janela)
+        self.pausa_inicial = pausa_segundos
+        self.pausa_maxima = max(pausa_maxima_segundos, pausa_segundos)
+        self.tempo_maximo_aberto = tempo_maximo_aberto_segundos
+        self.habilitado = habilitado
+        self.estado = self.FECHADO
+        self.pausa_segundos = pausa_segundos
+        self.reabre_em = 0.0
+        self.aberto_desde = 0.0
+        self.esgotado = False
+        # 1 para cada resposta recente com falha, 0 para as demais
+        self._janela = collections.deque(maxlen=janela)
+        self._mudanca: Optional[asyncio.Event] = None
+        self._desistencia: Optional[asyncio.Event] = None
+        self.aberturas = 0
+        self.sondas = 0
+        self.sondas_falhas = 0
+        self.tempo_aberto = 0.0
+    
+    @property
+    def fechado(self) -> bool:
+        return self.estado == self.FECHADO
+    
+    def _evento_mudanca(self) -> asyncio.Event:
+        if self._mudanca is None:
+            self._mudanca = asyncio.Event()
+        return self._mudanca
+    
+    def _mudar_estado(self, estado: str):
+        agora = time.monotonic()
+        if self.estado == self.FECHADO and estado != self.FECHADO:
+            self.aberto_desde = agora
+        elif estado == self.FECHADO and self.estado != self.FECHADO:
+            self.tempo_aberto += agora - self.aberto_desde
+        self.estado = estado
+        if estado == self.ABERTO:
+            self.reabre_em = agora + self.pausa_segundos
+        # Acorda quem espera pela mudança; os próximos esperam por um novo evento
+        if self._mudanca is not None:
+            self._mudanca.set()
+            self._mudanca = None
+    
+    def _evento_desistencia(self) -> asyncio.Event:
+        if self._desistencia is None:
+            self._desistencia = asyncio.Event()
+            if self.esgotado:
+                self._desistencia.set()
+        return self._desistencia
+    
+    async def aguardar_desistencia(self):
+        """
+        Retorna quando o disjuntor desistir (aberto por mais de tempo_maximo_aberto_segundos)
+        """
+        await self._evento_desistencia().wait()
+    
+    def _desistir(self):
+        self.esgotado = True
+        self._evento_desistencia().set()
+        logging.warning(safe_log_message(
+            f"🔌 Disjuntor aberto há {time.monotonic() - self.aberto_desde:.0f}s "
+            f"(máximo: {self.tempo_maximo_aberto:g}s) e {self.sondas_falhas} sonda(s) falharam: "
+            f"a execução será encerrada e os códigos restantes informados como não concluídos"
+        ))
+    
+    async def aguardar_vez(self) -> bool:
+        """
+        Espera até o disjuntor permitir uma requisição
+        
+        Returns:
+            bool: True se a requisição liberada é a sonda do estado meio_aberto (o resultado
+                dela deve ser informado com sonda=True em registrar, ou liberar_sonda se ela
+                não chegar a ser feita)
+        """
+        while not self.fechado:
+            if self.estado == self.ABERTO:
+                restante = self.reabre_em - time.monotonic()
+                if restante <= 0:
+                    self._mudar_estado(self.MEIO_ABERTO)
+                    self.sondas += 1
+                    return True
+                try:
+                    await asyncio.wait_for(self._evento_mudanca().wait(), restante)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Sonda em andamento
+                await self._evento_mudanca().wait()
+        return False
+    
+    @staticmethod
+    def eh_falha(status: Optional[int]) -> bool:
+        """
+        Indica se o resultado conta como falha da API (mesmo critério do controle de concorrência)
+        """
+        return AdaptiveConcurrencyController.sinal_congestionamento(status)
+    
+    def registrar(self, status: Optional[int], sonda: bool = False):
+        """
+        Alimenta o disjuntor com o resultado de uma requisição
+        
+        Args:
+            status (Optional[int]): Status HTTP, ou None para timeout/erro de conexão
+            sonda (bool): Se a requisição foi a sonda liberada por aguardar_vez
+        """
+        if not self.habilitado:
+            return
+        falha = self.eh_falha(status)
+        
+        if sonda:
+            if falha:
+                self.sondas_falhas += 1
+                self.pausa_segundos = min(self.pausa_maxima, self.pausa_segundos * 2)
+                self._mudar_estado(self.ABERTO)
+                if time.monotonic() - self.aberto_desde >= self.tempo_maximo_aberto:
+                    self._desistir()
+                    return
+                # A última sonda acontece no limite do tempo máximo aberto
+                self.reabre_em = min(self.reabre_em, self.aberto_desde + self.tempo_maximo_aberto)
+                logging.warning(safe_log_message(
+                    f"🔌 Sonda do disjuntor falhou ({status or 'sem resposta'}): "
+                    f"nova tentativa em {self.reabre_em - time.monotonic():.1f}s"
+                ))
+            else:
+                self.pausa_segundos = self.pausa_inicial
+                self._janela.clear()
+                self._mudar_estado(self.FECHADO)
+                logging.info(safe_log_message("🔌 Disjuntor fechado: a API voltou a responder"))
+            return
+        
+        # Respostas de requisições despachadas antes da abertura não mudam o estado
+        if not self.fechado:
+            return
+        self._janela.append(1 if falha else 0)
+        if (len(self._janela) >= self.amostras_minimas
+                and sum(self._janela) >= self.taxa_erro_limite * len(self._janela)):
+            self.aberturas += 1
+            self._mudar_estado(self.ABERTO)
+            logging.warning(safe_log_message(
+                f"🔌 Disjuntor aberto: {sum(self._janela)}/{len(self._janela)} respostas recentes com falha; "
+                f"despacho pausado por {self.pausa_segundos:g}s"
+            ))
+    
+    def liberar_sonda(self):
+        """
+        Devolve a vez de sonda quando a requisição liberada não chegou a um resultado
+        (ex.: cancelada pelo prazo); a próxima requisição vira a sonda
+        """
+        if self.estado == self.MEIO_ABERTO:
+            self._mudar_estado(self.ABERTO)
+            self.reabre_em = time.monotonic()
+    
+    def resumo(self) -> Dict[str, Any]:
+        tempo_aberto = self.tempo_aberto
+        if not self.fechado:
+            tempo_aberto += time.monotonic() - self.aberto_desde
+        return {
+            'habilitado': self.habilitado,
+            'estado': self.estado,
+            'taxa_erro_limite': self.taxa_erro_limite,
+            'pausa_inicial_segundos': self.pausa_inicial,
+            'tempo_maximo_aberto_segundos': self.tempo_maximo_aberto,
+            'esgotado': self.esgotado,
+            'aberturas': self.aberturas,
+            'sondas': self.sondas,
+            'sondas_falhas': self.sondas_falhas,
+            'tempo_aberto_segundos': round(tempo_aberto, 3)
+        }
+
+class HedgePolicy:
+    """
+    Requisições duplicadas (hedge) para cortar a cauda de latência: se uma requisição não
+    terminar até o `percentil` das latências recentes (AdaptiveTimeout.referencia_hedge, que
+    deve ser criado com o mesmo percentil), uma cópia é disparada, vale a primeira resposta
+    que chegar e a outra é cancelada.
+    
+    O orçamento limita as cópias a uma fração das requisições feitas (0,05 = no máximo 5% a
+    mais de requisições), para que o hedge não sobrecarregue a API justamente quando ela está
+    lenta.
+    """
+    
+    __slots__ = ('habilitado', 'percentil', 'orcamento', 'requisicoes', 'disparados', 'vencedores')
+    
+    def __init__(self, habilitado: bool = False, percentil: float = 0.95, orcamento: float = 0.05):
+        """
+        Args:
+            habilitado (bool): Se False, nenhuma cópia é disparada
+            percentil (float): Percentil da latência após o qual a cópia é disparada (0-1)
+            orcamento (float): Fração máxima de requisições extras
+        """
+        if not 0 < percentil < 1:
+            raise ValueError("O percentil do hedge deve estar entre 0 e 1")
+        self.habilitado = habilitado
+        self.percentil = percentil
+        self.orcamento = orcamento
+        self.requisicoes = 0
+        self.disparados = 0
+        self.vencedores = 0
+    
+    def atraso(self, controle_timeout: AdaptiveTimeout) -> Optional[float]:
+        """
+        Segundos de espera antes de disparar a cópia, ou None se o hedge não se aplica (desativado
+        ou sem latências suficientes)
+        """
+        if not self.habilitado:
+            return None
+        return controle_timeout.referencia_hedge
+    
+    def permitir(self) -> bool:
+        """
+        Indica se o orçamento comporta mais uma cópia
+        """
+        return self.disparados + 1 <= self.orcamento * self.requisicoes
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'habilitado': self.habilitado,
+            'percentil': self.percentil,
+            'orcamento': self.orcamento,
+            'requisicoes': self.requisicoes,
+            'disparados': self.disparados,
+            'vencedores': self.vencedores,
+            'taxa_extra': f"{self.disparados / self.requisicoes * 100:.1f}%" if self.requisicoes else '0.0%'
+        }
+
+class RetryPolicy:
+    """
+    Política de retentativas da consulta à API CNES, por classe de erro:
+    
+    - 404 (código não encontrado) e JSON inválido nunca são retentados
+    - Timeouts e erros de conexão são retentados
+    - Status HTTP em `status_retentaveis` (padrão: 429, 502, 503, 504) são retentados
+    
+    O atraso entre tentativas cresce exponencialmente com jitter completo e respeita o
+    cabeçalho Retry-After quando a API o envia.
+    """
+    
+    STATUS_RETENTAVEIS_PADRAO = (429, 502, 503, 504)
+    
+    def __init__(self, max_tentativas: int = 3, atraso_base: float = 0.5, atraso_maximo: float = 30.0,
+                 status_retentaveis: Tuple[int, ...] = STATUS_RETENTAVEIS_PADRAO,
+                 retentar_timeouts: bool = True, retentar_erros_conexao: bool = True,
+                 respeitar_retry_after: bool = True, retry_after_maximo: float = 120.0):
+        """
+        Args:
+            max_tentativas (int): Número máximo de tentativas por código (1 desativa retentativas)
+            atraso_base (float): Atraso base do backoff exponencial em segundos
+            atraso_maximo (float): Teto do atraso calculado pelo backoff
+            status_retentaveis (Tuple[int, ...]): Status HTTP que devem ser retentados
+            retentar_timeouts (bool): Retenta requisições que estouraram o timeout
+            retentar_erros_conexao (bool): Retenta falhas de conexão
+            respeitar_retry_after (bool): Usa o cabeçalho Retry-After como atraso mínimo
+            retry_after_maximo (float): Maior Retry-After aceito, em segundos
+        """
+        self.max_tentativas = max(1, max_tentativas)
+        self.atraso_base = atraso_base
+        self.atraso_maximo = atraso_maximo
+        self.status_retentaveis = frozenset(status_retentaveis)
+        self.retentar_timeouts = retentar_timeouts
+        self.retentar_erros_conexao = retentar_erros_conexao
+        self.respeitar_retry_after = respeitar_retry_after
+        self.retry_after_maximo = retry_after_maximo
+    
+    def deve_retentar(self, resultado: 'ResultadoTentativa', tentativa: int) -> bool:
+        """
+        Indica se uma tentativa que falhou deve ser repetida
+        
+        Args:
+            resultado (ResultadoTentativa): Resultado da tentativa
+            tentativa (int): Número da tentativa (começando em 1)
+        """
+        if resultado.sucesso or tentativa >= self.max_tentativas:
+            return False
+        if resultado.classe_erro == 'timeout':
+            return self.retentar_timeouts
+        if resultado.classe_erro == 'conexao':
+            return self.retentar_erros_conexao
+        if resultado.classe_erro == 'http':
+            return resultado.status in self.status_retentaveis
+        return False
+    
+    def calcular_atraso(self, tentativa: int, retry_after: Optional[float] = None) -> float:
+        """
+        Calcula o atraso antes da próxima tentativa (backoff exponencial com jitter completo)
+        
+        Args:
+            tentativa (int): Número da tentativa que acabou de falhar
+            retry_after (float): Valor do cabeçalho Retry-After em segundos, se houver
+        """
+        teto = min(self.atraso_maximo, self.atraso_base * (2 ** (tentativa - 1)))
+        atraso = random.uniform(0, teto)
+        if self.respeitar_retry_after and retry_after is not None:
+            atraso = max(atraso, min(retry_after, self.retry_after_maximo))
+        return atraso
+    
+    @staticmethod
+    def interpretar_retry_after(valor: Optional[str]) -> Optional[float]:
+        """
+        Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera
+        """
+        if not valor:
+            return None
+        valor = valor.strip()
+        if valor.isdigit():
+            return float(valor)
+        try:
+            data = parsedate_to_datetime(valor)
+        except (TypeError, ValueError):
+            return None
+        if data is None:
+            return None
+        if data.tzinfo is None:
+            data = data.replace(tzinfo=timezone.utc)
+        return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'max_tentativas': self.max_tentativas,
+            'atraso_base': self.atraso_base,
+            'atraso_maximo': self.atraso_maximo,
+            'status_retentaveis': sorted(self.status_retentaveis),
+            'retentar_timeouts': self.retentar_timeouts,
+            'retentar_erros_conexao': self.retentar_erros_conexao,
+            'respeitar_retry_after': self.respeitar_retry_after
+        }
+
+class LatencyHistogram:
+    """
+    Histograma de durações (segundos) com limites fixos, no modelo do Prometheus: registrar
+    custa uma busca binária e memória constante, e os percentis são estimados por
+    interpolação dentro do intervalo em que caem.
+    """
+    
+    LIMITES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+    
+    __slots__ = ('limites', 'contagens', 'soma', 'total', 'maximo')
+    
+    def __init__(self, limites: Tuple[float, ...] = LIMITES_PADRAO):
+        self.limites = tuple(limites)
+        # Uma contagem por limite (valores <= limite) e uma para os acima do último
+        self.contagens = [0] * (len(self.limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self.maximo = 0.0
+    
+    def registrar(self, valor: float):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+        if valor > self.maximo:
+            self.maximo = valor
+    
+    def percentil(self, fracao: float) -> Optional[float]:
+        """
+        Estimativa do percentil (fracao entre 0 e 1) em segundos (None sem registros)
+        """
+        if not self.total:
+            return None
+        alvo = fracao * self.total
+        acumulado = 0
+        for indice, contagem in enumerate(self.contagens):
+            if contagem and acumulado + contagem >= alvo:
+                inferior = self.limites[indice - 1] if indice > 0 else 0.0
+                superior = self.limites[indice] if indice < len(self.limites) else self.maximo
+                return min(self.maximo, inferior + (superior - inferior) * (alvo - acumulado) / contagem)
+            acumulado += contagem
+        return self.maximo
+    
+    def resumo(self) -> Dict[str, Any]:
+        """
+        Contagem, média, percentis estimados e máximo em ms, com as contagens acumuladas por
+        limite em segundos ('buckets', como no Prometheus)
+        """
+        def em_ms(valor: Optional[float]) -> Optional[float]:
+            return round(valor * 1000, 1) if valor is not None else None
+        
+        buckets = {}
+        acumulado = 0
+        for limite, contagem in zip(self.limites, self.contagens):
+            acumulado += contagem
+            buckets[f"{limite:g}"] = acumulado
+        buckets['+Inf'] = self.total
+        return {
+            'total': self.total,
+            'media_ms': em_ms(self.soma / self.total) if self.total else None,
+            'p50_ms': em_ms(self.percentil(0.50)),
+            'p95_ms': em_ms(self.percentil(0.95)),
+            'p99_ms': em_ms(self.percentil(0.99)),
+            'maxima_ms': em_ms(self.maximo),
+            'soma_s': round(self.soma, 6),
+            'buckets': buckets
+        }
+    
+    @classmethod
+    def de_resumo(cls, resumo: Dict[str, Any]) -> 'LatencyHistogram':
+        """
+        Reconstrói o histograma a partir de resumo() (ex.: para somar os de vários shards)
+        """
+        limites = tuple(float(limite) for limite in resumo['buckets'] if limite != '+Inf')
+        histograma = cls(limites)
+        anterior = 0
+        for indice, acumulado in enumerate(resumo['buckets'].values()):
+            histograma.contagens[indice] = acumulado - anterior
+            anterior = acumulado
+        histograma.total = resumo['total']
+        histograma.soma = resumo.get('soma_s', 0.0)
+        histograma.maximo = (resumo.get('maxima_ms') or 0.0) / 1000
+        return histograma
+    
+    def somar(self, outro: 'LatencyHistogram'):
+        """
+        Acrescenta as contagens de outro histograma com os mesmos limites
+        """
+        for indice, contagem in enumerate(outro.contagens):
+            self.contagens[indice] += contagem
+        self.soma += outro.soma
+        self.total += outro.total
+        self.maximo = max(self.maximo, outro.maximo)
+    
+    def linhas_prometheus(self, nome: str, rotulos: str = '') -> List[str]:
+        """
+        Linhas _bucket/_sum/_count no formato de texto do Prometheus
+        """
+        separador = ',' if rotulos else ''
+        linhas = []
+        acumulado = 0
+        for limite, contagem in zip(self.limites, self.contagens):
+            acumulado += contagem
+            linhas.append(f'{nome}_bucket{{{rotulos}{separador}le="{limite:g}"}} {acumulado}')
+        linhas.append(f'{nome}_bucket{{{rotulos}{separador}le="+Inf"}} {self.total}')
+        sufixo = f'{{{rotulos}}}' if rotulos else ''
+        linhas.append(f'{nome}_sum{sufixo} {self.soma:.6f}')
+        linhas.append(f'{nome}_count{sufixo} {self.total}')
+        return linhas
+
+class FetchMetrics:
+    """
+    Instrumentação da consulta à API, para separar a lentidão causada pela API, pela
+    rede (DNS/conexão) ou pelo próprio processo (CPU/loop):
+    - latência por tentativa, em histogramas por classe de status (2xx, 4xx, 5xx, timeout, conexao...)
+    - requisições em andamento e profundidade da fila de códigos (atual e máxima)
+    - bytes recebidos (trafegados) x descomprimidos e retentativas por classe
+    - tempo até o primeiro resultado da lista
+    - conexões novas x reutilizadas, tempo de conexão, espera por vaga no pool e DNS
+      (via aiohttp TraceConfig, ver criar_trace_config)
+    - atraso do loop de eventos: quanto um sleep curto atrasa além do pedido (CPU ocupada)
+    """
+    
+    LIMITES_ATRASO_LOOP = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    
+    __slots__ = ('latencia_por_classe', 'em_andamento', 'em_andamento_maximo', 'profundidade_fila',
+                 'fila_maxima', 'bytes_recebidos', 'bytes_descomprimidos', 'respostas_comprimidas',
+                 'retentativas_por_classe', 'conexoes_novas', 'conexoes_reutilizadas', 'tempo_conexao',
+                 'espera_pool', 'tempo_dns', 'dns_cache_hits', 'dns_cache_misses', 'atraso_loop',
+                 'inicio', 'tempo_primeiro_resultado')
+    
+    def __init__(self):
+        self.latencia_por_classe: Dict[str, LatencyHistogram] = {}
+        self.em_andamento = 0
+        self.em_andamento_maximo = 0
+        self.profundidade_fila = 0
+        self.fila_maxima = 0
+        self.bytes_recebidos = 0
+        self.bytes_descomprimidos = 0
+        self.respostas_comprimidas = 0
+        self.retentativas_por_classe: Dict[str, int] = {}
+        self.conexoes_novas = 0
+        self.conexoes_reutilizadas = 0
+        self.tempo_conexao = LatencyHistogram()
+        self.espera_pool = LatencyHistogram()
+        self.tempo_dns = LatencyHistogram()
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+        self.atraso_loop = LatencyHistogram(self.LIMITES_ATRASO_LOOP)
+        self.inicio = time.perf_counter()
+        self.tempo_primeiro_resultado: Optional[float] = None
+    
+    @staticmethod
+    def classe_resultado(resultado: Optional['ResultadoTentativa']) -> str:
+        """
+        Classe de status de uma tentativa: '2xx'...'5xx' ou a classe do erro sem status
+        """
+        if resultado is None:
+            return 'inesperado'
+        if resultado.status is not None:
+            return f"{resultado.status // 100}xx"
+        return resultado.classe_erro or 'inesperado'
+    
+    def iniciar_requisicao(self):
+        self.em_andamento += 1
+        if self.em_andamento > self.em_andamento_maximo:
+            self.em_andamento_maximo = self.em_andamento
+    
+    def terminar_requisicao(self, resultado: Optional['ResultadoTentativa'], latencia: float,
+                            classe: Optional[str] = None):
+        """
+        Registra o fim de uma requisição (classe: força a classe, ex.: 'cancelada')
+        """
+        self.em_andamento -= 1
+        classe = classe or self.classe_resultado(resultado)
+        histograma = self.latencia_por_classe.get(classe)
+        if histograma is None:
+            histograma = self.latencia_por_classe[classe] = LatencyHistogram()
+        histograma.registrar(latencia)
+    
+    def registrar_fila(self, profundidade: int):
+        self.profundidade_fila = profundidade
+        if profundidade > self.fila_maxima:
+            self.fila_maxima = profundidade
+    
+    def registrar_retentativa(self, resultado: 'ResultadoTentativa'):
+        classe = self.classe_resultado(resultado)
+        self.retentativas_por_classe[classe] = self.retentativas_por_classe.get(classe, 0) + 1
+    
+    def registrar_corpo(self, trafegados: int, descomprimidos: int, comprimido: bool):
+        """
+        Contabiliza o corpo de uma resposta: bytes como vieram da rede e depois de descomprimidos
+        """
+        self.bytes_recebidos += trafegados
+        self.bytes_descomprimidos += descomprimidos
+        if comprimido:
+            self.respostas_comprimidas += 1
+    
+    def registrar_resultado(self):
+        """
+        Marca a chegada de um resultado; só o primeiro importa (tempo até o primeiro resultado)
+        """
+        if self.tempo_primeiro_resultado is None:
+            self.tempo_primeiro_resultado = time.perf_counter() - self.inicio
+    
+    async def monitorar_loop(self, intervalo: float = 0.1):
+        """
+        Mede continuamente o atraso do loop de eventos (rodar como tarefa e cancelar ao final)
+        """
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(intervalo)
+            self.atraso_loop.registrar(max(0.0, time.perf_counter() - inicio - intervalo))
+    
+    @staticmethod
+    def criar_trace_config(obter_metricas) -> aiohttp.TraceConfig:
+        """
+        TraceConfig do aiohttp que alimenta as métricas de conexão e DNS
+        
+        Args:
+            obter_metricas: Função sem argumentos que devolve o FetchMetrics atual (a sessão
+                pode durar mais que as métricas de uma lista)
+        """
+        async def conexao_inicio(session, contexto, params):
+            contexto.inicio_conexao = time.perf_counter()
+        
+        async def conexao_fim(session, contexto, params):
+            metricas = obter_metricas()
+            metricas.conexoes_novas += 1
+            metricas.tempo_conexao.registrar(time.perf_counter() - contexto.inicio_conexao)
+        
+        async def conexao_reutilizada(session, contexto, params):
+            obter_metricas().conexoes_reutilizadas += 1
+        
+        async def espera_inicio(session, contexto, params):
+            contexto.inicio_espera = time.perf_counter()
+        
+        async def espera_fim(session, contexto, params):
+            obter_metricas().espera_pool.registrar(time.perf_counter() - contexto.inicio_espera)
+        
+        async def dns_inicio(session, contexto, params):
+            contexto.inicio_dns = time.perf_counter()
+        
+        async def dns_fim(session, contexto, params):
+            obter_metricas().tempo_dns.registrar(time.perf_counter() - contexto.inicio_dns)
+        
+        async def dns_cache_hit(session, contexto, params):
+            obter_metricas().dns_cache_hits += 1
+        
+        async def dns_cache_miss(session, contexto, params):
+            obter_metricas().dns_cache_misses += 1
+        
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(conexao_inicio)
+        trace_config.on_connection_create_end.append(conexao_fim)
+        trace_config.on_connection_reuseconn.append(conexao_reutilizada)
+        trace_config.on_connection_queued_start.append(espera_inicio)
+        trace_config.on_connection_queued_end.append(espera_fim)
+        trace_config.on_dns_resolvehost_start.append(dns_inicio)
+        trace_config.on_dns_resolvehost_end.append(dns_fim)
+        trace_config.on_dns_cache_hit.append(dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(dns_cache_miss)
+        return trace_config
+    
+    def resumo(self) -> Dict[str, Any]:
+        """
+        Bloco 'metricas' dos metadados da execução
+        """
+        total_conexoes = self.conexoes_novas + self.conexoes_reutilizadas
+        return {
+            'latencia_por_classe': {classe: histograma.resumo() for classe, histograma in sorted(self.latencia_por_classe.items())},
+            'em_andamento_maximo': self.em_andamento_maximo,
+            'fila_maxima': self.fila_maxima,
+            'bytes_recebidos': self.bytes_recebidos,
+            'compressao': {
+                'bytes_descomprimidos': self.bytes_descomprimidos,
+                'bytes_economizados': self.bytes_descomprimidos - self.bytes_recebidos,
+                'respostas_comprimidas': self.respostas_comprimidas,
+                'taxa_economia': (f"{(1 - self.bytes_recebidos / self.bytes_descomprimidos) * 100:.1f}%"
+                                  if self.bytes_descomprimidos else "N/A")
+            },
+            'tempo_primeiro_resultado_ms': (round(self.tempo_primeiro_resultado * 1000, 1)
+                                            if self.tempo_primeiro_resultado is not None else None),
+            'retentativas_por_classe': dict(sorted(self.retentativas_por_classe.items())),
+            'conexoes': {
+                'novas': self.conexoes_novas,
+                'reutilizadas': self.conexoes_reutilizadas,
+                'taxa_reutilizacao': f"{self.conexoes_reutilizadas / total_conexoes * 100:.1f}%" if total_conexoes else "N/A",
+                'tempo_conexao': self.tempo_conexao.resumo(),
+                'espera_pool': self.espera_pool.resumo()
+            },
+            'dns': {
+                'resolucoes': self.tempo_dns.resumo(),
+                'cache_hits': self.dns_cache_hits,
+                'cache_misses': self.dns_cache_misses
+            },
+            'atraso_loop': self.atraso_loop.resumo()
+        }
+    
+    def texto_prometheus(self, stats: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Métricas no formato de texto do Prometheus (com os contadores de `stats`, se informados)
+        """
+        linhas = ['# TYPE cnes_requisicao_duracao_segundos histogram']
+        for classe, histograma in sorted(self.latencia_por_classe.items()):
+            linhas.extend(histograma.linhas_prometheus('cnes_requisicao_duracao_segundos', f'classe="{classe}"'))
+        linhas += [
+            '# TYPE cnes_requisicoes_em_andamento gauge', f'cnes_requisicoes_em_andamento {self.em_andamento}',
+            '# TYPE cnes_fila_profundidade gauge', f'cnes_fila_profundidade {self.profundidade_fila}',
+            '# TYPE cnes_bytes_recebidos_total counter', f'cnes_bytes_recebidos_total {self.bytes_recebidos}',
+            '# TYPE cnes_bytes_descomprimidos_total counter', f'cnes_bytes_descomprimidos_total {self.bytes_descomprimidos}',
+            '# TYPE cnes_respostas_comprimidas_total counter', f'cnes_respostas_comprimidas_total {self.respostas_comprimidas}',
+            '# TYPE cnes_retentativas_total counter'
+        ]
+        linhas += [f'cnes_retentativas_total{{classe="{classe}"}} {total}'
+                   for classe, total in sorted(self.retentativas_por_classe.items())]
+        linhas += [
+            '# TYPE cnes_conexoes_total counter',
+            f'cnes_conexoes_total{{tipo="nova"}} {self.conexoes_novas}',
+            f'cnes_conexoes_total{{tipo="reutilizada"}} {self.conexoes_reutilizadas}',
+            '# TYPE cnes_conexao_duracao_segundos histogram',
+            *self.tempo_conexao.linhas_prometheus('cnes_conexao_duracao_segundos'),
+            '# TYPE cnes_espera_pool_segundos histogram',
+            *self.espera_pool.linhas_prometheus('cnes_espera_pool_segundos'),
+            '# TYPE cnes_dns_duracao_segundos histogram',
+            *self.tempo_dns.linhas_prometheus('cnes_dns_duracao_segundos'),
+            '# TYPE cnes_dns_cache_total counter',
+            f'cnes_dns_cache_total{{resultado="hit"}} {self.dns_cache_hits}',
+            f'cnes_dns_cache_total{{resultado="miss"}} {self.dns_cache_misses}',
+            '# TYPE cnes_atraso_loop_segundos histogram',
+            *self.atraso_loop.linhas_prometheus('cnes_atraso_loop_segundos')
+        ]
+        if stats:
+            linhas.append('# TYPE cnes_codigos_total counter')
+            for chave in ('sucessos', 'codigos_invalidos', 'erros_conexao', 'erros'):
+                linhas.append(f'cnes_codigos_total{{resultado="{chave}"}} {stats.get(chave, 0)}')
+        return '\n'.join(linhas) + '\n'
+
+class MetricsServer:
+    """
+    Endpoint HTTP local (GET /metrics) com as métricas no formato de texto do Prometheus,
+    servido no mesmo loop de eventos da consulta
+    """
+    
+    def __init__(self, obter_texto, porta: int, host: str = '127.0.0.1'):
+        """
+        Args:
+            obter_texto: Função sem argumentos que devolve o texto das métricas
+            porta (int): Porta TCP (0 = escolhida pelo sistema)
+            host (str): Endereço de escuta (padrão: apenas local)
+        """
+        self.obter_texto = obter_texto
+        self.porta = porta
+        self.host = host
+        self._runner = None
+    
+    async def _responder(self, request) -> Any:
+        from aiohttp import web
+        return web.Response(text=self.obter_texto(), content_type='text/plain', charset='utf-8')
+    
+    async def iniciar(self) -> str:
+        """
+        Returns:
+            str: URL do endpoint
+        """
+        from aiohttp import web
+        
+        app = web.Application()
+        app.router.add_get('/metrics', self._responder)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.porta).start()
+        host, porta = self._runner.addresses[0][:2]
+        return f"http://{host}:{porta}/metrics"
+    
+    async def parar(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+def descomprimir_corpo(corpo: bytes, codificacao: Optional[str]) -> bytes:
+    """
+    Descomprime o corpo de uma resposta conforme o Content-Encoding (gzip, deflate ou br);
+    sem codificação (ou identity), devolve o próprio corpo. Codificações não suportadas
+    levantam ValueError
+    """
+    codificacao = (codificacao or '').strip().lower()
+    if codificacao in ('', 'identity'):
+        return corpo
+    if codificacao in ('gzip', 'x-gzip'):
+        return zlib.decompress(corpo, 16 + zlib.MAX_WBITS)
+    if codificacao == 'deflate':
+        # O padrão é deflate com cabeçalho zlib, mas há servidores que mandam o deflate "cru"
+        try:
+            return zlib.decompress(corpo)
+        except zlib.error:
+            return zlib.decompress(corpo, -zlib.MAX_WBITS)
+    if codificacao == 'br':
+        modulo = CNESHTTPClient.modulo_brotli()
+        if modulo is not None:
+            return modulo.decompress(corpo)
+    raise ValueError(f"Content-Encoding não suportado: {codificacao}")
+
+class CNESHTTPClient:
+    """
+    Cliente HTTP de longa duração: dono do pool de conexões (TCPConnector) e da sessão aiohttp,
+    reaproveitado por várias listas e chamadas no mesmo processo, em vez de uma sessão por lista
+    
+    - pre_aquecer abre N conexões keep-alive antes da carga, para que as primeiras requisições
+      não paguem DNS + TCP + TLS em cada vaga
+    - keep-alive longo (keepalive_segundos), para as conexões sobreviverem ao intervalo entre
+      uma lista e a seguinte
+    - anuncia Accept-Encoding (gzip, deflate e, com o pacote Brotli ou brotlicffi instalado, br)
+      e não descomprime o corpo sozinho (auto_decompress=False): quem lê a resposta descomprime
+      com descomprimir_corpo e sabe quantos bytes de fato trafegaram
+    """
+    
+    # Timeout de cada requisição do pré-aquecimento (s); uma falha só deixa a vaga fria
+    TIMEOUT_PRE_AQUECIMENTO = 5.0
+    # Timeout para estabelecer uma conexão (s), também nos timeouts por requisição
+    TIMEOUT_CONEXAO = 5.0
+    
+    __slots__ = ('limite_conexoes', 'headers', 'trace_configs', 'keepalive_segundos', 'compressao',
+                 'timeout_segundos', 'pre_aquecimento', 'listas_atendidas', '_sessao')
+    
+    def __init__(self, limite_conexoes: int, headers: Optional[Dict[str, str]] = None,
+                 trace_configs: Optional[List[aiohttp.TraceConfig]] = None, keepalive_segundos: float = 60.0,
+                 compressao: bool = True, timeout_segundos: float = 15.0):
+        """
+        Args:
+            limite_conexoes (int): Conexões simultâneas com o servidor da API
+            headers (Dict[str, str]): Cabeçalhos enviados em todas as requisições
+            trace_configs (List[aiohttp.TraceConfig]): Instrumentação da sessão (ver FetchMetrics)
+            keepalive_segundos (float): Tempo que uma conexão ociosa fica aberta no pool
+            compressao (bool): Pede respostas comprimidas; False pede identity
+            timeout_segundos (float): Timeout padrão das requisições sem timeout próprio
+        """
+        self.limite_conexoes = limite_conexoes
+        self.headers = dict(headers or {})
+        self.trace_configs = list(trace_configs or [])
+        self.keepalive_segundos = keepalive_segundos
+        self.compressao = compressao
+        self.timeout_segundos = timeout_segundos
+        self.pre_aquecimento: Optional[Dict[str, Any]] = None
+        self.listas_atendidas = 0
+        self._sessao: Optional[aiohttp.ClientSession] = None
+    
+    @staticmethod
+    def modulo_brotli() -> Any:
+        """
+        Decodificador Brotli instalado (Brotli ou brotlicffi, os mesmos que o aiohttp aceita) ou None
+        """
+        for nome in ('brotli', 'brotlicffi'):
+            try:
+                return __import__(nome)
+            except ImportError:
+                continue
+        return None
+    
+    @classmethod
+    def criar_timeout(cls, segundos: float) -> aiohttp.ClientTimeout:
+        """
+        Timeout do aiohttp com o total informado e o limite para estabelecer a conexão
+        """
+        return aiohttp.ClientTimeout(total=segundos, connect=min(segundos, cls.TIMEOUT_CONEXAO))
+    
+    def accept_encoding(self) -> str:
+        if not self.compressao:
+            return 'identity'
+        return 'gzip, deflate, br' if self.modulo_brotli() is not None else 'gzip, deflate'
+    
+    @property
+    def sessao(self) -> aiohttp.ClientSession:
+        """
+        Sessão HTTP, criada no primeiro uso (dentro do loop de eventos)
+        """
+        if self._sessao is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limite_conexoes + 5,  # Pool de conexões
+                limit_per_host=self.limite_conexoes,
+                ttl_dns_cache=300,  # Cache DNS por 5 minutos
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_segundos
+            )
+            self._sessao = aiohttp.ClientSession(
+                headers={**self.headers, 'Accept-Encoding': self.accept_encoding()},
+                connector=connector,
+                timeout=self.criar_timeout(self.timeout_segundos),
+                trace_configs=self.trace_configs,
+                auto_decompress=False
+            )
+        return self._sessao
+    
+    async def pre_aquecer(self, url: str, conexoes: int,
+                          limitador: Optional[TokenBucketRateLimiter] = None) -> Dict[str, Any]:
+        """
+        Abre até `conexoes` conexões keep-alive com o servidor da URL por meio de requisições HEAD
+        simultâneas: cada uma ocupa uma conexão própria, que volta ao pool ao terminar
+        
+        Args:
+            url (str): URL leve do mesmo servidor da carga (o status da resposta não importa)
+            conexoes (int): Conexões desejadas (limitadas a limite_conexoes)
+            limitador (TokenBucketRateLimiter): Limite de taxa respeitado também no pré-aquecimento
+        
+        Returns:
+            Dict[str, Any]: Conexões solicitadas e abertas e tempo gasto (ms)
+        """
+        conexoes = max(0, min(conexoes, self.limite_conexoes))
+        sessao = self.sessao
+        
+        async def abrir_conexao() -> bool:
+            if limitador is not None:
+                await limitador.adquirir()
+            try:
+                async with sessao.head(url, timeout=aiohttp.ClientTimeout(total=self.TIMEOUT_PRE_AQUECIMENTO)) as response:
+                    await response.read()
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+        
+        inicio = time.perf_counter()
+        abertas = sum(await asyncio.gather(*(abrir_conexao() for _ in range(conexoes))))
+        self.pre_aquecimento = {
+            'conexoes_solicitadas': conexoes,
+            'conexoes_abertas': abertas,
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)
+        }
+        return self.pre_aquecimento
+    
+    def resumo(self) -> Dict[str, Any]:
+        """
+        Bloco 'cliente_http' dos metadados
+        """
+        return {
+            'keepalive_segundos': self.keepalive_segundos,
+            'accept_encoding': self.accept_encoding(),
+            'pre_aquecimento': self.pre_aquecimento,
+            'listas_atendidas': self.listas_atendidas
+        }
+    
+    async def fechar(self):
+        if self._sessao is not None:
+            await self._sessao.close()
+            self._sessao = None
+    
+    async def __aenter__(self) -> 'CNESHTTPClient':
+        self.sessao
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.fechar()
+
+def normalizar_codigo_cnes(codigo_cnes: Any) -> str:
+    """
+    Código CNES como texto com 7 dígitos (a API devolve o código como número, sem zeros à esquerda)
+    """
+    codigo = str(codigo_cnes).strip()
+    return codigo.zfill(7) if codigo.isdigit() else codigo
+
+def validar_codigo_cnes(valor: Any) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Valida e normaliza um código CNES lido da entrada, antes de qualquer requisição
+    
+    Códigos numéricos no JSON perdem os zeros à esquerda (0800635 vira 800635) e são
+    completados para 7 dígitos; o que nunca pode ser um código válido é rejeitado localmente.
+    
+    Returns:
+        Tuple[Optional[str], Optional[str]]: (código com 7 dígitos, None) ou (None, motivo da rejeição)
+    """
+    if isinstance(valor, bool) or not isinstance(valor, (str, int, float)):
+        return None, f"tipo inválido ({type(valor).__name__})"
+    if isinstance(valor, float):
+        if not valor.is_integer():
+            return None, "número não inteiro"
+        valor = int(valor)
+    if isinstance(valor, int) and valor < 0:
+        return None, "número negativo"
+    
+    codigo = str(valor).strip()
+    if not codigo:
+        return None, "vazio"
+    if not (codigo.isascii() and codigo.isdigit()):
+        return None, "contém caracteres não numéricos"
+    if len(codigo) > 7:
+        return None, "mais de 7 dígitos"
+    if not codigo.strip('0'):
+        return None, "código zerado"
+    return codigo.zfill(7), None
+
+def indice_shard(codigo_cnes: Any, total_shards: int) -> int:
+    """
+    Shard (1 a total_shards) de um código: CRC32 do código normalizado, estável entre processos
+    e máquinas (ao contrário de hash(), que muda a cada processo)
+    """
+    return zlib.crc32(normalizar_codigo_cnes(codigo_cnes).encode('utf-8')) % total_shards + 1
+
+def interpretar_shard(valor: str) -> Tuple[int, int]:
+    """
+    Converte 'i/N' (ex.: '2/4') em (i, N), com 1 <= i <= N
+    """
+    try:
+        indice, total = (int(parte) for parte in valor.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard inválido: {valor} (use i/N, ex.: 2/4)")
+    if not 1 <= indice <= total:
+        raise argparse.ArgumentTypeError(f"Shard inválido: {valor} (i deve estar entre 1 e N)")
+    return indice, total
+
+class ProjecaoCampos(tuple):
+    """
+    Projeção de campos de EstabelecimentoCNES: a tupla dos campos e o índice de cada campo,
+    montado uma vez e compartilhado por todos os registros da projeção
+    """
+    
+    def __new__(cls, campos):
+        projecao = super().__new__(cls, campos)
+        projecao.indices = {campo: indice for indice, campo in enumerate(projecao)}
+        return projecao
+
+class EstabelecimentoCNES:
+    """
+    Estabelecimento obtido da API, em formato compacto.
+    
+    Com uma projeção de campos, guarda só os valores das colunas escolhidas, numa tupla alinhada
+    a `campos` (a mesma tupla é compartilhada por todos os registros); sem projeção, guarda o
+    dict da resposta sem copiá-lo. Os metadados da consulta ficam em slots e o `_metadata`
+    (com `url_consultada`, derivada da URL base) só é montado em para_dict().
+    
+    Um campo da projeção ausente na resposta é guardado como AUSENTE, para que get() o
+    distinga de um null enviado pela API; em para_dict() os dois viram None.
+    """
+    __slots__ = ('codigo_cnes', 'campos', 'valores', 'url_base', 'consultado_em', 'origem',
+                 'obtido_da_api_em', 'tentativas', 'indice_processamento', 'mesclado', 'dados_macrorregiao')
+    
+    # Campos sempre mantidos numa projeção (identificação e mesclagem com macrorregião)
+    CAMPOS_OBRIGATORIOS = ('codigo_cnes', 'codigo_municipio')
+    
+    # Marca, na tupla de valores, um campo da projeção que não veio na resposta
+    AUSENTE = object()
+    
+    def __init__(self, codigo_cnes: str, dados: Dict[str, Any], url_base: str, origem: str = 'api',
+                 campos: Optional[Tuple[str, ...]] = None, consultado_em: Optional[float] = None,
+                 obtido_da_api_em: Optional[float] = None):
+        """
+        Args:
+            codigo_cnes (str): Código CNES consultado
+            dados (Dict[str, Any]): JSON da resposta da API (não é copiado)
+            url_base (str): URL base da API, da qual a URL consultada é derivada
+            origem (str): 'api', 'cache' ou 'cache_revalidado'
+            campos (ProjecaoCampos): Projeção de campos (ver projetar_campos); None mantém todos
+            consultado_em (float): Timestamp da consulta (padrão: agora)
+            obtido_da_api_em (float): Timestamp em que a resposta foi obtida da API (respostas do cache)
+        """
+        if campos is not None and not isinstance(campos, ProjecaoCampos):
+            campos = ProjecaoCampos(campos)
+        self.codigo_cnes = codigo_cnes
+        self.campos = campos
+        self.valores = dados if campos is None else tuple(dados.get(campo, self.AUSENTE) for campo in campos)
+        self.url_base = url_base
+        self.consultado_em = time.time() if consultado_em is None else consultado_em
+        self.origem = origem
+        self.obtido_da_api_em = obtido_da_api_em
+        self.tentativas = None
+        self.indice_processamento = None
+        self.mesclado = False
+        self.dados_macrorregiao = None
+    
+    @classmethod
+    def projetar_campos(cls, campos: Optional[List[str]]) -> Optional[ProjecaoCampos]:
+        """
+        Normaliza uma lista de campos para uso como projeção, incluindo os campos obrigatórios
+        """
+        if not campos:
+            return None
+        projecao = [campo for campo in cls.CAMPOS_OBRIGATORIOS if campo not in campos]
+        projecao.extend(dict.fromkeys(campos))
+        return ProjecaoCampos(projecao)
+    
+    @classmethod
+    def de_dict(cls, dados: Dict[str, Any], url_base: str, campos: Optional[ProjecaoCampos] = None) -> 'EstabelecimentoCNES':
+        """
+        Reconstrói um registro a partir de para_dict() (ex.: entrada do journal). O dict é reaproveitado
+        """
+        metadata = dados.pop('_metadata', None) or {}
+        
+        def timestamp(valor: Optional[str]) -> Optional[float]:
+            return datetime.fromisoformat(valor).timestamp() if valor else None
+        
+        registro = cls(
+            str(metadata.get('codigo_cnes_consultado', dados.get('codigo_cnes'))), dados, url_base,
+            origem=metadata.get('origem', 'api'), campos=campos,
+            consultado_em=timestamp(metadata.get('consultado_em')),
+            obtido_da_api_em=timestamp(metadata.get('obtido_da_api_em'))
+        )
+        if 'tentativas' in metadata:
+            registro.registrar_tentativas(metadata['tentativas'])
+        registro.indice_processamento = metadata.get('indice_processamento')
+        return registro
+    
+    @property
+    def url_consultada(self) -> str:
+        return f"{self.url_base}/{self.codigo_cnes}"
+    
+    def get(self, campo: str, padrao: Any = None) -> Any:
+        """
+        Valor de um campo dos dados do estabelecimento (mesma interface de dict.get): um null
+        da API é devolvido como None; `padrao` só vale para campos ausentes na resposta ou
+        fora da projeção, com ou sem projeção
+        """
+        if self.campos is None:
+            return self.valores.get(campo, padrao)
+        indice = self.campos.indices.get(campo)
+        if indice is None:
+            return padrao
+        valor = self.valores[indice]
+        return padrao if valor is self.AUSENTE else valor
+    
+    def registrar_tentativas(self, historico: List[Dict[str, Any]]):
+        """
+        Guarda o histórico de tentativas como tuplas (status, classe do erro, latência em ms)
+        """
+        self.tentativas = tuple(
+            (tentativa['status_code'], tentativa['classe_erro'], tentativa['latencia_ms']) for tentativa in historico
+        )
+    
+    def metadata(self) -> Dict[str, Any]:
+        """
+        Monta o bloco _metadata com os mesmos campos gravados nas versões anteriores
+        """
+        metadata = {
+            'consultado_em': datetime.fromtimestamp(self.consultado_em).isoformat(),
+            'codigo_cnes_consultado': self.codigo_cnes,
+            'url_consultada': self.url_consultada,
+            'origem': self.origem
+        }
+        if self.obtido_da_api_em is not None:
+            metadata['obtido_da_api_em'] = datetime.fromtimestamp(self.obtido_da_api_em).isoformat()
+        if self.tentativas is not None:
+            metadata['tentativas'] = [
+                {'tentativa': numero, 'status_code': status, 'classe_erro': classe_erro, 'latencia_ms': latencia_ms}
+                for numero, (status, classe_erro, latencia_ms) in enumerate(self.tentativas, 1)
+            ]
+            metadata['retentativas'] = len(self.tentativas) - 1
+        if self.indice_processamento is not None:
+            metadata['indice_processamento'] = self.indice_processamento
+        return metadata
+    
+    def para_dict(self, incluir_metadata: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Monta o dict gravado nos arquivos de saída
+        
+        Args:
+            incluir_metadata (bool): Inclui o bloco _metadata (padrão: apenas se o registro
+                não foi mesclado com macrorregião, como nas versões anteriores)
+        """
+        if self.campos is None:
+            dados = dict(self.valores)
+        else:
+            ausente = self.AUSENTE
+            dados = {campo: None if valor is ausente else valor for campo, valor in zip(self.campos, self.valores)}
+        
+        if incluir_metadata is None:
+            incluir_metadata = not self.mesclado
+        if incluir_metadata:
+            dados['_metadata'] = self.metadata()
+        if self.mesclado:
+            dados['dados_macrorregiao'] = self.dados_macrorregiao
+        return dados
+
+class ResultadoTentativa:
+    """
+    Resultado de uma única tentativa de consulta à API
+    """
+    __slots__ = ('sucesso', 'dados', 'status', 'classe_erro', 'retry_after', 'latencia', 'adiada')
+    
+    def __init__(self, sucesso: bool, dados: Any, status: Optional[int] = None,
+                 classe_erro: Optional[str] = None, retry_after: Optional[float] = None):
+        """
+        Args:
+            sucesso (bool): Se a consulta retornou o estabelecimento
+            dados (Any): EstabelecimentoCNES (sucesso) ou dict com a descrição do erro
+            status (int): Status HTTP (None em timeouts e erros de conexão)
+            classe_erro (str): 'nao_encontrado', 'http', 'json_invalido', 'timeout',
+                'conexao' ou 'inesperado' (None em caso de sucesso)
+            retry_after (float): Segundos pedidos pela API no cabeçalho Retry-After
+        """
+        self.sucesso = sucesso
+        self.dados = dados
+        self.status = status
+        self.classe_erro = classe_erro
+        self.retry_after = retry_after
+        self.latencia = 0.0
+        # Falha recebida com o disjuntor aberto: não conta como tentativa (ver CircuitBreaker)
+        self.adiada = False
+    
+    def registro(self, tentativa: int) -> Dict[str, Any]:
+        """
+        Resumo da tentativa para o histórico gravado em _metadata / erros
+        """
+        return {
+            'tentativa': tentativa,
+            'status_code': self.status,
+            'classe_erro': self.classe_erro,
+            'latencia_ms': round(self.latencia * 1000, 1)
+        }
+
+class CNESResponseCache:
+    """
+    Cache persistente em SQLite das respostas da API CNES, indexado pelo código CNES.
+    
+    Guarda o JSON bruto da resposta, os validadores HTTP (ETag / Last-Modified) e o horário
+    da consulta. Entradas dentro do TTL são usadas sem acessar a rede; entradas vencidas com
+    validadores são revalidadas com requisições condicionais (If-None-Match / If-Modified-Since).
+    O tamanho é limitado por número de entradas e/ou bytes, removendo as menos usadas (LRU).
+    
+    Vários processos (shards) podem usar o mesmo arquivo: cada gravação é confirmada na hora,
+    então o bloqueio de escrita dura um comando, e a espera pelo bloqueio é curta. Uma leitura
+    não escreve: o horário de acesso (usado pelo LRU) fica em memória e é gravado de uma vez
+    em confirmar(). Um erro do SQLite (arquivo bloqueado, disco cheio) nunca chega à consulta:
+    a leitura vira um miss e a gravação é descartada, ambas contadas em stats['falhas'].
+    """
+    
+    def __init__(self, arquivo: str = 'cnes_cache.sqlite3', ttl_segundos: float = 7 * 24 * 3600,
+                 max_entradas: Optional[int] = None, max_bytes: Optional[int] = None,
+                 intervalo_limites: int = 500, timeout_bloqueio: float = 2.0):
+        """
+        Args:
+            arquivo (str): Caminho do arquivo SQLite do cache
+            ttl_segundos (float): Tempo em que uma resposta é considerada fresca (padrão: 7 dias)
+            max_entradas (int): Número máximo de entradas (None = sem limite)
+            max_bytes (int): Tamanho máximo somado das respostas em bytes (None = sem limite)
+            intervalo_limites (int): Número de gravações entre aplicações dos limites de tamanho
+            timeout_bloqueio (float): Segundos de espera pelo bloqueio de outro processo; a
+                espera bloqueia o loop de eventos, então é curta
+        """
+        self.arquivo = arquivo
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.intervalo_limites = intervalo_limites
+        self._gravacoes_pendentes = 0
+        # Horário do último acesso de cada código lido, gravado em confirmar()
+        self._acessos: Dict[str, float] = {}
+        
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'expiradas': 0,
+            'revalidadas_304': 0,
+            'gravacoes': 0,
+            'remocoes_lru': 0,
+            'falhas': 0
+        }
+        
+        # Sem transações implícitas: cada comando é confirmado sozinho (autocommit)
+        self.conexao = sqlite3.connect(arquivo, timeout=timeout_bloqueio, isolation_level=None)
+        self.conexao.execute('PRAGMA journal_mode=WAL')
+        self.conexao.execute('PRAGMA synchronous=NORMAL')
+        self.conexao.execute('''
+            CREATE TABLE IF NOT EXISTS respostas (
+                codigo_cnes TEXT PRIMARY KEY,
+                corpo TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                obtido_em REAL NOT NULL,
+                acessado_em REAL NOT NULL,
+                tamanho INTEGER NOT NULL
+            )
+        ''')
+        self.conexao.execute('CREATE INDEX IF NOT EXISTS idx_respostas_acessado_em ON respostas (acessado_em)')
+    
+    def _registrar_falha(self, operacao: str, erro: sqlite3.Error):
+        # Avisa só a primeira falha; as demais ficam na contagem do resumo
+        self.stats['falhas'] += 1
+        if self.stats['falhas'] == 1:
+            logging.warning(safe_log_message(f"⚠️ Cache indisponível ({operacao}): {erro}; a consulta segue sem o cache"))
+    
+    def _escrever(self, operacao: str, sql: str, parametros: Tuple[Any, ...]) -> bool:
+        """
+        Executa um comando de escrita, confirmado na hora
+        
+        Returns:
+            bool: False se o SQLite falhou (a escrita é descartada)
+        """
+        try:
+            self.conexao.execute(sql, parametros)
+        except sqlite3.Error as e:
+            self._registrar_falha(operacao, e)
+            return False
+        self._registrar_gravacao()
+        return True
+    
+    def obter(self, codigo_cnes: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca a resposta de um código no cache
+        
+        Returns:
+            Optional[Dict]: {'corpo', 'etag', 'last_modified', 'obtido_em', 'fresca'} ou None
+        """
+        try:
+            linha = self.conexao.execute(
+                'SELECT corpo, etag, last_modified, obtido_em FROM respostas WHERE codigo_cnes = ?',
+                (codigo_cnes,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._registrar_falha('leitura', e)
+            linha = None
+        
+        if linha is None:
+            self.stats['misses'] += 1
+            return None
+        
+        agora = time.time()
+        corpo, etag, last_modified, obtido_em = linha
+        fresca = agora - obtido_em < self.ttl_segundos
+        if fresca:
+            self.stats['hits'] += 1
+        else:
+            self.stats['expiradas'] += 1
+        
+        self._acessos[codigo_cnes] = agora
+        
+        return {
+            'corpo': corpo,
+            'etag': etag,
+            'last_modified': last_modified,
+            'obtido_em': obtido_em,
+            'fresca': fresca
+        }
+    
+    def gravar(self, codigo_cnes: str, corpo: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """
+        Grava (ou substitui) a resposta de um código
+        """
+        agora = time.time()
+        if self._escrever(
+            'gravação',
+            'INSERT OR REPLACE INTO respostas '
+            '(codigo_cnes, corpo, etag, last_modified, obtido_em, acessado_em, tamanho) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (codigo_cnes, corpo, etag, last_modified, agora, agora, len(corpo))
+        ):
+            self.stats['gravacoes'] += 1
+    
+    def renovar(self, codigo_cnes: str):
+        """
+        Marca uma entrada como fresca novamente (resposta 304 Not Modified)
+        """
+        self._escrever('revalidação', 'UPDATE respostas SET obtido_em = ? WHERE codigo_cnes = ?', (time.time(), codigo_cnes))
+        self.stats['revalidadas_304'] += 1
+    
+    def remover(self, codigo_cnes: str):
+        """
+        Remove um código do cache (por exemplo, quando a API passa a responder 404)
+        """
+        self._escrever('remoção', 'DELETE FROM respostas WHERE codigo_cnes = ?', (codigo_cnes,))
+    
+    def _registrar_gravacao(self):
+        self._gravacoes_pendentes += 1
+        if self._gravacoes_pendentes >= self.intervalo_limites:
+            self.confirmar()
+    
+    def _remover_excesso(self):
+        """
+        Remove as entradas usadas há mais tempo até respeitar max_entradas e max_bytes
+        """
+        if self.max_entradas is not None:
+            total = self.conexao.execute('SELECT COUNT(*) FROM respostas').fetchone()[0]
+            excesso = total - self.max_entradas
+            if excesso > 0:
+                self.conexao.execute(
+                    'DELETE FROM respostas WHERE codigo_cnes IN '
+                    '(SELECT codigo_cnes FROM respostas ORDER BY acessado_em LIMIT ?)',
+                    (excesso,)
+                )
+                self.stats['remocoes_lru'] += excesso
+        
+        if self.max_bytes is not None:
+            total_bytes = self.conexao.execute('SELECT COALESCE(SUM(tamanho), 0) FROM respostas').fetchone()[0]
+            if total_bytes > self.max_bytes:
+                removidos = []
+                for codigo, tamanho in self.conexao.execute('SELECT codigo_cnes, tamanho FROM respostas ORDER BY acessado_em'):
+                    if total_bytes <= self.max_bytes:
+                        break
+                    removidos.append((codigo,))
+                    total_bytes -= tamanho
+                self.conexao.executemany('DELETE FROM respostas WHERE codigo_cnes = ?', removidos)
+                self.stats['remocoes_lru'] += len(removidos)
+    
+    def confirmar(self):
+        """
+        Grava os horários de acesso acumulados e aplica os limites de tamanho, numa transação
+        que reserva a escrita desde o início (BEGIN IMMEDIATE); as demais gravações já são
+        confirmadas uma a uma
+        """
+        acessos, self._acessos = self._acessos, {}
+        self._gravacoes_pendentes = 0
+        if not acessos and self.max_entradas is None and self.max_bytes is None:
+            return
+        try:
+            self.conexao.execute('BEGIN IMMEDIATE')
+            if acessos:
+                self.conexao.executemany('UPDATE respostas SET acessado_em = ? WHERE codigo_cnes = ?',
+                                         [(horario, codigo) for codigo, horario in acessos.items()])
+            self._remover_excesso()
+            self.conexao.execute('COMMIT')
+        except sqlite3.Error as e:
+            if self.conexao.in_transaction:
+                self.conexao.execute('ROLLBACK')
+            self._registrar_falha('confirmação', e)
+    
+    def fechar(self):
+        """
+        Grava os horários de acesso, aplica os limites de tamanho e fecha o arquivo do cache
+        """
+        self.confirmar()
+        self.conexao.close()
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'arquivo': self.arquivo,
+            'ttl_segundos': self.ttl_segundos,
+            'max_entradas': self.max_entradas,
+            'max_bytes': self.max_bytes,
+            **self.stats
+        }
+
+class CNESSnapshotStore:
+    """
+    Snapshot em SQLite do conteúdo de cada estabelecimento, para a sincronização incremental
+    (DeltaResultWriter).
+    
+    Guarda, por escopo (ex.: uma lista de códigos) e codigo_cnes, o hash do registro
+    normalizado: JSON canônico (chaves ordenadas) sem o bloco _metadata, que muda a cada
+    consulta (consultado_em, tentativas, latências) sem que o estabelecimento mude.
+    """
+    
+    def __init__(self, arquivo: str = 'cnes_snapshot.sqlite3'):
+        """
+        Args:
+            arquivo (str): Caminho do arquivo SQLite do snapshot
+        """
+        self.arquivo = arquivo
+        self.conexao = sqlite3.connect(arquivo)
+        self.conexao.execute('PRAGMA journal_mode=WAL')
+        self.conexao.execute('PRAGMA synchronous=NORMAL')
+        self.conexao.execute('''
+            CREATE TABLE IF NOT EXISTS registros (
+                escopo TEXT NOT NULL,
+                codigo_cnes TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                alterado_em TEXT NOT NULL,
+                PRIMARY KEY (escopo, codigo_cnes)
+            )
+        ''')
+        self.conexao.execute('''
+            CREATE TABLE IF NOT EXISTS escopos (
+                escopo TEXT PRIMARY KEY,
+                atualizado_em TEXT NOT NULL,
+                total INTEGER NOT NULL
+            )
+        ''')
+        self.conexao.commit()
+    
+    @staticmethod
+    def hash_conteudo(registro: Any) -> str:
+        """
+        Hash do registro (dict ou EstabelecimentoCNES) normalizado, sem o bloco _metadata
+        
+        Usa sempre o módulo json (e não CODEC_JSON) para o hash não mudar com a biblioteca instalada.
+        """
+        if isinstance(registro, EstabelecimentoCNES):
+            dados = registro.para_dict(incluir_metadata=False)
+        else:
+            dados = {chave: valor for chave, valor in registro.items() if chave != '_metadata'}
+        canonico = json.dumps(dados, sort_keys=True, ensure_ascii=False, separators=(',', ':'), cls=DateTimeEncoder)
+        return hashlib.blake2b(canonico.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def carregar(self, escopo: str) -> Dict[str, str]:
+        """
+        Hashes gravados para o escopo, por codigo_cnes
+        """
+        return dict(self.conexao.execute('SELECT codigo_cnes, hash FROM registros WHERE escopo = ?', (escopo,)))
+    
+    def info(self, escopo: str) -> Optional[Dict[str, Any]]:
+        """
+        Data da última atualização e total de registros do escopo (None se nunca sincronizado)
+        """
+        linha = self.conexao.execute('SELECT atualizado_em, total FROM escopos WHERE escopo = ?', (escopo,)).fetchone()
+        return {'atualizado_em': linha[0], 'total': linha[1]} if linha else None
+    
+    def atualizar(self, escopo: str, alterados: Dict[str, str], removidos: List[str]):
+        """
+        Grava os hashes novos/alterados e remove os códigos que saíram, numa única transação
+        """
+        agora = datetime.now().isoformat()
+        with self.conexao:
+            self.conexao.executemany(
+                'INSERT OR REPLACE INTO registros (escopo, codigo_cnes, hash, alterado_em) VALUES (?, ?, ?, ?)',
+                [(escopo, codigo, valor_hash, agora) for codigo, valor_hash in alterados.items()]
+            )
+            self.conexao.executemany('DELETE FROM registros WHERE escopo = ? AND codigo_cnes = ?',
+                                     [(escopo, codigo) for codigo in removidos])
+            total = self.conexao.execute('SELECT COUNT(*) FROM registros WHERE escopo = ?', (escopo,)).fetchone()[0]
+            self.conexao.execute('INSERT OR REPLACE INTO escopos (escopo, atualizado_em, total) VALUES (?, ?, ?)',
+                                 (escopo, agora, total))
+    
+    def fechar(self):
+        self.conexao.close()
+
+class CheckpointJournal:
+    """
+    Journal de checkpoint append-only em JSONL: uma linha por código concluído, gravada
+    assim que o resultado chega e sincronizada em disco (fsync) em intervalos configuráveis.
+    
+    A primeira linha é um cabeçalho com o arquivo de entrada da execução. Ao abrir um
+    journal existente, as entradas já gravadas ficam em `concluidos` para que a execução
+    seja retomada pulando esses códigos. Uma última linha truncada (processo morto no meio
+    da escrita) é descartada.
+    """
+    
+    # Erros que não mudam ao repetir a consulta; os demais são consultados de novo ao retomar
+    CLASSES_ERRO_DEFINITIVAS = ('nao_encontrado', 'json_invalido')
+    
+    def __init__(self, arquivo: str, intervalo_fsync_registros: int = 100, intervalo_fsync_segundos: float = 5.0,
+                 arquivo_entrada: Optional[str] = None, parametros: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            arquivo (str): Caminho do journal (.jsonl)
+            intervalo_fsync_registros (int): Número de registros entre sincronizações em disco
+            intervalo_fsync_segundos (float): Tempo máximo entre sincronizações em disco
+            arquivo_entrada (str): Arquivo de códigos da execução, gravado no cabeçalho
+            parametros (Dict[str, Any]): Parâmetros da execução gravados no cabeçalho
+                (ex.: comando e formato de saída), usados para retomá-la
+        """
+        self.arquivo = arquivo
+        self.intervalo_fsync_registros = max(1, intervalo_fsync_registros)
+        self.intervalo_fsync_segundos = intervalo_fsync_segundos
+        self.cabecalho = None
+        self.concluidos = {}
+        
+        tamanho_valido = self._carregar_existente() if os.path.exists(arquivo) else 0
+        
+        self._arquivo = open(arquivo, 'ab')
+        # Descarta uma linha final incompleta antes de voltar a acrescentar registros
+        if self._arquivo.tell() != tamanho_valido:
+            self._arquivo.truncate(tamanho_valido)
+            self._arquivo.seek(tamanho_valido)
+        
+        if self.cabecalho is None:
+            self.cabecalho = {
+                'tipo': 'cabecalho',
+                'criado_em': datetime.now().isoformat(),
+                'arquivo_entrada': arquivo_entrada,
+                'parametros': parametros or {}
+            }
+            self._escrever(self.cabecalho)
+            self.sincronizar()
+        
+        self._registros_pendentes = 0
+        self._ultima_sincronizacao = time.monotonic()
+    
+    def _carregar_existente(self) -> int:
+        """
+        Lê as entradas de um journal existente
+        
+        Returns:
+            int: Tamanho em bytes da parte válida do arquivo
+        """
+        tamanho_valido = 0
+        with open(self.arquivo, 'rb') as arquivo:
+            for linha in arquivo:
+                if not linha.endswith(b'\n'):
+                    break
+                try:
+                    entrada = CODEC_JSON.loads(linha)
+                except ValueError:
+                    break
+                tamanho_valido += len(linha)
+                
+                if entrada.get('tipo') == 'cabecalho':
+                    self.cabecalho = entrada
+                elif entrada.get('tipo') == 'resultado':
+                    self.concluidos[entrada['codigo_cnes']] = entrada
+        
+        logging.info(safe_log_message(f"📂 Journal {self.arquivo}: {len(self.concluidos)} códigos já registrados"))
+        return tamanho_valido
+    
+    @staticmethod
+    def novo_arquivo(prefixo: str = 'cnes_journal') -> str:
+        """
+        Nome de um journal novo, <prefixo>_AAAAMMDD_HHMMSS.jsonl, sem reaproveitar um arquivo
+        existente (duas execuções no mesmo segundo não podem retomar o journal uma da outra)
+        """
+        base = f"{prefixo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        arquivo = f"{base}.jsonl"
+        sequencia = 1
+        while os.path.exists(arquivo):
+            sequencia += 1
+            arquivo = f"{base}_{sequencia}.jsonl"
+        return arquivo
+    
+    @staticmethod
+    def ler_cabecalho(arquivo: str) -> Optional[Dict[str, Any]]:
+        """
+        Lê o cabeçalho de um journal sem abri-lo para escrita
+        """
+        with open(arquivo, 'rb') as f:
+            try:
+                entrada = CODEC_JSON.loads(f.readline())
+            except ValueError:
+                return None
+        return entrada if entrada.get('tipo') == 'cabecalho' else None
+    
+    @classmethod
+    def eh_definitivo(cls, entrada: Dict[str, Any]) -> bool:
+        """
+        Indica se uma entrada do journal dispensa nova consulta ao retomar a execução
+        """
+        if entrada.get('definitivo') is False:
+            return False
+        return entrada['sucesso'] or entrada['registro'].get('classe_erro') in cls.CLASSES_ERRO_DEFINITIVAS
+    
+    def _escrever(self, entrada: Dict[str, Any]):
+        self._arquivo.write(CODEC_JSON.dumps(entrada) + b'\n')
+    
+    def registrar(self, codigo_cnes: str, sucesso: bool, resultado: Dict[str, Any], indice: int,
+                  definitivo: bool = True):
+        """
+        Acrescenta o resultado de um código ao journal
+        
+        Args:
+            definitivo (bool): False para um resultado que deve ser consultado de novo ao
+                retomar, mesmo com sucesso (ex.: registro da listagem cujo complemento falhou)
+        """
+        entrada = {
+            'tipo': 'resultado',
+            'codigo_cnes': codigo_cnes,
+            'indice': indice,
+            'sucesso': sucesso,
+            'registro': resultado.para_dict(incluir_metadata=True) if isinstance(resultado, EstabelecimentoCNES) else resultado
+        }
+        if not definitivo:
+            entrada['definitivo'] = False
+        self._escrever(entrada)
+        self._registros_pendentes += 1
+        
+        if (self._registros_pendentes >= self.intervalo_fsync_registros or
+                time.monotonic() - self._ultima_sincronizacao >= self.intervalo_fsync_segundos):
+            self.sincronizar()
+    
+    def sincronizar(self):
+        """
+        Descarrega o buffer e força a gravação em disco (fsync)
+        """
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+        self._registros_pendentes = 0
+        self._ultima_sincronizacao = time.monotonic()
+    
+    def fechar(self):
+        if not self._arquivo.closed:
+            self.sincronizar()
+            self._arquivo.close()
+
+class StreamingResultWriter:
+    """
+    Escritor incremental de resultados: cada registro é serializado e gravado assim que
+    chega, então a memória usada não cresce com o número de códigos processados.
+    
+    Formatos:
+    - 'json': um objeto JSON com a lista de registros, a lista de erros e, no final, os
+      blocos de metadados e resumo. Os erros ficam num arquivo temporário até o fechamento
+    - 'jsonl': um registro por linha; erros, metadados e resumo vão para um arquivo
+      auxiliar <nome>_meta.json
+    
+    A verificação usa as contagens e o tamanho/SHA-256 acumulados durante a escrita, sem
+    reler o arquivo.
+    """
+    
+    FORMATOS = ('json', 'jsonl')
+    
+    def __init__(self, arquivo: str, formato: Optional[str] = None, chave_registros: str = 'estabelecimentos',
+                 chave_erros: str = 'erros', chave_metadados: str = 'metadados'):
+        """
+        Args:
+            arquivo (str): Caminho do arquivo de saída
+            formato (str): 'json' ou 'jsonl' (padrão: deduzido da extensão do arquivo)
+            chave_registros (str): Nome da lista de registros no JSON de saída
+            chave_erros (str): Nome da lista de erros no JSON de saída
+            chave_metadados (str): Nome do bloco de metadados no JSON de saída
+        """
+        if formato is None:
+            formato = 'jsonl' if arquivo.endswith('.jsonl') else 'json'
+        if formato not in self.FORMATOS:
+            raise ValueError(f"Formato de saída inválido: {formato}")
+        
+        self.arquivo = arquivo
+        self.formato = formato
+        self.chave_registros = chave_registros
+        self.chave_erros = chave_erros
+        self.chave_metadados = chave_metadados
+        self.arquivo_meta = os.path.splitext(arquivo)[0] + '_meta.json' if formato != 'json' else None
+        
+        self.total_registros = 0
+        self.total_erros = 0
+        self.bytes_escritos = 0
+        self._sha256 = hashlib.sha256()
+        
+        self._arquivo = open(arquivo, 'wb', buffering=1024 * 1024)
+        self._erros = tempfile.TemporaryFile(mode='w+b')
+        
+        if formato == 'json':
+            self._escrever(f'{{\n  {json.dumps(chave_registros)}: ['.encode('utf-8'))
+    
+    def _escrever(self, dados: bytes):
+        self._arquivo.write(dados)
+        self._sha256.update(dados)
+        self.bytes_escritos += len(dados)
+    
+    @staticmethod
+    def _serializar_item(item: Any, formato: str) -> bytes:
+        if formato == 'jsonl':
+            return CODEC_JSON.dumps(item)
+        # Mesmo layout de json.dump(..., indent=2) para itens de uma lista no segundo nível
+        return CODEC_JSON.dumps(item, indent=True).replace(b'\n', b'\n    ')
+    
+    def escrever_estabelecimento(self, dados: Any):
+        """
+        Grava um registro (dict ou EstabelecimentoCNES) no arquivo de saída
+        """
+        if isinstance(dados, EstabelecimentoCNES):
+            dados = dados.para_dict()
+        if self.formato == 'jsonl':
+            self._escrever(self._serializar_item(dados, 'jsonl') + b'\n')
+        else:
+            separador = b',\n    ' if self.total_registros else b'\n    '
+            self._escrever(separador + self._serializar_item(dados, 'json'))
+        self.total_registros += 1
+    
+    def escrever_erro(self, erro: Dict[str, Any]):
+        """
+        Acumula um erro em disco para gravá-lo no fechamento
+        """
+        separador = b',\n    ' if self.total_erros else b'\n    '
+        self._erros.write(separador + self._serializar_item(erro, 'json'))
+        self.total_erros += 1
+    
+    def _copiar_erros(self, destino):
+        self._erros.seek(0)
+        while True:
+            bloco = self._erros.read(1024 * 1024)
+            if not bloco:
+                break
+            destino(bloco)
+    
+    def finalizar(self, metadados: Dict[str, Any], resumo: Optional[Dict[str, Any]] = None,
+                  extras: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Grava os erros, metadados e resumo, fecha o arquivo e confere o tamanho gravado
+        
+        Args:
+            metadados (Dict[str, Any]): Bloco de metadados da execução
+            resumo (Dict[str, Any]): Bloco de resumo (opcional)
+            extras (Dict[str, Any]): Outros blocos a gravar no final (opcional)
+            
+        Returns:
+            Dict[str, Any]: Dados de verificação (contagens, bytes e SHA-256)
+        """
+        blocos = {self.chave_metadados: metadados}
+        if resumo is not None:
+            blocos['resumo'] = resumo
+        if extras:
+            blocos.update(extras)
+        
+        def serializar_bloco(chave: str, valor: Any) -> bytes:
+            return (f',\n  {json.dumps(chave)}: '.encode('utf-8') +
+                    CODEC_JSON.dumps(valor, indent=True).replace(b'\n', b'\n  '))
+        
+        if self.formato == 'json':
+            self._escrever(b'\n  ]' if self.total_registros else b']')
+            self._escrever(f',\n  {json.dumps(self.chave_erros)}: ['.encode('utf-8'))
+            self._copiar_erros(self._escrever)
+            self._escrever(b'\n  ]' if self.total_erros else b']')
+            for chave, valor in blocos.items():
+                self._escrever(serializar_bloco(chave, valor))
+            self._escrever(b'\n}')
+        
+        self._arquivo.close()
+        
+        verificacao = self._dados_verificacao()
+        
+        if self.arquivo_meta is not None:
+            with open(self.arquivo_meta, 'wb') as meta:
+                meta.write(f'{{\n  {json.dumps(self.chave_erros)}: ['.encode('utf-8'))
+                self._copiar_erros(meta.write)
+                meta.write(('\n  ]' if self.total_erros else ']').encode('utf-8'))
+                for chave, valor in {**blocos, 'verificacao': verificacao}.items():
+                    meta.write(serializar_bloco(chave, valor))
+                meta.write(b'\n}')
+        
+        self._erros.close()
+        
+        tamanho_arquivo = os.path.getsize(self.arquivo)
+        if tamanho_arquivo != self.bytes_escritos:
+            raise IOError(
+                f"Arquivo {self.arquivo} com tamanho inesperado: {tamanho_arquivo} bytes "
+                f"(esperado: {self.bytes_escritos})"
+            )
+        
+        return verificacao
+    
+    def _dados_verificacao(self) -> Dict[str, Any]:
+        return {
+            'arquivo': self.arquivo,
+            'formato': self.formato,
+            'registros': self.total_registros,
+            'erros': self.total_erros,
+            'bytes': self.bytes_escritos,
+            'sha256': self._sha256.hexdigest()
+        }
+    
+    def abortar(self):
+        """
+        Fecha os arquivos sem finalizar a estrutura (saída fica incompleta)
+        """
+        self._arquivo.close()
+        self._erros.close()
+
+# Colunas do bloco dados_macrorregiao no registro achatado (ver achatar_estabelecimento)
+COLUNAS_MACRORREGIAO = (
+    'codigo_regiao_pais', 'regiao_pais', 'uf', 'codigo_macrorregiao_saude', 'macrorregiao_saude',
+    'codigo_regiao_saude', 'regiao_saude', 'municipio', 'populacao_estimada_ibge_2022'
+)
+
+def _valor_tabular(valor: Any) -> Any:
+    if isinstance(valor, (dict, list)):
+        return CODEC_JSON.dumps(valor).decode('utf-8')
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+def achatar_estabelecimento(registro: Any) -> Dict[str, Any]:
+    """
+    Converte um estabelecimento (dict ou EstabelecimentoCNES, mesclado ou não) em uma linha
+    plana para saídas tabulares:
+    - os campos de dados_macrorregiao sobem para o nível principal, sem repetir o
+      codigo_municipio; sem município correspondente, essas colunas ficam nulas
+    - campos de outros objetos viram <objeto>_<campo> (ex.: _metadata.origem → metadata_origem)
+    - listas são gravadas como texto JSON
+    """
+    if isinstance(registro, EstabelecimentoCNES):
+        registro = registro.para_dict()
+    
+    linha = {}
+    for chave, valor in registro.items():
+        if chave == 'dados_macrorregiao':
+            continue
+        if isinstance(valor, dict):
+            prefixo = chave.lstrip('_')
+            for subchave, subvalor in valor.items():
+                linha[f"{prefixo}_{subchave}"] = _valor_tabular(subvalor)
+        else:
+            linha[chave] = _valor_tabular(valor)
+    
+    if 'dados_macrorregiao' in registro:
+        bloco = registro['dados_macrorregiao'] or {}
+        for coluna in COLUNAS_MACRORREGIAO:
+            # Um campo de mesmo nome vindo da API não é sobrescrito
+            linha[coluna if coluna not in linha else f"macrorregiao_{coluna}"] = _valor_tabular(bloco.get(coluna))
+    
+    return linha
+
+class _SaidaContabilizada:
+    """
+    Arquivo binário entregue ao pyarrow: repassa as escritas para o StreamingResultWriter,
+    que acumula tamanho e SHA-256
+    """
+    
+    def __init__(self, escritor: 'StreamingResultWriter'):
+        self._escritor = escritor
+        self.closed = False
+    
+    def write(self, dados) -> int:
+        dados = bytes(dados)
+        self._escritor._escrever(dados)
+        return len(dados)
+    
+    def tell(self) -> int:
+        return self._escritor.bytes_escritos
+    
+    def writable(self) -> bool:
+        return True
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        # O arquivo real é fechado pelo escritor em finalizar()/abortar()
+        self.closed = True
+
+class ColumnarResultWriter(StreamingResultWriter):
+    """
+    Escritor tabular de estabelecimentos para ferramentas de análise: cada registro é achatado
+    (achatar_estabelecimento) e as linhas são gravadas em grupos, conforme chegam.
+    
+    Formatos:
+    - 'parquet' e 'arrow' (Arrow IPC): colunas tipadas, um row group / record batch a cada
+      `linhas_por_grupo` registros. Exigem o pyarrow; sem ele, o arquivo é gravado como CSV
+    - 'csv': sem dependências
+    
+    As colunas e seus tipos são definidos pelo primeiro grupo (TIPOS_COLUNAS ou deduzidos dos
+    valores). Valores que não cabem no tipo da coluna ficam nulos e campos que só aparecem
+    depois do primeiro grupo são descartados; ambos são contados na verificação. Erros,
+    metadados e resumo vão para o arquivo auxiliar <nome>_meta.json, como no JSONL.
+    """
+    
+    FORMATOS = ('parquet', 'arrow', 'csv')
+    LINHAS_POR_GRUPO = 10000
+    
+    # Tipos fixos dos identificadores e coordenadas; as demais colunas têm o tipo deduzido
+    TIPOS_COLUNAS = {
+        'codigo_cnes': 'int',
+        'codigo_uf': 'int',
+        'codigo_municipio': 'int',
+        'latitude_estabelecimento_decimo_grau': 'float',
+        'longitude_estabelecimento_decimo_grau': 'float',
+        'populacao_estimada_ibge_2022': 'int'
+    }
+    
+    def __init__(self, arquivo: str, formato: Optional[str] = None, linhas_por_grupo: Optional[int] = None,
+                 chave_registros: str = 'estabelecimentos', chave_erros: str = 'erros',
+                 chave_metadados: str = 'metadados'):
+        """
+        Args:
+            arquivo (str): Caminho do arquivo de saída
+            formato (str): 'parquet', 'arrow' ou 'csv' (padrão: deduzido da extensão do arquivo)
+            linhas_por_grupo (int): Registros por row group (padrão: LINHAS_POR_GRUPO)
+            chave_registros, chave_erros, chave_metadados (str): Ver StreamingResultWriter
+        """
+        if formato is None:
+            formato = os.path.splitext(arquivo)[1].lstrip('.').lower()
+        
+        self._pyarrow = None
+        if formato in ('parquet', 'arrow'):
+            try:
+                import pyarrow
+                self._pyarrow = pyarrow
+            except ImportError:
+                arquivo = os.path.splitext(arquivo)[0] + '.csv'
+                logging.warning(safe_log_message(f"⚠️ pyarrow não instalado: gravando CSV em {arquivo}"))
+                formato = 'csv'
+        
+        super().__init__(arquivo, formato=formato, chave_registros=chave_registros,
+                         chave_erros=chave_erros, chave_metadados=chave_metadados)
+        
+        self.linhas_por_grupo = linhas_por_grupo or self.LINHAS_POR_GRUPO
+        self.colunas: Optional[Dict[str, str]] = None
+        self.grupos_gravados = 0
+        self.colunas_descartadas: Dict[str, int] = {}
+        self.valores_incompativeis: Dict[str, int] = {}
+        self._linhas: List[Dict[str, Any]] = []
+        self._escritor_arrow = None
+        self._schema = None
+    
+    @staticmethod
+    def _inferir_tipo(valores) -> str:
+        tipos = {type(valor) for valor in valores if valor is not None}
+        if not tipos:
+            return 'str'
+        if tipos == {bool}:
+            return 'bool'
+        if tipos == {int}:
+            return 'int'
+        if tipos <= {int, float}:
+            return 'float'
+        return 'str'
+    
+    @staticmethod
+    def _converter(valor: Any, tipo: str) -> Any:
+        """
+        Converte o valor para o tipo da coluna (TypeError/ValueError se não couber)
+        """
+        if valor is None or tipo == 'str':
+            return valor if valor is None or isinstance(valor, str) else str(valor)
+        if isinstance(valor, str):
+            # Códigos numéricos podem vir como texto (ex.: codigo_municipio no arquivo de macrorregião)
+            if not valor.strip():
+                return None
+            if tipo == 'int':
+                return int(valor)
+            if tipo == 'float':
+                return float(valor)
+        if isinstance(valor, bool) != (tipo == 'bool'):
+            raise TypeError(valor)
+        if tipo == 'int':
+            if isinstance(valor, float) and valor.is_integer():
+                return int(valor)
+            if not isinstance(valor, int):
+                raise TypeError(valor)
+        elif tipo == 'float':
+            if not isinstance(valor, (int, float)):
+                raise TypeError(valor)
+            return float(valor)
+        return valor
+    
+    def _definir_colunas(self, linhas: List[Dict[str, Any]]):
+        colunas = {}
+        for linha in linhas:
+            for coluna in linha:
+                colunas.setdefault(coluna, None)
+        self.colunas = {
+            coluna: self.TIPOS_COLUNAS.get(coluna) or self._inferir_tipo(linha.get(coluna) for linha in linhas)
+            for coluna in colunas
+        }
+        
+        if self.formato == 'csv':
+            if self.colunas:
+                self._escrever_csv([list(self.colunas)])
+            return
+        
+        pa = self._pyarrow
+        tipos_arrow = {'int': pa.int64(), 'float': pa.float64(), 'bool': pa.bool_(), 'str': pa.string()}
+        self._schema = pa.schema([(coluna, tipos_arrow[tipo]) for coluna, tipo in self.colunas.items()])
+        saida = _SaidaContabilizada(self)
+        if self.formato == 'parquet':
+            import pyarrow.parquet
+            self._escritor_arrow = pyarrow.parquet.ParquetWriter(saida, self._schema, compression='snappy')
+        else:
+            self._escritor_arrow = pa.ipc.new_file(saida, self._schema)
+    
+    def _escrever_csv(self, linhas):
+        texto = io.StringIO()
+        csv.writer(texto).writerows(linhas)
+        self._escrever(texto.getvalue().encode('utf-8'))
+    
+    def _gravar_grupo(self):
+        """
+        Converte as linhas acumuladas para os tipos das colunas e grava um grupo
+        """
+        if self.colunas is None:
+            self._definir_colunas(self._linhas)
+        if not self._linhas:
+            return
+        
+        colunas = self.colunas
+        valores = {coluna: [] for coluna in colunas}
+        for linha in self._linhas:
+            if not colunas.keys() >= linha.keys():
+                for coluna in linha.keys() - colunas.keys():
+                    self.colunas_descartadas[coluna] = self.colunas_descartadas.get(coluna, 0) + 1
+            for coluna, tipo in colunas.items():
+                valor = linha.get(coluna)
+                try:
+                    valores[coluna].append(self._converter(valor, tipo))
+                except (TypeError, ValueError):
+                    valores[coluna].append(None)
+                    self.valores_incompativeis[coluna] = self.valores_incompativeis.get(coluna, 0) + 1
+        
+        if self.formato == 'csv':
+            self._escrever_csv(zip(*valores.values()))
+        else:
+            pa = self._pyarrow
+            lote = pa.record_batch([pa.array(valores[campo.name], type=campo.type) for campo in self._schema],
+                                   schema=self._schema)
+            if self.formato == 'parquet':
+                self._escritor_arrow.write_table(pa.Table.from_batches([lote]))
+            else:
+                self._escritor_arrow.write_batch(lote)
+        
+        self.grupos_gravados += 1
+        self._linhas = []
+    
+    def escrever_estabelecimento(self, dados: Any):
+        """
+        Acumula um registro achatado e grava o grupo quando ele completa linhas_por_grupo
+        """
+        self._linhas.append(achatar_estabelecimento(dados))
+        self.total_registros += 1
+        if len(self._linhas) >= self.linhas_por_grupo:
+            self._gravar_grupo()
+    
+    def finalizar(self, metadados: Dict[str, Any], resumo: Optional[Dict[str, Any]] = None,
+                  extras: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Grava o último grupo, fecha a tabela e grava o arquivo auxiliar (ver StreamingResultWriter.finalizar)
+        """
+        self._gravar_grupo()
+        if self._escritor_arrow is not None:
+            self._escritor_arrow.close()
+            self._escritor_arrow = None
+        return super().finalizar(metadados, resumo, extras)
+    
+    def _dados_verificacao(self) -> Dict[str, Any]:
+        verificacao = super()._dados_verificacao()
+        verificacao.update({
+            'colunas': self.colunas,
+            'grupos': self.grupos_gravados,
+            'colunas_descartadas': self.colunas_descartadas,
+            'valores_incompativeis': self.valores_incompativeis
+        })
+        return verificacao
+    
+    def abortar(self):
+        if self._escritor_arrow is not None:
+            try:
+                self._escritor_arrow.close()
+            except Exception:
+                pass
+            self._escritor_arrow = None
+        super().abortar()
+
+class SQLiteResultWriter:
+    """
+    Destino de resultados em um banco SQLite local, atualizado no lugar a cada execução
+    (em vez de um arquivo novo por execução).
+    
+    Cada estabelecimento é achatado (achatar_estabelecimento) e gravado com upsert por
+    codigo_cnes na tabela `estabelecimentos`; colunas que ainda não existem são criadas quando
+    aparecem e colunas ausentes no registro mantêm o valor anterior. Os erros ficam na tabela
+    `erros` (o código sai dela quando volta a ser consultado com sucesso) e os metadados e o
+    resumo de cada execução, na tabela `execucoes`.
+    
+    As gravações são agrupadas em transações de `registros_por_transacao` registros, e há
+    índices por codigo_municipio, codigo_regiao_saude, codigo_macrorregiao_saude e codigo_uf:
+    consultas como "estabelecimentos de uma macrorregião" não percorrem a tabela inteira.
+    """
+    
+    FORMATOS = ('sqlite',)
+    EXTENSOES = ('sqlite', 'sqlite3', 'db')
+    
+    # Colunas criadas com a tabela (com índice), com o tipo de cada uma
+    COLUNAS_INDEXADAS = {
+        'codigo_uf': 'INTEGER',
+        'codigo_municipio': 'INTEGER',
+        'codigo_macrorregiao_saude': 'TEXT',
+        'codigo_regiao_saude': 'TEXT'
+    }
+    
+    def __init__(self, arquivo: str, registros_por_transacao: int = 1000, chave_registros: str = 'estabelecimentos',
+                 chave_erros: str = 'erros', chave_metadados: str = 'metadados'):
+        """
+        Args:
+            arquivo (str): Caminho do banco SQLite (criado se não existir)
+            registros_por_transacao (int): Registros gravados por transação
+            chave_registros, chave_erros (str): Aceitos por compatibilidade com os escritores
+                de arquivo; as tabelas são sempre `estabelecimentos` e `erros`
+            chave_metadados (str): Registrado em `execucoes.tipo` (ex.: 'metadados_mesclagem')
+        """
+        self.arquivo = arquivo
+        self.formato = 'sqlite'
+        self.registros_por_transacao = registros_por_transacao
+        self.chave_metadados = chave_metadados
+        
+        self.total_registros = 0
+        self.total_erros = 0
+        self._estabelecimentos: List[Tuple[str, Dict[str, Any]]] = []
+        self._erros: List[Tuple[Any, ...]] = []
+        self._sql_upsert: Dict[Tuple[str, ...], str] = {}
+        
+        self.conexao = sqlite3.connect(arquivo)
+        self.conexao.execute('PRAGMA journal_mode=WAL')
+        self.conexao.execute('PRAGMA synchronous=NORMAL')
+        colunas_indexadas = ''.join(f'{coluna} {tipo}, ' for coluna, tipo in self.COLUNAS_INDEXADAS.items())
+        self.conexao.execute(f'''
+            CREATE TABLE IF NOT EXISTS estabelecimentos (
+                codigo_cnes TEXT PRIMARY KEY,
+                {colunas_indexadas}atualizado_em TEXT NOT NULL
+            )
+        ''')
+        for coluna in self.COLUNAS_INDEXADAS:
+            self.conexao.execute(
+                f'CREATE INDEX IF NOT EXISTS idx_estabelecimentos_{coluna} ON estabelecimentos ({coluna})'
+            )
+        self.conexao.execute('''
+            CREATE TABLE IF NOT EXISTS erros (
+                codigo_cnes TEXT PRIMARY KEY,
+                status_code INTEGER,
+                classe_erro TEXT,
+                erro TEXT,
+                registro TEXT NOT NULL,
+                atualizado_em TEXT NOT NULL
+            )
+        ''')
+        self.conexao.execute('''
+            CREATE TABLE IF NOT EXISTS execucoes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                finalizada_em TEXT NOT NULL,
+                registros INTEGER NOT NULL,
+                erros INTEGER NOT NULL,
+                metadados TEXT NOT NULL,
+                resumo TEXT,
+                extras TEXT
+            )
+        ''')
+        self.conexao.commit()
+        
+        self.colunas = {linha[1] for linha in self.conexao.execute('PRAGMA table_info(estabelecimentos)')}
+        self._total_inicial = self.conexao.execute('SELECT COUNT(*) FROM estabelecimentos').fetchone()[0]
+    
+    @staticmethod
+    def _tipo_sqlite(valor: Any) -> str:
+        if isinstance(valor, (bool, int)):
+            return 'INTEGER'
+        if isinstance(valor, float):
+            return 'REAL'
+        return 'TEXT'
+    
+    def escrever_estabelecimento(self, dados: Any):
+        """
+        Acumula um estabelecimento (dict ou EstabelecimentoCNES) para o próximo upsert
+        """
+        codigo = dados.codigo_cnes if isinstance(dados, EstabelecimentoCNES) else dados.get('codigo_cnes')
+        linha = achatar_estabelecimento(dados)
+        linha.pop('codigo_cnes', None)
+        self._estabelecimentos.append((normalizar_codigo_cnes(codigo), linha))
+        self.total_registros += 1
+        self._registrar_gravacao()
+    
+    def escrever_erro(self, erro: Dict[str, Any]):
+        """
+        Acumula um erro para o próximo upsert na tabela `erros`
+        """
+        self._erros.append((
+            normalizar_codigo_cnes(erro.get('codigo_cnes', '')),
+            erro.get('status_code'),
+            erro.get('classe_erro'),
+            erro.get('erro'),
+            CODEC_JSON.dumps(erro).decode('utf-8')
+        ))
+        self.total_erros += 1
+        self._registrar_gravacao()
+    
+    def _registrar_gravacao(self):
+        if len(self._estabelecimentos) + len(self._erros) >= self.registros_por_transacao:
+            self.confirmar()
+    
+    def _criar_colunas(self, linhas: List[Tuple[str, Dict[str, Any]]]):
+        for _, linha in linhas:
+            for coluna, valor in linha.items():
+                if coluna not in self.colunas and valor is not None:
+                    nome = coluna.replace('"', '""')
+                    self.conexao.execute(f'ALTER TABLE estabelecimentos ADD COLUMN "{nome}" {self._tipo_sqlite(valor)}')
+                    self.colunas.add(coluna)
+    
+    def _sql(self, colunas: Tuple[str, ...]) -> str:
+        sql = self._sql_upsert.get(colunas)
+        if sql is None:
+            nomes = ', '.join('"' + coluna.replace('"', '""') + '"' for coluna in ('codigo_cnes', 'atualizado_em') + colunas)
+            atualizacoes = ', '.join(
+                f'"{nome}" = excluded."{nome}"' for nome in
+                (coluna.replace('"', '""') for coluna in ('atualizado_em',) + colunas)
+            )
+            sql = (f'INSERT INTO estabelecimentos ({nomes}) VALUES ({", ".join("?" * (len(colunas) + 2))}) '
+                   f'ON CONFLICT(codigo_cnes) DO UPDATE SET {atualizacoes}')
+            self._sql_upsert[colunas] = sql
+        return sql
+    
+    def confirmar(self):
+        """
+        Grava os registros acumulados em uma única transação
+        """
+        if not self._estabelecimentos and not self._erros:
+            return
+        
+        agora = datetime.now().isoformat()
+        with self.conexao:
+            self._criar_colunas(self._estabelecimentos)
+            
+            # Registros com o mesmo conjunto de campos compartilham o mesmo comando
+            grupos: Dict[Tuple[str, ...], List[Tuple[Any, ...]]] = {}
+            for codigo, linha in self._estabelecimentos:
+                colunas = tuple(coluna for coluna, valor in linha.items() if coluna in self.colunas)
+                grupos.setdefault(colunas, []).append((codigo, agora) + tuple(linha[coluna] for coluna in colunas))
+            for colunas, valores in grupos.items():
+                self.conexao.executemany(self._sql(colunas), valores)
+            if self._estabelecimentos:
+                self.conexao.executemany('DELETE FROM erros WHERE codigo_cnes = ?',
+                                         [(codigo,) for codigo, _ in self._estabelecimentos])
+            
+            self.conexao.executemany(
+                'INSERT OR REPLACE INTO erros (codigo_cnes, status_code, classe_erro, erro, registro, atualizado_em) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [erro + (agora,) for erro in self._erros]
+            )
+        
+        self._estabelecimentos = []
+        self._erros = []
+    
+    def finalizar(self, metadados: Dict[str, Any], resumo: Optional[Dict[str, Any]] = None,
+                  extras: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Grava os registros pendentes, registra a execução na tabela `execucoes` e fecha o banco
+        
+        Returns:
+            Dict[str, Any]: Dados de verificação (contagens da execução e do banco)
+        """
+        self.confirmar()
+        with self.conexao:
+            cursor = self.conexao.execute(
+                'INSERT INTO execucoes (tipo, finalizada_em, registros, erros, metadados, resumo, extras) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    self.chave_metadados,
+                    datetime.now().isoformat(),
+                    self.total_registros,
+                    self.total_erros,
+                    CODEC_JSON.dumps(metadados).decode('utf-8'),
+                    CODEC_JSON.dumps(resumo).decode('utf-8') if resumo is not None else None,
+                    CODEC_JSON.dumps(extras).decode('utf-8') if extras else None
+                )
+            )
+        
+        total_banco = self.conexao.execute('SELECT COUNT(*) FROM estabelecimentos').fetchone()[0]
+        verificacao = {
+            'arquivo': self.arquivo,
+            'formato': self.formato,
+            'execucao_id': cursor.lastrowid,
+            'registros': self.total_registros,
+            'erros': self.total_erros,
+            'novos_no_banco': total_banco - self._total_inicial,
+            'total_no_banco': total_banco,
+            'erros_no_banco': self.conexao.execute('SELECT COUNT(*) FROM erros').fetchone()[0]
+        }
+        self.conexao.close()
+        verificacao['bytes'] = os.path.getsize(self.arquivo)
+        return verificacao
+    
+    def abortar(self):
+        """
+        Grava os registros já recebidos (upserts são idempotentes) e fecha o banco sem
+        registrar a execução
+        """
+        try:
+            self.confirmar()
+        finally:
+            self.conexao.close()
+
+class DeltaResultWriter:
+    """
+    Sincronização incremental: envolve um escritor de resultados (JSON, Parquet, SQLite...) e
+    repassa a ele apenas os estabelecimentos novos ou alterados desde o último snapshot do
+    escopo (CNESSnapshotStore).
+    
+    Ao finalizar, os códigos do snapshot que não voltaram nesta execução (fora da lista ou
+    com 404) são considerados removidos; códigos com erro transitório (timeout, 5xx) ou não
+    concluídos (ver adiar) ficam como estavam. O snapshot só é atualizado depois que o
+    escritor interno é finalizado, e um manifesto compacto (totais e códigos novos,
+    alterados, removidos e adiados) é gravado em JSON. Os erros são repassados normalmente.
+    """
+    
+    def __init__(self, destino: Any, snapshot: CNESSnapshotStore, escopo: str,
+                 arquivo_manifesto: Optional[str] = None):
+        """
+        Args:
+            destino: Escritor que recebe os registros alterados (ver criar_escritor_resultados)
+            snapshot (CNESSnapshotStore): Snapshot usado na comparação e atualizado no final
+            escopo (str): Conjunto comparado (ex.: comando + nome da lista de códigos)
+            arquivo_manifesto (str): Caminho do manifesto (padrão: <saída>_manifesto.json)
+        """
+        self.destino = destino
+        self.snapshot = snapshot
+        self.escopo = escopo
+        self.arquivo = destino.arquivo
+        self.arquivo_manifesto = arquivo_manifesto or os.path.splitext(destino.arquivo)[0] + '_manifesto.json'
+        
+        self.snapshot_anterior = snapshot.info(escopo)
+        self._hashes_anteriores = snapshot.carregar(escopo)
+        self._vistos: set = set()
+        self._alterados: Dict[str, str] = {}
+        self._nao_verificados: set = set()
+        self._adiados: List[str] = []
+        self._lista_completa = True
+        self.novos: List[str] = []
+        self.alterados: List[str] = []
+        self.inalterados = 0
+    
+    def escrever_estabelecimento(self, dados: Any):
+        """
+        Compara o hash do registro com o snapshot e repassa apenas se for novo ou alterado
+        """
+        codigo = normalizar_codigo_cnes(dados.codigo_cnes if isinstance(dados, EstabelecimentoCNES) else dados.get('codigo_cnes'))
+        valor_hash = CNESSnapshotStore.hash_conteudo(dados)
+        self._vistos.add(codigo)
+        
+        anterior = self._hashes_anteriores.get(codigo)
+        if anterior == valor_hash:
+            self.inalterados += 1
+            return
+        
+        (self.novos if anterior is None else self.alterados).append(codigo)
+        self._alterados[codigo] = valor_hash
+        self.destino.escrever_estabelecimento(dados)
+    
+    def escrever_erro(self, erro: Dict[str, Any]):
+        """
+        Repassa o erro; códigos com erro transitório não contam como removidos
+        """
+        if erro.get('classe_erro') != 'nao_encontrado':
+            self._nao_verificados.add(normalizar_codigo_cnes(erro.get('codigo_cnes', '')))
+        self.destino.escrever_erro(erro)
+    
+    def adiar(self, codigos: List[str], lista_completa: bool = True):
+        """
+        Marca os códigos que ficaram sem resultado nesta execução (prazo esgotado ou
+        desistência do disjuntor): não contam como removidos e continuam no snapshot como
+        estavam, para a próxima execução ou o resume
+        
+        Args:
+            codigos (List[str]): Códigos não concluídos (metadados.codigos_nao_concluidos)
+            lista_completa (bool): False se a lista de códigos da execução ficou incompleta
+                (listagem paginada interrompida); nesse caso nenhum código é removido
+        """
+        self._adiados.extend(normalizar_codigo_cnes(codigo) for codigo in codigos)
+        self._nao_verificados.update(self._adiados)
+        self._lista_completa = self._lista_completa and lista_completa
+    
+    def _resumo_delta(self, removidos: List[str]) -> Dict[str, Any]:
+        return {
+            'escopo': self.escopo,
+            'snapshot': self.snapshot.arquivo,
+            'snapshot_anterior': self.snapshot_anterior,
+            'novos': len(self.novos),
+            'alterados': len(self.alterados),
+            'removidos': len(removidos),
+            'inalterados': self.inalterados,
+            'nao_verificados': len(self._nao_verificados - self._vistos),
+            'arquivo_manifesto': self.arquivo_manifesto
+        }
+    
+    def finalizar(self, metadados: Dict[str, Any], resumo: Optional[Dict[str, Any]] = None,
+                  extras: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Finaliza o escritor interno (com o resumo do delta), atualiza o snapshot e grava o manifesto
+        
+        Returns:
+            Dict[str, Any]: Verificação do escritor interno, com o resumo do delta em 'delta'
+        """
+        removidos = sorted(
+            codigo for codigo in self._hashes_anteriores
+            if codigo not in self._vistos and codigo not in self._nao_verificados
+        ) if self._lista_completa else []
+        resumo_delta = self._resumo_delta(removidos)
+        
+        verificacao = self.destino.finalizar(metadados, resumo, extras={**(extras or {}), 'delta': resumo_delta})
+        self.snapshot.atualizar(self.escopo, self._alterados, removidos)
+        
+        manifesto = {
+            **resumo_delta,
+            'gerado_em': datetime.now().isoformat(),
+            'arquivo_delta': verificacao.get('arquivo', self.arquivo),
+            'codigos_novos': self.novos,
+            'codigos_alterados': self.alterados,
+            'codigos_removidos': removidos,
+            'codigos_adiados': self._adiados
+        }
+        with open(self.arquivo_manifesto, 'wb') as arquivo:
+            arquivo.write(CODEC_JSON.dumps(manifesto, indent=True))
+        
+        verificacao['delta'] = resumo_delta
+        return verificacao
+    
+    def abortar(self):
+        """
+        Aborta o escritor interno sem alterar o snapshot
+        """
+        self.destino.abortar()
+
+# Formatos aceitos por criar_escritor_resultados (e --formato-saida)
+FORMATOS_SAIDA = StreamingResultWriter.FORMATOS + ColumnarResultWriter.FORMATOS + SQLiteResultWriter.FORMATOS
+
+def criar_escritor_resultados(arquivo: str, formato: Optional[str] = None, **chaves) -> Any:
+    """
+    Cria o escritor do formato informado (padrão: deduzido da extensão do arquivo): JSON/JSONL
+    com StreamingResultWriter, tabela Parquet/Arrow/CSV com ColumnarResultWriter ou banco
+    SQLite (.sqlite, .sqlite3, .db) com SQLiteResultWriter
+    
+    Args:
+        arquivo (str): Caminho do arquivo de saída
+        formato (str): Um de FORMATOS_SAIDA
+        **chaves: chave_registros, chave_erros e chave_metadados (ver StreamingResultWriter)
+    """
+    extensao = os.path.splitext(arquivo)[1].lstrip('.').lower()
+    if formato in SQLiteResultWriter.FORMATOS or (formato is None and extensao in SQLiteResultWriter.EXTENSOES):
+        return SQLiteResultWriter(arquivo, **chaves)
+    if (formato or extensao) in ColumnarResultWriter.FORMATOS:
+        return ColumnarResultWriter(arquivo, formato=formato, **chaves)
+    return StreamingResultWriter(arquivo, formato=formato, **chaves)
+
+class IncrementalJSONReader:
+    """
+    Leitor incremental de arquivos de resultados, sem carregar o documento inteiro.
+    
+    Para JSON, percorre o objeto de nível superior e emite eventos:
+    - ('item', chave, elemento) para cada elemento das listas em `chaves_streaming`
+      (ou chave None se o documento for uma lista no nível superior)
+    - ('bloco', chave, valor) para as demais chaves, lidas por inteiro
+    
+    Para JSONL, cada linha vira um evento ('item', chave_jsonl, registro).
+    """
+    
+    ESPACOS = ' \t\r\n'
+    
+    def __init__(self, arquivo: str, chaves_streaming: Tuple[str, ...] = ('estabelecimentos', 'erros'),
+                 formato: Optional[str] = None, chave_jsonl: str = 'estabelecimentos',
+                 tamanho_bloco: int = 1024 * 1024):
+        """
+        Args:
+            arquivo (str): Caminho do arquivo JSON/JSONL
+            chaves_streaming (Tuple[str, ...]): Chaves cujas listas são lidas elemento a elemento
+            formato (str): 'json' ou 'jsonl' (padrão: deduzido da extensão)
+            chave_jsonl (str): Chave atribuída aos registros de um arquivo JSONL
+            tamanho_bloco (int): Bytes lidos do disco por vez
+        """
+        self.arquivo = arquivo
+        self.chaves_streaming = chaves_streaming
+        self.formato = formato or ('jsonl' if arquivo.endswith('.jsonl') else 'json')
+        self.chave_jsonl = chave_jsonl
+        self.tamanho_bloco = tamanho_bloco
+        self.tamanho_total = os.path.getsize(arquivo)
+        self.bytes_lidos = 0
+        
+        self._arquivo = open(arquivo, 'rb')
+        self._decodificador_utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._fim = False
+    
+    def _ler_mais(self) -> bool:
+        dados = self._arquivo.read(self.tamanho_bloco)
+        # Descarta a parte já consumida antes de acrescentar o próximo bloco
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        if not dados:
+            self._fim = True
+            self._buffer += self._decodificador_utf8.decode(b'', final=True)
+            return False
+        self.bytes_lidos += len(dados)
+        self._buffer += self._decodificador_utf8.decode(dados)
+        return True
+    
+    def _proximo_caractere(self) -> str:
+        """
+        Pula espaços e devolve o próximo caractere sem consumi-lo ('' no fim do arquivo)
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self.ESPACOS:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._ler_mais():
+                return ''
+    
+    def _consumir(self, esperado: str):
+        encontrado = self._proximo_caractere()
+        if encontrado != esperado:
+            raise ValueError(f"JSON inválido em {self.arquivo}: esperado '{esperado}', encontrado '{encontrado}'")
+        self._pos += 1
+    
+    def _ler_valor(self) -> Any:
+        self._proximo_caractere()
+        while True:
+            try:
+                valor, fim = self._decoder.raw_decode(self._buffer, self._pos)
+                # Um valor que termina exatamente no fim do buffer pode estar cortado (ex.: números)
+                if fim < len(self._buffer) or self._fim:
+                    self._pos = fim
+                    return valor
+            except json.JSONDecodeError:
+                if self._fim:
+                    raise
+            self._ler_mais()
+    
+    def _iterar_lista(self):
+        self._consumir('[')
+        if self._proximo_caractere() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._ler_valor()
+            if self._proximo_caractere() == ',':
+                self._pos += 1
+                continue
+            self._consumir(']')
+            return
+    
+    def eventos(self):
+        """
+        Gera os eventos do arquivo na ordem em que aparecem
+        """
+        if self.formato == 'jsonl':
+            for linha in self._arquivo:
+                self.bytes_lidos += len(linha)
+                if linha.strip():
+                    yield 'item', self.chave_jsonl, CODEC_JSON.loads(linha)
+            return
+        
+        if self._proximo_caractere() == '[':
+            for elemento in self._iterar_lista():
+                yield 'item', None, elemento
+            return
+        
+        self._consumir('{')
+        if self._proximo_caractere() == '}':
+            return
+        while True:
+            chave = self._ler_valor()
+            self._consumir(':')
+            if chave in self.chaves_streaming and self._proximo_caractere() == '[':
+                for elemento in self._iterar_lista():
+                    yield 'item', chave, elemento
+            else:
+                yield 'bloco', chave, self._ler_valor()
+            
+            if self._proximo_caractere() == ',':
+                self._pos += 1
+                continue
+            self._consumir('}')
+            return
+    
+    def fechar(self):
+        self._arquivo.close()
+    
+    @classmethod
+    def eventos_resultados(cls, arquivo: str, chaves_streaming: Tuple[str, ...] = ('estabelecimentos', 'erros'),
+                           meta_primeiro: bool = False):
+        """
+        Gera os eventos de um arquivo de resultados e, quando ele é JSONL, do arquivo auxiliar
+        <nome>_meta.json, junto com o leitor de cada arquivo
+        
+        Args:
+            arquivo (str): Arquivo de resultados JSON/JSONL
+            chaves_streaming (Tuple[str, ...]): Chaves cujas listas são lidas elemento a elemento
+            meta_primeiro (bool): Lê o arquivo auxiliar antes dos registros
+        """
+        arquivos = [arquivo]
+        arquivo_meta = os.path.splitext(arquivo)[0] + '_meta.json'
+        if arquivo.endswith('.jsonl') and os.path.exists(arquivo_meta):
+            arquivos.insert(0 if meta_primeiro else 1, arquivo_meta)
+        
+        for caminho in arquivos:
+            leitor = cls(caminho, chaves_streaming)
+            try:
+                for evento in leitor.eventos():
+                    yield leitor, evento
+            finally:
+                leitor.fechar()
+
+class CNESAPIAutomator:
+    """
+    Classe principal para automatizar consultas na API CNES - VERSÃO ASSÍNCRONA OTIMIZADA
+    """
+    
+    MODOS_PROCESSAMENTO = ('pool', 'lotes')
+    
+    # Códigos rejeitados na validação listados individualmente no log (os demais só são contados)
+    LIMITE_REJEITADOS_LOG = 10
+    
+    def __init__(self, concurrent_requests: int = 10, delay_between_batches: float = 0.5,
+                 modo_processamento: str = 'pool', requests_per_second: Optional[float] = None,
+                 adaptive_concurrency: bool = False, min_concurrent_requests: int = 1,
+                 max_concurrent_requests: Optional[int] = None, retry_policy: Optional[RetryPolicy] = None,
+                 cache: Optional[CNESResponseCache] = None, journal_fsync_interval: int = 100,
+                 journal_fsync_seconds: float = 5.0, merger: Optional['CNESMacrorregiaeMerger'] = None,
+                 campos: Optional[List[str]] = None, observadores_progresso: Optional[List[Any]] = None,
+                 limite_pagina: int = 20, complementar_listagem: bool = True,
+                 campos_detalhe: Optional[List[str]] = None, conexoes_pre_aquecidas: Optional[int] = None,
+                 keepalive_segundos: float = 60.0, compressao: bool = True,
+                 timeout_adaptativo: bool = True, timeout_minimo: float = 2.0, timeout_maximo: float = 15.0,
+                 prazo_segundos: Optional[float] = None, disjuntor: bool = True,
+                 disjuntor_taxa_erro: float = 0.5, disjuntor_pausa_segundos: float = 5.0,
+                 disjuntor_tempo_maximo: float = 300.0, hedge: bool = False, hedge_percentil: float = 0.95, hedge_orcamento: float = 0.05):
+        """
+        Inicializa o automatizador assíncrono
+        
+        Args:
+            concurrent_requests (int): Número de requisições simultâneas (padrão: 10).
+                Com concorrência adaptativa, é o valor inicial
+            delay_between_batches (float): Tempo de espera entre lotes (padrão: 0.5s).
+                Usado apenas no modo 'lotes'
+            modo_processamento (str): 'pool' (trabalhadores alimentados continuamente, padrão)
+                ou 'lotes' (modo legado: lote + gather + pausa)
+            requests_per_second (float): Taxa máxima de requisições por segundo (token bucket).
+                None desativa o limite
+            adaptive_concurrency (bool): Ajusta a concorrência automaticamente (AIMD)
+            min_concurrent_requests (int): Menor concorrência do ajuste adaptativo (padrão: 1)
+            max_concurrent_requests (int): Maior concorrência do ajuste adaptativo
+                (padrão: 50 ou concurrent_requests, o que for maior)
+            retry_policy (RetryPolicy): Política de retentativas (padrão: RetryPolicy())
+            cache (CNESResponseCache): Cache local de respostas (None desativa o cache).
+                O chamador é responsável por fechá-lo
+            journal_fsync_interval (int): Registros entre fsyncs do journal de checkpoint
+            journal_fsync_seconds (float): Tempo máximo entre fsyncs do journal de checkpoint
+            merger (CNESMacrorregiaeMerger): Etapa de mesclagem com macrorregião aplicada a cada
+                estabelecimento assim que ele chega (None grava os dados da API sem mesclagem)
+            campos (List[str]): Campos da resposta mantidos em cada estabelecimento (None mantém
+                todos); codigo_cnes e codigo_municipio são sempre mantidos
+            observadores_progresso (List[Callable]): Callbacks repassados ao ProgressTracker de
+                cada lista processada (recebem ProgressTracker.estado())
+            limite_pagina (int): Registros por página da listagem (ver processar_listagem)
+            complementar_listagem (bool): Consulta individualmente os códigos cujo registro da
+                listagem não traz algum dos campos necessários
+            campos_detalhe (List[str]): Campos que a listagem precisa trazer para dispensar a
+                consulta individual (padrão: os campos da projeção, se houver)
+            conexoes_pre_aquecidas (int): Conexões keep-alive abertas antes da carga (padrão:
+                concurrent_requests; 0 desativa). Ver pre_aquecer
+            keepalive_segundos (float): Tempo que uma conexão ociosa fica aberta no pool
+            compressao (bool): Pede respostas comprimidas (gzip/deflate/br) à API
+            timeout_adaptativo (bool): Calcula o timeout de cada requisição a partir das
+                latências observadas (ver AdaptiveTimeout); se False, usa timeout_maximo
+            timeout_minimo (float): Menor timeout por requisição em segundos
+            timeout_maximo (float): Maior timeout por requisição em segundos
+            prazo_segundos (float): Prazo da execução inteira, contado do início da primeira
+                lista; esgotado, os códigos que faltam são informados como não concluídos
+                (None = sem prazo)
+            disjuntor (bool): Pausa o despacho quando a API passa a falhar (ver CircuitBreaker)
+            disjuntor_taxa_erro (float): Fração de falhas nas respostas recentes que abre o disjuntor
+            disjuntor_pausa_segundos (float): Pausa antes da primeira sonda com o disjuntor aberto
+            disjuntor_tempo_maximo (float): Tempo aberto após o qual o disjuntor desiste e os códigos
+                restantes são informados como não concluídos (como no fim do prazo)
+            hedge (bool): Dispara uma cópia das requisições que passam do percentil de latência
+                (ver HedgePolicy)
+            hedge_percentil (float): Percentil da latência após o qual a cópia é disparada
+            hedge_orcamento (float): Fração máxima de requisições extras disparadas pelo hedge
+        """
+        if modo_processamento not in self.MODOS_PROCESSAMENTO:
+            raise ValueError(f"Modo de processamento inválido: {modo_processamento}")
+        
+        self.base_url = "https://apidadosabertos.saude.gov.br/cnes/estabelecimentos"
+        self.concurrent_requests = concurrent_requests
+        self.delay_between_batches = delay_between_batches
+        self.modo_processamento = modo_processamento
+        self.merger = merger
+        self.campos = EstabelecimentoCNES.projetar_campos(campos)
+        
+        # Limitação de taxa e controle de concorrência
+        self.limitador_taxa = TokenBucketRateLimiter(requests_per_second) if requests_per_second else None
+        if adaptive_concurrency:
+            limite_maximo = max_concurrent_requests or max(concurrent_requests, 50)
+        else:
+            limite_maximo = concurrent_requests
+        self.controlador_concorrencia = AdaptiveConcurrencyController(
+            limite_inicial=concurrent_requests,
+            limite_minimo=min_concurrent_requests,
+            limite_maximo=limite_maximo,
+            adaptativo=adaptive_concurrency
+        )
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cache = cache
+        self.journal_fsync_interval = journal_fsync_interval
+        self.journal_fsync_seconds = journal_fsync_seconds
+        # Lista opcional com a latência (s) de cada tentativa, para percentis (ver executar_benchmark_mock)
+        self.latencias_tentativas: Optional[List[float]] = None
+        # Histogramas, conexões e fila da lista em processamento (ver texto_metricas)
+        self.metricas = FetchMetrics()
+        self.observadores_progresso = list(observadores_progresso or [])
+        self.limite_pagina = limite_pagina
+        self.complementar_listagem = complementar_listagem
+        self.campos_detalhe = tuple(campos_detalhe) if campos_detalhe else self.campos
+        self.conexoes_pre_aquecidas = concurrent_requests if conexoes_pre_aquecidas is None else conexoes_pre_aquecidas
+        self.keepalive_segundos = keepalive_segundos
+        self.compressao = compressao
+        # Timeouts das consultas por código e das páginas da listagem (latências diferentes)
+        self.timeout_consultas = AdaptiveTimeout(piso=timeout_minimo, teto=timeout_maximo, adaptativo=timeout_adaptativo,
+                                                 percentil_hedge=hedge_percentil)
+        self.timeout_paginas = AdaptiveTimeout(piso=timeout_minimo, teto=timeout_maximo, adaptativo=timeout_adaptativo,
+                                               percentil_hedge=hedge_percentil)
+        self.prazo_segundos = prazo_segundos
+        self.prazo_final: Optional[float] = None
+        self.disjuntor = CircuitBreaker(taxa_erro_limite=disjuntor_taxa_erro, pausa_segundos=disjuntor_pausa_segundos,
+                                        tempo_maximo_aberto_segundos=disjuntor_tempo_maximo, habilitado=disjuntor)
+        self.hedge = HedgePolicy(habilitado=hedge, percentil=hedge_percentil, orcamento=hedge_orcamento)
+        # Valores rejeitados na validação do último carregar_codigos_cnes ({'valor', 'motivo'})
+        self.codigos_rejeitados: List[Dict[str, Any]] = []
+        
+        # Headers para as requisições
+        self.headers = {
+            'User-Agent': 'CNES-Automator/2.0-AsyncOptimized-WithProgress',
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+        
+        # Estatísticas da execução
+        self.stats = self._novas_estatisticas()
+
+    @staticmethod
+    def _novas_estatisticas() -> Dict[str, Any]:
+        return {
+            'total_requisicoes': 0,
+            'sucessos': 0,
+            'erros': 0,
+            'codigos_invalidos': 0,
+            'erros_conexao': 0,
+            'tentativas': 0,
+            'retentativas': 0,
+            'recuperados_apos_retentativa': 0,
+            'retentativas_esgotadas': 0,
+            'nao_concluidos': 0,
+            'adiados_disjuntor': 0,
+            'hedges': 0,
+            'hedges_vencedores': 0,
+            'latencia_media_tentativa_ms': 0.0,
+            'latencia_maxima_tentativa_ms': 0.0,
+            'inicio_execucao': None,
+            'fim_execucao': None
+        }
+
+    def carregar_codigos_cnes(self, arquivo_entrada: str, shard: Optional[Tuple[int, int]] = None) -> List[str]:
+        """
+        Carrega a lista de códigos CNES de um arquivo JSON
+        
+        Args:
+            arquivo_entrada (str): Caminho para o arquivo JSON com os códigos
+            shard (Tuple[int, int]): (i, N) para manter apenas os códigos do shard i de N
+                (ver indice_shard); a divisão é a mesma em qualquer processo ou máquina
+            
+        Returns:
+            List[str]: Lista de códigos CNES válidos (7 dígitos, sem duplicatas, na ordem do arquivo).
+                Os valores rejeitados na validação ficam em self.codigos_rejeitados
+        """
+        logging.info(safe_log_message(f"📂 Carregando códigos CNES do arquivo: {arquivo_entrada}"))
+        
+        try:
+            with open(arquivo_entrada, 'rb') as arquivo:
+                dados = CODEC_JSON.loads(arquivo.read())
+            
+            # Extrai os valores brutos dos códigos CNES do arquivo (a validação vem depois)
+            valores = []
+            
+            # Se for uma lista de objetos com campo 'codigo_cnes'
+            if isinstance(dados, list):
+                for item in dados:
+                    if isinstance(item, dict) and 'codigo_cnes' in item:
+                        valores.append(item['codigo_cnes'])
+                    else:
+                        valores.append(item)
+            
+            # Se for um objeto com campo 'estabelecimentos'
+            elif isinstance(dados, dict):
+                if 'estabelecimentos' in dados:
+                    for estabelecimento in dados['estabelecimentos']:
+                        if isinstance(estabelecimento, dict) and 'codigo_cnes' in estabelecimento:
+                            valores.append(estabelecimento['codigo_cnes'])
+                elif 'codigo_cnes' in dados:
+                    valores.append(dados['codigo_cnes'])
+                elif 'codigos' in dados:
+                    valores.extend(dados['codigos'])
+            
+            # Normaliza para 7 dígitos, rejeita o que não pode ser um código e remove
+            # duplicatas mantendo a ordem do arquivo
+            codigos = []
+            vistos = set()
+            duplicados = 0
+            self.codigos_rejeitados = []
+            for valor in valores:
+                codigo, motivo = validar_codigo_cnes(valor)
+                if codigo is None:
+                    self.codigos_rejeitados.append({'valor': valor if valor is None or isinstance(valor, (str, int, float)) else repr(valor),
+                                                    'motivo': motivo})
+                elif codigo in vistos:
+                    duplicados += 1
+                else:
+                    vistos.add(codigo)
+                    codigos.append(codigo)
+            
+            logging.info(safe_log_message(f"✅ Carregados {len(codigos)} códigos CNES únicos"))
+            if duplicados:
+                logging.info(safe_log_message(f"🔁 {duplicados} código(s) duplicado(s) ignorado(s)"))
+            if self.codigos_rejeitados:
+                motivos = {}
+                for rejeitado in self.codigos_rejeitados:
+                    motivos[rejeitado['motivo']] = motivos.get(rejeitado['motivo'], 0) + 1
+                logging.warning(safe_log_message(
+                    f"⚠️ {len(self.codigos_rejeitados)} código(s) inválido(s) rejeitado(s) sem consulta à API: "
+                    + ", ".join(f"{motivo}: {total}" for motivo, total in motivos.items())
+                ))
+                for rejeitado in self.codigos_rejeitados[:self.LIMITE_REJEITADOS_LOG]:
+                    logging.warning(safe_log_message(f"   - {rejeitado['valor']!r}: {rejeitado['motivo']}"))
+            
+            if not codigos:
+                raise ValueError("Nenhum código CNES válido encontrado no arquivo")
+            
+            if shard is not None:
+                indice, total_shards = shard
+                total = len(codigos)
+                codigos = [codigo for codigo in codigos if indice_shard(codigo, total_shards) == indice]
+                logging.info(safe_log_message(f"🧩 Shard {indice}/{total_shards}: {len(codigos)} de {total} códigos"))
+            
+            return codigos
+            
+        except Exception as e:
+            logging.error(safe_log_message(f"❌ Erro ao carregar arquivo: {e}"))
+            raise
+
+    async def _tentar_consulta(self, session: aiohttp.ClientSession, codigo_cnes: str,
+                               cortes_anteriores: int = 0) -> ResultadoTentativa:
+        """
+        Executa uma única tentativa de consulta a um código CNES
+        
+        A requisição respeita o limitador de taxa e ocupa uma vaga do controlador de
+        concorrência, que é alimentado com o status e a latência da resposta. Respostas
+        frescas no cache local são devolvidas sem acessar a rede.
+        
+        Args:
+            cortes_anteriores (int): Tentativas anteriores do código cortadas pelo timeout
+                (cada uma dobra o timeout desta, ver AdaptiveTimeout)
+        """
+        entrada_cache = self.cache.obter(codigo_cnes) if self.cache is not None else None
+        if entrada_cache is not None and entrada_cache['fresca']:
+            resultado = self._resultado_do_cache(codigo_cnes, entrada_cache, 'cache')
+            if resultado is not None:
+                return resultado
+            entrada_cache = None
+        
+        return await self._requisicao_controlada(
+            lambda timeout: self._executar_requisicao(session, codigo_cnes, entrada_cache, timeout),
+            self.timeout_consultas, cortes_anteriores
+        )
+    
+    @staticmethod
+    def _contar_cortes(historico: List[Dict[str, Any]]) -> int:
+        """
+        Tentativas do histórico cortadas pelo timeout
+        """
+        return sum(1 for registro in historico if registro['classe_erro'] == 'timeout')
+
+    async def _requisicao_controlada(self, executar, controle_timeout: AdaptiveTimeout,
+                                     cortes_anteriores: int = 0) -> ResultadoTentativa:
+        """
+        Executa uma requisição (executar(timeout) devolve a corrotina) respeitando o limitador de
+        taxa e uma vaga do controlador de concorrência, com o timeout calculado por
+        `controle_timeout`, e registra latência e métricas da tentativa
+        
+        Uma requisição cancelada (ex.: prazo da execução esgotado) não alimenta as estatísticas
+        nem os controles de concorrência e timeout
+        
+        Com o disjuntor aberto a requisição espera antes de ser despachada. Uma falha que chega
+        com o disjuntor aberto (inclusive a que o abriu) volta marcada como `adiada`: quem
+        chamou deve repetir a requisição sem contá-la como tentativa
+        """
+        sonda = await self.disjuntor.aguardar_vez()
+        registrada = False
+        try:
+            if self.limitador_taxa is not None:
+                await self.limitador_taxa.adquirir()
+            
+            async with self.controlador_concorrencia:
+                inicio = time.perf_counter()
+                resultado = None
+                # Latência da requisição que respondeu (a da cópia, se o hedge vencer)
+                latencia_resposta = None
+                cancelada = False
+                self.metricas.iniciar_requisicao()
+                try:
+                    timeout = controle_timeout.calcular(cortes_anteriores)
+                    atraso_hedge = self.hedge.atraso(controle_timeout) if not sonda else None
+                    self.hedge.requisicoes += 1
+                    if atraso_hedge is not None and atraso_hedge < timeout:
+                        resultado, latencia_resposta = await self._executar_com_hedge(executar, timeout, atraso_hedge)
+                    else:
+                        resultado = await executar(timeout)
+                    return resultado
+                except asyncio.CancelledError:
+                    cancelada = True
+                    raise
+                finally:
+                    latencia = time.perf_counter() - inicio
+                    if cancelada:
+                        self.metricas.terminar_requisicao(None, latencia, 'cancelada')
+                    else:
+                        status = resultado.status if resultado is not None else None
+                        if resultado is not None:
+                            resultado.latencia = latencia
+                        self.metricas.terminar_requisicao(resultado, latencia)
+                        self._registrar_latencia_tentativa(latencia)
+                        # Os controles acompanham a latência da API, sem a espera antes da cópia
+                        latencia_api = latencia if latencia_resposta is None else latencia_resposta
+                        self.controlador_concorrencia.registrar_resposta(status, latencia_api)
+                        # Erros de conexão falham rápido e não dizem nada sobre a latência da API
+                        if resultado is not None and (resultado.status is not None or resultado.classe_erro == 'timeout'):
+                            controle_timeout.registrar(latencia_api, cortada=resultado.classe_erro == 'timeout')
+                        self.disjuntor.registrar(status, sonda)
+                        registrada = True
+                        if (resultado is not None and not sonda and not self.disjuntor.fechado
+                                and self.disjuntor.eh_falha(status)):
+                            resultado.adiada = True
+        finally:
+            if sonda and not registrada:
+                self.disjuntor.liberar_sonda()
+
+    async def _executar_com_hedge(self, executar, timeout: float,
+                                  atraso: float) -> Tuple[ResultadoTentativa, Optional[float]]:
+        """
+        Executa a requisição e, se ela não terminar em `atraso` segundos, dispara uma cópia (se o
+        orçamento do hedge, o disjuntor, uma vaga livre do controlador de concorrência e o
+        limitador de taxa permitirem)
+        
+        Vale a primeira resposta que não seja falha transitória (ou a última, se as duas
+        falharem); a outra requisição é cancelada e entra nas métricas como 'descartada'
+        
+        Returns:
+            Tuple[ResultadoTentativa, Optional[float]]: O resultado e, se ele veio da cópia, a
+                latência da própria cópia (None quando veio da requisição original)
+        """
+        principal = asyncio.create_task(executar(timeout))
+        copia = None
+        vencedora = None
+        inicio = inicio_copia = time.perf_counter()
+        try:
+            concluidas, _ = await asyncio.wait({principal}, timeout=atraso)
+            if concluidas or not self.hedge.permitir() or not self.disjuntor.fechado:
+                return await principal, None
+            # A cópia ocupa uma vaga própria, para não passar do limite de concorrência; se a
+            # original responder antes de uma vaga abrir, a cópia não é mais necessária
+            if not await self._ocupar_vaga_antes(principal):
+                return await principal, None
+            if self.limitador_taxa is not None and not self.limitador_taxa.tentar_adquirir():
+                await self.controlador_concorrencia.liberar()
+                return await principal, None
+            
+            self.hedge.disparados += 1
+            self.stats['hedges'] += 1
+            self.metricas.iniciar_requisicao()
+            inicio_copia = time.perf_counter()
+            copia = asyncio.create_task(executar(timeout))
+            
+            pendentes = {principal, copia}
+            while True:
+                concluidas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                # Se as duas chegaram juntas, a principal tem a preferência
+                for tarefa in sorted(concluidas, key=lambda tarefa: tarefa is copia):
+                    resultado, origem = tarefa.result(), tarefa
+                    # Falha transitória: vale esperar a outra requisição, se ainda estiver em andamento
+                    if resultado.sucesso or not CircuitBreaker.eh_falha(resultado.status):
+                        vencedora = tarefa
+                        break
+                if vencedora is not None or not pendentes:
+                    break
+            
+            if vencedora is copia:
+                self.hedge.vencedores += 1
+                self.stats['hedges_vencedores'] += 1
+            return resultado, (time.perf_counter() - inicio_copia) if origem is copia else None
+        finally:
+            if copia is not None:
+                # Uma das duas é descartada: a perdedora, ou a cópia se nenhuma vencer
+                inicio_descartada = inicio if vencedora is copia else inicio_copia
+                self.metricas.terminar_requisicao(None, time.perf_counter() - inicio_descartada, 'descartada')
+            for tarefa in (principal, copia):
+                if tarefa is not None and not tarefa.done():
+                    tarefa.cancel()
+            await asyncio.gather(*(tarefa for tarefa in (principal, copia) if tarefa is not None), return_exceptions=True)
+            if copia is not None:
+                await self.controlador_concorrencia.liberar()
+
+    async def _ocupar_vaga_antes(self, tarefa: asyncio.Task) -> bool:
+        """
+        Aguarda uma vaga do controlador de concorrência enquanto `tarefa` não termina
+        
+        Returns:
+            bool: True se a vaga foi ocupada (e deve ser devolvida com liberar())
+        """
+        if self.controlador_concorrencia.tentar_ocupar():
+            return True
+        ocupacao = asyncio.ensure_future(self.controlador_concorrencia.ocupar_com_prioridade())
+        cancelada = True
+        try:
+            await asyncio.wait({tarefa, ocupacao}, return_when=asyncio.FIRST_COMPLETED)
+            cancelada = False
+        finally:
+            ocupacao.cancel()
+            await asyncio.gather(ocupacao, return_exceptions=True)
+            # A vaga pode ter sido ocupada junto com o fim da tarefa ou com um cancelamento
+            ocupada = not ocupacao.cancelled() and ocupacao.exception() is None
+            usar = ocupada and not cancelada and not tarefa.done()
+            if ocupada and not usar:
+                await self.controlador_concorrencia.liberar()
+        return usar
+
+    def _registrar_latencia_tentativa(self, latencia: float):
+        """
+        Atualiza as estatísticas de latência por tentativa
+        """
+        self.stats['tentativas'] += 1
+        latencia_ms = latencia * 1000
+        media = self.stats['latencia_media_tentativa_ms']
+        self.stats['latencia_media_tentativa_ms'] = round(media + (latencia_ms - media) / self.stats['tentativas'], 1)
+        if latencia_ms > self.stats['latencia_maxima_tentativa_ms']:
+            self.stats['latencia_maxima_tentativa_ms'] = round(latencia_ms, 1)
+        if self.latencias_tentativas is not None:
+            self.latencias_tentativas.append(latencia)
+
+    def _finalizar_consulta(self, codigo_cnes: str, resultado: ResultadoTentativa,
+                            historico: List[Dict[str, Any]], contabilizar_erro: bool = True) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Consolida o resultado final de um código: anexa o histórico de tentativas e atualiza as estatísticas
+        
+        Args:
+            codigo_cnes (str): Código CNES consultado
+            resultado (ResultadoTentativa): Resultado da última tentativa
+            historico (List[Dict]): Registro de todas as tentativas feitas
+            contabilizar_erro (bool): False quando a falha não é o resultado final do código
+                (ex.: complemento de um registro da listagem), que quem chamou contabiliza
+            
+        Returns:
+            Tuple[bool, Any]: (sucesso, EstabelecimentoCNES ou dict do erro)
+        """
+        retentativas = len(historico) - 1
+        dados = resultado.dados
+        
+        if resultado.sucesso:
+            self.stats['sucessos'] += 1
+            if retentativas:
+                self.stats['recuperados_apos_retentativa'] += 1
+            dados.registrar_tentativas(historico)
+            return True, dados
+        
+        if contabilizar_erro:
+            self.stats[self._chave_estatistica_erro(resultado.classe_erro)] += 1
+        
+        if retentativas and self.retry_policy.deve_retentar(resultado, 1):
+            # Ainda seria retentável, mas as tentativas acabaram
+            self.stats['retentativas_esgotadas'] += 1
+        
+        dados['classe_erro'] = resultado.classe_erro
+        dados['tentativas'] = historico
+        return False, dados
+
+    @staticmethod
+    def _chave_estatistica_erro(classe_erro: Optional[str]) -> str:
+        """
+        Contador de stats em que um código que falhou com `classe_erro` é contabilizado
+        """
+        if classe_erro == 'nao_encontrado':
+            return 'codigos_invalidos'
+        if classe_erro in ('timeout', 'conexao'):
+            return 'erros_conexao'
+        return 'erros'
+
+    async def consultar_estabelecimento_async(self, session: aiohttp.ClientSession, codigo_cnes: str,
+                                              contabilizar_erro: bool = True) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Consulta um estabelecimento específico na API CNES de forma assíncrona, retentando
+        falhas transitórias conforme a política de retentativas
+        
+        A espera entre tentativas acontece fora da vaga de concorrência, então não bloqueia
+        as demais requisições em andamento.
+        
+        Args:
+            session (aiohttp.ClientSession): Sessão HTTP assíncrona
+            codigo_cnes (str): Código CNES do estabelecimento
+            contabilizar_erro (bool): Como em _finalizar_consulta
+            
+        Returns:
+            Tuple[bool, Dict]: (sucesso, dados_ou_erro)
+        """
+        historico = []
+        while True:
+            resultado = await self._tentar_consulta(session, codigo_cnes, self._contar_cortes(historico))
+            if resultado.adiada:
+                # Falha com o disjuntor aberto: repete (após a pausa) sem gastar uma tentativa
+                self.stats['adiados_disjuntor'] += 1
+                continue
+            historico.append(resultado.registro(len(historico) + 1))
+            
+            if not self.retry_policy.deve_retentar(resultado, len(historico)):
+                return self._finalizar_consulta(codigo_cnes, resultado, historico, contabilizar_erro)
+            
+            self.stats['retentativas'] += 1
+            self.metricas.registrar_retentativa(resultado)
+            await asyncio.sleep(self.retry_policy.calcular_atraso(len(historico), resultado.retry_after))
+
+    def _resultado_do_cache(self, codigo_cnes: str, entrada_cache: Dict[str, Any], origem: str) -> Optional[ResultadoTentativa]:
+        """
+        Monta o resultado de uma consulta a partir de uma resposta guardada no cache
+        
+        Args:
+            codigo_cnes (str): Código CNES consultado
+            entrada_cache (Dict): Entrada devolvida por CNESResponseCache.obter
+            origem (str): 'cache' (entrada fresca) ou 'cache_revalidado' (resposta 304)
+            
+        Returns:
+            Optional[ResultadoTentativa]: None se a entrada estiver corrompida
+        """
+        try:
+            dados = CODEC_JSON.loads(entrada_cache['corpo'])
+        except ValueError:
+            dados = None
+        if not isinstance(dados, dict):
+            self.cache.remover(codigo_cnes)
+            return None
+        
+        registro = EstabelecimentoCNES(
+            codigo_cnes, dados, self.base_url, origem=origem, campos=self.campos,
+            obtido_da_api_em=entrada_cache['obtido_em']
+        )
+        return ResultadoTentativa(True, registro, 200)
+
+    async def _executar_requisicao(self, session: aiohttp.ClientSession, codigo_cnes: str,
+                                   entrada_cache: Optional[Dict[str, Any]] = None,
+                                   timeout: float = 15.0) -> ResultadoTentativa:
+        """
+        Executa a requisição HTTP de um código CNES
+        
+        Args:
+            session (aiohttp.ClientSession): Sessão HTTP assíncrona
+            codigo_cnes (str): Código CNES do estabelecimento
+            entrada_cache (Dict): Entrada vencida do cache; seus validadores viram uma
+                requisição condicional e um 304 reaproveita o corpo guardado
+            timeout (float): Timeout da requisição em segundos
+        
+        Returns:
+            ResultadoTentativa: Dados ou erro da tentativa, com status e classe do erro
+        """
+        url = f"{self.base_url}/{codigo_cnes}"
+        
+        # Cabeçalhos de requisição condicional para revalidar uma entrada vencida do cache
+        headers_condicionais = {}
+        if entrada_cache is not None:
+            if entrada_cache['etag']:
+                headers_condicionais['If-None-Match'] = entrada_cache['etag']
+            if entrada_cache['last_modified']:
+                headers_condicionais['If-Modified-Since'] = entrada_cache['last_modified']
+        
+        try:
+            # Incrementa contador de requisições
+            self.stats['total_requisicoes'] += 1
+            
+            async with session.get(url, headers=headers_condicionais or None,
+                                   timeout=CNESHTTPClient.criar_timeout(timeout)) as response:
+                if response.status == 304 and entrada_cache is not None:
+                    self.cache.renovar(codigo_cnes)
+                    resultado = self._resultado_do_cache(codigo_cnes, entrada_cache, 'cache_revalidado')
+                    if resultado is not None:
+                        resultado.status = response.status
+                        return resultado
+                    erro = {
+                        'codigo_cnes': codigo_cnes,
+                        'erro': 'Entrada do cache corrompida após resposta 304',
+                        'status_code': response.status,
+                        'url_consultada': url
+                    }
+                    return ResultadoTentativa(False, erro, response.status, 'http')
+                
+                if response.status == 200:
+                    try:
+                        # Decodifica os bytes direto (sem detecção de charset do response.text())
+                        corpo = await self._ler_corpo(session, response)
+                        if response.charset and response.charset.lower() not in ('utf-8', 'utf8'):
+                            corpo = corpo.decode(response.charset).encode('utf-8')
+                        dados = CODEC_JSON.loads(corpo)
+                        if not isinstance(dados, dict):
+                            raise ValueError("Resposta não é um objeto JSON")
+                        
+                        # Registro compacto (projeção de campos + metadados da consulta)
+                        registro = EstabelecimentoCNES(codigo_cnes, dados, self.base_url, campos=self.campos)
+                        
+                    except Exception as json_error:
+                        erro = {
+                            'codigo_cnes': codigo_cnes,
+                            'erro': 'Resposta não é um JSON válido',
+                            'status_code': response.status,
+                            'detalhes': str(json_error)
+                        }
+                        return ResultadoTentativa(False, erro, response.status, 'json_invalido')
+                    
+                    if self.cache is not None:
+                        # Uma falha do cache (arquivo bloqueado, disco cheio) não descarta a resposta
+                        self.cache.gravar(
+                            codigo_cnes, corpo.decode('utf-8'),
+                            etag=response.headers.get('ETag'),
+                            last_modified=response.headers.get('Last-Modified')
+                        )
+                    return ResultadoTentativa(True, registro, response.status)
+                        
+                elif response.status == 404:
+                    if entrada_cache is not None:
+                        self.cache.remover(codigo_cnes)
+                    erro = {
+                        'codigo_cnes': codigo_cnes,
+                        'erro': 'Código CNES não encontrado',
+                        'status_code': 404,
+                        'url_consultada': url
+                    }
+                    return ResultadoTentativa(False, erro, response.status, 'nao_encontrado')
+                    
+                else:
+                    erro = {
+                        'codigo_cnes': codigo_cnes,
+                        'erro': f'Erro HTTP {response.status}',
+                        'status_code': response.status,
+                        'url_consultada': url
+                    }
+                    retry_after = RetryPolicy.interpretar_retry_after(response.headers.get('Retry-After'))
+                    return ResultadoTentativa(False, erro, response.status, 'http', retry_after)
+                    
+        except asyncio.TimeoutError:
+            erro = {
+                'codigo_cnes': codigo_cnes,
+                'erro': 'Timeout na requisição',
+                'detalhes': f'A requisição demorou mais que {timeout:.1f} segundos',
+                'url_consultada': url
+            }
+            return ResultadoTentativa(False, erro, None, 'timeout')
+            
+        except aiohttp.ClientError as e:
+            erro = {
+                'codigo_cnes': codigo_cnes,
+                'erro': 'Erro de conexão',
+                'detalhes': str(e),
+                'url_consultada': url
+            }
+            return ResultadoTentativa(False, erro, None, 'conexao')
+            
+        except Exception as e:
+            erro = {
+                'codigo_cnes': codigo_cnes,
+                'erro': 'Erro inesperado',
+                'detalhes': str(e),
+                'url_consultada': url
+            }
+            return ResultadoTentativa(False, erro, None, 'inesperado')
+
+    async def processar_lote_codigos(self, session: aiohttp.ClientSession, codigos_lote: List[str]) -> List[Tuple[bool, Dict[str, Any]]]:
+        """
+        Processa um lote de códigos CNES de forma assíncrona
+        """
+        tarefas = []
+        for codigo in codigos_lote:
+            tarefa = self.consultar_estabelecimento_async(session, codigo)
+            tarefas.append(tarefa)
+        
+        # Executa todas as tarefas do lote simultaneamente
+        resultados = await asyncio.gather(*tarefas, return_exceptions=True)
+        
+        # Processa exceções
+        resultados_limpos = []
+        for i, resultado in enumerate(resultados):
+            if isinstance(resultado, Exception):
+                erro = {
+                    'codigo_cnes': codigos_lote[i],
+                    'erro': 'Exceção durante processamento',
+                    'detalhes': str(resultado)
+                }
+                resultados_limpos.append((False, erro))
+            else:
+                resultados_limpos.append(resultado)
+        
+        return resultados_limpos
+
+    async def _processar_em_lotes(self, session: aiohttp.ClientSession, pendentes: List[Tuple[int, str]], registrar):
+        """
+        Modo legado: divide os códigos em lotes, aguarda o lote inteiro com gather e pausa entre lotes
+        
+        Args:
+            session (aiohttp.ClientSession): Sessão HTTP assíncrona
+            pendentes (List[Tuple[int, str]]): Pares (índice na lista de entrada, código CNES)
+            registrar: Callback chamado com (sucesso, resultado, indice, latencia) para cada código
+        """
+        lotes = []
+        for i in range(0, len(pendentes), self.concurrent_requests):
+            lote = pendentes[i:i + self.concurrent_requests]
+            lotes.append(lote)
+        
+        for i, lote in enumerate(lotes, 1):
+            inicio_lote = time.perf_counter()
+            # No modo lotes, a "fila" são os códigos dos lotes seguintes
+            self.metricas.registrar_fila(len(pendentes) - (i - 1) * self.concurrent_requests - len(lote))
+            
+            # Processa o lote
+            resultados_lote = await self.processar_lote_codigos(session, [codigo for _, codigo in lote])
+            latencia_lote = time.perf_counter() - inicio_lote
+            
+            # Processa os resultados
+            for (indice, _), (sucesso, resultado) in zip(lote, resultados_lote):
+                registrar(sucesso, resultado, indice, latencia_lote)
+            
+            # Pausa entre lotes (exceto no último)
+            if i < len(lotes):
+                await asyncio.sleep(self.delay_between_batches)
+
+    async def _processar_com_pool(self, session: aiohttp.ClientSession, pendentes: List[Tuple[int, str]], registrar):
+        """
+        Processa os códigos com um pool de trabalhadores alimentado continuamente por uma fila limitada.
+        
+        Cada trabalhador pega o próximo código assim que termina o anterior, então uma resposta
+        lenta ocupa apenas a sua vaga em vez de travar um lote inteiro.
+        
+        Args:
+            session (aiohttp.ClientSession): Sessão HTTP assíncrona
+            pendentes (List[Tuple[int, str]]): Pares (índice na lista de entrada, código CNES)
+            registrar: Callback chamado com (sucesso, resultado, indice, latencia) para cada código
+        """
+        # Com concorrência adaptativa há um trabalhador por vaga máxima; o controlador de
+        # concorrência decide quantos deles podem ter requisições em andamento
+        total_trabalhadores = self.controlador_concorrencia.limite_maximo
+        fila: asyncio.Queue = asyncio.Queue(maxsize=total_trabalhadores * 2)
+        
+        reagendamentos = set()
+        
+        async def produtor():
+            for indice, codigo in pendentes:
+                await fila.put((indice, codigo, []))
+        
+        async def reagendar(item: Tuple[int, str, List[Dict[str, Any]]], atraso: float):
+            # Devolve o código à fila após o backoff; o task_done do item original só é
+            # chamado depois, para que fila.join() não termine com retentativas pendentes
+            try:
+                await asyncio.sleep(atraso)
+                await fila.put(item)
+            finally:
+                fila.task_done()
+        
+        def agendar(item: Tuple[int, str, List[Dict[str, Any]]], atraso: float):
+            tarefa = asyncio.create_task(reagendar(item, atraso))
+            reagendamentos.add(tarefa)
+            tarefa.add_done_callback(reagendamentos.discard)
+        
+        async def trabalhador():
+            while True:
+                item = await fila.get()
+                self.metricas.registrar_fila(fila.qsize())
+                indice, codigo, historico = item
+                reagendado = False
+                try:
+                    try:
+                        tentativa = await self._tentar_consulta(session, codigo, self._contar_cortes(historico))
+                        if tentativa.adiada:
+                            # Falha com o disjuntor aberto: o código volta à fila sem gastar uma
+                            # tentativa e espera o disjuntor fechar
+                            self.stats['adiados_disjuntor'] += 1
+                            agendar(item, 0.0)
+                            reagendado = True
+                            continue
+                        historico.append(tentativa.registro(len(historico) + 1))
+                        
+                        if self.retry_policy.deve_retentar(tentativa, len(historico)):
+                            # A espera do backoff não ocupa o trabalhador
+                            self.stats['retentativas'] += 1
+                            self.metricas.registrar_retentativa(tentativa)
+                            agendar(item, self.retry_policy.calcular_atraso(len(historico), tentativa.retry_after))
+                            reagendado = True
+                            continue
+                        
+                        sucesso, resultado = self._finalizar_consulta(codigo, tentativa, historico)
+                    except Exception as e:
+                        sucesso, resultado = False, {
+                            'codigo_cnes': codigo,
+                            'erro': 'Exceção durante processamento',
+                            'detalhes': str(e)
+                        }
+                    latencia = sum(registro['latencia_ms'] for registro in historico) / 1000
+                    registrar(sucesso, resultado, indice, latencia)
+                finally:
+                    if not reagendado:
+                        fila.task_done()
+        
+        trabalhadores = [asyncio.create_task(trabalhador()) for _ in range(total_trabalhadores)]
+        try:
+            await produtor()
+            await fila.join()
+        finally:
+            pendentes = trabalhadores + list(reagendamentos)
+            for tarefa in pendentes:
+                tarefa.cancel()
+            await asyncio.gather(*pendentes, return_exceptions=True)
+
+    def criar_cliente(self) -> CNESHTTPClient:
+        """
+        Cria o cliente HTTP com o pool de conexões dimensionado para a concorrência máxima.
+        O mesmo cliente pode ser passado a várias chamadas de processar_lista_codigos e
+        processar_listagem (ver executar_consultas)
+        """
+        return CNESHTTPClient(
+            self.controlador_concorrencia.limite_maximo, headers=self.headers,
+            trace_configs=[FetchMetrics.criar_trace_config(lambda: self.metricas)],
+            keepalive_segundos=self.keepalive_segundos, compressao=self.compressao,
+            timeout_segundos=self.timeout_consultas.teto
+        )
+    
+    async def pre_aquecer(self, cliente: CNESHTTPClient, limite: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Abre conexoes_pre_aquecidas conexões keep-alive com a API antes da carga
+        
+        Args:
+            cliente (CNESHTTPClient): Cliente a aquecer
+            limite (int): Máximo de conexões (ex.: o número de códigos pendentes)
+        
+        Returns:
+            Optional[Dict[str, Any]]: Resumo do pré-aquecimento (None se desativado)
+        """
+        conexoes = self.conexoes_pre_aquecidas if limite is None else min(self.conexoes_pre_aquecidas, limite)
+        if conexoes <= 0:
+            return None
+        resultado = await cliente.pre_aquecer(self.base_url, conexoes, self.limitador_taxa)
+        logging.info(safe_log_message(
+            f"🔗 Pré-aquecimento: {resultado['conexoes_abertas']}/{resultado['conexoes_solicitadas']} conexões "
+            f"em {resultado['tempo_ms']:.0f} ms"
+        ))
+        return resultado
+    
+    async def _executar_com_cliente(self, cliente: Optional[CNESHTTPClient], executar,
+                                    limite_pre_aquecimento: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Roda executar(sessao) com o cliente compartilhado ou, se None, com um cliente próprio,
+        pré-aquecido antes e fechado ao final
+        
+        Returns:
+            Dict[str, Any]: Resumo do cliente usado (bloco 'cliente_http' dos metadados)
+        """
+        if cliente is not None:
+            cliente.listas_atendidas += 1
+            await executar(cliente.sessao)
+            return cliente.resumo()
+        
+        async with self.criar_cliente() as cliente_proprio:
+            cliente_proprio.listas_atendidas += 1
+            await self.pre_aquecer(cliente_proprio, limite_pre_aquecimento)
+            await executar(cliente_proprio.sessao)
+            return cliente_proprio.resumo()
+    
+    def _iniciar_prazo(self):
+        """
+        Começa a contar prazo_segundos no início da primeira lista; as listas seguintes do
+        mesmo automatizador compartilham o mesmo prazo
+        """
+        if self.prazo_segundos is not None and self.prazo_final is None:
+            self.prazo_final = time.monotonic() + self.prazo_segundos
+    
+    async def _aguardar_no_prazo(self, corrotina) -> bool:
+        """
+        Aguarda a corrotina até o prazo da execução ou até o disjuntor desistir (ver
+        CircuitBreaker); nesses casos ela é cancelada junto com as requisições em andamento
+        
+        Returns:
+            bool: False se o prazo esgotou ou o disjuntor desistiu antes do fim
+        """
+        tarefa = asyncio.ensure_future(corrotina)
+        desistencia = asyncio.ensure_future(self.disjuntor.aguardar_desistencia())
+        restante = None if self.prazo_final is None else max(0.0, self.prazo_final - time.monotonic())
+        try:
+            await asyncio.wait({tarefa, desistencia}, timeout=restante, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            desistencia.cancel()
+            if not tarefa.done():
+                tarefa.cancel()
+            await asyncio.gather(tarefa, desistencia, return_exceptions=True)
+        if tarefa.cancelled():
+            return False
+        tarefa.result()
+        return True
+    
+    def _registrar_nao_concluidos(self, nao_concluidos: List[str]):
+        """
+        Contabiliza os códigos deixados sem resultado pelo fim do prazo ou pela desistência do
+        disjuntor (não vão para o journal, então uma retomada os consulta)
+        """
+        self.stats['nao_concluidos'] = len(nao_concluidos)
+        if not nao_concluidos:
+            return
+        if self.disjuntor.esgotado:
+            motivo = f"🔌 API fora do ar por mais de {self.disjuntor.tempo_maximo_aberto:g}s"
+        else:
+            motivo = f"⏰ Prazo de {self.prazo_segundos:g}s esgotado"
+        logging.warning(safe_log_message(f"{motivo}: {len(nao_concluidos)} código(s) não concluído(s)"))
+    
+    async def _ler_corpo(self, session: aiohttp.ClientSession, response: aiohttp.ClientResponse) -> bytes:
+        """
+        Lê o corpo de uma resposta, descomprimindo-o quando a sessão não o faz (ver
+        CNESHTTPClient), e contabiliza os bytes trafegados e descomprimidos
+        """
+        corpo = await response.read()
+        if session.auto_decompress:
+            # Sessão externa: o aiohttp já descomprimiu e o tamanho trafegado não é conhecido
+            self.metricas.registrar_corpo(len(corpo), len(corpo), False)
+            return corpo
+        descomprimido = descomprimir_corpo(corpo, response.headers.get('Content-Encoding'))
+        self.metricas.registrar_corpo(len(corpo), len(descomprimido), descomprimido is not corpo)
+        return descomprimido
+    
+    def texto_metricas(self) -> str:
+        """
+        Métricas da lista em processamento no formato de texto do Prometheus (ver MetricsServer)
+        """
+        linhas = [
+            '# TYPE cnes_disjuntor_estado gauge',
+            *(f'cnes_disjuntor_estado{{estado="{estado}"}} {int(self.disjuntor.estado == estado)}'
+              for estado in (CircuitBreaker.FECHADO, CircuitBreaker.ABERTO, CircuitBreaker.MEIO_ABERTO)),
+            '# TYPE cnes_disjuntor_aberturas_total counter',
+            f'cnes_disjuntor_aberturas_total {self.disjuntor.aberturas}',
+            '# TYPE cnes_hedges_total counter',
+            f'cnes_hedges_total{{resultado="disparado"}} {self.hedge.disparados}',
+            f'cnes_hedges_total{{resultado="vencedor"}} {self.hedge.vencedores}'
+        ]
+        return self.metricas.texto_prometheus(self.stats) + '\n'.join(linhas) + '\n'
+
+    async def _processar_pendentes(self, session: aiohttp.ClientSession, pendentes: List[Tuple[int, str]], registrar):
+        """
+        Encaminha os códigos pendentes ao modo de processamento configurado
+        """
+        if self.modo_processamento == 'pool':
+            await self._processar_com_pool(session, pendentes, registrar)
+        else:
+            await self._processar_em_lotes(session, pendentes, registrar)
+
+    def _estimar_velocidade_lotes(self, latencias: List[float]) -> float:
+        """
+        Estima quanto tempo o modo em lotes levaria com as latências observadas nesta execução:
+        cada lote dura o tempo da sua requisição mais lenta, somado ao delay entre lotes.
+        
+        Args:
+            latencias (List[float]): Latência de cada código, na ordem da lista de entrada
+            
+        Returns:
+            float: Tempo estimado em segundos
+        """
+        tamanho = self.concurrent_requests
+        total_lotes = (len(latencias) + tamanho - 1) // tamanho
+        tempo = sum(max(latencias[i:i + tamanho]) for i in range(0, len(latencias), tamanho))
+        return tempo + max(total_lotes - 1, 0) * self.delay_between_batches
+
+    async def _executar_requisicao_pagina(self, session: aiohttp.ClientSession, filtros: Dict[str, Any],
+                                          offset: int, timeout: float = 15.0) -> ResultadoTentativa:
+        """
+        Executa a requisição de uma página da listagem (GET base_url?filtros&limit&offset)
+        
+        Returns:
+            ResultadoTentativa: Lista de registros da página (dados) ou erro
+        """
+        url = f"{self.base_url}?{urlencode({**filtros, 'limit': self.limite_pagina, 'offset': offset})}"
+        
+        try:
+            self.stats['total_requisicoes'] += 1
+            
+            async with session.get(url, timeout=CNESHTTPClient.criar_timeout(timeout)) as response:
+                if response.status == 200:
+                    try:
+                        corpo = await self._ler_corpo(session, response)
+                        if response.charset and response.charset.lower() not in ('utf-8', 'utf8'):
+                            corpo = corpo.decode(response.charset).encode('utf-8')
+                        dados = CODEC_JSON.loads(corpo)
+                        registros = dados.get('estabelecimentos') if isinstance(dados, dict) else dados
+                        if not isinstance(registros, list):
+                            raise ValueError("Resposta sem a lista 'estabelecimentos'")
+                        return ResultadoTentativa(True, registros, response.status)
+                    except Exception as json_error:
+                        erro = {
+                            'offset': offset,
+                            'erro': 'Resposta não é um JSON válido',
+                            'status_code': response.status,
+                            'detalhes': str(json_error),
+                            'url_consultada': url
+                        }
+                        return ResultadoTentativa(False, erro, response.status, 'json_invalido')
+                
+                if response.status == 404:
+                    # Página depois do último registro, filtro sem estabelecimentos ou falha da
+                    # API: quem decide é listar_estabelecimentos
+                    erro = {
+                        'offset': offset,
+                        'erro': 'Página não encontrada (404)',
+                        'status_code': response.status,
+                        'url_consultada': url
+                    }
+                    return ResultadoTentativa(False, erro, response.status, 'nao_encontrado')
+                
+                erro = {
+                    'offset': offset,
+                    'erro': f'Erro HTTP {response.status}',
+                    'status_code': response.status,
+                    'url_consultada': url
+                }
+                retry_after = RetryPolicy.interpretar_retry_after(response.headers.get('Retry-After'))
+                return ResultadoTentativa(False, erro, response.status, 'http', retry_after)
+        
+        except asyncio.TimeoutError:
+            erro = {'offset': offset, 'erro': 'Timeout na requisição', 'url_consultada': url}
+            return ResultadoTentativa(False, erro, None, 'timeout')
+        
+        except aiohttp.ClientError as e:
+            erro = {'offset': offset, 'erro': 'Erro de conexão', 'detalhes': str(e), 'url_consultada': url}
+            return ResultadoTentativa(False, erro, None, 'conexao')
+
+    async def listar_estabelecimentos(self, session: aiohttp.ClientSession, filtros: Dict[str, Any],
+                                      ao_receber, contadores: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Lê todas as páginas da listagem filtrada, com várias páginas em andamento ao mesmo tempo
+        
+        A API não informa o total de registros: cada leitor pega o próximo offset e, quando uma
+        página vem incompleta, os offsets seguintes deixam de ser pedidos. Os leitores começam
+        com um e ganham mais um a cada página cheia (até concurrent_requests), então uma
+        listagem pequena não dispara páginas à toa; as páginas já em andamento depois do fim
+        voltam vazias (no máximo uma por leitor).
+        
+        Uma página 404 só marca o fim da lista no offset 0 ou a partir do fim indicado por uma
+        página incompleta. Como essa página pode chegar depois do 404, os offsets seguintes
+        deixam de ser pedidos e a confirmação fica para o fim da leitura; um 404 no meio da
+        lista é tratado como falha de página.
+        
+        Args:
+            session (aiohttp.ClientSession): Sessão HTTP assíncrona
+            filtros (Dict[str, Any]): Parâmetros da listagem (ex.: {'codigo_uf': 11})
+            ao_receber: Callback chamado com a lista de registros de cada página, na ordem de chegada
+            contadores (Dict[str, Any]): Dicionário onde as contagens de páginas são mantidas
+                durante a leitura (válidas mesmo se a listagem for cancelada no meio)
+            
+        Returns:
+            Dict[str, Any]: Contagem de páginas lidas e vazias (o próprio `contadores`, se informado)
+            
+        Raises:
+            RuntimeError: Se uma página falhar mesmo após as retentativas (a listagem ficaria incompleta)
+        """
+        limite = self.limite_pagina
+        proximo_offset = 0
+        fim: Optional[int] = None
+        # Fim indicado pelas páginas incompletas (as únicas que confirmam um 404)
+        fim_confirmado: Optional[int] = None
+        paginas_404 = []
+        falhas = []
+        resumo = contadores if contadores is not None else {}
+        resumo.update({'paginas': 0, 'paginas_vazias': 0})
+        
+        async def leitor():
+            nonlocal proximo_offset, fim, fim_confirmado
+            while not falhas and (fim is None or proximo_offset < fim):
+                offset = proximo_offset
+                proximo_offset += limite
+                
+                tentativa = 0
+                cortes = 0
+                while True:
+                    resultado = await self._requisicao_controlada(
+                        lambda timeout: self._executar_requisicao_pagina(session, filtros, offset, timeout),
+                        self.timeout_paginas, cortes
+                    )
+                    if resultado.adiada:
+                        self.stats['adiados_disjuntor'] += 1
+                        continue
+                    tentativa += 1
+                    if resultado.classe_erro == 'timeout':
+                        cortes += 1
+                    if not self.retry_policy.deve_retentar(resultado, tentativa):
+                        break
+                    self.stats['retentativas'] += 1
+                    self.metricas.registrar_retentativa(resultado)
+                    await asyncio.sleep(self.retry_policy.calcular_atraso(tentativa, resultado.retry_after))
+                
+                if not resultado.sucesso and resultado.status == 404 and offset > 0:
+                    resultado.dados['tentativas'] = tentativa
+                    paginas_404.append(resultado.dados)
+                    resumo['paginas'] += 1
+                    resumo['paginas_vazias'] += 1
+                    fim = offset if fim is None else min(fim, offset)
+                    continue
+                if not resultado.sucesso and resultado.status != 404:
+                    resultado.dados['tentativas'] = tentativa
+                    falhas.append(resultado.dados)
+                    return
+                
+                # 404 no offset 0: filtro sem estabelecimentos
+                registros = resultado.dados if resultado.sucesso else []
+                resumo['paginas'] += 1
+                if not registros:
+                    resumo['paginas_vazias'] += 1
+                if len(registros) < limite:
+                    fim = offset + limite if fim is None else min(fim, offset + limite)
+                    fim_confirmado = offset + limite if fim_confirmado is None else min(fim_confirmado, offset + limite)
+                elif fim is None and len(leitores) < self.concurrent_requests:
+                    leitores.append(asyncio.create_task(leitor()))
+                ao_receber(registros)
+        
+        leitores = [asyncio.create_task(leitor())]
+        try:
+            # A lista cresce enquanto os leitores são aguardados
+            for tarefa in leitores:
+                await tarefa
+        finally:
+            for tarefa in leitores:
+                tarefa.cancel()
+            await asyncio.gather(*leitores, return_exceptions=True)
+        
+        falhas.extend(pagina for pagina in sorted(paginas_404, key=lambda pagina: pagina['offset'])
+                      if fim_confirmado is None or pagina['offset'] < fim_confirmado)
+        if falhas:
+            raise RuntimeError(
+                f"Listagem incompleta: página offset={falhas[0]['offset']} falhou ({falhas[0]['erro']})"
+            )
+        return resumo
+
+    async def processar_listagem(self, filtros: Dict[str, Any],
+                                 journal: Optional[CheckpointJournal] = None,
+                                 destino: Optional[Any] = None,
+                                 cliente: Optional[CNESHTTPClient] = None) -> Dict[str, Any]:
+        """
+        Consulta todos os estabelecimentos de uma UF/município pela listagem paginada da API, em
+        vez de uma requisição por código
+        
+        Os registros de cada página seguem para a mesma mesclagem e gravação de
+        processar_lista_codigos assim que a página chega, sem duplicatas (um estabelecimento pode
+        aparecer em duas páginas se a base mudar durante a leitura). Com complementar_listagem,
+        os registros sem algum dos campos_detalhe são completados pela consulta individual do
+        código, da qual só os campos que faltam são aproveitados; as consultas individuais
+        acontecem enquanto as páginas seguintes ainda estão sendo lidas.
+        
+        Args:
+            filtros (Dict[str, Any]): Filtros da listagem, ex.: {'codigo_uf': 11} ou {'codigo_municipio': 110020}
+            journal (CheckpointJournal): Como em processar_lista_codigos; os códigos com resultado
+                definitivo no journal são retomados de lá em vez de gravados a partir da listagem
+            destino: Como em processar_lista_codigos
+            cliente (CNESHTTPClient): Como em processar_lista_codigos
+            
+        Returns:
+            Dict[str, Any]: Como processar_lista_codigos, com metadados['listagem'] descrevendo a
+                paginação e os complementos
+        """
+        self.stats = self._novas_estatisticas()
+        self.metricas = FetchMetrics()
+        self._iniciar_prazo()
+        
+        journal_proprio = journal is None
+        if journal_proprio:
+            journal = CheckpointJournal(
+                CheckpointJournal.novo_arquivo(),
+                intervalo_fsync_registros=self.journal_fsync_interval,
+                intervalo_fsync_segundos=self.journal_fsync_seconds
+            )
+        
+        stats_mesclagem = self.merger.novas_estatisticas() if self.merger is not None else None
+        emitir, totais = self._criar_emissor(destino, stats_mesclagem)
+        campos_detalhe = self.campos_detalhe if self.complementar_listagem else None
+        listagem = {
+            'filtros': filtros,
+            'limite_pagina': self.limite_pagina,
+            'campos_detalhe': list(campos_detalhe) if campos_detalhe else None,
+            'registros_recebidos': 0,
+            'duplicados': 0,
+            'sem_codigo': 0,
+            'complementados': 0,
+            'complementos_falhos': 0
+        }
+        
+        print("=" * 60)
+        print("🚀 CNES AUTOMATOR - LISTAGEM PAGINADA")
+        print("=" * 60)
+        print(f"🔎 Filtros: {', '.join(f'{chave}={valor}' for chave, valor in filtros.items())}")
+        print(f"📄 {self.limite_pagina} registros por página, {self.concurrent_requests} páginas simultâneas")
+        if campos_detalhe:
+            print(f"🔁 Consulta individual para registros sem: {', '.join(campos_detalhe)}")
+        print("=" * 60)
+        logging.info(safe_log_message(f"📒 Journal de checkpoint: {journal.arquivo}"))
+        
+        self.stats['inicio_execucao'] = datetime.now().isoformat()
+        
+        # O total só é conhecido ao fim da listagem: até lá, soma uma página ao que já foi descoberto
+        progress_tracker = ProgressTracker(self.limite_pagina, "📄 Listando estabelecimentos",
+                                           observadores=self.observadores_progresso)
+        vistos = {}
+        registrados = set()
+        processados = 0
+        sucessos_execucao = 0
+        codigos_retomados = 0
+        listagem_concluida = False
+        
+        def registrar(codigo: str, sucesso: bool, resultado: Any, definitivo: bool = True):
+            nonlocal processados, sucessos_execucao
+            processados += 1
+            registrados.add(codigo)
+            indice = vistos[codigo]
+            if sucesso:
+                resultado.indice_processamento = indice
+                sucessos_execucao += 1
+            journal.registrar(codigo, sucesso, resultado, indice, definitivo)
+            emitir(sucesso, resultado)
+            self.metricas.registrar_resultado()
+            progress_tracker.total_items = len(vistos) + (0 if listagem_concluida else self.limite_pagina)
+            progress_tracker.update(
+                processed=processados,
+                success_count=sucessos_execucao,
+                error_count=processados - sucessos_execucao
+            )
+        
+        fila_complementos: asyncio.Queue = asyncio.Queue()
+        
+        def ao_receber(registros: List[Any]):
+            nonlocal codigos_retomados
+            listagem['registros_recebidos'] += len(registros)
+            for dados in registros:
+                if not isinstance(dados, dict) or dados.get('codigo_cnes') is None:
+                    listagem['sem_codigo'] += 1
+                    continue
+                codigo = normalizar_codigo_cnes(dados['codigo_cnes'])
+                if codigo in vistos:
+                    listagem['duplicados'] += 1
+                    continue
+                vistos[codigo] = len(vistos) + 1
+                
+                entrada = journal.concluidos.get(codigo)
+                if entrada is not None and CheckpointJournal.eh_definitivo(entrada):
+                    registro = entrada['registro']
+                    if entrada['sucesso']:
+                        registro = EstabelecimentoCNES.de_dict(registro, self.base_url, self.campos)
+                    codigos_retomados += 1
+                    registrar(codigo, entrada['sucesso'], registro)
+                    continue
+                
+                faltantes = [campo for campo in campos_detalhe if campo not in dados] if campos_detalhe else None
+                if faltantes:
+                    fila_complementos.put_nowait((codigo, dados, faltantes))
+                else:
+                    self.stats['sucessos'] += 1
+                    registrar(codigo, True, EstabelecimentoCNES(codigo, dados, self.base_url, origem='listagem',
+                                                                campos=self.campos))
+        
+        async def complementar(sessao: aiohttp.ClientSession):
+            while True:
+                codigo, dados, faltantes = await fila_complementos.get()
+                try:
+                    try:
+                        # A falha do complemento não é o resultado do código (ver abaixo)
+                        sucesso, detalhe = await self.consultar_estabelecimento_async(sessao, codigo,
+                                                                                      contabilizar_erro=False)
+                    except Exception as e:
+                        sucesso, detalhe = False, {'codigo_cnes': codigo, 'erro': 'Exceção durante processamento',
+                                                   'detalhes': str(e)}
+                    definitivo = True
+                    if sucesso:
+                        for campo in faltantes:
+                            dados[campo] = detalhe.get(campo)
+                        listagem['complementados'] += 1
+                        registro = EstabelecimentoCNES(codigo, dados, self.base_url, origem='listagem+detalhe',
+                                                       campos=self.campos)
+                        registro.tentativas = detalhe.tentativas
+                    else:
+                        # O estabelecimento existe na listagem: é gravado sem os campos que faltam
+                        # e conta como sucesso; com falha transitória (timeout, 5xx), o journal o
+                        # marca como não definitivo, para que o resume busque o complemento de novo
+                        self.stats['sucessos'] += 1
+                        definitivo = detalhe.get('classe_erro') in CheckpointJournal.CLASSES_ERRO_DEFINITIVAS
+                        listagem['complementos_falhos'] += 1
+                        logging.warning(safe_log_message(
+                            f"⚠️ Complemento do CNES {codigo} falhou ({detalhe.get('erro')}); gravado só com os dados da listagem"
+                        ))
+                        registro = EstabelecimentoCNES(codigo, dados, self.base_url, origem='listagem',
+                                                       campos=self.campos)
+                    registrar(codigo, True, registro, definitivo)
+                finally:
+                    fila_complementos.task_done()
+        
+        async def executar(sessao: aiohttp.ClientSession):
+            nonlocal listagem_concluida
+            trabalhadores = [asyncio.create_task(complementar(sessao))
+                             for _ in range(self.controlador_concorrencia.limite_maximo)]
+            try:
+                await self.listar_estabelecimentos(sessao, filtros, ao_receber, contadores=listagem)
+                listagem_concluida = True
+                await fila_complementos.join()
+            finally:
+                for tarefa in trabalhadores:
+                    tarefa.cancel()
+                await asyncio.gather(*trabalhadores, return_exceptions=True)
+        
+        no_prazo = True
+        
+        async def executar_no_prazo(sessao: aiohttp.ClientSession):
+            nonlocal no_prazo
+            no_prazo = await self._aguardar_no_prazo(executar(sessao))
+        
+        monitor_loop = asyncio.create_task(self.metricas.monitorar_loop())
+        try:
+            resumo_cliente = await self._executar_com_cliente(cliente, executar_no_prazo)
+        
+        except Exception as e:
+            logging.error(safe_log_message(f"❌ Erro durante a listagem: {e}"))
+            raise
+        
+        finally:
+            monitor_loop.cancel()
+            if self.cache is not None:
+                self.cache.confirmar()
+            if journal_proprio:
+                journal.fechar()
+            else:
+                journal.sincronizar()
+        
+        progress_tracker.total_items = len(vistos)
+        progress_tracker.finish()
+        
+        # Com o prazo esgotado, a listagem pode ter parado no meio: os códigos já descobertos e
+        # sem resultado são informados como não concluídos (uma retomada lista tudo de novo)
+        nao_concluidos = [] if no_prazo else [codigo for codigo in vistos if codigo not in registrados]
+        self._registrar_nao_concluidos(nao_concluidos)
+        listagem['concluida'] = listagem_concluida
+        
+        self.stats['fim_execucao'] = datetime.now().isoformat()
+        inicio = datetime.fromisoformat(self.stats['inicio_execucao'])
+        fim = datetime.fromisoformat(self.stats['fim_execucao'])
+        tempo_execucao = (fim - inicio).total_seconds()
+        requisicoes_por_segundo = self.stats['total_requisicoes'] / tempo_execucao if tempo_execucao > 0 else 0.0
+        
+        logging.info(safe_log_message(
+            f"📄 Listagem: {listagem['paginas']} páginas | {len(vistos)} estabelecimentos "
+            f"| {listagem['duplicados']} duplicados | {listagem['complementados']} complementados"
+        ))
+        
+        resultado_consolidado = {
+            'metadados': {
+                'data_processamento': self.stats['fim_execucao'],
+                'tempo_execucao_segundos': tempo_execucao,
+                'fonte_api': self.base_url,
+                'total_codigos_processados': len(vistos),
+                'versao_script': '2.1_async_worker_pool',
+                'configuracao_performance': {**self._configuracao_performance(None, requisicoes_por_segundo),
+                                             'timeout_paginas': self.timeout_paginas.resumo(),
+                                             'cliente_http': resumo_cliente},
+                'estatisticas': self.stats.copy(),
+                'metricas': self.metricas.resumo(),
+                'listagem': listagem,
+                'codigos_nao_concluidos': nao_concluidos,
+                'journal': {
+                    'arquivo': journal.arquivo,
+                    'codigos_retomados': codigos_retomados
+                }
+            },
+            'estabelecimentos': totais['estabelecimentos'],
+            'erros': totais['erros_encontrados'],
+            'resumo': {
+                'total_sucessos': totais['sucessos'],
+                'total_erros': totais['erros'],
+                'total_nao_concluidos': len(nao_concluidos),
+                'taxa_sucesso': f"{(totais['sucessos']/len(vistos)*100):.1f}%" if vistos else "0%",
+                'velocidade_media': f"{requisicoes_por_segundo:.1f} req/s" if tempo_execucao > 0 else "N/A"
+            }
+        }
+        
+        return self._concluir_processamento(resultado_consolidado, destino, stats_mesclagem)
+
+    def _criar_emissor(self, destino: Any, stats_mesclagem: Optional[Dict[str, Any]]) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Cria a função emitir(sucesso, resultado), que encaminha cada resultado final à mesclagem
+        e ao destino de streaming (sem destino, às listas em memória)
+        
+        Returns:
+            Tuple[Callable, Dict]: (emitir, totais com 'sucessos', 'erros', 'estabelecimentos' e 'erros_encontrados')
+        """
+        totais = {'sucessos': 0, 'erros': 0, 'estabelecimentos': [], 'erros_encontrados': []}
+        
+        def emitir(sucesso: bool, resultado: Any):
+            if sucesso:
+                totais['sucessos'] += 1
+                # A mesclagem acontece em memória, enquanto as demais requisições seguem em andamento
+                if self.merger is not None:
+                    self.merger.mesclar_e_contabilizar(resultado, stats_mesclagem)
+                if destino is not None:
+                    destino.escrever_estabelecimento(resultado)
+                else:
+                    totais['estabelecimentos'].append(resultado)
+            else:
+                totais['erros'] += 1
+                if destino is not None:
+                    destino.escrever_erro(resultado)
+                else:
+                    totais['erros_encontrados'].append(resultado)
+        
+        return emitir, totais
+
+    def _configuracao_performance(self, total_lotes: Optional[int], requisicoes_por_segundo: float) -> Dict[str, Any]:
+        """
+        Bloco configuracao_performance dos metadados
+        """
+        return {
+            'modo_processamento': self.modo_processamento,
+            'requisicoes_simultaneas': self.concurrent_requests,
+            'delay_entre_lotes': self.delay_between_batches,
+            'total_lotes': total_lotes,
+            'requisicoes_por_segundo': round(requisicoes_por_segundo, 2),
+            'limite_taxa': self.limitador_taxa.resumo() if self.limitador_taxa is not None else None,
+            'concorrencia': self.controlador_concorrencia.resumo(),
+            'politica_retentativas': self.retry_policy.resumo(),
+            'timeout': self.timeout_consultas.resumo(),
+            'prazo_segundos': self.prazo_segundos,
+            'disjuntor': self.disjuntor.resumo(),
+            'hedge': self.hedge.resumo(),
+            'cache': self.cache.resumo() if self.cache is not None else None
+        }
+
+    async def processar_lista_codigos(self, codigos_cnes: List[str],
+                                      journal: Optional[CheckpointJournal] = None,
+                                      destino: Optional[StreamingResultWriter] = None,
+                                      cliente: Optional[CNESHTTPClient] = None,
+                                      codigos_rejeitados: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Processa uma lista de códigos CNES de forma assíncrona otimizada com loading em tempo real
+        
+        Cada resultado é acrescentado a um journal de checkpoint assim que chega. Se o journal
+        já tiver resultados definitivos (sucesso ou erro que não muda ao repetir), esses
+        códigos não são consultados de novo e seus resultados entram no consolidado.
+        
+        Args:
+            codigos_cnes (List[str]): Lista de códigos CNES para consultar
+            journal (CheckpointJournal): Journal a usar/retomar. Se None, um novo
+                cnes_journal_AAAAMMDD_HHMMSS.jsonl é criado e fechado ao final
+            destino (StreamingResultWriter): Se informado, cada resultado é gravado assim que
+                chega e não fica em memória; o destino é finalizado com metadados e resumo.
+                Com `merger`, use CNESMacrorregiaeMerger.criar_destino para o layout mesclado
+            cliente (CNESHTTPClient): Cliente HTTP compartilhado entre várias listas (ver
+                criar_cliente). Se None, um cliente próprio é criado, pré-aquecido e fechado ao final
+            codigos_rejeitados (List[Dict[str, Any]]): Valores rejeitados na validação da entrada
+                (ver carregar_codigos_cnes), registrados nos metadados sem consulta à API
+            
+        Returns:
+            Dict[str, Any]: Dados consolidados com estabelecimentos (EstabelecimentoCNES) e erros. Com `destino`,
+                as listas não são devolvidas e a chave 'verificacao' descreve o arquivo gravado.
+                Com `merger`, os estabelecimentos já vêm mesclados e a chave 'metadados_mesclagem'
+                traz as estatísticas da mesclagem
+        """
+        modo_pool = self.modo_processamento == 'pool'
+        
+        # Cada lista tem suas próprias estatísticas e métricas, mesmo com o automatizador reaproveitado
+        self.stats = self._novas_estatisticas()
+        self.metricas = FetchMetrics()
+        self._iniciar_prazo()
+        
+        journal_proprio = journal is None
+        if journal_proprio:
+            journal = CheckpointJournal(
+                CheckpointJournal.novo_arquivo(),
+                intervalo_fsync_registros=self.journal_fsync_interval,
+                intervalo_fsync_segundos=self.journal_fsync_seconds
+            )
+        
+        latencias = [0.0] * len(codigos_cnes)
+        stats_mesclagem = self.merger.novas_estatisticas() if self.merger is not None else None
+        emitir, totais = self._criar_emissor(destino, stats_mesclagem)
+        
+        # Separa os códigos já concluídos no journal dos que ainda precisam ser consultados
+        pendentes = []
+        codigos_retomados = 0
+        for indice, codigo in enumerate(codigos_cnes, 1):
+            entrada = journal.concluidos.get(codigo)
+            if entrada is not None and CheckpointJournal.eh_definitivo(entrada):
+                registro = entrada['registro']
+                if entrada['sucesso']:
+                    registro = EstabelecimentoCNES.de_dict(registro, self.base_url, self.campos)
+                emitir(entrada['sucesso'], registro)
+                codigos_retomados += 1
+            else:
+                pendentes.append((indice, codigo))
+        
+        total_lotes = (len(pendentes) + self.concurrent_requests - 1) // self.concurrent_requests
+        
+        # Exibe informações iniciais detalhadas
+        print("=" * 60)
+        print("🚀 CNES AUTOMATOR - PROCESSAMENTO ASSÍNCRONO OTIMIZADO")
+        print("=" * 60)
+        print(f"📋 Total de códigos CNES: {len(codigos_cnes):,}")
+        if codigos_retomados:
+            print(f"♻️ Retomando do journal: {codigos_retomados:,} já concluídos, {len(pendentes):,} pendentes")
+        print(f"⚡ Requisições simultâneas: {self.concurrent_requests}")
+        if self.controlador_concorrencia.adaptativo:
+            print(f"📈 Concorrência adaptativa: {self.controlador_concorrencia.limite_minimo}"
+                  f"-{self.controlador_concorrencia.limite_maximo}")
+        if self.limitador_taxa is not None:
+            print(f"🚦 Limite de taxa: {self.limitador_taxa.taxa_por_segundo:g} req/s")
+        if modo_pool:
+            print("🔄 Modo: pool contínuo de trabalhadores")
+        else:
+            print(f"⏱️ Delay entre lotes: {self.delay_between_batches}s")
+            
+            # Calcula estimativa inicial
+            estimativa_tempo = len(pendentes) / (self.concurrent_requests * (1/self.delay_between_batches))
+            print(f"🔮 Tempo estimado: ~{estimativa_tempo:.1f}s ({timedelta(seconds=int(estimativa_tempo))})")
+            print(f"📦 Dividido em {total_lotes} lotes")
+        print("=" * 60)
+        
+        logging.info(safe_log_message(f"🚀 Iniciando processamento assíncrono de {len(pendentes)} códigos CNES"))
+        logging.info(safe_log_message(f"⚡ Configuração: {self.concurrent_requests} requisições simultâneas (modo {self.modo_processamento})"))
+        logging.info(safe_log_message(f"📒 Journal de checkpoint: {journal.arquivo}"))
+        
+        self.stats['inicio_execucao'] = datetime.now().isoformat()
         
         # Inicializa o tracker de progresso
-        progress_tracker = ProgressTracker(len(codigos_cnes), "🏥 Consultando API CNES")
-        
-        # Configurações do connector para otimização
-        connector = aiohttp.TCPConnector(
-            limit=self.concurrent_requests + 5,  # Pool de conexões
-            limit_per_host=self.concurrent_requests,
-            ttl_dns_cache=300,  # Cache DNS por 5 minutos
-            use_dns_cache=True,
+        progress_tracker = ProgressTracker(len(pendentes), "🏥 Consultando API CNES",
+                                           observadores=self.observadores_progresso)
+        processados = 0
+        sucessos_execucao = 0
+        registrados = set()
+        
+        def registrar(sucesso: bool, resultado: Dict[str, Any], indice: int, latencia: float):
+            nonlocal processados, sucessos_execucao
+            processados += 1
+            latencias[indice - 1] = latencia
+            registrados.add(indice)
+            
+            if sucesso:
+                resultado.indice_processamento = indice
+                sucessos_execucao += 1
+            
+            journal.registrar(codigos_cnes[indice - 1], sucesso, resultado, indice)
+            emitir(sucesso, resultado)
+            self.metricas.registrar_resultado()
+            
+            # Atualiza o progresso com informações detalhadas
+            lote_atual = None if modo_pool else (processados - 1) // self.concurrent_requests + 1
+            progress_tracker.update(
+                processed=processados,
+                current_batch=lote_atual,
+                total_batches=None if modo_pool else total_lotes,
+                success_count=sucessos_execucao,
+                error_count=processados - sucessos_execucao
+            )
+        
+        monitor_loop = asyncio.create_task(self.metricas.monitorar_loop())
+        no_prazo = True
+        
+        async def executar(sessao: aiohttp.ClientSession):
+            nonlocal no_prazo
+            no_prazo = await self._aguardar_no_prazo(self._processar_pendentes(sessao, pendentes, registrar))
+        
+        try:
+            resumo_cliente = await self._executar_com_cliente(cliente, executar, len(pendentes))
+        
+        except Exception as e:
+            logging.error(safe_log_message(f"❌ Erro durante sessão assíncrona: {e}"))
+            raise
+        
+        finally:
+            monitor_loop.cancel()
+            # Grava em disco as respostas novas do cache
+            if self.cache is not None:
+                self.cache.confirmar()
+            
+            # Garante que todos os resultados recebidos estão no journal
+            if journal_proprio:
+                journal.fechar()
+            else:
+                journal.sincronizar()
+        
+        # Finaliza o progresso
+        progress_tracker.finish()
+        
+        # Com o prazo esgotado, os códigos sem resultado são informados como não concluídos
+        nao_concluidos = [] if no_prazo else [codigo for indice, codigo in pendentes if indice not in registrados]
+        self._registrar_nao_concluidos(nao_concluidos)
+        if nao_concluidos:
+            pendentes = [(indice, codigo) for indice, codigo in pendentes if indice in registrados]
+        
+        self.stats['fim_execucao'] = datetime.now().isoformat()
+        
+        # Calcula tempo de execução
+        inicio = datetime.fromisoformat(self.stats['inicio_execucao'])
+        fim = datetime.fromisoformat(self.stats['fim_execucao'])
+        tempo_execucao = (fim - inicio).total_seconds()
+        
+        requisicoes_por_segundo = len(pendentes) / tempo_execucao if tempo_execucao > 0 else 0.0
+        
+        configuracao_performance = self._configuracao_performance(total_lotes, requisicoes_por_segundo)
+        configuracao_performance['cliente_http'] = resumo_cliente
+        
+        # No modo pool, compara a vazão sustentada com a estimativa do modo em lotes
+        if modo_pool and pendentes:
+            tempo_lotes = self._estimar_velocidade_lotes([latencias[indice - 1] for indice, _ in pendentes])
+            velocidade_lotes = len(pendentes) / tempo_lotes if tempo_lotes > 0 else 0.0
+            configuracao_performance['comparativo_modo_lotes'] = {
+                'tempo_estimado_segundos': round(tempo_lotes, 2),
+                'requisicoes_por_segundo_estimadas': round(velocidade_lotes, 2),
+                'ganho_estimado': f"{requisicoes_por_segundo / velocidade_lotes:.2f}x" if velocidade_lotes > 0 else "N/A"
+            }
+        
+        # Consolida os resultados finais
+        resultado_consolidado = {
+            'metadados': {
+                'data_processamento': self.stats['fim_execucao'],
+                'tempo_execucao_segundos': tempo_execucao,
+                'fonte_api': self.base_url,
+                'total_codigos_processados': len(codigos_cnes),
+                'versao_script': '2.1_async_worker_pool',
+                'configuracao_performance': configuracao_performance,
+                'estatisticas': self.stats.copy(),
+                'metricas': self.metricas.resumo(),
+                'codigos_rejeitados': codigos_rejeitados or [],
+                'codigos_nao_concluidos': nao_concluidos,
+                'journal': {
+                    'arquivo': journal.arquivo,
+                    'codigos_retomados': codigos_retomados
+                }
+            },
+            'estabelecimentos': totais['estabelecimentos'],
+            'erros': totais['erros_encontrados'],
+            'resumo': {
+                'total_sucessos': totais['sucessos'],
+                'total_erros': totais['erros'],
+                'total_nao_concluidos': len(nao_concluidos),
+                'taxa_sucesso': f"{(totais['sucessos']/len(codigos_cnes)*100):.1f}%" if codigos_cnes else "0%",
+                'velocidade_media': f"{requisicoes_por_segundo:.1f} req/s" if tempo_execucao > 0 else "N/A"
+            }
+        }
+        
+        return self._concluir_processamento(resultado_consolidado, destino, stats_mesclagem)
+
+    def _concluir_processamento(self, resultado_consolidado: Dict[str, Any], destino: Any,
+                                stats_mesclagem: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Etapa final comum a processar_lista_codigos e processar_listagem: acrescenta os metadados
+        da mesclagem, finaliza o destino de streaming e registra o resumo no log
+        """
+        if self.merger is not None:
+            resultado_consolidado['metadados_mesclagem'] = self.merger.gerar_metadados_mesclagem(stats_mesclagem)
+            self.merger.registrar_resumo_logs()
+        
+        if destino is not None:
+            # Os registros já estão no arquivo; fecha a estrutura com metadados e resumo
+            del resultado_consolidado['estabelecimentos'], resultado_consolidado['erros']
+            if isinstance(destino, DeltaResultWriter):
+                metadados = resultado_consolidado['metadados']
+                destino.adiar(metadados['codigos_nao_concluidos'],
+                              lista_completa=metadados.get('listagem', {}).get('concluida', True))
+            if self.merger is not None:
+                resultado_consolidado['verificacao'] = destino.finalizar(
+                    resultado_consolidado['metadados_mesclagem'], resultado_consolidado['resumo'],
+                    extras={'metadados_originais': resultado_consolidado['metadados']}
+                )
+            else:
+                resultado_consolidado['verificacao'] = destino.finalizar(
+                    resultado_consolidado['metadados'], resultado_consolidado['resumo']
+                )
+        
+        logging.info(safe_log_message(f"✅ Processamento assíncrono concluído!"))
+        logging.info(safe_log_message(f"📈 Sucessos: {resultado_consolidado['resumo']['total_sucessos']}"))
+        logging.info(safe_log_message(f"❌ Erros: {resultado_consolidado['resumo']['total_erros']}"))
+        logging.info(safe_log_message(f"📊 Taxa de sucesso: {resultado_consolidado['resumo']['taxa_sucesso']}"))
+        logging.info(safe_log_message(f"⚡ Velocidade média: {resultado_consolidado['resumo']['velocidade_media']}"))
+        if self.cache is not None:
+            logging.info(safe_log_message(
+                f"💾 Cache: {self.cache.stats['hits']} hits | {self.cache.stats['revalidadas_304']} revalidadas (304) "
+                f"| {self.cache.stats['misses']} misses"
+                + (f" | {self.cache.stats['falhas']} falhas" if self.cache.stats['falhas'] else "")
+            ))
+        if self.stats['retentativas']:
+            logging.info(safe_log_message(
+                f"🔄 Retentativas: {self.stats['retentativas']} "
+                f"| Recuperados: {self.stats['recuperados_apos_retentativa']} "
+                f"| Esgotadas: {self.stats['retentativas_esgotadas']}"
+            ))
+        if self.disjuntor.aberturas:
+            disjuntor = self.disjuntor.resumo()
+            logging.info(safe_log_message(
+                f"🔌 Disjuntor: {disjuntor['aberturas']} aberturas | {disjuntor['tempo_aberto_segundos']:.1f}s aberto "
+                f"| Sondas: {disjuntor['sondas']} | Adiados: {self.stats['adiados_disjuntor']}"
+            ))
+        if self.stats['hedges']:
+            logging.info(safe_log_message(
+                f"🔀 Hedge: {self.stats['hedges']} cópias disparadas | {self.stats['hedges_vencedores']} chegaram antes"
+            ))
+        configuracao_performance = resultado_consolidado['metadados']['configuracao_performance']
+        if 'comparativo_modo_lotes' in configuracao_performance:
+            comparativo = configuracao_performance['comparativo_modo_lotes']
+            logging.info(safe_log_message(
+                f"📈 Modo lotes (estimado): {comparativo['requisicoes_por_segundo_estimadas']:.1f} req/s "
+                f"| Ganho do pool: {comparativo['ganho_estimado']}"
+            ))
+        if self.controlador_concorrencia.adaptativo:
+            concorrencia = configuracao_performance['concorrencia']
+            logging.info(safe_log_message(
+                f"📈 Concorrência adaptativa: {concorrencia['limite_inicial']} → {concorrencia['limite_final']} "
+                f"(+{concorrencia['aumentos']} / -{concorrencia['reducoes']})"
+            ))
+        metricas = resultado_consolidado['metadados']['metricas']
+        logging.info(safe_log_message(
+            f"📡 Conexões: {metricas['conexoes']['novas']} novas | {metricas['conexoes']['reutilizadas']} reutilizadas "
+            f"| Atraso do loop (p95): {metricas['atraso_loop']['p95_ms']} ms "
+            f"| Recebidos: {metricas['bytes_recebidos'] / (1024 * 1024):.1f} MB "
+            f"(economia da compressão: {metricas['compressao']['taxa_economia']})"
+        ))
+        if metricas['tempo_primeiro_resultado_ms'] is not None:
+            logging.info(safe_log_message(f"⏱️ Primeiro resultado em {metricas['tempo_primeiro_resultado_ms']:.0f} ms"))
+        logging.info(safe_log_message(f"⏱️ Tempo total: {resultado_consolidado['metadados']['tempo_execucao_segundos']:.1f} segundos"))
+        
+        return resultado_consolidado
+
+    def salvar_resultados(self, dados: Dict[str, Any], arquivo_saida: str, formato: Optional[str] = None):
+        """
+        Salva os resultados consolidados em um arquivo JSON/JSONL (ou tabela Parquet/Arrow/CSV),
+        gravando registro a registro
+        
+        A verificação usa as contagens e o tamanho acumulados durante a escrita, sem montar
+        o documento inteiro em memória nem reler o arquivo.
+        
+        Args:
+            dados (Dict[str, Any]): Dados consolidados para salvar
+            arquivo_saida (str): Caminho do arquivo de saída
+            formato (str): Um de FORMATOS_SAIDA (padrão: deduzido da extensão)
+        """
+        try:
+            logging.info(safe_log_message(f"💾 Salvando resultados em: {arquivo_saida}"))
+            
+            escritor = criar_escritor_resultados(arquivo_saida, formato=formato)
+            try:
+                for estabelecimento in dados.get('estabelecimentos', []):
+                    escritor.escrever_estabelecimento(estabelecimento)
+                for erro in dados.get('erros', []):
+                    escritor.escrever_erro(erro)
+                verificacao = escritor.finalizar(dados.get('metadados', {}), dados.get('resumo'))
+            except Exception:
+                escritor.abortar()
+                raise
+            
+            logging.info(safe_log_message(f"✅ Arquivo salvo e verificado com sucesso!"))
+            if 'sha256' in verificacao:
+                logging.info(safe_log_message(f"📁 Tamanho: {verificacao['bytes']:,} bytes (sha256 {verificacao['sha256'][:16]}...)"))
+            logging.info(safe_log_message(f"📊 Estabelecimentos salvos: {verificacao['registros']}"))
+            logging.info(safe_log_message(f"❌ Erros salvos: {verificacao['erros']}"))
+            
+            return verificacao
+            
+        except Exception as e:
+            logging.error(safe_log_message(f"❌ Erro ao salvar arquivo: {e}"))
+            
+            # Tenta salvar um arquivo de emergência sem formatação
+            try:
+                arquivo_emergencia = arquivo_saida.replace('.json', '_emergencia.json')
+                with open(arquivo_emergencia, 'w', encoding='utf-8') as arquivo:
+                    json.dump(dados, arquivo, ensure_ascii=False, cls=DateTimeEncoder)
+                logging.info(safe_log_message(f"💾 Arquivo de emergência salvo: {arquivo_emergencia}"))
+            except Exception as e2:
+                logging.error(safe_log_message(f"❌ Falhou também no arquivo de emergência: {e2}"))
+            
+            raise
+
+class CNESMacrorregiaeMerger:
+    """
+    Classe para mesclar dados de macrorregião com dados das unidades de saúde
+    """
+    
+    # Avisos individuais de município não encontrado antes de passar a apenas contar
+    LIMITE_AVISOS_INDIVIDUAIS = 10
+    
+    def __init__(self, arquivo_macrorregiao: str):
+        """
+        Inicializa o merger com o arquivo de macrorregiões
+        
+        Args:
+            arquivo_macrorregiao (str): Caminho para o arquivo JSON com dados de macrorregião
+        """
+        self.arquivo_macrorregiao = arquivo_macrorregiao
+        self.dados_macrorregiao = {}
+        # Callbacks repassados ao ProgressTracker de mesclar_arquivo_resultados
+        self.observadores_progresso: List[Any] = []
+        # Bloco dados_macrorregiao já no formato de saída, um por município, compartilhado
+        # por todos os estabelecimentos do município (sem cópia por registro)
+        self.blocos_mesclagem = {}
+        self.carregar_dados_macrorregiao()
+        
+        # Configurar logging específico para merger (uma única vez, mesmo com várias instâncias)
+        self.logger = logging.getLogger('CNESMacrorregiaeMerger')
+        if not self.logger.handlers:
+            handler = logging.FileHandler('cnes_macrorregiao_merger.log', encoding='utf-8')
+            handler.setFormatter(FORMATO_LOG)
+            configurar_log_em_fila(self.logger, handler)
+            self.logger.setLevel(logging.INFO)
+        
+        # Eventos por registro são contados e registrados em resumo (registrar_resumo_logs)
+        self.total_mesclados_log = 0
+        self.municipios_nao_encontrados_log: Dict[str, int] = {}
+    
+    def carregar_dados_macrorregiao(self):
+        """
+        Carrega os dados de macrorregião do arquivo JSON e cria índice por código de município
+        """
+        try:
+            logging.info(safe_log_message(f"📂 Carregando dados de macrorregião de: {self.arquivo_macrorregiao}"))
+            
+            with open(self.arquivo_macrorregiao, 'rb') as arquivo:
+                dados = CODEC_JSON.loads(arquivo.read())
+            
+            # Verifica se a estrutura contém o campo esperado
+            if 'macrorregiao_regiao_saude_municipios' in dados:
+                lista_municipios = dados['macrorregiao_regiao_saude_municipios']
+            elif isinstance(dados, list):
+                lista_municipios = dados
+            else:
+                raise ValueError("Estrutura do arquivo de macrorregião não reconhecida")
+            
+            # Cria índice por código de município para busca rápida
+            for item in lista_municipios:
+                codigo_municipio = str(item.get('codigo_municipio', ''))
+                if codigo_municipio:
+                    self.dados_macrorregiao[codigo_municipio] = {
+                        'codigo_regiao_pais': item.get('codigo_regiao_pais'),
+                        'regiao_pais': item.get('regiao_pais'),
+                        'codigo_uf': item.get('codigo_uf'),
+                        'uf': item.get('uf'),
+                        'codigo_macrorregiao_saude': item.get('codigo_macrorregiao_saude'),
+                        'macrorregiao_saude': item.get('macrorregiao_saude'),
+                        'codigo_regiao_saude': item.get('codigo_regiao_saude'),
+                        'regiao_saude': item.get('regiao_saude'),
+                        'municipio': item.get('municipio'),
+                        'populacao_estimada_ibge_2022': item.get('populacao_estimada_ibge_2022')
+                    }
+                    
+                    # Remove campos duplicados que já existem no estabelecimento (codigo_uf) e
+                    # adiciona o codigo_municipio com o mesmo tipo (int) do estabelecimento
+                    bloco = dict(self.dados_macrorregiao[codigo_municipio])
+                    del bloco['codigo_uf']
+                    bloco['codigo_municipio'] = int(codigo_municipio) if codigo_municipio.isdigit() else codigo_municipio
+                    self.blocos_mesclagem[codigo_municipio] = bloco
+            
+            logging.info(safe_log_message(f"✅ Carregados dados de {len(self.dados_macrorregiao)} municípios"))
+            
+        except Exception as e:
+            logging.error(safe_log_message(f"❌ Erro ao carregar dados de macrorregião: {e}"))
+            raise
+    
+    def _bloco_macrorregiao(self, unidade_saude: Any) -> Optional[Dict[str, Any]]:
+        """
+        Bloco dados_macrorregiao do município da unidade (None se não encontrado)
+        """
+        codigo_municipio = str(unidade_saude.get('codigo_municipio', ''))
+        bloco = self.blocos_mesclagem.get(codigo_municipio) if codigo_municipio else None
+        
+        if bloco is not None:
+            self.total_mesclados_log += 1
+        else:
+            ocorrencias = self.municipios_nao_encontrados_log.get(codigo_municipio, 0)
+            self.municipios_nao_encontrados_log[codigo_municipio] = ocorrencias + 1
+            if ocorrencias == 0 and len(self.municipios_nao_encontrados_log) <= self.LIMITE_AVISOS_INDIVIDUAIS:
+                self.logger.warning(safe_log_message(f"⚠️ Código município não encontrado: {codigo_municipio}"))
+        
+        return bloco
+    
+    def mesclar_dados_unidade(self, unidade_saude: Dict[str, Any], copiar: bool = True) -> Dict[str, Any]:
+        """
+        Mescla os dados de uma unidade de saúde com os dados de macrorregião
+        
+        O bloco dados_macrorregiao é compartilhado entre as unidades do mesmo município e não
+        deve ser alterado.
+        
+        Args:
+            unidade_saude (Dict[str, Any]): Dados da unidade de saúde obtidos da API
+            copiar (bool): Cria uma cópia da unidade (False altera o dict recebido)
+            
+        Returns:
+            Dict[str, Any]: Unidade de saúde com dados de macrorregião mesclados
+        """
+        unidade_mesclada = unidade_saude.copy() if copiar else unidade_saude
+        
+        # Remove o campo _metadata se existir (não incluir no resultado final)
+        unidade_mesclada.pop('_metadata', None)
+        
+        # Adiciona os dados de macrorregião em uma seção específica (None se não encontrar o município)
+        unidade_mesclada['dados_macrorregiao'] = self._bloco_macrorregiao(unidade_mesclada)
+        
+        return unidade_mesclada
+    
+    def mesclar_registro(self, registro: EstabelecimentoCNES) -> EstabelecimentoCNES:
+        """
+        Mescla um EstabelecimentoCNES com os dados de macrorregião, sem copiar dados
+        """
+        registro.dados_macrorregiao = self._bloco_macrorregiao(registro)
+        registro.mesclado = True
+        return registro
+    
+    def registrar_resumo_logs(self):
+        """
+        Registra em uma única mensagem os eventos por registro acumulados desde o último resumo
+        """
+        total_nao_encontrados = sum(self.municipios_nao_encontrados_log.values())
+        self.logger.info(safe_log_message(
+            f"✅ Mesclagens bem-sucedidas: {self.total_mesclados_log} | "
+            f"⚠️ Sem município correspondente: {total_nao_encontrados}"
+        ))
+        if self.municipios_nao_encontrados_log:
+            mais_frequentes = sorted(self.municipios_nao_encontrados_log.items(), key=lambda item: -item[1])
+            detalhes = ', '.join(f"{codigo or '(vazio)'} ({ocorrencias}x)" for codigo, ocorrencias in mais_frequentes[:20])
+            restantes = len(mais_frequentes) - 20
+            if restantes > 0:
+                detalhes += f" e mais {restantes}"
+            self.logger.warning(safe_log_message(
+                f"⚠️ {len(mais_frequentes)} códigos de município não encontrados: {detalhes}"
+            ))
+        
+        self.total_mesclados_log = 0
+        self.municipios_nao_encontrados_log = {}
+    
+    @staticmethod
+    def novas_estatisticas() -> Dict[str, Any]:
+        """
+        Cria o bloco de estatísticas da mesclagem, acumulado registro a registro
+        """
+        return {
+            'total_unidades': 0,
+            'mesclagens_bem_sucedidas': 0,
+            'mesclagens_falharam': 0,
+            'codigos_municipio_nao_encontrados': []
+        }
+    
+    def mesclar_e_contabilizar(self, unidade_saude: Any, stats_mesclagem: Dict[str, Any], copiar: bool = True) -> Any:
+        """
+        Mescla uma unidade de saúde e atualiza as estatísticas da mesclagem
+        
+        Args:
+            unidade_saude (Any): EstabelecimentoCNES ou dict com os dados obtidos da API
+            stats_mesclagem (Dict[str, Any]): Estatísticas criadas por novas_estatisticas()
+            copiar (bool): Para dicts, cria uma cópia da unidade (ver mesclar_dados_unidade)
+            
+        Returns:
+            Any: Unidade de saúde com dados de macrorregião mesclados (do mesmo tipo recebido)
+        """
+        if isinstance(unidade_saude, EstabelecimentoCNES):
+            unidade_mesclada = self.mesclar_registro(unidade_saude)
+            bloco = unidade_mesclada.dados_macrorregiao
+        else:
+            unidade_mesclada = self.mesclar_dados_unidade(unidade_saude, copiar=copiar)
+            bloco = unidade_mesclada['dados_macrorregiao']
+        
+        stats_mesclagem['total_unidades'] += 1
+        if bloco is not None:
+            stats_mesclagem['mesclagens_bem_sucedidas'] += 1
+        else:
+            stats_mesclagem['mesclagens_falharam'] += 1
+            codigo_municipio = str(unidade_saude.get('codigo_municipio', ''))
+            if codigo_municipio:
+                stats_mesclagem['codigos_municipio_nao_encontrados'].append(codigo_municipio)
+        
+        return unidade_mesclada
+    
+    def gerar_metadados_mesclagem(self, stats_mesclagem: Dict[str, Any], arquivo_entrada: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Monta o bloco metadados_mesclagem do arquivo de saída
+        
+        Args:
+            stats_mesclagem (Dict[str, Any]): Estatísticas acumuladas da mesclagem
+            arquivo_entrada (str): Arquivo de resultados mesclado (None na mesclagem durante a consulta)
+        """
+        return {
+            'data_mesclagem': datetime.now().isoformat(),
+            'arquivo_entrada': arquivo_entrada,
+            'arquivo_macrorregiao': self.arquivo_macrorregiao,
+            'versao_merger': '1.1_streaming',
+            'modo_mesclagem': 'arquivo' if arquivo_entrada else 'durante_consulta',
+            'estatisticas': stats_mesclagem
+        }
+    
+    @staticmethod
+    def criar_destino(arquivo_saida: str, formato: Optional[str] = None) -> Any:
+        """
+        Cria o escritor incremental com o layout do arquivo mesclado
+        (estabelecimentos_com_macrorregiao, erros_originais, metadados_mesclagem, metadados_originais).
+        Em Parquet/Arrow/CSV/SQLite, cada linha traz as colunas de macrorregião (ver achatar_estabelecimento)
+        """
+        return criar_escritor_resultados(
+            arquivo_saida,
+            formato=formato,
+            chave_registros='estabelecimentos_com_macrorregiao',
+            chave_erros='erros_originais',
+            chave_metadados='metadados_mesclagem'
         )
+    
+    def mesclar_arquivo_resultados(self, arquivo_entrada: str, arquivo_saida: str, formato: Optional[str] = None):
+        """
+        Mescla um arquivo completo de resultados da API CNES com dados de macrorregião
         
-        # Timeout personalizado
-        timeout = aiohttp.ClientTimeout(total=15, connect=5)
+        O arquivo de entrada (JSON ou JSONL) é lido incrementalmente e cada estabelecimento
+        mesclado é gravado direto na saída, então a memória usada não cresce com o tamanho
+        do arquivo. Usado para mesclar resultados já gravados; na consulta normal a mesclagem
+        acontece durante o processamento (parâmetro `merger` do CNESAPIAutomator).
         
+        Args:
+            arquivo_entrada (str): Caminho para o arquivo JSON/JSONL com resultados da API CNES
+            arquivo_saida (str): Caminho para salvar o arquivo mesclado
+            formato (str): Um de FORMATOS_SAIDA (padrão: deduzido da extensão de arquivo_saida)
+            
+        Returns:
+            Dict[str, Any]: Metadados da mesclagem e dados de verificação do arquivo gravado
+        """
         try:
-            async with aiohttp.ClientSession(
-                headers=self.headers,
-                connector=connector,
-                timeout=timeout
-            ) as session:
-                
-                for i, lote in enumerate(lotes, 1):
-                    # Processa o lote
-                    resultados_lote = await self.processar_lote_codigos(session, lote)
-                    
-                    # Processa os resultados
-                    for j, (sucesso, resultado) in enumerate(resultados_lote):
-                        if sucesso:
-                            if isinstance(resultado, dict) and '_metadata' in resultado:
-                                resultado['_metadata']['indice_processamento'] = (i-1) * self.concurrent_requests + j + 1
-                            estabelecimentos_validos.append(resultado)
-                        else:
-                            erros_encontrados.append(resultado)
-                    
-                    # Atualiza o progresso com informações detalhadas
-                    processados = min(i * self.concurrent_requests, len(codigos_cnes))
-                    progress_tracker.update(
-                        processed=processados, 
-                        current_batch=i, 
-                        total_batches=len(lotes),
-                        success_count=len(estabelecimentos_validos),
-                        error_count=len(erros_encontrados)
-                    )
+            logging.info(safe_log_message(f"🔄 Iniciando mesclagem de arquivo: {arquivo_entrada}"))
+            
+            # Estatísticas da mesclagem (acumuladas durante a leitura)
+            stats_mesclagem = self.novas_estatisticas()
+            blocos_originais = {}
+            estrutura_reconhecida = False
+            
+            # O total de unidades só é conhecido no fim: o progresso é medido em KB lidos
+            tamanho_kb = max(1, os.path.getsize(arquivo_entrada) // 1024)
+            progress_tracker = ProgressTracker(tamanho_kb, "🗺️ Mesclando macrorregião (KB)",
+                                               observadores=self.observadores_progresso)
+            
+            escritor = self.criar_destino(arquivo_saida, formato=formato)
+            
+            try:
+                for leitor, (tipo, chave, valor) in IncrementalJSONReader.eventos_resultados(arquivo_entrada):
+                    if tipo == 'item' and chave in (None, 'estabelecimentos'):
+                        estrutura_reconhecida = True
+                        # O registro acabou de ser lido do arquivo: mescla sem copiar
+                        estabelecimento_mesclado = self.mesclar_e_contabilizar(valor, stats_mesclagem, copiar=False)
+                        escritor.escrever_estabelecimento(estabelecimento_mesclado)
+                        
+                        # Atualiza progresso a cada 50 estabelecimentos
+                        if stats_mesclagem['total_unidades'] % 50 == 0 and leitor.arquivo == arquivo_entrada:
+                            progress_tracker.update(min(tamanho_kb, leitor.bytes_lidos // 1024))
                     
-                    # Salva backup a cada 5 lotes
-                    if i % 5 == 0:
-                        self.salvar_backup_incremental(estabelecimentos_validos, erros_encontrados, arquivo_backup)
+                    elif tipo == 'item' and chave == 'erros':
+                        escritor.escrever_erro(valor)
                     
-                    # Pausa entre lotes (exceto no último)
-                    if i < len(lotes):
-                        await asyncio.sleep(self.delay_between_batches)
-        
+                    elif tipo == 'bloco' and chave == 'metadados':
+                        # Preserva metadados originais
+                        blocos_originais['metadados_originais'] = valor
+                
+                if not estrutura_reconhecida and not blocos_originais:
+                    raise ValueError("Estrutura do arquivo de entrada não reconhecida")
+                
+                progress_tracker.update(tamanho_kb)
+                progress_tracker.finish()
+                self.registrar_resumo_logs()
+                
+                metadados_mesclagem = self.gerar_metadados_mesclagem(stats_mesclagem, arquivo_entrada)
+                
+                verificacao = escritor.finalizar(metadados_mesclagem, extras=blocos_originais)
+            except BaseException:
+                escritor.abortar()
+                raise
+            
+            taxa_sucesso = (stats_mesclagem['mesclagens_bem_sucedidas'] / stats_mesclagem['total_unidades'] * 100
+                            if stats_mesclagem['total_unidades'] > 0 else 0)
+            
+            logging.info(safe_log_message(f"✅ Mesclagem concluída com sucesso!"))
+            logging.info(safe_log_message(f"📁 Arquivo mesclado salvo: {verificacao['arquivo']}"))
+            logging.info(safe_log_message(f"📊 Tamanho do arquivo: {verificacao['bytes']:,} bytes"))
+            logging.info(safe_log_message(f"🏥 Total de unidades processadas: {stats_mesclagem['total_unidades']}"))
+            logging.info(safe_log_message(f"✅ Mesclagens bem-sucedidas: {stats_mesclagem['mesclagens_bem_sucedidas']}"))
+            logging.info(safe_log_message(f"❌ Mesclagens falharam: {stats_mesclagem['mesclagens_falharam']}"))
+            logging.info(safe_log_message(f"📈 Taxa de sucesso: {taxa_sucesso:.1f}%"))
+            
+            return {
+                'metadados_mesclagem': metadados_mesclagem,
+                'verificacao': verificacao
+            }
+            
         except Exception as e:
-            logging.error(safe_log_message(f"❌ Erro durante sessão assíncrona: {e}"))
+            logging.error(safe_log_message(f"❌ Erro durante mesclagem: {e}"))
             raise
+
+# Valores padrão das opções da linha de comando / arquivo de configuração
+CONFIGURACAO_PADRAO = {
+    'concorrencia': 15,
+    'modo': 'pool',
+    'delay_entre_lotes': 0.3,
+    'requisicoes_por_segundo': None,
+    'concorrencia_adaptativa': False,
+    'max_tentativas': 3,
+    'cache_arquivo': 'cnes_cache.sqlite3',
+    'cache_validade_horas': 168.0,
+    'formato_saida': 'json',
+    'diretorio_saida': '.',
+    'macrorregiao': None,
+    'url_api': None,
+    'backend_json': None,
+    'campos': None,
+    'arquivo_sqlite': None,
+    'delta': False,
+    'snapshot_arquivo': 'cnes_snapshot.sqlite3',
+    'metricas_porta': None,
+    'limite_pagina': 20,
+    'complementar_listagem': True,
+    'campos_detalhe': None,
+    'conexoes_pre_aquecidas': None,
+    'keepalive_segundos': 60.0,
+    'compressao': True,
+    'timeout_adaptativo': True,
+    'timeout_minimo': 2.0,
+    'timeout_maximo': 15.0,
+    'prazo_segundos': None,
+    'disjuntor': True,
+    'disjuntor_taxa_erro': 0.5,
+    'disjuntor_pausa_segundos': 5.0,
+    'disjuntor_tempo_maximo': 300.0,
+    'hedge': False,
+    'hedge_percentil': 0.95,
+    'hedge_orcamento': 0.05
+}
+
+def carregar_configuracao(arquivo: str) -> Dict[str, Any]:
+    """
+    Carrega um arquivo de configuração TOML ou JSON com as chaves de CONFIGURACAO_PADRAO
+    (no nível superior ou numa seção/objeto "cnes")
+    
+    Args:
+        arquivo (str): Caminho do arquivo .toml ou .json
         
-        finally:
-            # Fecha o connector
-            await connector.close()
+    Returns:
+        Dict[str, Any]: Opções lidas do arquivo
+    """
+    if arquivo.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Arquivos TOML exigem Python 3.11+ ou o pacote 'tomli'; use um arquivo JSON")
+        with open(arquivo, 'rb') as arquivo_config:
+            dados = tomllib.load(arquivo_config)
+    else:
+        with open(arquivo, 'r', encoding='utf-8') as arquivo_config:
+            dados = json.load(arquivo_config)
+    
+    if not isinstance(dados, dict):
+        raise ValueError(f"Arquivo de configuração inválido: {arquivo}")
+    dados = dados.get('cnes', dados)
+    
+    desconhecidas = sorted(set(dados) - set(CONFIGURACAO_PADRAO))
+    if desconhecidas:
+        raise ValueError(f"Opções desconhecidas no arquivo de configuração: {', '.join(desconhecidas)}")
+    if dados.get('modo', 'pool') not in CNESAPIAutomator.MODOS_PROCESSAMENTO:
+        raise ValueError(f"Modo de processamento inválido: {dados['modo']}")
+    for chave in ('campos', 'campos_detalhe'):
+        if dados.get(chave) is not None and not isinstance(dados[chave], list):
+            raise ValueError(f"A opção '{chave}' deve ser uma lista de nomes de campos")
+    if dados.get('backend_json') not in (None,) + JSONCodec.BACKENDS:
+        raise ValueError(f"Backend JSON inválido: {dados['backend_json']}")
+    if dados.get('formato_saida', 'json') not in FORMATOS_SAIDA:
+        raise ValueError(f"Formato de saída inválido: {dados['formato_saida']}")
+    
+    return dados
+
+def resolver_configuracao(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Combina, em ordem de prioridade, as opções da linha de comando, o arquivo de
+    configuração (--config) e CONFIGURACAO_PADRAO
+    """
+    config = dict(CONFIGURACAO_PADRAO)
+    if getattr(args, 'config', None):
+        config.update(carregar_configuracao(args.config))
+    for chave in CONFIGURACAO_PADRAO:
+        valor = getattr(args, chave, None)
+        if valor is not None:
+            config[chave] = valor
+    
+    if not config['macrorregiao']:
+        config['macrorregiao'] = localizar_arquivo_macrorregiao()
+    
+    return config
+
+def localizar_arquivo_macrorregiao() -> Optional[str]:
+    """
+    Procura o arquivo de macrorregião nos caminhos padrão
+    """
+    caminhos_padrao = [
+        'macrorregiao_regiao_saude_municipios.json',
+        '../macrorregiao_regiao_saude_municipios.json',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'macrorregiao_regiao_saude_municipios.json')
+    ]
+    
+    for caminho in caminhos_padrao:
+        if os.path.exists(caminho):
+            return caminho
+    
+    return None
+
+def arquivo_saida_configurado(config: Dict[str, Any], nome: str) -> str:
+    """
+    Caminho da saída de uma lista/arquivo: <diretorio_saida>/<nome>.<formato_saida> ou, no
+    formato sqlite, o banco único atualizado a cada execução (arquivo_sqlite)
+    """
+    if config['formato_saida'] == 'sqlite':
+        return config['arquivo_sqlite'] or os.path.join(config['diretorio_saida'], 'cnes_estabelecimentos.sqlite3')
+    return os.path.join(config['diretorio_saida'], f"{nome}.{config['formato_saida']}")
+
+def criar_automatizador(config: Dict[str, Any], cache: Optional[CNESResponseCache] = None) -> CNESAPIAutomator:
+    """
+    Cria o automatizador com as opções de desempenho da configuração
+    """
+    automatizador = CNESAPIAutomator(
+        concurrent_requests=config['concorrencia'],
+        delay_between_batches=config['delay_entre_lotes'],
+        modo_processamento=config['modo'],
+        requests_per_second=config['requisicoes_por_segundo'],
+        adaptive_concurrency=config['concorrencia_adaptativa'],
+        retry_policy=RetryPolicy(max_tentativas=config['max_tentativas']),
+        cache=cache,
+        campos=config['campos'],
+        limite_pagina=config['limite_pagina'],
+        complementar_listagem=config['complementar_listagem'],
+        campos_detalhe=config['campos_detalhe'],
+        conexoes_pre_aquecidas=config['conexoes_pre_aquecidas'],
+        keepalive_segundos=config['keepalive_segundos'],
+        compressao=config['compressao'],
+        timeout_adaptativo=config['timeout_adaptativo'],
+        timeout_minimo=config['timeout_minimo'],
+        timeout_maximo=config['timeout_maximo'],
+        prazo_segundos=config['prazo_segundos'],
+        disjuntor=config['disjuntor'],
+        disjuntor_taxa_erro=config['disjuntor_taxa_erro'],
+        disjuntor_pausa_segundos=config['disjuntor_pausa_segundos'],
+        disjuntor_tempo_maximo=config['disjuntor_tempo_maximo'],
+        hedge=config['hedge'],
+        hedge_percentil=config['hedge_percentil'],
+        hedge_orcamento=config['hedge_orcamento']
+    )
+    if config['url_api']:
+        automatizador.base_url = config['url_api'].rstrip('/')
+    return automatizador
+
+def confirmar_execucao(mensagem: str, assumir_sim: bool) -> bool:
+    """
+    Pede confirmação ao usuário, a menos que --yes tenha sido informado.
+    Sem terminal interativo (cron, orquestradores), a resposta é "não"
+    """
+    if assumir_sim:
+        return True
+    try:
+        return input(mensagem).strip().lower() == 's'
+    except EOFError:
+        print("\n❌ Sem terminal interativo para confirmar; use --yes")
+        return False
+
+def criar_destino_configurado(config: Dict[str, Any], nome_base: str, timestamp: str, mesclar: bool,
+                              snapshot: Optional[CNESSnapshotStore] = None) -> Any:
+    """
+    Cria o destino da saída de uma lista no layout de fetch ou run (mesclar) e, com snapshot,
+    no modo delta (apenas os estabelecimentos novos ou alterados, com manifesto)
+    """
+    prefixo = 'cnes_delta_' if snapshot is not None else 'cnes_'
+    if mesclar:
+        arquivo_saida = arquivo_saida_configurado(config, f"{prefixo}com_macrorregiao_{nome_base}_{timestamp}")
+        destino = CNESMacrorregiaeMerger.criar_destino(arquivo_saida, formato=config['formato_saida'])
+    else:
+        arquivo_saida = arquivo_saida_configurado(config, f"{prefixo}resultados_{nome_base}_{timestamp}")
+        destino = criar_escritor_resultados(arquivo_saida, formato=config['formato_saida'])
+    if snapshot is not None:
+        destino = DeltaResultWriter(
+            destino, snapshot, escopo=f"{'run' if mesclar else 'fetch'}:{nome_base}",
+            arquivo_manifesto=os.path.join(config['diretorio_saida'], f"cnes_delta_{nome_base}_{timestamp}_manifesto.json")
+        )
+    return destino
+
+def imprimir_delta(verificacao: Dict[str, Any]):
+    """
+    Mostra as contagens do modo delta de um destino finalizado
+    """
+    delta = verificacao['delta']
+    print(f"🔄 Delta: {delta['novos']} novos | {delta['alterados']} alterados | "
+          f"{delta['removidos']} removidos | {delta['inalterados']} inalterados "
+          f"→ {delta['arquivo_manifesto']}")
+
+def nome_listagem(filtros: Dict[str, Any]) -> str:
+    """
+    Nome de uma listagem paginada nas saídas, journals e escopo do delta (ex.: 'uf11', 'municipio110020')
+    """
+    if 'codigo_municipio' in filtros:
+        return f"municipio{filtros['codigo_municipio']}"
+    return f"uf{filtros['codigo_uf']}"
+
+async def executar_consultas(tarefas: List[Dict[str, Any]], config: Dict[str, Any], assumir_sim: bool = False) -> bool:
+    """
+    Consulta várias listas de códigos no mesmo processo, compartilhando o cliente HTTP (pool de
+    conexões keep-alive, pré-aquecido uma vez antes da primeira lista), o cache, o controle de
+    taxa/concorrência e os dados de macrorregião
+    
+    Args:
+        tarefas (List[Dict[str, Any]]): Uma por lista, com 'arquivo_entrada' (ou 'listagem': filtros
+            da listagem paginada, ver CNESAPIAutomator.processar_listagem), 'mesclar' e,
+            opcionalmente, 'shard' (i, N), 'journal' (para retomar uma execução) e 'delta'
+            (padrão: config['delta'])
+        config (Dict[str, Any]): Configuração resolvida (resolver_configuracao)
+        assumir_sim (bool): Não pede confirmação
         
-        # Finaliza o progresso
-        progress_tracker.finish()
+    Returns:
+        bool: True se todas as listas foram processadas
+    """
+    merger = None
+    if any(tarefa['mesclar'] for tarefa in tarefas):
+        if not config['macrorregiao'] or not os.path.exists(config['macrorregiao']):
+            print(f"❌ Arquivo de macrorregião não encontrado: {config['macrorregiao']}")
+            return False
+        merger = CNESMacrorregiaeMerger(config['macrorregiao'])
+    
+    cache = None
+    if config['cache_validade_horas'] > 0:
+        cache = CNESResponseCache(config['cache_arquivo'], ttl_segundos=config['cache_validade_horas'] * 3600)
+    
+    for tarefa in tarefas:
+        tarefa.setdefault('delta', config['delta'])
+    snapshot = CNESSnapshotStore(config['snapshot_arquivo']) if any(tarefa['delta'] for tarefa in tarefas) else None
+    servidor_metricas = None
+    
+    try:
+        automatizador = criar_automatizador(config, cache)
         
-        self.stats['fim_execucao'] = datetime.now().isoformat()
+        arquivos = [tarefa for tarefa in tarefas if not tarefa.get('listagem')]
+        for tarefa in arquivos:
+            tarefa['codigos'] = automatizador.carregar_codigos_cnes(tarefa['arquivo_entrada'], shard=tarefa.get('shard'))
+            tarefa['rejeitados'] = automatizador.codigos_rejeitados
         
-        # Calcula tempo de execução
-        inicio = datetime.fromisoformat(self.stats['inicio_execucao'])
-        fim = datetime.fromisoformat(self.stats['fim_execucao'])
-        tempo_execucao = (fim - inicio).total_seconds()
+        if arquivos:
+            total_codigos = sum(len(tarefa['codigos']) for tarefa in arquivos)
+            print(f"\n📋 {len(arquivos)} arquivo(s) com {total_codigos:,} códigos CNES para processar")
+        listagens = [nome_listagem(tarefa['listagem']) for tarefa in tarefas if tarefa.get('listagem')]
+        if listagens:
+            print(f"\n🔎 Listagem paginada ({config['limite_pagina']} por página): {', '.join(listagens)}")
+        total_rejeitados = sum(len(tarefa['rejeitados']) for tarefa in arquivos)
+        if total_rejeitados:
+            print(f"⚠️ {total_rejeitados:,} código(s) inválido(s) rejeitado(s) sem consulta à API "
+                  f"(listados em metadados.codigos_rejeitados da saída)")
+        print(f"⚡ Configuração: {config['concorrencia']} requisições simultâneas (modo {config['modo']})")
+        if config['concorrencia'] > 25 and not config['concorrencia_adaptativa']:
+            print("⚠️ Aviso: Mais de 25 requisições simultâneas pode sobrecarregar a API")
         
-        # Consolida os resultados finais
-        resultado_consolidado = {
-            'metadados': {
-                'data_processamento': self.stats['fim_execucao'],
-                'tempo_execucao_segundos': tempo_execucao,
-                'fonte_api': self.base_url,
-                'total_codigos_processados': len(codigos_cnes),
-                'versao_script': '2.0_async_optimized_with_progress',
-                'configuracao_performance': {
-                    'requisicoes_simultaneas': self.concurrent_requests,
-                    'delay_entre_lotes': self.delay_between_batches,
-                    'total_lotes': len(lotes)
-                },
-                'estatisticas': self.stats.copy()
-            },
-            'estabelecimentos': estabelecimentos_validos,
-            'erros': erros_encontrados,
-            'resumo': {
-                'total_sucessos': len(estabelecimentos_validos),
-                'total_erros': len(erros_encontrados),
-                'taxa_sucesso': f"{(len(estabelecimentos_validos)/len(codigos_cnes)*100):.1f}%" if codigos_cnes else "0%",
-                'velocidade_media': f"{len(codigos_cnes)/tempo_execucao:.1f} req/s" if tempo_execucao > 0 else "N/A"
-            }
-        }
+        if not confirmar_execucao("\nDeseja continuar? (s/n): ", assumir_sim):
+            return False
         
-        logging.info(safe_log_message(f"✅ Processamento assíncrono concluído!"))
-        logging.info(safe_log_message(f"📈 Sucessos: {len(estabelecimentos_validos)}"))
-        logging.info(safe_log_message(f"❌ Erros: {len(erros_encontrados)}"))
-        logging.info(safe_log_message(f"📊 Taxa de sucesso: {resultado_consolidado['resumo']['taxa_sucesso']}"))
-        logging.info(safe_log_message(f"⚡ Velocidade média: {resultado_consolidado['resumo']['velocidade_media']}"))
-        logging.info(safe_log_message(f"⏱️ Tempo total: {tempo_execucao:.1f} segundos"))
+        os.makedirs(config['diretorio_saida'], exist_ok=True)
+        falhas = 0
+        
+        if config['metricas_porta'] is not None:
+            servidor_metricas = MetricsServer(automatizador.texto_metricas, config['metricas_porta'])
+            print(f"📡 Métricas (Prometheus): {await servidor_metricas.iniciar()}")
+        
+        async with automatizador.criar_cliente() as cliente:
+            pre_aquecimento = await automatizador.pre_aquecer(cliente)
+            if pre_aquecimento is not None:
+                print(f"🔗 {pre_aquecimento['conexoes_abertas']} conexões pré-aquecidas em {pre_aquecimento['tempo_ms']:.0f} ms")
+            
+            for tarefa in tarefas:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                parametros = {'comando': 'run' if tarefa['mesclar'] else 'fetch'}
+                if tarefa.get('listagem'):
+                    nome_base = nome_listagem(tarefa['listagem'])
+                    origem = f"listagem {nome_base}"
+                    parametros['listagem'] = tarefa['listagem']
+                else:
+                    nome_base = os.path.splitext(os.path.basename(tarefa['arquivo_entrada']))[0]
+                    origem = tarefa['arquivo_entrada']
+                if tarefa['delta']:
+                    parametros['delta'] = True
+                if tarefa.get('shard'):
+                    # Cada shard tem sua saída e seu journal (e, no modo delta, seu escopo no snapshot)
+                    indice, total_shards = tarefa['shard']
+                    nome_base = f"{nome_base}_shard{indice}de{total_shards}"
+                    parametros['shard'] = f"{indice}/{total_shards}"
+                
+                if tarefa.get('journal'):
+                    journal = CheckpointJournal(tarefa['journal'])
+                else:
+                    journal = CheckpointJournal(
+                        CheckpointJournal.novo_arquivo(os.path.join(config['diretorio_saida'], f"cnes_journal_{nome_base}")),
+                        arquivo_entrada=tarefa.get('arquivo_entrada'),
+                        parametros=parametros
+                    )
+                
+                # No modo delta, a saída traz apenas os estabelecimentos novos ou alterados
+                destino = criar_destino_configurado(config, nome_base, timestamp, tarefa['mesclar'],
+                                                    snapshot if tarefa['delta'] else None)
+                
+                automatizador.merger = merger if tarefa['mesclar'] else None
+                concluido = False
+                try:
+                    try:
+                        if tarefa.get('listagem'):
+                            resultados = await automatizador.processar_listagem(
+                                tarefa['listagem'], journal=journal, destino=destino, cliente=cliente
+                            )
+                        else:
+                            resultados = await automatizador.processar_lista_codigos(
+                                tarefa['codigos'], journal=journal, destino=destino, cliente=cliente,
+                                codigos_rejeitados=tarefa['rejeitados']
+                            )
+                    except BaseException:
+                        destino.abortar()
+                        raise
+                    print(f"📁 {origem} → {destino.arquivo} "
+                          f"({resultados['resumo']['taxa_sucesso']} de sucesso, {resultados['resumo']['velocidade_media']})")
+                    if tarefa['delta']:
+                        imprimir_delta(resultados['verificacao'])
+                    # Prazo esgotado ou disjuntor desistiu: a saída é parcial e o journal fica para
+                    # retomar os que faltam
+                    nao_concluidos = resultados['resumo']['total_nao_concluidos']
+                    if nao_concluidos:
+                        falhas += 1
+                        motivo = "🔌 API fora do ar" if automatizador.disjuntor.esgotado else "⏰ Prazo esgotado"
+                        print(f"{motivo}: {nao_concluidos:,} código(s) não concluído(s) "
+                              f"(listados em metadados.codigos_nao_concluidos da saída)")
+                    concluido = not nao_concluidos
+                except Exception as e:
+                    falhas += 1
+                    logging.error(safe_log_message(f"❌ Erro ao processar {origem}: {e}"))
+                finally:
+                    journal.fechar()
+                    if concluido:
+                        os.remove(journal.arquivo)
+                    else:
+                        print(f"♻️ Para retomar: python {os.path.basename(__file__)} resume {journal.arquivo}")
         
-        # Remove arquivo de backup se processamento foi bem-sucedido
+        return falhas == 0
+    
+    finally:
+        if servidor_metricas is not None:
+            await servidor_metricas.parar()
+        if cache is not None:
+            cache.fechar()
+        if snapshot is not None:
+            snapshot.fechar()
+
+def executar_mesclagens(entradas: List[str], config: Dict[str, Any]) -> bool:
+    """
+    Mescla arquivos de resultados já gravados (reprocessamentos), carregando os dados de
+    macrorregião uma única vez
+    """
+    if not config['macrorregiao'] or not os.path.exists(config['macrorregiao']):
+        print(f"❌ Arquivo de macrorregião não encontrado: {config['macrorregiao']}")
+        return False
+    
+    merger = CNESMacrorregiaeMerger(config['macrorregiao'])
+    os.makedirs(config['diretorio_saida'], exist_ok=True)
+    falhas = 0
+    
+    for arquivo_entrada in entradas:
+        nome_base = os.path.splitext(os.path.basename(arquivo_entrada))[0]
+        arquivo_saida = arquivo_saida_configurado(config, f"{nome_base}_com_macrorregiao")
         try:
-            if os.path.exists(arquivo_backup):
-                os.remove(arquivo_backup)
-                logging.info(safe_log_message(f"🗑️ Backup temporário removido: {arquivo_backup}"))
-        except:
-            pass
+            resultado = merger.mesclar_arquivo_resultados(arquivo_entrada, arquivo_saida, formato=config['formato_saida'])
+            print(f"📁 {arquivo_entrada} → {resultado['verificacao']['arquivo']}")
+        except Exception:
+            falhas += 1
+    
+    return falhas == 0
+
+# Chaves das listas de registros e de erros nos layouts de fetch e run
+CHAVES_REGISTROS_RESULTADOS = ('estabelecimentos', 'estabelecimentos_com_macrorregiao')
+CHAVES_ERROS_RESULTADOS = ('erros', 'erros_originais')
+
+def resultados_mesclados(arquivo: str) -> bool:
+    """
+    Indica se um arquivo de resultados (JSON/JSONL) está no layout mesclado com macrorregião (run),
+    lendo apenas o início do arquivo
+    """
+    eventos = IncrementalJSONReader.eventos_resultados(
+        arquivo, chaves_streaming=CHAVES_REGISTROS_RESULTADOS + CHAVES_ERROS_RESULTADOS, meta_primeiro=True
+    )
+    try:
+        for _, (tipo, chave, valor) in eventos:
+            return chave in ('estabelecimentos_com_macrorregiao', 'erros_originais', 'metadados_mesclagem')
+        return False
+    finally:
+        eventos.close()
+
+def nome_base_shard(arquivo: str) -> str:
+    """
+    Nome da lista de códigos de uma saída de shard
+    (cnes_resultados_<nome>_shard2de4_<timestamp>.jsonl → <nome>)
+    """
+    nome = os.path.splitext(os.path.basename(arquivo))[0]
+    encontrado = re.match(r'cnes_(?:delta_)?(?:com_macrorregiao|resultados)_(.+)_shard\d+de\d+_\d{8}_\d{6}$', nome)
+    return encontrado.group(1) if encontrado else nome
+
+def _combinar_estatisticas(lista: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Soma as estatísticas de vários shards: contadores somados, início/fim e máximos pelo
+    extremo, latência média ponderada pelas tentativas e listas unidas
+    """
+    combinadas = {}
+    for chave, valor in lista[0].items():
+        valores = [estatisticas[chave] for estatisticas in lista if estatisticas.get(chave) is not None]
+        if not valores:
+            combinadas[chave] = valor
+        elif chave.startswith('inicio_'):
+            combinadas[chave] = min(valores)
+        elif chave.startswith('fim_') or '_maxima' in chave:
+            combinadas[chave] = max(valores)
+        elif chave == 'latencia_media_tentativa_ms':
+            tentativas = sum(estatisticas.get('tentativas', 0) for estatisticas in lista)
+            combinadas[chave] = round(sum(estatisticas.get(chave, 0) * estatisticas.get('tentativas', 0)
+                                          for estatisticas in lista) / tentativas, 1) if tentativas else 0.0
+        elif isinstance(valor, list):
+            combinadas[chave] = list(dict.fromkeys(item for itens in valores for item in itens))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            combinadas[chave] = sum(valores)
+        else:
+            combinadas[chave] = valor
+    return combinadas
+
+def _combinar_metricas(lista: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Soma os blocos 'metricas' (FetchMetrics.resumo) de vários shards: histogramas somados
+    bucket a bucket, contadores somados e máximos pelo maior valor
+    """
+    combinadas = {}
+    for chave in dict.fromkeys(chave for item in lista for chave in item):
+        valores = [item[chave] for item in lista if item.get(chave) is not None]
+        if not valores:
+            combinadas[chave] = None
+        elif isinstance(valores[0], dict) and 'buckets' in valores[0]:
+            histograma = LatencyHistogram.de_resumo(valores[0])
+            for valor in valores[1:]:
+                histograma.somar(LatencyHistogram.de_resumo(valor))
+            combinadas[chave] = histograma.resumo()
+        elif isinstance(valores[0], dict):
+            combinadas[chave] = _combinar_metricas(valores)
+        elif chave.endswith('_maximo') or chave.endswith('_maxima'):
+            combinadas[chave] = max(valores)
+        elif chave == 'tempo_primeiro_resultado_ms':
+            combinadas[chave] = min(valores)
+        elif isinstance(valores[0], (int, float)) and not isinstance(valores[0], bool):
+            combinadas[chave] = sum(valores)
+        else:
+            combinadas[chave] = valores[0]
+    
+    conexoes = combinadas.get('conexoes')
+    if conexoes and 'taxa_reutilizacao' in conexoes:
+        total = conexoes.get('novas', 0) + conexoes.get('reutilizadas', 0)
+        conexoes['taxa_reutilizacao'] = f"{conexoes.get('reutilizadas', 0) / total * 100:.1f}%" if total else "N/A"
+    compressao = combinadas.get('compressao')
+    if compressao and 'taxa_economia' in compressao:
+        descomprimidos = compressao.get('bytes_descomprimidos', 0)
+        compressao['taxa_economia'] = (f"{compressao.get('bytes_economizados', 0) / descomprimidos * 100:.1f}%"
+                                       if descomprimidos else "N/A")
+    return combinadas
+
+def _combinar_metadados(lista: List[Dict[str, Any]], shards: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Monta o bloco de metadados da execução a partir dos metadados de cada shard
+    """
+    if not lista:
+        return {'shards': shards}
+    
+    metadados = dict(lista[0])
+    metadados.pop('journal', None)
+    estatisticas = [item['estatisticas'] for item in lista if item.get('estatisticas')]
+    if estatisticas:
+        metadados['estatisticas'] = _combinar_estatisticas(estatisticas)
+    metadados['data_processamento'] = max(item.get('data_processamento') or '' for item in lista) or None
+    metadados['total_codigos_processados'] = sum(item.get('total_codigos_processados', 0) for item in lista)
+    if any('codigos_nao_concluidos' in item for item in lista):
+        metadados['codigos_nao_concluidos'] = [codigo for item in lista for codigo in item.get('codigos_nao_concluidos', [])]
+    
+    # Os shards rodam em paralelo: o tempo é o do primeiro início ao último fim
+    inicio = metadados.get('estatisticas', {}).get('inicio_execucao')
+    fim = metadados.get('estatisticas', {}).get('fim_execucao')
+    if inicio and fim:
+        metadados['tempo_execucao_segundos'] = (datetime.fromisoformat(fim) - datetime.fromisoformat(inicio)).total_seconds()
+    else:
+        metadados['tempo_execucao_segundos'] = max(item.get('tempo_execucao_segundos', 0) for item in lista)
+    
+    metricas = [item['metricas'] for item in lista if item.get('metricas')]
+    if metricas:
+        metadados['metricas'] = _combinar_metricas(metricas)
+    
+    configuracao = [item['configuracao_performance'] for item in lista if item.get('configuracao_performance')]
+    if configuracao:
+        metadados['configuracao_performance'] = dict(configuracao[0])
+        metadados['configuracao_performance'].pop('comparativo_modo_lotes', None)
+        metadados['configuracao_performance']['requisicoes_por_segundo'] = round(
+            sum(item.get('requisicoes_por_segundo', 0) for item in configuracao), 2
+        )
+    metadados['shards'] = shards
+    return metadados
+
+def combinar_resultados(entradas: List[str], destino: Any) -> Dict[str, Any]:
+    """
+    Junta as saídas de vários shards (JSON/JSONL de fetch ou de run) num único destino, no
+    layout usual: registros e erros são copiados em streaming e os blocos de metadados,
+    estatísticas e resumo são somados
+    
+    Args:
+        entradas (List[str]): Saídas dos shards, todas no mesmo layout
+        destino (Any): Escritor no layout das entradas (criar_escritor_resultados ou
+            CNESMacrorregiaeMerger.criar_destino)
+        
+    Returns:
+        Dict[str, Any]: Metadados, resumo e dados de verificação do arquivo gravado
+    """
+    blocos_shards = []
+    try:
+        for entrada in entradas:
+            blocos = {}
+            shard = {'arquivo': entrada, 'registros': 0, 'erros': 0}
+            for _, (tipo, chave, valor) in IncrementalJSONReader.eventos_resultados(
+                    entrada, chaves_streaming=CHAVES_REGISTROS_RESULTADOS + CHAVES_ERROS_RESULTADOS):
+                if tipo == 'item' and chave in (None,) + CHAVES_REGISTROS_RESULTADOS:
+                    destino.escrever_estabelecimento(valor)
+                    shard['registros'] += 1
+                elif tipo == 'item' and chave in CHAVES_ERROS_RESULTADOS:
+                    destino.escrever_erro(valor)
+                    shard['erros'] += 1
+                elif tipo == 'bloco':
+                    blocos[chave] = valor
+            if 'metadados' in blocos and blocos['metadados'].get('journal'):
+                shard['journal'] = blocos['metadados']['journal'].get('arquivo')
+            blocos_shards.append((shard, blocos))
+        
+        shards = [shard for shard, _ in blocos_shards]
+        mesclado = any('metadados_mesclagem' in blocos for _, blocos in blocos_shards)
+        chave_metadados = 'metadados_originais' if mesclado else 'metadados'
+        metadados = _combinar_metadados(
+            [blocos[chave_metadados] for _, blocos in blocos_shards if blocos.get(chave_metadados)], shards
+        )
+        
+        resumos = [blocos['resumo'] for _, blocos in blocos_shards if blocos.get('resumo')]
+        total_sucessos = sum(resumo.get('total_sucessos', 0) for resumo in resumos)
+        total_erros = sum(resumo.get('total_erros', 0) for resumo in resumos)
+        total_nao_concluidos = sum(resumo.get('total_nao_concluidos', 0) for resumo in resumos)
+        total_codigos = metadados.get('total_codigos_processados') or total_sucessos + total_erros
+        requisicoes_por_segundo = metadados.get('configuracao_performance', {}).get('requisicoes_por_segundo', 0)
+        resumo = {
+            'total_sucessos': total_sucessos,
+            'total_erros': total_erros,
+            'total_nao_concluidos': total_nao_concluidos,
+            'taxa_sucesso': f"{(total_sucessos/total_codigos*100):.1f}%" if total_codigos else "0%",
+            'velocidade_media': f"{requisicoes_por_segundo:.1f} req/s" if requisicoes_por_segundo > 0 else "N/A"
+        }
+        
+        if isinstance(destino, DeltaResultWriter):
+            metadados_shards = [blocos[chave_metadados] for _, blocos in blocos_shards if blocos.get(chave_metadados)]
+            destino.adiar(metadados.get('codigos_nao_concluidos', []),
+                          lista_completa=all(item.get('listagem', {}).get('concluida', True) for item in metadados_shards))
+        
+        if mesclado:
+            mesclagens = [blocos['metadados_mesclagem'] for _, blocos in blocos_shards if blocos.get('metadados_mesclagem')]
+            metadados_mesclagem = dict(mesclagens[0])
+            metadados_mesclagem['data_mesclagem'] = max(item.get('data_mesclagem') or '' for item in mesclagens) or None
+            metadados_mesclagem['estatisticas'] = _combinar_estatisticas([item['estatisticas'] for item in mesclagens])
+            verificacao = destino.finalizar(metadados_mesclagem, resumo, extras={'metadados_originais': metadados})
+        else:
+            verificacao = destino.finalizar(metadados, resumo)
+    except BaseException:
+        destino.abortar()
+        raise
+    
+    return {'metadados': metadados, 'resumo': resumo, 'verificacao': verificacao}
+
+def executar_combinacao(entradas: List[str], config: Dict[str, Any], nome_base: Optional[str] = None) -> bool:
+    """
+    Junta saídas de shards (processos locais ou várias máquinas) num arquivo no formato
+    configurado, em <diretorio_saida>; com delta, grava só as mudanças desde a última execução
+    da mesma lista (escopo fetch:<nome> ou run:<nome>)
+    """
+    for entrada in entradas:
+        if not os.path.exists(entrada):
+            print(f"❌ Arquivo não encontrado: {entrada}")
+            return False
+    
+    layouts = {resultados_mesclados(entrada) for entrada in entradas}
+    if len(layouts) > 1:
+        print("❌ As saídas dos shards misturam resultados de fetch e de run")
+        return False
+    
+    nome_base = nome_base or nome_base_shard(entradas[0])
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.makedirs(config['diretorio_saida'], exist_ok=True)
+    snapshot = CNESSnapshotStore(config['snapshot_arquivo']) if config['delta'] else None
+    try:
+        destino = criar_destino_configurado(config, nome_base, timestamp, layouts.pop(), snapshot)
+        resultado = combinar_resultados(entradas, destino)
+    except Exception as e:
+        logging.error(safe_log_message(f"❌ Erro ao combinar os shards de {nome_base}: {e}"))
+        return False
+    finally:
+        if snapshot is not None:
+            snapshot.fechar()
+    
+    print(f"🧩 {len(entradas)} shard(s) → {resultado['verificacao']['arquivo']} "
+          f"({resultado['resumo']['taxa_sucesso']} de sucesso, {resultado['resumo']['velocidade_media']})")
+    if config['delta']:
+        imprimir_delta(resultado['verificacao'])
+    return True
+
+def executar_shards_locais(comando: str, entradas: List[str], config: Dict[str, Any], processos: int,
+                           assumir_sim: bool = False) -> bool:
+    """
+    Divide os códigos de cada lista em `processos` shards, processados em paralelo por
+    processos locais (este script com --shard i/N), e junta as saídas no layout usual
+    
+    Cada shard grava JSONL e journal em <diretorio_saida>/cnes_shards_<timestamp>, com um log
+    por processo. Se algum shard falhar, o diretório é mantido para retomar os shards pelos
+    journals e juntar as saídas com o subcomando combine.
+    
+    Returns:
+        bool: True se todos os shards terminaram e as saídas foram combinadas
+    """
+    for entrada in entradas:
+        if not os.path.exists(entrada):
+            print(f"❌ Arquivo não encontrado: {entrada}")
+            return False
+    
+    print(f"\n🧩 {len(entradas)} arquivo(s) divididos em {processos} shards, um processo por shard")
+    print(f"⚡ Configuração: {config['concorrencia']} requisições simultâneas por processo "
+          f"({config['concorrencia'] * processos} no total)")
+    # O limite de requisições por segundo vale para a API: é dividido entre os shards
+    rps_shard = config['requisicoes_por_segundo'] / processos if config['requisicoes_por_segundo'] else None
+    if rps_shard:
+        print(f"🚦 Limite: {config['requisicoes_por_segundo']:g} requisições/s no total "
+              f"({rps_shard:g} por processo)")
+    if not confirmar_execucao("\nDeseja continuar? (s/n): ", assumir_sim):
+        return False
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    diretorio_shards = os.path.abspath(os.path.join(config['diretorio_saida'], f"cnes_shards_{timestamp}"))
+    os.makedirs(diretorio_shards, exist_ok=True)
+    
+    # Os shards gravam JSONL sem delta: o formato e o delta configurados valem para a saída combinada
+    arquivo_config = os.path.join(diretorio_shards, 'config.json')
+    with open(arquivo_config, 'w', encoding='utf-8') as arquivo:
+        json.dump({**config, 'formato_saida': 'jsonl', 'diretorio_saida': diretorio_shards, 'delta': False,
+                   'requisicoes_por_segundo': rps_shard},
+                  arquivo, ensure_ascii=False, indent=2)
+    
+    def argumentos_metricas(indice: int) -> List[str]:
+        # Um endpoint de métricas por processo, em portas consecutivas
+        if config['metricas_porta'] is None:
+            return []
+        return ['--metricas-porta', str(config['metricas_porta'] + indice - 1 if config['metricas_porta'] else 0)]
+    
+    execucoes = []
+    try:
+        for indice in range(1, processos + 1):
+            log = open(os.path.join(diretorio_shards, f"shard_{indice}de{processos}.log"), 'w', encoding='utf-8')
+            execucoes.append((indice, log, subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), comando, *entradas, '--config', arquivo_config,
+                 '--shard', f"{indice}/{processos}", '--yes', *argumentos_metricas(indice)],
+                stdout=log, stderr=subprocess.STDOUT, env={**os.environ, 'PYTHONIOENCODING': 'utf-8'}
+            )))
         
-        return resultado_consolidado
+        falhas = 0
+        for indice, log, processo in execucoes:
+            codigo_saida = processo.wait()
+            if codigo_saida == 0:
+                print(f"✅ Shard {indice}/{processos} concluído")
+            else:
+                falhas += 1
+                print(f"❌ Shard {indice}/{processos} falhou (código {codigo_saida}); log: {log.name}")
+    except BaseException:
+        for _, _, processo in execucoes:
+            processo.terminate()
+        raise
+    finally:
+        for _, log, _ in execucoes:
+            log.close()
+    
+    if falhas:
+        print(f"♻️ Retome os shards com falha pelos journals em {diretorio_shards} e junte as saídas com:")
+        print(f"   python {os.path.basename(__file__)} combine {diretorio_shards}/cnes_*_<lista>_shard*.jsonl")
+        return False
+    
+    prefixo = 'cnes_com_macrorregiao_' if comando == 'run' else 'cnes_resultados_'
+    combinados = 0
+    for entrada in entradas:
+        nome_base = os.path.splitext(os.path.basename(entrada))[0]
+        saidas = []
+        for indice in range(1, processos + 1):
+            saidas.extend(sorted(glob.glob(os.path.join(
+                diretorio_shards, f"{prefixo}{glob.escape(nome_base)}_shard{indice}de{processos}_*.jsonl"
+            ))))
+        if len(saidas) != processos:
+            print(f"❌ Esperadas {processos} saídas de shard para {entrada}, encontradas {len(saidas)}")
+        elif executar_combinacao(saidas, config, nome_base=nome_base):
+            combinados += 1
+    
+    if combinados < len(entradas):
+        print(f"📂 Saídas e logs dos shards mantidos em {diretorio_shards}")
+        return False
+    shutil.rmtree(diretorio_shards)
+    return True
 
-    def salvar_resultados(self, dados: Dict[str, Any], arquivo_saida: str):
-        """
-        Salva os resultados consolidados em um arquivo JSON com validação
-        
-        Args:
-            dados (Dict[str, Any]): Dados consolidados para salvar
-            arquivo_saida (str): Caminho do arquivo de saída
-        """
-        try:
-            logging.info(safe_log_message(f"💾 Salvando resultados em: {arquivo_saida}"))
-            
-            # Primeiro, valida se os dados podem ser serializados
-            json_string = json.dumps(dados, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
-            
-            # Salva o arquivo
-            with open(arquivo_saida, 'w', encoding='utf-8') as arquivo:
-                arquivo.write(json_string)
-            
-            # Verifica se o arquivo foi salvo corretamente
-            tamanho_arquivo = os.path.getsize(arquivo_saida)
-            
-            # Testa se o arquivo pode ser lido de volta
-            with open(arquivo_saida, 'r', encoding='utf-8') as arquivo:
-                dados_verificacao = json.load(arquivo)
-            
-            logging.info(safe_log_message(f"✅ Arquivo salvo e verificado com sucesso!"))
-            logging.info(safe_log_message(f"📁 Tamanho: {tamanho_arquivo:,} bytes"))
-            logging.info(safe_log_message(f"📊 Estabelecimentos salvos: {len(dados_verificacao.get('estabelecimentos', []))}"))
-            logging.info(safe_log_message(f"❌ Erros salvos: {len(dados_verificacao.get('erros', []))}"))
-            
-        except Exception as e:
-            logging.error(safe_log_message(f"❌ Erro ao salvar arquivo: {e}"))
-            
-            # Tenta salvar um arquivo de emergência sem formatação
+async def executar_benchmark(arquivo_entrada: str, config: Dict[str, Any], amostra: int) -> Dict[str, Any]:
+    """
+    Mede a vazão dos modos de processamento com uma amostra de códigos, sem cache e sem
+    mesclagem; journal e saída ficam num diretório temporário
+    
+    Returns:
+        Dict[str, Any]: Vazão, tempo e contagens por modo
+    """
+    automatizador = criar_automatizador(config)
+    codigos = sorted(automatizador.carregar_codigos_cnes(arquivo_entrada))[:amostra]
+    relatorio = {'arquivo_entrada': arquivo_entrada, 'amostra': len(codigos), 'modos': {}}
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        for modo in CNESAPIAutomator.MODOS_PROCESSAMENTO:
+            automatizador = criar_automatizador({**config, 'modo': modo})
+            journal = CheckpointJournal(os.path.join(diretorio, f"journal_{modo}.jsonl"))
+            destino = criar_escritor_resultados(os.path.join(diretorio, f"resultados_{modo}.{config['formato_saida']}"))
             try:
-                arquivo_emergencia = arquivo_saida.replace('.json', '_emergencia.json')
-                with open(arquivo_emergencia, 'w', encoding='utf-8') as arquivo:
-                    json.dump(dados, arquivo, ensure_ascii=False, cls=DateTimeEncoder)
-                logging.info(safe_log_message(f"💾 Arquivo de emergência salvo: {arquivo_emergencia}"))
-            except Exception as e2:
-                logging.error(safe_log_message(f"❌ Falhou também no arquivo de emergência: {e2}"))
+                resultados = await automatizador.processar_lista_codigos(codigos, journal=journal, destino=destino)
+            except BaseException:
+                destino.abortar()
+                raise
+            finally:
+                journal.fechar()
             
-            raise
+            tempo = resultados['metadados']['tempo_execucao_segundos']
+            relatorio['modos'][modo] = {
+                'tempo_segundos': round(tempo, 3),
+                'requisicoes_por_segundo': round(len(codigos) / tempo, 2) if tempo > 0 else None,
+                'sucessos': resultados['resumo']['total_sucessos'],
+                'erros': resultados['resumo']['total_erros']
+            }
+    
+    return relatorio
 
-class CNESMacrorregiaeMerger:
+def _registro_exemplo_cnes(codigo_cnes: str) -> Dict[str, Any]:
     """
-    Classe para mesclar dados de macrorregião com dados das unidades de saúde
+    Registro com os campos e tipos de uma resposta da API de estabelecimentos, para benchmarks
     """
+    numero = int(codigo_cnes) if codigo_cnes.isdigit() else 0
+    return {
+        'codigo_cnes': numero,
+        'numero_cnpj_entidade': f"{numero:014d}",
+        'nome_razao_social': f"FUNDO MUNICIPAL DE SAÚDE {codigo_cnes}",
+        'nome_fantasia': f"UNIDADE BÁSICA DE SAÚDE SÃO JOÃO {codigo_cnes}",
+        'natureza_organizacao_entidade': None,
+        'tipo_gestao': 'M',
+        'codigo_nivel_hierarquia': None,
+        'codigo_esfera_administrativa': None,
+        'codigo_tipo_unidade': 2,
+        'codigo_atividade_ensino_unidade': '04',
+        'codigo_natureza_organizacao_unidade': None,
+        'codigo_tipo_estabelecimento': None,
+        'codigo_atividade': None,
+        'tipo_pessoa': 3,
+        'codigo_uf': 11,
+        'codigo_municipio': 110001 + numero % 52,
+        'endereco_estabelecimento': 'AVENIDA MARECHAL RONDON',
+        'numero_estabelecimento': str(numero % 9999),
+        'bairro_estabelecimento': 'CENTRO',
+        'codigo_cep_estabelecimento': '76900000',
+        'latitude_estabelecimento_decimo_grau': -11.4302 - numero % 1000 / 10000,
+        'longitude_estabelecimento_decimo_grau': -61.9429 + numero % 1000 / 10000,
+        'numero_telefone_estabelecimento': '(69)3441-1234',
+        'descricao_turno_atendimento': 'ATENDIMENTO NOS TURNOS DA MANHÃ E À TARDE',
+        'estabelecimento_faz_atendimento_ambulatorial_sus': 'SIM',
+        'estabelecimento_possui_centro_cirurgico': 0,
+        'estabelecimento_possui_servico_apoio': 1,
+        'estabelecimento_possui_atendimento_ambulatorial': 1,
+        'data_atualizacao': '2025-06-13',
+        '_metadata': {
+            'consultado_em': datetime(2025, 7, 7, 12, 25, 0, numero % 1000000),
+            'codigo_cnes_consultado': codigo_cnes,
+            'origem': 'api'
+        }
+    }
+
+class MockCNESServer:
+    """
+    Servidor HTTP local que imita a API de estabelecimentos (/cnes/estabelecimentos/{codigo})
+    para benchmarks sem depender da API pública.
     
-    def __init__(self, arquivo_macrorregiao: str):
-        """
-        Inicializa o merger com o arquivo de macrorregiões
+    As respostas são montadas uma vez na inicialização, a partir dos códigos de um arquivo
+    (ex.: cnes_estado_11.json) e dos municípios do arquivo de macrorregião, então o servidor
+    gasta pouco processamento por requisição. Códigos fora do arquivo respondem 404.
+    
+    - Latência: distribuição log-normal definida pela mediana (p50) e pelo p95
+    - taxa_404: fração dos códigos do arquivo que não existe (sempre os mesmos códigos)
+    - taxa_5xx: fração das requisições que responde 503 (transitório; a retentativa pode acertar)
+    - taxa_timeout: fração das requisições que só responde após atraso_timeout_s, acima do
+      timeout do cliente (15 s)
+    - tamanho_payload: bytes aproximados de cada resposta, completados com uma lista de
+      serviços (mínimo: o registro padrão, ~1,3 KB)
+    - Listagem (/cnes/estabelecimentos?codigo_uf=&codigo_municipio=&limit=&offset=): os mesmos
+      registros, na ordem do arquivo, sem os campos_fora_da_listagem
+    - comprimir: respostas comprimidas conforme o Accept-Encoding do cliente, como a API pública
+    """
+    
+    ROTA = '/cnes/estabelecimentos/{codigo}'
+    ROTA_LISTAGEM = '/cnes/estabelecimentos'
+    
+    def __init__(self, arquivo_codigos: str, arquivo_macrorregiao: str, latencia_p50_ms: float = 80.0,
+                 latencia_p95_ms: float = 250.0, taxa_404: float = 0.05, taxa_5xx: float = 0.02,
+                 taxa_timeout: float = 0.0, atraso_timeout_s: float = 20.0,
+                 tamanho_payload: Optional[int] = None, campos_fora_da_listagem: Tuple[str, ...] = (),
+                 comprimir: bool = True, semente: int = 42):
+        self.arquivo_codigos = arquivo_codigos
+        self.arquivo_macrorregiao = arquivo_macrorregiao
+        self.latencia_p50_ms = latencia_p50_ms
+        self.latencia_p95_ms = max(latencia_p95_ms, latencia_p50_ms)
+        self.taxa_404 = taxa_404
+        self.taxa_5xx = taxa_5xx
+        self.taxa_timeout = taxa_timeout
+        self.atraso_timeout_s = atraso_timeout_s
+        self.tamanho_payload = tamanho_payload
+        self.campos_fora_da_listagem = tuple(campos_fora_da_listagem)
+        self.comprimir = comprimir
         
-        Args:
-            arquivo_macrorregiao (str): Caminho para o arquivo JSON com dados de macrorregião
+        self._aleatorio = random.Random(semente)
+        # p95 de uma log-normal = mediana * e^(1,645 * sigma)
+        self._sigma = math.log(self.latencia_p95_ms / self.latencia_p50_ms) / 1.645 if self.latencia_p50_ms > 0 else 0.0
+        self._registros_listagem: List[Dict[str, Any]] = []
+        self._respostas = self._montar_respostas()
+        self._runner = None
+        self.contagens = {'requisicoes': 0, 'por_status': {}}
+    
+    def _montar_respostas(self) -> Dict[str, bytes]:
         """
-        self.arquivo_macrorregiao = arquivo_macrorregiao
-        self.dados_macrorregiao = {}
-        self.carregar_dados_macrorregiao()
+        Corpo JSON da resposta de cada código do arquivo (exceto os sorteados para 404); os
+        registros da listagem são guardados em _registros_listagem
+        """
+        codigos = CNESAPIAutomator().carregar_codigos_cnes(self.arquivo_codigos)
+        with open(self.arquivo_macrorregiao, 'r', encoding='utf-8') as arquivo:
+            dados = json.load(arquivo)
+        municipios = dados.get('macrorregiao_regiao_saude_municipios', []) if isinstance(dados, dict) else dados
         
-        # Configurar logging específico para merger
-        self.logger = logging.getLogger('CNESMacrorregiaeMerger')
-        handler = logging.FileHandler('cnes_macrorregiao_merger.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+        respostas = {}
+        for codigo in codigos:
+            codigo = normalizar_codigo_cnes(codigo)
+            sorteio = zlib.crc32(codigo.encode('utf-8'))
+            if sorteio % 10000 < self.taxa_404 * 10000:
+                continue
+            registro = _registro_exemplo_cnes(codigo)
+            del registro['_metadata']
+            if municipios:
+                municipio = municipios[sorteio % len(municipios)]
+                registro['codigo_municipio'] = int(municipio['codigo_municipio'])
+                registro['codigo_uf'] = int(municipio['codigo_uf'])
+            corpo = json.dumps(registro, ensure_ascii=False).encode('utf-8')
+            if self.tamanho_payload and len(corpo) < self.tamanho_payload:
+                servico = {'codigo_servico': 159, 'descricao_servico': 'ATENCAO PSICOSSOCIAL', 'codigo_classificacao': '001'}
+                tamanho_servico = len(json.dumps(servico, ensure_ascii=False)) + 2
+                registro['servicos_especializados'] = [servico] * max(1, (self.tamanho_payload - len(corpo)) // tamanho_servico)
+                corpo = json.dumps(registro, ensure_ascii=False).encode('utf-8')
+            respostas[codigo] = corpo
+            self._registros_listagem.append(
+                {campo: valor for campo, valor in registro.items() if campo not in self.campos_fora_da_listagem}
+            )
+        return respostas
     
-    def carregar_dados_macrorregiao(self):
+    def _listar(self, parametros) -> bytes:
         """
-        Carrega os dados de macrorregião do arquivo JSON e cria índice por código de município
+        Corpo da listagem: registros que atendem aos filtros, paginados por limit/offset
         """
-        try:
-            logging.info(safe_log_message(f"📂 Carregando dados de macrorregião de: {self.arquivo_macrorregiao}"))
-            
-            with open(self.arquivo_macrorregiao, 'r', encoding='utf-8') as arquivo:
-                dados = json.load(arquivo)
-            
-            # Verifica se a estrutura contém o campo esperado
-            if 'macrorregiao_regiao_saude_municipios' in dados:
-                lista_municipios = dados['macrorregiao_regiao_saude_municipios']
-            elif isinstance(dados, list):
-                lista_municipios = dados
-            else:
-                raise ValueError("Estrutura do arquivo de macrorregião não reconhecida")
-            
-            # Cria índice por código de município para busca rápida
-            for item in lista_municipios:
-                codigo_municipio = str(item.get('codigo_municipio', ''))
-                if codigo_municipio:
-                    self.dados_macrorregiao[codigo_municipio] = {
-                        'codigo_regiao_pais': item.get('codigo_regiao_pais'),
-                        'regiao_pais': item.get('regiao_pais'),
-                        'codigo_uf': item.get('codigo_uf'),
-                        'uf': item.get('uf'),
-                        'codigo_macrorregiao_saude': item.get('codigo_macrorregiao_saude'),
-                        'macrorregiao_saude': item.get('macrorregiao_saude'),
-                        'codigo_regiao_saude': item.get('codigo_regiao_saude'),
-                        'regiao_saude': item.get('regiao_saude'),
-                        'municipio': item.get('municipio'),
-                        'populacao_estimada_ibge_2022': item.get('populacao_estimada_ibge_2022')
-                    }
-            
-            logging.info(safe_log_message(f"✅ Carregados dados de {len(self.dados_macrorregiao)} municípios"))
-            
-        except Exception as e:
-            logging.error(safe_log_message(f"❌ Erro ao carregar dados de macrorregião: {e}"))
-            raise
+        filtros = {campo: int(parametros[campo]) for campo in ('codigo_uf', 'codigo_municipio') if campo in parametros}
+        limite = int(parametros.get('limit', 20))
+        offset = int(parametros.get('offset', 0))
+        pagina = []
+        for registro in self._registros_listagem:
+            if all(registro.get(campo) == valor for campo, valor in filtros.items()):
+                if offset:
+                    offset -= 1
+                    continue
+                pagina.append(registro)
+                if len(pagina) >= limite:
+                    break
+        return json.dumps({'estabelecimentos': pagina}, ensure_ascii=False).encode('utf-8')
+    
+    async def _responder(self, request) -> Any:
+        from aiohttp import web
+        
+        self.contagens['requisicoes'] += 1
+        sorteio = self._aleatorio.random()
+        if sorteio < self.taxa_timeout:
+            await asyncio.sleep(self.atraso_timeout_s)
+        elif self._sigma > 0:
+            await asyncio.sleep(self.latencia_p50_ms / 1000 * math.exp(self._sigma * self._aleatorio.gauss(0, 1)))
+        else:
+            await asyncio.sleep(self.latencia_p50_ms / 1000)
+        
+        if 'codigo' in request.match_info:
+            corpo = self._respostas.get(normalizar_codigo_cnes(request.match_info['codigo']))
+        else:
+            corpo = self._listar(request.query)
+        if self.taxa_timeout <= sorteio < self.taxa_timeout + self.taxa_5xx:
+            resposta = web.json_response({'detail': 'Service Unavailable'}, status=503)
+        elif corpo is None:
+            resposta = web.json_response({'detail': 'Not Found'}, status=404)
+        else:
+            resposta = web.Response(body=corpo, content_type='application/json')
+            if self.comprimir:
+                resposta.enable_compression()
+        
+        por_status = self.contagens['por_status']
+        por_status[str(resposta.status)] = por_status.get(str(resposta.status), 0) + 1
+        return resposta
     
-    def mesclar_dados_unidade(self, unidade_saude: Dict[str, Any]) -> Dict[str, Any]:
+    async def iniciar(self, host: str = '127.0.0.1', porta: int = 0) -> str:
         """
-        Mescla os dados de uma unidade de saúde com os dados de macrorregião
+        Inicia o servidor no loop atual
         
-        Args:
-            unidade_saude (Dict[str, Any]): Dados da unidade de saúde obtidos da API
-            
         Returns:
-            Dict[str, Any]: Unidade de saúde com dados de macrorregião mesclados
+            str: URL base para CNESAPIAutomator.base_url (porta 0 = porta livre escolhida pelo sistema)
         """
-        # Cria uma cópia da unidade para não modificar o original
-        unidade_mesclada = unidade_saude.copy()
+        from aiohttp import web
         
-        # Remove o campo _metadata se existir (não incluir no resultado final)
-        if '_metadata' in unidade_mesclada:
-            del unidade_mesclada['_metadata']
+        app = web.Application()
+        app.router.add_get(self.ROTA, self._responder)
+        app.router.add_get(self.ROTA_LISTAGEM, self._responder)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, porta)
+        await site.start()
+        host, porta = self._runner.addresses[0][:2]
+        return f"http://{host}:{porta}{self.ROTA.rsplit('/', 1)[0]}"
+    
+    async def parar(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'arquivo_codigos': self.arquivo_codigos,
+            'codigos_existentes': len(self._respostas),
+            'latencia_p50_ms': self.latencia_p50_ms,
+            'latencia_p95_ms': self.latencia_p95_ms,
+            'taxa_404': self.taxa_404,
+            'taxa_5xx': self.taxa_5xx,
+            'taxa_timeout': self.taxa_timeout,
+            'tamanho_medio_resposta_bytes': (round(sum(map(len, self._respostas.values())) / len(self._respostas))
+                                             if self._respostas else 0),
+            **self.contagens
+        }
+
+def _servir_mock_em_processo(opcoes: Dict[str, Any], conexao):
+    """
+    Roda o MockCNESServer num processo separado, para que o servidor não dispute o loop e a
+    CPU do processo medido: envia a URL base, espera o pedido de parada e devolve o resumo
+    """
+    async def servir():
+        servidor = MockCNESServer(**opcoes)
+        conexao.send(await servidor.iniciar())
+        await asyncio.get_running_loop().run_in_executor(None, conexao.recv)
+        conexao.send(servidor.resumo())
+        await servidor.parar()
+    
+    asyncio.run(servir())
+
+def percentil(valores_ordenados: List[float], fracao: float) -> Optional[float]:
+    """
+    Percentil (fracao entre 0 e 1) de uma lista já ordenada, com interpolação linear
+    (None se a lista estiver vazia)
+    """
+    if not valores_ordenados:
+        return None
+    posicao = (len(valores_ordenados) - 1) * fracao
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(valores_ordenados) - 1)
+    return valores_ordenados[inferior] + (valores_ordenados[superior] - valores_ordenados[inferior]) * (posicao - inferior)
+
+def pico_memoria_mb() -> Optional[float]:
+    """
+    Pico de memória residente (RSS) do processo em MB (None onde o módulo resource não existe, ex.: Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em bytes no macOS e em KB no Linux
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class _ChamadasCronometradas:
+    """
+    Repassa atributos e chamadas a outro objeto, acumulando o tempo gasto nos métodos indicados
+    (usado pelo benchmark para separar o tempo de mesclagem e de gravação)
+    """
+    
+    __slots__ = ('_alvo', '_metodos', 'segundos')
+    
+    def __init__(self, alvo: Any, metodos: Tuple[str, ...]):
+        self._alvo = alvo
+        self._metodos = metodos
+        self.segundos = 0.0
+    
+    def __getattr__(self, nome: str) -> Any:
+        atributo = getattr(self._alvo, nome)
+        if nome not in self._metodos:
+            return atributo
         
-        # Extrai o código do município da unidade de saúde
-        codigo_municipio = str(unidade_saude.get('codigo_municipio', ''))
+        def cronometrado(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return atributo(*args, **kwargs)
+            finally:
+                self.segundos += time.perf_counter() - inicio
+        return cronometrado
+
+async def executar_benchmark_mock(arquivo_codigos: str, config: Dict[str, Any], opcoes_mock: Dict[str, Any],
+                                  amostra: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Roda o pipeline completo (consulta → mesclagem → gravação, como o subcomando run) contra
+    o MockCNESServer, sem cache, com journal e saída num diretório temporário
+    
+    Args:
+        arquivo_codigos (str): Arquivo de códigos servidos pelo mock e consultados
+        config (Dict[str, Any]): Configuração resolvida (concorrência, modo, formato de saída...)
+        opcoes_mock (Dict[str, Any]): Parâmetros do MockCNESServer (latência, taxas de erro, payload)
+        amostra (int): Número de códigos consultados (padrão: todos)
         
-        if codigo_municipio and codigo_municipio in self.dados_macrorregiao:
-            # Obtém os dados de macrorregião
-            dados_macro_originais = self.dados_macrorregiao[codigo_municipio]
-            
-            # Cria uma cópia dos dados de macrorregião para evitar duplicações
-            dados_macro_limpos = dados_macro_originais.copy()
-            
-            # Remove campos duplicados que já existem no estabelecimento
-            # O codigo_uf já está presente no estabelecimento, não precisa duplicar
-            if 'codigo_uf' in dados_macro_limpos:
-                del dados_macro_limpos['codigo_uf']
-            
-            # Adiciona o codigo_municipio como chave primária dentro dos dados de macrorregião
-            # Mantém o mesmo tipo de dados (int) do estabelecimento principal
-            dados_macro_limpos['codigo_municipio'] = int(codigo_municipio)
-            
-            # Adiciona os dados de macrorregião limpos em uma seção específica
-            unidade_mesclada['dados_macrorregiao'] = dados_macro_limpos
+    Returns:
+        Dict[str, Any]: req/s, percentis de latência, pico de RSS, tempo por fase e contagens
+    """
+    import multiprocessing
+    
+    if not config['macrorregiao'] or not os.path.exists(config['macrorregiao']):
+        raise ValueError(f"Arquivo de macrorregião não encontrado: {config['macrorregiao']}")
+    
+    fases = {}
+    inicio = time.perf_counter()
+    # spawn: o processo do servidor não herda o loop nem as threads de log deste processo
+    contexto = multiprocessing.get_context('spawn')
+    conexao, conexao_servidor = contexto.Pipe()
+    servidor = contexto.Process(
+        target=_servir_mock_em_processo,
+        args=({**opcoes_mock, 'arquivo_codigos': arquivo_codigos, 'arquivo_macrorregiao': config['macrorregiao']},
+              conexao_servidor),
+        daemon=True
+    )
+    servidor.start()
+    try:
+        url_mock = await asyncio.get_running_loop().run_in_executor(None, conexao.recv)
+        fases['inicio_servidor_mock'] = time.perf_counter() - inicio
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            inicio = time.perf_counter()
+            automatizador = criar_automatizador({**config, 'url_api': url_mock})
+            automatizador.latencias_tentativas = []
+            codigos = automatizador.carregar_codigos_cnes(arquivo_codigos)[:amostra]
+            fases['carregar_codigos'] = time.perf_counter() - inicio
             
-            self.logger.info(safe_log_message(f"✅ Mesclagem bem-sucedida para código município: {codigo_municipio}"))
+            inicio = time.perf_counter()
+            merger = _ChamadasCronometradas(CNESMacrorregiaeMerger(config['macrorregiao']), ('mesclar_e_contabilizar',))
+            fases['carregar_macrorregiao'] = time.perf_counter() - inicio
             
-        else:
-            # Caso não encontre o código do município
-            unidade_mesclada['dados_macrorregiao'] = None
+            automatizador.merger = merger
+            formato = config['formato_saida']
+            destino = _ChamadasCronometradas(
+                CNESMacrorregiaeMerger.criar_destino(os.path.join(diretorio, f"bench.{formato}"), formato=formato),
+                ('escrever_estabelecimento', 'escrever_erro', 'finalizar')
+            )
+            journal = CheckpointJournal(os.path.join(diretorio, 'journal.jsonl'))
+            inicio = time.perf_counter()
+            try:
+                resultados = await automatizador.processar_lista_codigos(codigos, journal=journal, destino=destino)
+            except BaseException:
+                destino.abortar()
+                raise
+            finally:
+                journal.fechar()
+            tempo_pipeline = time.perf_counter() - inicio
             
-            self.logger.warning(safe_log_message(f"⚠️ Código município não encontrado: {codigo_municipio}"))
+            # A mesclagem e a gravação acontecem durante a consulta, no mesmo loop: o tempo de
+            # consulta é o restante do pipeline
+            fases['mesclagem'] = merger.segundos
+            fases['gravacao'] = destino.segundos
+            fases['consulta'] = tempo_pipeline - merger.segundos - destino.segundos
+            fases['pipeline_total'] = tempo_pipeline
         
-        return unidade_mesclada
+        conexao.send('parar')
+        resumo_servidor = await asyncio.get_running_loop().run_in_executor(None, conexao.recv)
+    finally:
+        servidor.join(timeout=5)
+        if servidor.is_alive():
+            servidor.terminate()
     
-    def mesclar_arquivo_resultados(self, arquivo_entrada: str, arquivo_saida: str):
-        """
-        Mescla um arquivo completo de resultados da API CNES com dados de macrorregião
+    estatisticas = resultados['metadados']['estatisticas']
+    latencias = sorted(latencia * 1000 for latencia in automatizador.latencias_tentativas)
+    return {
+        'data': datetime.now().isoformat(),
+        'arquivo_codigos': arquivo_codigos,
+        'codigos': len(codigos),
+        'configuracao': {
+            'modo': config['modo'],
+            'concorrencia': config['concorrencia'],
+            'concorrencia_adaptativa': config['concorrencia_adaptativa'],
+            'requisicoes_por_segundo': config['requisicoes_por_segundo'],
+            'max_tentativas': config['max_tentativas'],
+            'formato_saida': formato,
+            'campos': config['campos'],
+            'backend_json': CODEC_JSON.backend
+        },
+        'servidor_mock': resumo_servidor,
+        'requisicoes_por_segundo': round(estatisticas['tentativas'] / tempo_pipeline, 2) if tempo_pipeline > 0 else None,
+        'codigos_por_segundo': round(len(codigos) / tempo_pipeline, 2) if tempo_pipeline > 0 else None,
+        'latencia_ms': {
+            'p50': round(percentil(latencias, 0.50), 1) if latencias else None,
+            'p95': round(percentil(latencias, 0.95), 1) if latencias else None,
+            'p99': round(percentil(latencias, 0.99), 1) if latencias else None,
+            'media': estatisticas['latencia_media_tentativa_ms'],
+            'maxima': estatisticas['latencia_maxima_tentativa_ms']
+        },
+        'pico_rss_mb': pico_memoria_mb(),
+        'fases_segundos': {fase: round(segundos, 3) for fase, segundos in fases.items()},
+        'metricas': resultados['metadados']['metricas'],
+        'contagens': {
+            'sucessos': resultados['resumo']['total_sucessos'],
+            'erros': resultados['resumo']['total_erros'],
+            'tentativas': estatisticas['tentativas'],
+            'retentativas': estatisticas['retentativas'],
+            'retentativas_esgotadas': estatisticas['retentativas_esgotadas']
+        }
+    }
+
+def comparar_benchmarks(atual: Dict[str, Any], anterior: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compara dois relatórios de executar_benchmark_mock: razão atual/anterior das métricas principais
+    """
+    metricas = {
+        'requisicoes_por_segundo': lambda relatorio: relatorio.get('requisicoes_por_segundo'),
+        'latencia_p50_ms': lambda relatorio: relatorio.get('latencia_ms', {}).get('p50'),
+        'latencia_p95_ms': lambda relatorio: relatorio.get('latencia_ms', {}).get('p95'),
+        'latencia_p99_ms': lambda relatorio: relatorio.get('latencia_ms', {}).get('p99'),
+        'pico_rss_mb': lambda relatorio: relatorio.get('pico_rss_mb'),
+        'pipeline_total_segundos': lambda relatorio: relatorio.get('fases_segundos', {}).get('pipeline_total')
+    }
+    comparacao = {'arquivo_anterior_data': anterior.get('data')}
+    for nome, extrair in metricas.items():
+        valor_atual, valor_anterior = extrair(atual), extrair(anterior)
+        comparacao[nome] = {
+            'anterior': valor_anterior,
+            'atual': valor_atual,
+            'razao': f"{valor_atual / valor_anterior:.2f}x" if valor_atual is not None and valor_anterior else "N/A"
+        }
+    return comparacao
+
+def benchmark_codecs_json(arquivo_entrada: str, repeticoes: int = 5) -> Dict[str, Any]:
+    """
+    Compara os backends JSON instalados nos caminhos quentes do script, usando o arquivo de
+    códigos e um registro no formato da API por código:
+    - leitura do arquivo de códigos
+    - decodificação das respostas (um JSON compacto por registro: API, cache, journal)
+    - codificação compacta (journal/JSONL) e indentada (arquivo de saída JSON)
+    
+    Returns:
+        Dict[str, Any]: Melhor tempo (ms) de cada etapa por backend, ganho em relação ao json
+            e se a saída indentada é idêntica byte a byte à do json
+    """
+    with open(arquivo_entrada, 'rb') as arquivo:
+        conteudo_arquivo = arquivo.read()
+    codigos = sorted(CNESAPIAutomator().carregar_codigos_cnes(arquivo_entrada))
+    registros = [_registro_exemplo_cnes(codigo) for codigo in codigos]
+    
+    referencia = JSONCodec('json')
+    saida_referencia = [referencia.dumps(registro, indent=True) for registro in registros]
+    respostas = [referencia.dumps(registro) for registro in registros]
+    
+    def medir(funcao) -> float:
+        melhor = float('inf')
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao()
+            melhor = min(melhor, time.perf_counter() - inicio)
+        return round(melhor * 1000, 2)
+    
+    relatorio = {'arquivo': arquivo_entrada, 'registros': len(registros), 'repeticoes': repeticoes, 'backends': {}}
+    for nome in JSONCodec.BACKENDS:
+        if not JSONCodec.disponivel(nome):
+            continue
+        codec = JSONCodec(nome)
+        relatorio['backends'][nome] = {
+            'leitura_arquivo_codigos_ms': medir(lambda: codec.loads(conteudo_arquivo)),
+            'decodificacao_respostas_ms': medir(lambda: [codec.loads(resposta) for resposta in respostas]),
+            'codificacao_compacta_ms': medir(lambda: [codec.dumps(registro) for registro in registros]),
+            'codificacao_indentada_ms': medir(lambda: [codec.dumps(registro, indent=True) for registro in registros]),
+            'saida_indentada_identica_ao_json': all(
+                codec.dumps(registro, indent=True) == esperado
+                for registro, esperado in zip(registros, saida_referencia)
+            )
+        }
+    
+    base = relatorio['backends']['json']
+    for resultado in relatorio['backends'].values():
+        resultado['ganho_vs_json'] = {
+            etapa: f"{base[etapa] / resultado[etapa]:.1f}x" if resultado[etapa] > 0 else "N/A"
+            for etapa in ('leitura_arquivo_codigos_ms', 'decodificacao_respostas_ms',
+                          'codificacao_compacta_ms', 'codificacao_indentada_ms')
+        }
+    
+    return relatorio
+
+def criar_parser() -> argparse.ArgumentParser:
+    """
+    Cria o parser da linha de comando. Sem subcomando, o script roda no modo interativo
+    """
+    parser = argparse.ArgumentParser(
+        description="Automatizador da API CNES - versão assíncrona otimizada",
+        epilog="Sem subcomando, o script pergunta as opções interativamente."
+    )
+    parser.add_argument('--resume', metavar='JOURNAL',
+                        help="Retoma uma execução interrompida a partir do journal de checkpoint (.jsonl)")
+    
+    # Opções comuns aos subcomandos; None = usar o arquivo de configuração ou o padrão
+    comuns = argparse.ArgumentParser(add_help=False)
+    comuns.add_argument('--config', metavar='ARQUIVO', help="Arquivo de configuração TOML ou JSON")
+    comuns.add_argument('-y', '--yes', action='store_true', help="Não pede confirmação (execuções agendadas)")
+    comuns.add_argument('-c', '--concorrencia', type=int, help="Requisições simultâneas (padrão: 15)")
+    comuns.add_argument('--modo', choices=CNESAPIAutomator.MODOS_PROCESSAMENTO, help="Modo de processamento (padrão: pool)")
+    comuns.add_argument('--delay-entre-lotes', type=float, help="Delay entre lotes no modo lotes (padrão: 0.3)")
+    comuns.add_argument('--rps', dest='requisicoes_por_segundo', type=float, help="Limite de requisições por segundo")
+    comuns.add_argument('--delta', action='store_const', const=True,
+                        help="Grava apenas os estabelecimentos novos/alterados desde a última execução, com manifesto")
+    comuns.add_argument('--snapshot-arquivo', help="Arquivo SQLite do snapshot do modo delta (padrão: cnes_snapshot.sqlite3)")
+    comuns.add_argument('--concorrencia-adaptativa', action='store_const', const=True,
+                        help="Ajusta a concorrência automaticamente (AIMD)")
+    comuns.add_argument('--max-tentativas', type=int, help="Tentativas por código em falhas transitórias (padrão: 3)")
+    comuns.add_argument('--cache-arquivo', help="Arquivo SQLite do cache de respostas (padrão: cnes_cache.sqlite3)")
+    comuns.add_argument('--cache-validade-horas', type=float, help="Validade do cache em horas; 0 desativa (padrão: 168)")
+    comuns.add_argument('--formato-saida', choices=FORMATOS_SAIDA,
+                        help="Formato dos arquivos de saída; parquet/arrow exigem o pyarrow, senão CSV (padrão: json)")
+    comuns.add_argument('--diretorio-saida', help="Diretório dos arquivos de saída e journals (padrão: .)")
+    comuns.add_argument('--arquivo-sqlite', help="Banco do formato sqlite, atualizado a cada execução "
+                                                   "(padrão: <diretorio-saida>/cnes_estabelecimentos.sqlite3)")
+    comuns.add_argument('--macrorregiao', help="Arquivo de macrorregião (padrão: procura nos caminhos usuais)")
+    comuns.add_argument('--url-api', help="URL base da API de estabelecimentos (padrão: API pública do CNES)")
+    comuns.add_argument('--campos', type=lambda valor: [campo.strip() for campo in valor.split(',') if campo.strip()],
+                        help="Campos da API mantidos em cada estabelecimento, separados por vírgula (padrão: todos)")
+    comuns.add_argument('--metricas-porta', type=int,
+                        help="Serve as métricas no formato do Prometheus em http://127.0.0.1:PORTA/metrics durante a consulta")
+    comuns.add_argument('--pre-aquecer', dest='conexoes_pre_aquecidas', type=int, metavar='N',
+                        help="Conexões keep-alive abertas antes da primeira requisição; 0 desativa (padrão: a concorrência)")
+    comuns.add_argument('--keepalive-segundos', type=float,
+                        help="Tempo que uma conexão ociosa fica aberta para reúso (padrão: 60)")
+    comuns.add_argument('--sem-compressao', dest='compressao', action='store_const', const=False,
+                        help="Não pede respostas comprimidas (gzip/deflate/br) à API")
+    comuns.add_argument('--timeout-minimo', type=float,
+                        help="Menor timeout por requisição em segundos (padrão: 2)")
+    comuns.add_argument('--timeout-maximo', type=float,
+                        help="Maior timeout por requisição em segundos (padrão: 15)")
+    comuns.add_argument('--sem-timeout-adaptativo', dest='timeout_adaptativo', action='store_const', const=False,
+                        help="Usa sempre o timeout máximo, em vez do calculado pelas latências observadas")
+    comuns.add_argument('--prazo-segundos', type=float,
+                        help="Prazo da execução; esgotado, os códigos restantes são informados como não concluídos")
+    comuns.add_argument('--sem-disjuntor', dest='disjuntor', action='store_const', const=False,
+                        help="Não pausa o despacho quando a API passa a falhar")
+    comuns.add_argument('--disjuntor-taxa-erro', type=float,
+                        help="Fração de falhas (429/5xx, timeouts) nas respostas recentes que abre o disjuntor (padrão: 0.5)")
+    comuns.add_argument('--disjuntor-pausa', dest='disjuntor_pausa_segundos', type=float,
+                        help="Segundos com o disjuntor aberto antes da requisição de sonda (padrão: 5)")
+    comuns.add_argument('--disjuntor-tempo-maximo', type=float,
+                        help="Segundos aberto sem resposta da API após os quais a execução é encerrada e os "
+                             "códigos restantes ficam para o resume (padrão: 300)")
+    comuns.add_argument('--hedge', action='store_const', const=True,
+                        help="Dispara uma cópia das requisições que passam do p95 de latência e usa a primeira resposta")
+    comuns.add_argument('--hedge-percentil', type=float,
+                        help="Percentil da latência após o qual a cópia é disparada (padrão: 0.95)")
+    comuns.add_argument('--hedge-orcamento', type=float,
+                        help="Fração máxima de requisições extras disparadas pelo hedge (padrão: 0.05)")
+    comuns.add_argument('--backend-json', choices=JSONCodec.BACKENDS,
+                        help="Biblioteca JSON (padrão: orjson ou msgspec se instalados, senão json)")
+    
+    # Divisão dos códigos em shards (fetch e run)
+    shards = argparse.ArgumentParser(add_help=False)
+    grupo_shards = shards.add_mutually_exclusive_group()
+    grupo_shards.add_argument('--shard', type=interpretar_shard, metavar='I/N',
+                              help="Processa apenas o shard I de N dos códigos (divisão estável por hash do código, "
+                                   "a mesma em qualquer máquina); junte as saídas com o subcomando combine")
+    grupo_shards.add_argument('--processos', type=int, metavar='N',
+                              help="Divide os códigos em N shards processados em paralelo por processos locais "
+                                   "e junta as saídas no formato configurado")
+    
+    # Listagem paginada por UF/município (fetch e run)
+    listagem = argparse.ArgumentParser(add_help=False)
+    grupo_listagem = listagem.add_argument_group('listagem paginada (em vez de uma requisição por código)')
+    grupo_listagem.add_argument('--uf', type=int, action='append', metavar='CODIGO_UF',
+                                help="Lista todos os estabelecimentos da UF (código IBGE, ex.: 11); pode repetir")
+    grupo_listagem.add_argument('--municipio', type=int, action='append', metavar='CODIGO_MUNICIPIO',
+                                help="Lista todos os estabelecimentos do município (código IBGE de 6 dígitos); pode repetir")
+    grupo_listagem.add_argument('--limite-pagina', type=int, help="Registros por página da listagem (padrão: 20)")
+    grupo_listagem.add_argument('--campos-detalhe',
+                                type=lambda valor: [campo.strip() for campo in valor.split(',') if campo.strip()],
+                                help="Campos que, se ausentes na listagem, são buscados na consulta individual do código "
+                                     "(padrão: os de --campos)")
+    grupo_listagem.add_argument('--sem-complemento', dest='complementar_listagem', action='store_const', const=False,
+                                help="Grava só os dados da listagem, sem consultas individuais")
+    
+    subparsers = parser.add_subparsers(dest='comando', metavar='COMANDO')
+    
+    fetch = subparsers.add_parser('fetch', parents=[comuns, shards, listagem], help="Consulta a API e grava os resultados sem mesclagem")
+    fetch.add_argument('entradas', nargs='*', metavar='ENTRADA', help="Arquivos JSON com códigos CNES")
+    
+    run = subparsers.add_parser('run', parents=[comuns, shards, listagem], help="Consulta a API e mescla com macrorregião durante a consulta")
+    run.add_argument('entradas', nargs='*', metavar='ENTRADA', help="Arquivos JSON com códigos CNES")
+    
+    merge = subparsers.add_parser('merge', parents=[comuns], help="Mescla arquivos de resultados já gravados com macrorregião")
+    merge.add_argument('entradas', nargs='+', metavar='RESULTADOS', help="Arquivos de resultados (JSON/JSONL)")
+    
+    combine = subparsers.add_parser('combine', parents=[comuns], help="Junta as saídas dos shards de uma lista (--shard) num arquivo")
+    combine.add_argument('entradas', nargs='+', metavar='RESULTADOS', help="Saídas dos shards (JSON/JSONL), todas de fetch ou todas de run")
+    combine.add_argument('--nome', help="Nome da lista na saída e no escopo do delta (padrão: deduzido das saídas dos shards)")
+    
+    resume = subparsers.add_parser('resume', parents=[comuns], help="Retoma execuções interrompidas a partir dos journals")
+    resume.add_argument('journals', nargs='+', metavar='JOURNAL', help="Journals de checkpoint (.jsonl)")
+    
+    bench = subparsers.add_parser('bench', parents=[comuns], help="Compara a vazão dos modos pool e lotes com uma amostra (consulta a API)")
+    bench.add_argument('entrada', nargs='?', metavar='ENTRADA',
+                       help="Arquivo JSON com códigos CNES (com --mock, padrão: cnes_estado_11.json)")
+    bench.add_argument('--amostra', type=int, help="Número de códigos da amostra (padrão: 200; com --mock, todos)")
+    bench.add_argument('--codecs-json', action='store_true',
+                       help="Compara os backends JSON instalados com os códigos do arquivo (não consulta a API)")
+    mock = bench.add_argument_group('servidor local (--mock)')
+    mock.add_argument('--mock', action='store_true',
+                      help="Roda o pipeline completo (consulta, mesclagem, gravação) contra um servidor local que imita a API")
+    mock.add_argument('--latencia-p50-ms', type=float, default=80.0, help="Latência mediana do servidor (padrão: 80)")
+    mock.add_argument('--latencia-p95-ms', type=float, default=250.0, help="Latência p95 do servidor (padrão: 250)")
+    mock.add_argument('--taxa-404', type=float, default=0.05, help="Fração dos códigos inexistentes (padrão: 0.05)")
+    mock.add_argument('--taxa-5xx', type=float, default=0.02, help="Fração das requisições com 503 (padrão: 0.02)")
+    mock.add_argument('--taxa-timeout', type=float, default=0.0,
+                      help="Fração das requisições que excedem o timeout do cliente (padrão: 0)")
+    mock.add_argument('--tamanho-payload', type=int, help="Bytes aproximados de cada resposta (padrão: registro padrão, ~1,3 KB)")
+    mock.add_argument('--saida-bench', metavar='ARQUIVO',
+                      help="Relatório JSON (padrão: <diretorio-saida>/cnes_bench_AAAAMMDD_HHMMSS.json)")
+    mock.add_argument('--comparar', metavar='RELATORIO', help="Relatório JSON de uma execução anterior para comparar")
+    
+    return parser
+
+def executar_subcomando(args: argparse.Namespace) -> bool:
+    """
+    Executa um subcomando da linha de comando sem perguntas interativas (exceto a
+    confirmação, dispensada com --yes)
+    
+    Returns:
+        bool: True em caso de sucesso
+    """
+    config = resolver_configuracao(args)
+    if config['backend_json']:
+        definir_backend_json(config['backend_json'])
+    
+    if args.comando == 'merge':
+        return executar_mesclagens(args.entradas, config)
+    
+    if args.comando == 'combine':
+        return executar_combinacao(args.entradas, config, nome_base=args.nome)
+    
+    if args.comando in ('fetch', 'run'):
+        listagens = ([{'codigo_uf': uf} for uf in args.uf or []]
+                     + [{'codigo_municipio': municipio} for municipio in args.municipio or []])
+        if not args.entradas and not listagens:
+            print("❌ Informe arquivos de códigos ou --uf/--municipio")
+            return False
+        if listagens and (args.shard or args.processos):
+            print("❌ --shard/--processos dividem arquivos de códigos; não se aplicam a --uf/--municipio")
+            return False
+    
+    if getattr(args, 'processos', None) and args.processos > 1:
+        return executar_shards_locais(args.comando, args.entradas, config, args.processos, assumir_sim=args.yes)
+    
+    if args.comando == 'bench':
+        if args.mock:
+            # Sem arquivos informados, usa os dados de Rondônia que acompanham o script
+            diretorio_script = os.path.dirname(os.path.abspath(__file__))
+            entrada = args.entrada or os.path.join(diretorio_script, 'cnes_estado_11.json')
+            config['macrorregiao'] = config['macrorregiao'] or os.path.join(diretorio_script, 'macrorregiao_regiao_saude_municipios.json')
+        elif not args.entrada:
+            print("❌ Informe o arquivo de códigos (ou use --mock)")
+            return False
+        else:
+            entrada = args.entrada
         
-        Args:
-            arquivo_entrada (str): Caminho para o arquivo JSON com resultados da API CNES
-            arquivo_saida (str): Caminho para salvar o arquivo mesclado
-        """
-        try:
-            logging.info(safe_log_message(f"🔄 Iniciando mesclagem de arquivo: {arquivo_entrada}"))
-            
-            # Carrega os dados do arquivo de entrada
-            with open(arquivo_entrada, 'r', encoding='utf-8') as arquivo:
-                dados_entrada = json.load(arquivo)
-            
-            # Verifica se é um arquivo de resultados do automatizador
-            if 'estabelecimentos' in dados_entrada:
-                estabelecimentos = dados_entrada['estabelecimentos']
-            elif isinstance(dados_entrada, list):
-                estabelecimentos = dados_entrada
-            else:
-                raise ValueError("Estrutura do arquivo de entrada não reconhecida")
-            
-            # Estatísticas da mesclagem
-            stats_mesclagem = {
-                'total_unidades': len(estabelecimentos),
-                'mesclagens_bem_sucedidas': 0,
-                'mesclagens_falharam': 0,
-                'codigos_municipio_nao_encontrados': []
-            }
-            
-            # Inicializa tracker de progresso para mesclagem
-            progress_tracker = ProgressTracker(len(estabelecimentos), "🗺️ Mesclando macrorregião")
-            
-            # Processa cada estabelecimento
-            estabelecimentos_mesclados = []
-            for i, estabelecimento in enumerate(estabelecimentos, 1):
-                # Mescla os dados
-                estabelecimento_mesclado = self.mesclar_dados_unidade(estabelecimento)
-                
-                # Atualiza estatísticas
-                if estabelecimento_mesclado.get('dados_macrorregiao') is not None:
-                    stats_mesclagem['mesclagens_bem_sucedidas'] += 1
-                else:
-                    stats_mesclagem['mesclagens_falharam'] += 1
-                    codigo_municipio = str(estabelecimento.get('codigo_municipio', ''))
-                    if codigo_municipio:
-                        stats_mesclagem['codigos_municipio_nao_encontrados'].append(codigo_municipio)
-                
-                estabelecimentos_mesclados.append(estabelecimento_mesclado)
-                
-                # Atualiza progresso a cada 50 estabelecimentos
-                if i % 50 == 0 or i == len(estabelecimentos):
-                    progress_tracker.update(i)
-            
-            # Finaliza progresso
-            progress_tracker.finish()
-            
-            # Prepara dados de saída
-            dados_saida = {
-                'metadados_mesclagem': {
-                    'data_mesclagem': datetime.now().isoformat(),
-                    'arquivo_entrada': arquivo_entrada,
-                    'arquivo_macrorregiao': self.arquivo_macrorregiao,
-                    'versao_merger': '1.0_with_progress',
-                    'estatisticas': stats_mesclagem
-                },
-                'estabelecimentos_com_macrorregiao': estabelecimentos_mesclados
+        arquivo_relatorio = None
+        if args.codecs_json:
+            relatorio = benchmark_codecs_json(entrada)
+        elif args.mock:
+            opcoes_mock = {
+                'latencia_p50_ms': args.latencia_p50_ms,
+                'latencia_p95_ms': args.latencia_p95_ms,
+                'taxa_404': args.taxa_404,
+                'taxa_5xx': args.taxa_5xx,
+                'taxa_timeout': args.taxa_timeout,
+                'tamanho_payload': args.tamanho_payload
             }
+            relatorio = asyncio.run(executar_benchmark_mock(entrada, config, opcoes_mock, args.amostra))
+            if args.comparar:
+                with open(args.comparar, 'r', encoding='utf-8') as arquivo:
+                    relatorio['comparacao'] = comparar_benchmarks(relatorio, json.load(arquivo))
             
-            # Preserva metadados originais se existirem
-            if 'metadados' in dados_entrada:
-                dados_saida['metadados_originais'] = dados_entrada['metadados']
-            
-            # Preserva erros originais se existirem
-            if 'erros' in dados_entrada:
-                dados_saida['erros_originais'] = dados_entrada['erros']
-            
-            # Salva o arquivo mesclado
-            with open(arquivo_saida, 'w', encoding='utf-8') as arquivo:
-                json.dump(dados_saida, arquivo, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
-            
-            # Verifica se o arquivo foi salvo corretamente
-            tamanho_arquivo = os.path.getsize(arquivo_saida)
-            
-            logging.info(safe_log_message(f"✅ Mesclagem concluída com sucesso!"))
-            logging.info(safe_log_message(f"📁 Arquivo mesclado salvo: {arquivo_saida}"))
-            logging.info(safe_log_message(f"📊 Tamanho do arquivo: {tamanho_arquivo:,} bytes"))
-            logging.info(safe_log_message(f"🏥 Total de unidades processadas: {stats_mesclagem['total_unidades']}"))
-            logging.info(safe_log_message(f"✅ Mesclagens bem-sucedidas: {stats_mesclagem['mesclagens_bem_sucedidas']}"))
-            logging.info(safe_log_message(f"❌ Mesclagens falharam: {stats_mesclagem['mesclagens_falharam']}"))
-            logging.info(safe_log_message(f"📈 Taxa de sucesso: {(stats_mesclagem['mesclagens_bem_sucedidas']/stats_mesclagem['total_unidades']*100):.1f}%"))
-            
-            return dados_saida
-            
-        except Exception as e:
-            logging.error(safe_log_message(f"❌ Erro durante mesclagem: {e}"))
-            raise
+            arquivo_relatorio = args.saida_bench or os.path.join(
+                config['diretorio_saida'], f"cnes_bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            )
+            os.makedirs(os.path.dirname(arquivo_relatorio) or '.', exist_ok=True)
+            with open(arquivo_relatorio, 'w', encoding='utf-8') as arquivo:
+                json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        else:
+            relatorio = asyncio.run(executar_benchmark(entrada, config, args.amostra or 200))
+        print(json.dumps(relatorio, ensure_ascii=False, indent=2))
+        if arquivo_relatorio:
+            print(f"💾 Relatório salvo em {arquivo_relatorio}")
+        return True
+    
+    if args.comando == 'resume':
+        tarefas = []
+        for arquivo_journal in args.journals:
+            cabecalho = CheckpointJournal.ler_cabecalho(arquivo_journal) if os.path.exists(arquivo_journal) else None
+            if not cabecalho or not (cabecalho.get('arquivo_entrada') or (cabecalho.get('parametros') or {}).get('listagem')):
+                print(f"❌ Journal sem arquivo de entrada registrado: {arquivo_journal}")
+                return False
+            parametros = cabecalho.get('parametros') or {}
+            if parametros.get('listagem'):
+                tarefas.append({
+                    'listagem': parametros['listagem'],
+                    'journal': arquivo_journal,
+                    'mesclar': parametros.get('comando', 'run') == 'run',
+                    'delta': parametros.get('delta', False) or config['delta']
+                })
+                continue
+            tarefas.append({
+                'arquivo_entrada': cabecalho['arquivo_entrada'],
+                'journal': arquivo_journal,
+                'mesclar': parametros.get('comando', 'run') == 'run',
+                'delta': parametros.get('delta', False) or config['delta'],
+                'shard': interpretar_shard(parametros['shard']) if parametros.get('shard') else None
+            })
+    else:
+        tarefas = [{'arquivo_entrada': entrada, 'mesclar': args.comando == 'run', 'shard': args.shard}
+                   for entrada in args.entradas]
+        tarefas.extend({'listagem': filtros, 'mesclar': args.comando == 'run'} for filtros in listagens)
+    
+    for tarefa in tarefas:
+        if tarefa.get('arquivo_entrada') and not os.path.exists(tarefa['arquivo_entrada']):
+            print(f"❌ Arquivo não encontrado: {tarefa['arquivo_entrada']}")
+            return False
+    
+    return asyncio.run(executar_consultas(tarefas, config, assumir_sim=args.yes))
 
 def main():
     """
     Função principal do script - Processamento integrado ASSÍNCRONO de códigos CNES com mesclagem de macrorregião
     """
+    args = criar_parser().parse_args()
+    
+    # Subcomandos: execução não interativa (cron, orquestradores, vários arquivos por processo)
+    if args.comando:
+        try:
+            sucesso = executar_subcomando(args)
+        except KeyboardInterrupt:
+            print("\n❌ Processamento interrompido pelo usuário")
+            sucesso = False
+        except Exception as e:
+            logging.error(safe_log_message(f"❌ Erro: {e}"))
+            sucesso = False
+        sys.exit(0 if sucesso else 1)
+    
     print("🏥 AUTOMATIZADOR DA API CNES - VERSÃO ASSÍNCRONA OTIMIZADA")
     print("🔗 Consulta detalhada por código de estabelecimento")
     print("🛠️ Correções: Processamento paralelo, otimizações de velocidade")
@@ -842,8 +7024,20 @@ def main():
     print("📊 NOVO: Barra de progresso, ETA e velocidade em tempo real!")
     print("=" * 80)
     
+    arquivo_entrada = None
+    if args.resume:
+        if not os.path.exists(args.resume):
+            print(f"❌ Journal não encontrado: {args.resume}")
+            return
+        cabecalho = CheckpointJournal.ler_cabecalho(args.resume)
+        arquivo_entrada = cabecalho.get('arquivo_entrada') if cabecalho else None
+        print(f"\n♻️ Retomando execução do journal: {args.resume}")
+        if arquivo_entrada:
+            print(f"📂 Arquivo de códigos da execução original: {arquivo_entrada}")
+    
     # Solicita arquivo de entrada
-    arquivo_entrada = input("\nDigite o caminho do arquivo JSON com os códigos CNES: ").strip()
+    if not arquivo_entrada or not os.path.exists(arquivo_entrada):
+        arquivo_entrada = input("\nDigite o caminho do arquivo JSON com os códigos CNES: ").strip()
     
     if not os.path.exists(arquivo_entrada):
         print(f"❌ Arquivo não encontrado: {arquivo_entrada}")
@@ -854,11 +7048,28 @@ def main():
     concurrent_str = input("Número de requisições simultâneas (padrão: 15, máx recomendado: 25): ").strip()
     concurrent_requests = int(concurrent_str) if concurrent_str else 15
     
-    delay_str = input("Delay entre lotes em segundos (padrão: 0.3): ").strip()
-    delay_between_batches = float(delay_str) if delay_str else 0.3
+    modo_str = input("Modo de processamento - pool contínuo ou lotes (padrão: pool): ").strip().lower()
+    modo_processamento = modo_str if modo_str in CNESAPIAutomator.MODOS_PROCESSAMENTO else 'pool'
+    
+    delay_between_batches = 0.3
+    if modo_processamento == 'lotes':
+        delay_str = input("Delay entre lotes em segundos (padrão: 0.3): ").strip()
+        delay_between_batches = float(delay_str) if delay_str else 0.3
+    
+    rps_str = input("Limite de requisições por segundo (Enter = sem limite): ").strip()
+    requests_per_second = float(rps_str) if rps_str else None
     
-    # Validação das configurações
-    if concurrent_requests > 25:
+    tentativas_str = input("Número máximo de tentativas por código em falhas transitórias (padrão: 3): ").strip()
+    max_tentativas = int(tentativas_str) if tentativas_str else 3
+    
+    adaptativa_str = input("Ajustar a concorrência automaticamente conforme a resposta da API? (s/n, padrão: n): ").strip().lower()
+    adaptive_concurrency = adaptativa_str == 's'
+    
+    cache_str = input("Validade do cache local de respostas em horas (padrão: 168, 0 desativa o cache): ").strip()
+    ttl_cache_horas = float(cache_str) if cache_str else 168.0
+    
+    # Validação das configurações (com ajuste automático, o controlador reduz a carga sozinho)
+    if concurrent_requests > 25 and not adaptive_concurrency:
         print("⚠️ Aviso: Mais de 25 requisições simultâneas pode sobrecarregar a API")
         confirma_config = input("Deseja continuar mesmo assim? (s/n): ").strip().lower()
         if confirma_config != 's':
@@ -869,16 +7080,7 @@ def main():
     arquivo_macrorregiao = input("\nDigite o caminho do arquivo de macrorregião (ou pressione Enter para usar o padrão): ").strip()
     
     if not arquivo_macrorregiao:
-        caminhos_padrao = [
-            'macrorregiao_regiao_saude_municipios.json',
-            '../macrorregiao_regiao_saude_municipios.json',
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'macrorregiao_regiao_saude_municipios.json')
-        ]
-        
-        for caminho in caminhos_padrao:
-            if os.path.exists(caminho):
-                arquivo_macrorregiao = caminho
-                break
+        arquivo_macrorregiao = localizar_arquivo_macrorregiao()
         
         if not arquivo_macrorregiao:
             print("❌ Arquivo de macrorregião não encontrado. Especifique o caminho completo.")
@@ -889,11 +7091,23 @@ def main():
         return
     
     async def processar_async():
+        cache = CNESResponseCache(ttl_segundos=ttl_cache_horas * 3600) if ttl_cache_horas > 0 else None
+        journal = None
+        concluido = False
         try:
+            # Inicializa o merger: cada estabelecimento é mesclado assim que chega da API
+            merger = CNESMacrorregiaeMerger(arquivo_macrorregiao)
+            
             # Inicializa o automatizador assíncrono
             automatizador = CNESAPIAutomator(
                 concurrent_requests=concurrent_requests,
-                delay_between_batches=delay_between_batches
+                delay_between_batches=delay_between_batches,
+                modo_processamento=modo_processamento,
+                requests_per_second=requests_per_second,
+                adaptive_concurrency=adaptive_concurrency,
+                retry_policy=RetryPolicy(max_tentativas=max_tentativas),
+                cache=cache,
+                merger=merger
             )
             
             # Carrega os códigos CNES
@@ -905,6 +7119,8 @@ def main():
             
             # Confirma antes de processar
             print(f"\n📋 Encontrados {len(codigos)} códigos CNES para processar")
+            if automatizador.codigos_rejeitados:
+                print(f"⚠️ {len(automatizador.codigos_rejeitados)} código(s) inválido(s) rejeitado(s) sem consulta à API")
             print(f"⚡ Configuração: {concurrent_requests} requisições simultâneas")
             print(f"⏱️ Tempo estimado: {tempo_estimado:.1f} segundos ({tempo_estimado/60:.1f} minutos)")
             print(f"🚀 Velocidade estimada: ~{len(codigos)/tempo_estimado:.1f} requisições/segundo")
@@ -916,50 +7132,67 @@ def main():
                 print(f"📊 Loading em tempo real com ETA ativado!")
                 print()
                 
-                # Processa os códigos de forma assíncrona
-                resultados = await automatizador.processar_lista_codigos(codigos)
-                
-                # Salva os resultados iniciais
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                arquivo_intermediario = f"cnes_resultados_temp_{timestamp}.json"
-                automatizador.salvar_resultados(resultados, arquivo_intermediario)
-                
-                print(f"\n✅ Processamento da API concluído!")
-                print(f"🔄 Iniciando mesclagem com dados de macrorregião...")
-                print()
                 
-                # Inicializa o merger
-                merger = CNESMacrorregiaeMerger(arquivo_macrorregiao)
+                # Journal de checkpoint: novo ou retomado
+                if args.resume:
+                    journal = CheckpointJournal(args.resume)
+                else:
+                    journal = CheckpointJournal(CheckpointJournal.novo_arquivo(), arquivo_entrada=arquivo_entrada,
+                                                parametros={'comando': 'run'})
                 
-                # Executa a mesclagem
+                # Os resultados são mesclados e gravados no arquivo final conforme chegam
                 arquivo_final = f"cnes_com_macrorregiao_{timestamp}.json"
-                resultado_final = merger.mesclar_arquivo_resultados(arquivo_intermediario, arquivo_final)
+                destino = merger.criar_destino(arquivo_final)
                 
-                # Remove arquivo intermediário
+                # Processa os códigos de forma assíncrona
                 try:
-                    os.remove(arquivo_intermediario)
-                    print(f"🗑️ Arquivo temporário removido: {arquivo_intermediario}")
-                except:
-                    pass
+                    resultados = await automatizador.processar_lista_codigos(
+                        codigos, journal=journal, destino=destino, codigos_rejeitados=automatizador.codigos_rejeitados
+                    )
+                except BaseException:
+                    destino.abortar()
+                    raise
                 
-                print(f"\n🎉 Processamento e mesclagem concluídos!")
+                # Disjuntor desistiu: a saída é parcial e o journal fica para retomar os que faltam
+                nao_concluidos = resultados['resumo']['total_nao_concluidos']
+                concluido = not nao_concluidos
+                if concluido:
+                    print(f"\n🎉 Processamento e mesclagem concluídos!")
+                else:
+                    print(f"\n🔌 API fora do ar: {nao_concluidos:,} código(s) não concluído(s) "
+                          f"(listados em metadados.codigos_nao_concluidos da saída)")
                 print(f"📁 Arquivo final: {arquivo_final}")
                 
                 # Mostra estatísticas finais
                 stats_api = resultados['resumo']
-                stats_mesclagem = resultado_final['metadados_mesclagem']['estatisticas']
+                stats_mesclagem = resultados['metadados_mesclagem']['estatisticas']
+                taxa_mesclagem = (stats_mesclagem['mesclagens_bem_sucedidas'] / stats_mesclagem['total_unidades'] * 100
+                                  if stats_mesclagem['total_unidades'] > 0 else 0)
                 
                 print(f"\n📊 Estatísticas finais:")
                 print(f"   - Códigos processados: {stats_api['total_sucessos']}")
                 print(f"   - Mesclagens bem-sucedidas: {stats_mesclagem['mesclagens_bem_sucedidas']}")
                 print(f"   - Taxa de sucesso API: {stats_api['taxa_sucesso']}")
-                print(f"   - Taxa de sucesso mesclagem: {(stats_mesclagem['mesclagens_bem_sucedidas']/stats_mesclagem['total_unidades']*100):.1f}%")
+                print(f"   - Taxa de sucesso mesclagem: {taxa_mesclagem:.1f}%")
                 print(f"   - Velocidade média: {stats_api['velocidade_media']}")
                 print(f"   - Tempo total: {resultados['metadados']['tempo_execucao_segundos']:.1f} segundos")
                 
         except Exception as e:
             logging.error(safe_log_message(f"❌ Erro durante processamento integrado assíncrono: {e}"))
             print(f"❌ Erro: {e}")
+        
+        finally:
+            if cache is not None:
+                cache.fechar()
+            
+            if journal is not None:
+                journal.fechar()
+                if concluido:
+                    # O arquivo final já contém tudo; o journal não é mais necessário
+                    os.remove(journal.arquivo)
+                else:
+                    print(f"\n♻️ Para retomar: python {os.path.basename(__file__)} --resume {journal.arquivo}")
     
     # Executa o processamento assíncrono
     try:
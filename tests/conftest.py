@@ -0,0 +1,116 @@
+"""
+Fixtures comuns dos testes: cada teste roda num diretório temporário (logs, journals e saídas
+não sujam o repositório) e consulta um MockCNESServer local no lugar da API pública
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Com um handler já configurado, o módulo não cria o cnes_automator.log no diretório atual
+logging.getLogger().addHandler(logging.NullHandler())
+
+import cnes_automator_fast as cnes  # noqa: E402
+
+ARQUIVO_ESTADO = os.path.join(RAIZ, 'cnes_estado_11.json')
+ARQUIVO_MACRORREGIAO = os.path.join(RAIZ, 'macrorregiao_regiao_saude_municipios.json')
+
+
+@pytest.fixture(autouse=True)
+def diretorio_execucao(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def codigos_estado():
+    with open(ARQUIVO_ESTADO, 'r', encoding='utf-8') as arquivo:
+        return [cnes.normalizar_codigo_cnes(codigo) for codigo in json.load(arquivo)]
+
+
+@pytest.fixture
+def arquivo_codigos(tmp_path, codigos_estado):
+    """
+    Cria um arquivo JSON com os `quantidade` primeiros códigos do estado 11 e devolve o caminho
+    """
+    def criar(quantidade: int = 40, nome: str = 'codigos.json') -> str:
+        caminho = str(tmp_path / nome)
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            json.dump(codigos_estado[:quantidade], arquivo)
+        return caminho
+    return criar
+
+
+@pytest.fixture
+def com_mock(arquivo_codigos):
+    """
+    Roda `corrotina(servidor, url_base)` com um MockCNESServer iniciado no mesmo loop
+
+    As opções padrão tiram a latência e as falhas aleatórias; cada teste liga só as que exercita.
+    """
+    def executar(corrotina, quantidade: int = 40, **opcoes):
+        opcoes = {'latencia_p50_ms': 1, 'latencia_p95_ms': 1, 'taxa_404': 0.0, 'taxa_5xx': 0.0, **opcoes}
+
+        async def principal():
+            servidor = cnes.MockCNESServer(arquivo_codigos(quantidade, 'codigos_mock.json'),
+                                           ARQUIVO_MACRORREGIAO, **opcoes)
+            url = await servidor.iniciar()
+            try:
+                return await corrotina(servidor, url)
+            finally:
+                await servidor.parar()
+
+        return asyncio.run(principal())
+    return executar
+
+
+@pytest.fixture
+def mock_em_processo(arquivo_codigos):
+    """
+    Inicia um MockCNESServer em outro processo, para os subcomandos da linha de comando (que
+    rodam o próprio loop), e devolve a URL base; o servidor é parado no fim do teste
+    """
+    processos = []
+
+    def iniciar(quantidade: int = 40, **opcoes) -> str:
+        opcoes = {'arquivo_codigos': arquivo_codigos(quantidade, 'codigos_mock.json'),
+                  'arquivo_macrorregiao': ARQUIVO_MACRORREGIAO, 'latencia_p50_ms': 1, 'latencia_p95_ms': 1,
+                  'taxa_404': 0.0, 'taxa_5xx': 0.0, **opcoes}
+        conexao, conexao_servidor = multiprocessing.Pipe()
+        processo = multiprocessing.Process(target=cnes._servir_mock_em_processo,
+                                           args=(opcoes, conexao_servidor), daemon=True)
+        processo.start()
+        processos.append((processo, conexao))
+        return conexao.recv()
+
+    yield iniciar
+    for processo, conexao in processos:
+        conexao.send('parar')
+        conexao.recv()
+        processo.join(5)
+
+
+@pytest.fixture
+def automatizador():
+    """
+    Cria um CNESAPIAutomator apontado para a URL do mock, sem cache e sem retentativas lentas
+    """
+    def criar(url: str, **opcoes) -> cnes.CNESAPIAutomator:
+        opcoes.setdefault('retry_policy', cnes.RetryPolicy(max_tentativas=3, atraso_base=0.01))
+        automator = cnes.CNESAPIAutomator(**opcoes)
+        automator.base_url = url
+        return automator
+    return criar
+
+
+def ler_jsonl(caminho: str):
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo if linha.strip()]
@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pytest
+
+import cnes_automator_fast as cnes
+from conftest import ARQUIVO_MACRORREGIAO
+
+
+def test_percentil_interpola():
+    assert cnes.percentil([], 0.5) is None
+    assert cnes.percentil([10.0], 0.99) == 10.0
+    assert cnes.percentil([1.0, 2.0, 3.0, 4.0], 0.5) == 2.5
+    assert cnes.percentil([1.0, 2.0, 3.0, 4.0], 1.0) == 4.0
+
+
+def test_comparar_benchmarks():
+    anterior = {'data': '2025-07-07', 'requisicoes_por_segundo': 100.0, 'latencia_ms': {'p50': 80.0}}
+    atual = {'requisicoes_por_segundo': 250.0, 'latencia_ms': {'p50': 40.0}}
+
+    comparacao = cnes.comparar_benchmarks(atual, anterior)
+
+    assert comparacao['arquivo_anterior_data'] == '2025-07-07'
+    assert comparacao['requisicoes_por_segundo']['razao'] == '2.50x'
+    assert comparacao['latencia_p50_ms']['razao'] == '0.50x'
+    assert comparacao['pico_rss_mb']['razao'] == 'N/A'
+
+
+def test_servidor_mock_responde_como_a_api(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        resultado = await automatizador(url).processar_lista_codigos(codigos_estado[:40] + ['9999999'])
+        return servidor, resultado
+
+    servidor, resultado = com_mock(executar, taxa_404=0.2)
+
+    resumo = servidor.resumo()
+    assert resumo['codigos_existentes'] == resultado['resumo']['total_sucessos'] < 40
+    # Os códigos sorteados para 404 e os de fora do arquivo não são retentados
+    assert resultado['resumo']['total_erros'] == 41 - resumo['codigos_existentes']
+    assert resultado['metadados']['estatisticas']['retentativas'] == 0
+    assert resumo['tamanho_medio_resposta_bytes'] > 1000
+
+
+def test_tamanho_payload_do_mock(com_mock):
+    async def executar(servidor, url):
+        return servidor.resumo()
+
+    assert com_mock(executar, tamanho_payload=8000)['tamanho_medio_resposta_bytes'] >= 7900
+
+
+def test_bench_mock_grava_relatorio_e_compara(arquivo_codigos):
+    arquivo_codigos(40)
+    parser = cnes.criar_parser()
+    comuns = ['bench', 'codigos.json', '--mock', '--macrorregiao', ARQUIVO_MACRORREGIAO, '--latencia-p50-ms', '2',
+              '--latencia-p95-ms', '5', '--taxa-404', '0.1', '--taxa-5xx', '0', '--formato-saida', 'jsonl']
+
+    assert cnes.executar_subcomando(parser.parse_args(comuns + ['--saida-bench', 'anterior.json']))
+    assert cnes.executar_subcomando(parser.parse_args(comuns + ['--saida-bench', 'atual.json',
+                                                                '--comparar', 'anterior.json']))
+
+    with open('atual.json', 'r', encoding='utf-8') as arquivo:
+        relatorio = json.load(arquivo)
+    assert relatorio['codigos'] == 40
+    contagens = relatorio['contagens']
+    assert contagens['sucessos'] == relatorio['servidor_mock']['codigos_existentes']
+    assert contagens['sucessos'] + contagens['erros'] == 40
+    assert relatorio['servidor_mock']['requisicoes'] >= contagens['tentativas']
+    assert relatorio['configuracao']['formato_saida'] == 'jsonl'
+    assert relatorio['latencia_ms']['p50'] >= 2
+    assert set(relatorio['fases_segundos']) >= {'consulta', 'mesclagem', 'gravacao', 'pipeline_total'}
+    assert relatorio['comparacao']['requisicoes_por_segundo']['razao'].endswith('x')
+
+
+def test_bench_mock_sem_macrorregiao(arquivo_codigos):
+    arquivo_codigos(5)
+    config = cnes.resolver_configuracao(cnes.criar_parser().parse_args(['bench', 'codigos.json', '--mock']))
+    config['macrorregiao'] = 'inexistente.json'
+
+    with pytest.raises(ValueError):
+        asyncio.run(cnes.executar_benchmark_mock('codigos.json', config, {}))
+
+
+def test_bench_compara_os_modos_de_processamento(mock_em_processo, arquivo_codigos, capsys):
+    url = mock_em_processo(30)
+    arquivo_codigos(30)
+
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['bench', 'codigos.json', '--amostra', '20', '--url-api', url]
+    ))
+
+    saida = capsys.readouterr().out
+    relatorio = json.loads(saida[saida.index('\n{') + 1:])
+    assert relatorio['amostra'] == 20
+    assert set(relatorio['modos']) == set(cnes.CNESAPIAutomator.MODOS_PROCESSAMENTO)
+    assert all(modo['sucessos'] == 20 for modo in relatorio['modos'].values())
@@ -0,0 +1,92 @@
+import sqlite3
+import time
+
+import cnes_automator_fast as cnes
+
+
+def horario_acesso(arquivo, codigo):
+    with sqlite3.connect(arquivo) as conexao:
+        return conexao.execute('SELECT acessado_em FROM respostas WHERE codigo_cnes = ?', (codigo,)).fetchone()[0]
+
+
+def test_resposta_fresca_e_vencida():
+    cache = cnes.CNESResponseCache('cache.sqlite3', ttl_segundos=3600)
+    cache.gravar('2000733', '{"codigo_cnes": 2000733}', etag='"v1"')
+
+    entrada = cache.obter('2000733')
+    assert entrada['fresca'] and entrada['etag'] == '"v1"'
+    assert cache.obter('9999999') is None
+
+    cache.ttl_segundos = 0
+    assert not cache.obter('2000733')['fresca']
+    assert (cache.stats['hits'], cache.stats['expiradas'], cache.stats['misses']) == (1, 1, 1)
+    cache.fechar()
+
+
+def test_leitura_so_grava_o_acesso_ao_confirmar():
+    cache = cnes.CNESResponseCache('cache.sqlite3')
+    cache.gravar('2000733', '{}')
+    gravado_em = horario_acesso('cache.sqlite3', '2000733')
+
+    time.sleep(0.01)
+    cache.obter('2000733')
+    assert horario_acesso('cache.sqlite3', '2000733') == gravado_em
+
+    cache.confirmar()
+    assert horario_acesso('cache.sqlite3', '2000733') > gravado_em
+    cache.fechar()
+
+
+def test_limite_de_entradas_remove_as_menos_usadas():
+    cache = cnes.CNESResponseCache('cache.sqlite3', max_entradas=2)
+    for codigo in ('0000001', '0000002', '0000003'):
+        cache.gravar(codigo, '{}')
+        time.sleep(0.01)
+    cache.obter('0000001')
+    cache.fechar()
+
+    with sqlite3.connect('cache.sqlite3') as conexao:
+        restantes = sorted(linha[0] for linha in conexao.execute('SELECT codigo_cnes FROM respostas'))
+    assert restantes == ['0000001', '0000003']
+    assert cache.stats['remocoes_lru'] == 1
+
+
+def test_arquivo_bloqueado_nao_interrompe_a_consulta():
+    cache = cnes.CNESResponseCache('cache.sqlite3', timeout_bloqueio=0.05)
+    outro_processo = sqlite3.connect('cache.sqlite3', isolation_level=None)
+    outro_processo.execute('BEGIN IMMEDIATE')
+    try:
+        cache.gravar('2000733', '{}')
+    finally:
+        outro_processo.execute('ROLLBACK')
+        outro_processo.close()
+
+    assert cache.stats['gravacoes'] == 0
+    assert cache.stats['falhas'] == 1
+    assert cache.obter('2000733') is None
+
+    cache.gravar('2000733', '{}')
+    assert cache.obter('2000733') is not None
+    cache.fechar()
+
+
+def test_segunda_execucao_usa_o_cache_sem_acessar_a_api(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:20]
+
+    async def executar(servidor, url):
+        cache = cnes.CNESResponseCache('cache.sqlite3')
+        primeira = await automatizador(url, cache=cache).processar_lista_codigos(codigos)
+        requisicoes = servidor.contagens['requisicoes']
+        segunda = await automatizador(url, cache=cache).processar_lista_codigos(codigos)
+        cache.fechar()
+        return primeira, segunda, servidor.contagens['requisicoes'] - requisicoes, cache
+
+    primeira, segunda, requisicoes_segunda, cache = com_mock(executar)
+
+    assert primeira['resumo']['total_sucessos'] == segunda['resumo']['total_sucessos'] == 20
+    assert cache.stats['gravacoes'] == 20
+    assert cache.stats['hits'] == 20
+    # Só o pré-aquecimento das conexões (HEAD) chega à API
+    pre_aquecimento = segunda['metadados']['configuracao_performance']['cliente_http']['pre_aquecimento']
+    assert segunda['metadados']['estatisticas']['total_requisicoes'] == 0
+    assert requisicoes_segunda == pre_aquecimento['conexoes_abertas']
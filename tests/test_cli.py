@@ -0,0 +1,99 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cnes_automator_fast as cnes
+from conftest import ARQUIVO_MACRORREGIAO, RAIZ
+
+
+def escrever_json(caminho, dados):
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(dados, arquivo)
+    return caminho
+
+
+def test_configuracao_json_e_toml():
+    escrever_json('config.json', {'cnes': {'concorrencia': 4, 'modo': 'lotes'}})
+    with open('config.toml', 'w', encoding='utf-8') as arquivo:
+        arquivo.write('[cnes]\nconcorrencia = 6\ncampos = ["codigo_cnes"]\n')
+
+    assert cnes.carregar_configuracao('config.json') == {'concorrencia': 4, 'modo': 'lotes'}
+    assert cnes.carregar_configuracao('config.toml') == {'concorrencia': 6, 'campos': ['codigo_cnes']}
+
+
+@pytest.mark.parametrize('dados', [
+    {'concorrenca': 4},
+    {'modo': 'turbo'},
+    {'campos': 'codigo_cnes'},
+    {'formato_saida': 'xml'},
+    [1, 2],
+])
+def test_configuracao_invalida(dados):
+    with pytest.raises(ValueError):
+        cnes.carregar_configuracao(escrever_json('config.json', dados))
+
+
+def test_linha_de_comando_tem_prioridade_sobre_o_arquivo():
+    escrever_json('config.json', {'concorrencia': 4, 'max_tentativas': 5})
+    args = cnes.criar_parser().parse_args(['fetch', 'codigos.json', '--config', 'config.json', '-c', '8'])
+
+    config = cnes.resolver_configuracao(args)
+
+    assert config['concorrencia'] == 8
+    assert config['max_tentativas'] == 5
+    assert config['modo'] == cnes.CONFIGURACAO_PADRAO['modo']
+
+
+def test_sem_terminal_e_sem_yes_nao_consulta(arquivo_codigos, monkeypatch):
+    def sem_terminal(mensagem):
+        raise EOFError
+
+    arquivo_codigos(5)
+    monkeypatch.setattr('builtins.input', sem_terminal)
+    args = cnes.criar_parser().parse_args(['fetch', 'codigos.json', '--url-api', 'http://127.0.0.1:9',
+                                           '--cache-validade-horas', '0'])
+
+    assert not cnes.executar_subcomando(args)
+    assert not glob.glob('cnes_resultados_*')
+
+
+def test_fetch_com_arquivo_de_configuracao(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(10)
+    arquivo_codigos(10)
+    escrever_json('config.json', {'url_api': url, 'cache_validade_horas': 0, 'formato_saida': 'jsonl',
+                                  'diretorio_saida': 'saidas', 'macrorregiao': ARQUIVO_MACRORREGIAO})
+
+    resultado = subprocess.run([sys.executable, os.path.join(RAIZ, 'cnes_automator_fast.py'), 'fetch',
+                                'codigos.json', '--config', 'config.json', '-y'], capture_output=True, text=True)
+
+    assert resultado.returncode == 0, resultado.stdout + resultado.stderr
+    saidas = glob.glob('saidas/cnes_resultados_codigos_*.jsonl')
+    assert len(saidas) == 1
+    with open(saidas[0], 'r', encoding='utf-8') as arquivo:
+        assert len(arquivo.readlines()) == 10
+    # Concluída, a execução não deixa journal para retomar
+    assert not glob.glob('saidas/cnes_journal_*.jsonl')
+
+
+def test_fetch_sem_entradas_termina_com_erro():
+    resultado = subprocess.run([sys.executable, os.path.join(RAIZ, 'cnes_automator_fast.py'), 'fetch'],
+                               capture_output=True, text=True)
+
+    assert resultado.returncode == 1
+    assert 'Informe arquivos de códigos' in resultado.stdout
+
+
+def test_script_legado_delega_apenas_subcomandos_conhecidos():
+    legado = os.path.join(RAIZ, 'cnes_automator.py')
+
+    recusado = subprocess.run([sys.executable, legado, '--uf', '11'], capture_output=True, text=True)
+    delegado = subprocess.run([sys.executable, legado, 'fetch'], capture_output=True, text=True)
+
+    assert recusado.returncode == 2
+    assert 'Argumento não reconhecido: --uf' in recusado.stdout
+    assert delegado.returncode == 1
+    assert 'Informe arquivos de códigos' in delegado.stdout
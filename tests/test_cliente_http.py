@@ -0,0 +1,88 @@
+import asyncio
+import glob
+import json
+
+import cnes_automator_fast as cnes
+
+
+def test_cliente_compartilhado_entre_listas_reaproveita_as_conexoes(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=4, conexoes_pre_aquecidas=4)
+        async with automator.criar_cliente() as cliente:
+            await automator.pre_aquecer(cliente)
+            primeira = await automator.processar_lista_codigos(codigos_estado[:20], cliente=cliente)
+            segunda = await automator.processar_lista_codigos(codigos_estado[20:40], cliente=cliente)
+        return primeira, segunda
+
+    primeira, segunda = com_mock(executar)
+
+    assert segunda['metadados']['configuracao_performance']['cliente_http']['listas_atendidas'] == 2
+    # A segunda lista encontra o pool já aberto pela primeira
+    assert segunda['metadados']['metricas']['conexoes']['novas'] == 0
+    assert segunda['metadados']['metricas']['conexoes']['reutilizadas'] == 20
+    assert primeira['resumo']['total_sucessos'] == segunda['resumo']['total_sucessos'] == 20
+
+
+def test_pre_aquecimento_abre_as_conexoes_antes_da_carga(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=4, conexoes_pre_aquecidas=4)
+        return await automator.processar_lista_codigos(codigos_estado[:20])
+
+    resultado = com_mock(executar)
+
+    cliente = resultado['metadados']['configuracao_performance']['cliente_http']
+    assert cliente['pre_aquecimento']['conexoes_abertas'] == 4
+    conexoes = resultado['metadados']['metricas']['conexoes']
+    assert conexoes['novas'] == 4
+    assert conexoes['reutilizadas'] == 20
+
+
+def test_pre_aquecimento_limitado_aos_codigos_pendentes(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=8, conexoes_pre_aquecidas=8)
+        return await automator.processar_lista_codigos(codigos_estado[:2])
+
+    resultado = com_mock(executar)
+
+    pre_aquecimento = resultado['metadados']['configuracao_performance']['cliente_http']['pre_aquecimento']
+    assert (pre_aquecimento['conexoes_solicitadas'], pre_aquecimento['conexoes_abertas']) == (2, 2)
+
+
+def test_pre_aquecimento_sem_servidor_nao_falha():
+    async def executar():
+        async with cnes.CNESHTTPClient(2) as cliente:
+            return await cliente.pre_aquecer('http://127.0.0.1:1/cnes/estabelecimentos', 5)
+
+    resumo = asyncio.run(executar())
+
+    assert (resumo['conexoes_solicitadas'], resumo['conexoes_abertas']) == (2, 0)
+
+
+def test_sem_compressao_pede_identity(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        return await automatizador(url, compressao=False).processar_lista_codigos(codigos_estado[:5])
+
+    resultado = com_mock(executar)
+
+    assert resultado['metadados']['configuracao_performance']['cliente_http']['accept_encoding'] == 'identity'
+    compressao = resultado['metadados']['metricas']['compressao']
+    assert compressao['respostas_comprimidas'] == 0
+    assert compressao['bytes_economizados'] == 0
+
+
+def test_subcomando_usa_um_cliente_para_todas_as_listas(mock_em_processo, codigos_estado):
+    url = mock_em_processo(20)
+    for nome, codigos in (('a.json', codigos_estado[:10]), ('b.json', codigos_estado[10:20])):
+        with open(nome, 'w', encoding='utf-8') as arquivo:
+            json.dump(codigos, arquivo)
+
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['fetch', 'a.json', 'b.json', '--url-api', url, '--cache-validade-horas', '0', '-y']
+    ))
+
+    listas_atendidas = []
+    for nome in ('a', 'b'):
+        with open(glob.glob(f'cnes_resultados_{nome}_*.json')[0], 'r', encoding='utf-8') as arquivo:
+            metadados = json.load(arquivo)['metadados']
+        listas_atendidas.append(metadados['configuracao_performance']['cliente_http']['listas_atendidas'])
+    assert listas_atendidas == [1, 2]
@@ -0,0 +1,63 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+BACKENDS_INSTALADOS = [backend for backend in cnes.JSONCodec.BACKENDS if cnes.JSONCodec.disponivel(backend)]
+
+DOCUMENTO = {
+    'codigo_cnes': 2000733,
+    'nome_fantasia': 'UNIDADE BÁSICA DE SAÚDE SÃO JOÃO',
+    'latitude': -11.4302,
+    'servicos': [{'codigo': 159}, {}],
+    'vazio': [],
+    'natureza': None,
+    'ativo': True
+}
+
+
+@pytest.fixture(params=BACKENDS_INSTALADOS)
+def codec(request):
+    return cnes.JSONCodec(request.param)
+
+
+def test_ida_e_volta(codec):
+    assert codec.loads(codec.dumps(DOCUMENTO)) == DOCUMENTO
+    assert codec.loads(codec.dumps(DOCUMENTO).decode('utf-8')) == DOCUMENTO
+
+
+def test_mesmo_layout_do_json_da_biblioteca_padrao(codec):
+    esperado = json.dumps(DOCUMENTO, ensure_ascii=False, indent=2).encode('utf-8')
+
+    assert codec.dumps(DOCUMENTO, indent=True) == esperado
+    assert codec.dumps(DOCUMENTO) == json.dumps(DOCUMENTO, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def test_datetime_vira_iso_8601(codec):
+    consultado_em = datetime(2025, 7, 7, 12, 25, 0, 123456)
+
+    assert codec.loads(codec.dumps({'consultado_em': consultado_em})) == {'consultado_em': consultado_em.isoformat()}
+
+
+def test_valores_fora_do_backend_rapido_usam_o_json(codec):
+    assert codec.loads(codec.dumps({'grande': 2 ** 70})) == {'grande': 2 ** 70}
+
+
+def test_json_invalido_levanta_value_error(codec):
+    with pytest.raises(ValueError):
+        codec.loads(b'{"codigo_cnes": ')
+
+
+def test_backend_invalido():
+    with pytest.raises(ValueError):
+        cnes.JSONCodec('simplejson')
+
+
+def test_definir_backend_troca_o_codec_global(monkeypatch):
+    monkeypatch.setattr(cnes, 'CODEC_JSON', cnes.CODEC_JSON)
+
+    cnes.definir_backend_json('json')
+
+    assert cnes.CODEC_JSON.backend == 'json'
@@ -0,0 +1,153 @@
+import glob
+import json
+
+import cnes_automator_fast as cnes
+
+
+def sincronizar(registros, erros=(), adiados=None, lista_completa=True, nome='delta'):
+    snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+    destino = cnes.DeltaResultWriter(cnes.StreamingResultWriter(f'{nome}.json'), snapshot, escopo='fetch:codigos')
+    for registro in registros:
+        destino.escrever_estabelecimento(registro)
+    for erro in erros:
+        destino.escrever_erro(erro)
+    if adiados is not None:
+        destino.adiar(adiados, lista_completa=lista_completa)
+    verificacao = destino.finalizar({})
+    snapshot.fechar()
+    with open(destino.arquivo_manifesto, 'r', encoding='utf-8') as arquivo:
+        return verificacao, json.load(arquivo)
+
+
+def unidade(codigo, nome='UBS', **extras):
+    return {'codigo_cnes': codigo, 'nome_fantasia': nome, **extras}
+
+
+def codigos_no_snapshot():
+    snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+    try:
+        return sorted(snapshot.carregar('fetch:codigos'))
+    finally:
+        snapshot.fechar()
+
+
+def test_delta_grava_so_novos_e_alterados():
+    sincronizar([unidade(codigo) for codigo in range(1, 6)], nome='primeira')
+
+    verificacao, manifesto = sincronizar([
+        unidade(1, _metadata={'consultado_em': 'agora'}),
+        unidade(2, nome='UBS REFORMADA'),
+        unidade(6)
+    ], erros=[
+        {'codigo_cnes': '0000003', 'classe_erro': 'nao_encontrado'},
+        {'codigo_cnes': '0000004', 'classe_erro': 'http'}
+    ])
+
+    with open('delta.json', 'r', encoding='utf-8') as arquivo:
+        gravados = [registro['codigo_cnes'] for registro in json.load(arquivo)['estabelecimentos']]
+    assert gravados == [2, 6]
+    assert manifesto['codigos_novos'] == ['0000006']
+    assert manifesto['codigos_alterados'] == ['0000002']
+    # 404 e código fora da lista saem; erro transitório fica como estava
+    assert manifesto['codigos_removidos'] == ['0000003', '0000005']
+    assert (manifesto['inalterados'], manifesto['nao_verificados']) == (1, 1)
+    assert verificacao['delta']['snapshot_anterior']['total'] == 5
+    assert codigos_no_snapshot() == ['0000001', '0000002', '0000004', '0000006']
+
+
+def test_codigos_adiados_nao_sao_removidos():
+    sincronizar([unidade(codigo) for codigo in range(1, 4)], nome='primeira')
+
+    _, manifesto = sincronizar([unidade(1)], adiados=['2'])
+
+    assert manifesto['codigos_adiados'] == ['0000002']
+    assert manifesto['codigos_removidos'] == ['0000003']
+
+
+def test_lista_incompleta_nao_remove_nada():
+    sincronizar([unidade(codigo) for codigo in range(1, 4)], nome='primeira')
+
+    _, manifesto = sincronizar([unidade(1)], adiados=[], lista_completa=False)
+
+    assert manifesto['codigos_removidos'] == []
+    assert codigos_no_snapshot() == ['0000001', '0000002', '0000003']
+
+
+def test_abortar_nao_altera_o_snapshot():
+    sincronizar([unidade(1)], nome='primeira')
+    snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+    destino = cnes.DeltaResultWriter(cnes.StreamingResultWriter('abortado.json'), snapshot, escopo='fetch:codigos')
+    destino.escrever_estabelecimento(unidade(2))
+    destino.abortar()
+    snapshot.fechar()
+
+    assert codigos_no_snapshot() == ['0000001']
+
+
+def test_hash_ignora_metadata_e_ordem_das_chaves():
+    registro = cnes.EstabelecimentoCNES('0000001', {'b': 1, 'a': [1, 2]}, 'http://api')
+
+    assert cnes.CNESSnapshotStore.hash_conteudo(registro) == cnes.CNESSnapshotStore.hash_conteudo(
+        {'a': [1, 2], 'b': 1, '_metadata': {'origem': 'cache'}}
+    )
+
+
+def test_execucoes_seguidas_contra_a_api(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:20]
+
+    async def executar(servidor, url, nome, **opcoes):
+        snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+        destino = cnes.DeltaResultWriter(cnes.StreamingResultWriter(f'{nome}.json'), snapshot, escopo='fetch:codigos')
+        try:
+            resultado = await automatizador(url, **opcoes).processar_lista_codigos(codigos, destino=destino)
+        finally:
+            snapshot.fechar()
+        return resultado
+
+    primeira = com_mock(lambda servidor, url: executar(servidor, url, 'primeira'))
+    segunda = com_mock(lambda servidor, url: executar(servidor, url, 'segunda'))
+    # Na terceira, parte dos códigos deixou de existir na API
+    terceira = com_mock(lambda servidor, url: executar(servidor, url, 'terceira'), taxa_404=0.3)
+
+    assert primeira['verificacao']['delta']['novos'] == 20
+    assert segunda['verificacao']['registros'] == 0
+    assert segunda['verificacao']['delta']['inalterados'] == 20
+    removidos = terceira['verificacao']['delta']['removidos']
+    assert removidos == terceira['resumo']['total_erros'] > 0
+    assert len(codigos_no_snapshot()) == 20 - removidos
+
+
+def test_prazo_esgotado_nao_remove_os_codigos_nao_concluidos(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:20]
+
+    async def executar(servidor, url, **opcoes):
+        snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+        destino = cnes.DeltaResultWriter(cnes.StreamingResultWriter('delta.json'), snapshot, escopo='fetch:codigos')
+        try:
+            return await automatizador(url, **opcoes).processar_lista_codigos(codigos, destino=destino)
+        finally:
+            snapshot.fechar()
+
+    com_mock(executar)
+    resultado = com_mock(lambda servidor, url: executar(servidor, url, concurrent_requests=2, prazo_segundos=0.3),
+                         latencia_p50_ms=100, latencia_p95_ms=100)
+
+    assert resultado['resumo']['total_nao_concluidos'] > 0
+    assert resultado['verificacao']['delta']['removidos'] == 0
+    assert codigos_no_snapshot() == sorted(codigos)
+
+
+def test_subcomando_fetch_delta_grava_manifesto(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(10)
+    arquivo_codigos(10)
+    argumentos = ['fetch', 'codigos.json', '--delta', '--url-api', url, '--cache-validade-horas', '0', '-y']
+
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(argumentos + ['--diretorio-saida', 'primeira']))
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(argumentos + ['--diretorio-saida', 'segunda']))
+
+    with open(glob.glob('primeira/cnes_delta_codigos_*_manifesto.json')[0], 'r', encoding='utf-8') as arquivo:
+        assert json.load(arquivo)['novos'] == 10
+    with open(glob.glob('segunda/cnes_delta_codigos_*_manifesto.json')[0], 'r', encoding='utf-8') as arquivo:
+        manifesto = json.load(arquivo)
+    assert (manifesto['novos'], manifesto['inalterados']) == (0, 10)
+    assert manifesto['arquivo_delta'].startswith('segunda/cnes_delta_resultados_codigos_')
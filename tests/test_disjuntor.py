@@ -0,0 +1,173 @@
+import asyncio
+import glob
+import time
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def disjuntor_aberto(**opcoes):
+    disjuntor = cnes.CircuitBreaker(janela=10, amostras_minimas=10, **opcoes)
+    for _ in range(10):
+        disjuntor.registrar(503)
+    assert disjuntor.estado == cnes.CircuitBreaker.ABERTO
+    return disjuntor
+
+
+def test_abre_so_com_amostras_suficientes_e_taxa_de_falhas():
+    disjuntor = cnes.CircuitBreaker(taxa_erro_limite=0.5, janela=10, amostras_minimas=10)
+    for status in [503] * 4 + [200] * 5:
+        disjuntor.registrar(status)
+    assert disjuntor.fechado
+
+    disjuntor.registrar(None)
+    assert disjuntor.estado == cnes.CircuitBreaker.ABERTO
+    assert disjuntor.aberturas == 1
+
+
+def test_404_nao_conta_como_falha():
+    assert not cnes.CircuitBreaker.eh_falha(404)
+    assert not cnes.CircuitBreaker.eh_falha(200)
+    assert all(cnes.CircuitBreaker.eh_falha(status) for status in (429, 500, 503, None))
+
+    disjuntor = cnes.CircuitBreaker(janela=10, amostras_minimas=10)
+    for _ in range(20):
+        disjuntor.registrar(404)
+    assert disjuntor.fechado
+
+
+def test_sonda_bem_sucedida_fecha():
+    disjuntor = disjuntor_aberto(pausa_segundos=0.05)
+    # Respostas de requisições despachadas antes da abertura são ignoradas
+    disjuntor.registrar(200)
+    assert disjuntor.estado == cnes.CircuitBreaker.ABERTO
+
+    inicio = time.monotonic()
+    sonda = asyncio.run(disjuntor.aguardar_vez())
+    assert sonda
+    assert time.monotonic() - inicio >= 0.04
+    assert disjuntor.estado == cnes.CircuitBreaker.MEIO_ABERTO
+
+    disjuntor.registrar(200, sonda=True)
+    assert disjuntor.fechado
+    assert disjuntor.resumo()['sondas'] == 1
+    assert disjuntor.resumo()['tempo_aberto_segundos'] >= 0.04
+
+
+def test_sonda_com_falha_dobra_a_pausa_ate_desistir():
+    disjuntor = disjuntor_aberto(pausa_segundos=0.05, tempo_maximo_aberto_segundos=0.2)
+
+    async def sondar_ate_desistir():
+        desistencia = asyncio.ensure_future(disjuntor.aguardar_desistencia())
+        pausas = []
+        while not disjuntor.esgotado:
+            assert await disjuntor.aguardar_vez()
+            disjuntor.registrar(503, sonda=True)
+            pausas.append(disjuntor.pausa_segundos)
+        await asyncio.wait_for(desistencia, 1)
+        return pausas
+
+    pausas = asyncio.run(sondar_ate_desistir())
+
+    assert pausas[:2] == [0.1, 0.2]
+    assert disjuntor.resumo()['sondas_falhas'] == len(pausas)
+    assert disjuntor.estado == cnes.CircuitBreaker.ABERTO
+
+
+def test_liberar_sonda_passa_a_vez_para_a_proxima_requisicao():
+    disjuntor = disjuntor_aberto(pausa_segundos=0.01)
+    assert asyncio.run(disjuntor.aguardar_vez())
+
+    disjuntor.liberar_sonda()
+
+    assert disjuntor.estado == cnes.CircuitBreaker.ABERTO
+    assert asyncio.run(asyncio.wait_for(disjuntor.aguardar_vez(), 0.05))
+
+
+def test_desabilitado_nunca_abre():
+    disjuntor = cnes.CircuitBreaker(janela=10, amostras_minimas=10, habilitado=False)
+    for _ in range(50):
+        disjuntor.registrar(503)
+
+    assert disjuntor.fechado
+
+
+@pytest.mark.parametrize('opcoes', [
+    {'taxa_erro_limite': 0},
+    {'taxa_erro_limite': 1.5},
+    {'pausa_segundos': 0},
+    {'pausa_segundos': 10, 'tempo_maximo_aberto_segundos': 5}
+])
+def test_parametros_invalidos(opcoes):
+    with pytest.raises(ValueError):
+        cnes.CircuitBreaker(**opcoes)
+
+
+def test_api_que_volta_a_responder_fecha_o_disjuntor(com_mock, automatizador, codigos_estado, monkeypatch):
+    responder = cnes.MockCNESServer._responder
+    fora_do_ar_ate = []
+
+    async def responder_com_queda(self, request):
+        from aiohttp import web
+        if time.monotonic() < fora_do_ar_ate[0]:
+            self.contagens['requisicoes'] += 1
+            return web.json_response({'detail': 'Service Unavailable'}, status=503)
+        return await responder(self, request)
+
+    monkeypatch.setattr(cnes.MockCNESServer, '_responder', responder_com_queda)
+
+    async def executar(servidor, url):
+        fora_do_ar_ate.append(time.monotonic() + 0.3)
+        automator = automatizador(url, concurrent_requests=10, conexoes_pre_aquecidas=0, disjuntor_pausa_segundos=0.05,
+                                  retry_policy=cnes.RetryPolicy(max_tentativas=6, atraso_base=0.01))
+        return await automator.processar_lista_codigos(codigos_estado[:40])
+
+    resultado = com_mock(executar)
+
+    disjuntor = resultado['metadados']['configuracao_performance']['disjuntor']
+    assert disjuntor['aberturas'] >= 1
+    assert disjuntor['estado'] == 'fechado'
+    assert not disjuntor['esgotado']
+    assert resultado['resumo']['total_sucessos'] == 40
+
+
+def test_desistencia_preserva_o_snapshot_do_delta(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:20]
+
+    async def executar(servidor, url, **opcoes):
+        snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+        destino = cnes.DeltaResultWriter(cnes.StreamingResultWriter('delta.json'), snapshot, escopo='fetch:codigos')
+        try:
+            return await automatizador(url, **opcoes).processar_lista_codigos(codigos, destino=destino)
+        finally:
+            snapshot.fechar()
+
+    com_mock(executar)
+    inicio = time.monotonic()
+    resultado = com_mock(lambda servidor, url: executar(
+        servidor, url, disjuntor_pausa_segundos=0.05, disjuntor_tempo_maximo=0.3,
+        retry_policy=cnes.RetryPolicy(max_tentativas=10, atraso_base=0.01)
+    ), taxa_5xx=1.0)
+
+    assert time.monotonic() - inicio < 5
+    assert resultado['metadados']['configuracao_performance']['disjuntor']['esgotado']
+    assert resultado['resumo']['total_nao_concluidos'] > 0
+    assert resultado['verificacao']['delta']['removidos'] == 0
+    snapshot = cnes.CNESSnapshotStore('snapshot.sqlite3')
+    try:
+        assert len(snapshot.carregar('fetch:codigos')) == 20
+    finally:
+        snapshot.fechar()
+
+
+def test_subcomando_mantem_o_journal_quando_o_disjuntor_desiste(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(20, taxa_5xx=1.0)
+    arquivo_codigos(20)
+
+    assert not cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['fetch', 'codigos.json', '--url-api', url, '--cache-validade-horas', '0', '--disjuntor-pausa', '0.05',
+         '--disjuntor-tempo-maximo', '0.3', '--max-tentativas', '10', '-y']
+    ))
+
+    assert len(glob.glob('cnes_journal_codigos*.jsonl')) == 1
@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+import pytest
+
+import cnes_automator_fast as cnes
+from conftest import ler_jsonl
+
+
+def escrever(arquivo, formato=None):
+    escritor = cnes.StreamingResultWriter(arquivo, formato=formato)
+    for numero in range(3):
+        escritor.escrever_estabelecimento({'codigo_cnes': numero, 'nome_fantasia': f'UNIDADE {numero}'})
+    escritor.escrever_erro({'codigo_cnes': '9999999', 'status_code': 404})
+    return escritor.finalizar({'fonte_api': 'mock'}, {'total_sucessos': 3})
+
+
+def test_json_equivale_ao_documento_completo():
+    verificacao = escrever('saida.json')
+
+    with open('saida.json', 'rb') as arquivo:
+        conteudo = arquivo.read()
+    assert json.loads(conteudo) == {
+        'estabelecimentos': [{'codigo_cnes': numero, 'nome_fantasia': f'UNIDADE {numero}'} for numero in range(3)],
+        'erros': [{'codigo_cnes': '9999999', 'status_code': 404}],
+        'metadados': {'fonte_api': 'mock'},
+        'resumo': {'total_sucessos': 3}
+    }
+    assert verificacao['bytes'] == len(conteudo)
+    assert verificacao['sha256'] == hashlib.sha256(conteudo).hexdigest()
+    assert (verificacao['registros'], verificacao['erros']) == (3, 1)
+
+
+def test_jsonl_grava_metadados_no_arquivo_auxiliar():
+    verificacao = escrever('saida.jsonl')
+
+    assert [registro['codigo_cnes'] for registro in ler_jsonl('saida.jsonl')] == [0, 1, 2]
+    with open('saida_meta.json', 'r', encoding='utf-8') as arquivo:
+        meta = json.load(arquivo)
+    assert meta['erros'] == [{'codigo_cnes': '9999999', 'status_code': 404}]
+    assert meta['verificacao']['sha256'] == verificacao['sha256']
+
+
+def test_saida_vazia_e_json_valido():
+    cnes.StreamingResultWriter('vazia.json').finalizar({})
+
+    with open('vazia.json', 'r', encoding='utf-8') as arquivo:
+        assert json.load(arquivo) == {'estabelecimentos': [], 'erros': [], 'metadados': {}}
+
+
+def test_formato_invalido():
+    with pytest.raises(ValueError):
+        cnes.StreamingResultWriter('saida.xml', formato='xml')
+
+
+def test_consulta_grava_direto_no_destino(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:15] + ['9999999']
+
+    async def executar(servidor, url):
+        destino = cnes.criar_escritor_resultados('resultados.jsonl')
+        return await automatizador(url).processar_lista_codigos(codigos, destino=destino)
+
+    resultado = com_mock(executar)
+
+    assert 'estabelecimentos' not in resultado
+    assert resultado['verificacao']['registros'] == 15
+    assert sorted(registro['_metadata']['codigo_cnes_consultado'] for registro in ler_jsonl('resultados.jsonl')) \
+        == sorted(codigos[:15])
+    with open('resultados_meta.json', 'r', encoding='utf-8') as arquivo:
+        meta = json.load(arquivo)
+    assert [erro['codigo_cnes'] for erro in meta['erros']] == ['9999999']
+    assert meta['resumo']['total_sucessos'] == 15
@@ -0,0 +1,85 @@
+import csv
+import json
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def registro(codigo_cnes, **campos):
+    return {'codigo_cnes': codigo_cnes, 'codigo_municipio': 110001, 'nome_fantasia': f'UNIDADE {codigo_cnes}', **campos}
+
+
+def test_achatar_sobe_a_macrorregiao_e_serializa_listas():
+    linha = cnes.achatar_estabelecimento({
+        'codigo_cnes': 1,
+        'codigo_municipio': 110001,
+        'uf': 'RO',
+        'servicos': [{'codigo': 159}],
+        '_metadata': {'origem': 'cache'},
+        'dados_macrorregiao': {'regiao_saude': 'ZONA DA MATA', 'uf': 'Rondônia', 'codigo_municipio': 110001}
+    })
+
+    assert linha['servicos'] == '[{"codigo":159}]'
+    assert linha['metadata_origem'] == 'cache'
+    assert linha['regiao_saude'] == 'ZONA DA MATA'
+    # Um campo de mesmo nome vindo da API não é sobrescrito
+    assert (linha['uf'], linha['macrorregiao_uf']) == ('RO', 'Rondônia')
+    assert linha['populacao_estimada_ibge_2022'] is None
+    assert 'dados_macrorregiao' not in linha
+
+
+def test_csv_em_grupos_com_colunas_do_primeiro_grupo():
+    escritor = cnes.ColumnarResultWriter('saida.csv', linhas_por_grupo=2)
+    escritor.escrever_estabelecimento(registro(1))
+    escritor.escrever_estabelecimento(registro(2, codigo_municipio='110002'))
+    escritor.escrever_estabelecimento(registro(3, codigo_municipio='sem código'))
+    escritor.escrever_estabelecimento(registro(4, telefone='(69)3441-1234'))
+    escritor.escrever_erro({'codigo_cnes': '9999999', 'status_code': 404})
+    verificacao = escritor.finalizar({'fonte_api': 'mock'})
+
+    with open('saida.csv', 'r', encoding='utf-8', newline='') as arquivo:
+        linhas = list(csv.DictReader(arquivo))
+    assert [linha['codigo_municipio'] for linha in linhas] == ['110001', '110002', '', '110001']
+    assert list(linhas[0]) == ['codigo_cnes', 'codigo_municipio', 'nome_fantasia']
+    assert verificacao['grupos'] == 2
+    assert verificacao['colunas']['codigo_municipio'] == 'int'
+    assert verificacao['valores_incompativeis'] == {'codigo_municipio': 1}
+    assert verificacao['colunas_descartadas'] == {'telefone': 1}
+    with open('saida_meta.json', 'r', encoding='utf-8') as arquivo:
+        assert json.load(arquivo)['erros'] == [{'codigo_cnes': '9999999', 'status_code': 404}]
+
+
+def test_parquet_sem_pyarrow_grava_csv():
+    try:
+        import pyarrow  # noqa: F401
+        pytest.skip("pyarrow instalado")
+    except ImportError:
+        pass
+
+    escritor = cnes.criar_escritor_resultados('saida.parquet')
+    escritor.escrever_estabelecimento(registro(1))
+    verificacao = escritor.finalizar({})
+
+    assert verificacao['formato'] == 'csv'
+    assert verificacao['arquivo'] == 'saida.csv'
+
+
+@pytest.mark.parametrize('formato', ['parquet', 'arrow'])
+def test_tabela_arrow_tipada(formato):
+    pa = pytest.importorskip('pyarrow')
+
+    escritor = cnes.ColumnarResultWriter(f'saida.{formato}', linhas_por_grupo=2)
+    for codigo in range(5):
+        escritor.escrever_estabelecimento(registro(codigo, latitude_estabelecimento_decimo_grau=-11))
+    escritor.finalizar({})
+
+    if formato == 'parquet':
+        import pyarrow.parquet
+        tabela = pyarrow.parquet.read_table('saida.parquet')
+    else:
+        with pa.memory_map('saida.arrow') as arquivo:
+            tabela = pa.ipc.open_file(arquivo).read_all()
+    assert tabela.num_rows == 5
+    assert tabela.schema.field('codigo_cnes').type == pa.int64()
+    assert tabela.schema.field('latitude_estabelecimento_decimo_grau').type == pa.float64()
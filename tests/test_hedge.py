@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def test_orcamento_limita_as_copias():
+    hedge = cnes.HedgePolicy(habilitado=True, orcamento=0.05)
+
+    hedge.requisicoes = 19
+    assert not hedge.permitir()
+    hedge.requisicoes = 20
+    assert hedge.permitir()
+
+    hedge.disparados = 1
+    hedge.requisicoes = 39
+    assert not hedge.permitir()
+    hedge.requisicoes = 40
+    assert hedge.permitir()
+    assert hedge.resumo()['taxa_extra'] == '2.5%'
+
+
+def test_atraso_e_o_percentil_das_latencias_recentes():
+    controle = cnes.AdaptiveTimeout(percentil_hedge=0.9)
+    for latencia in range(1, 21):
+        controle.registrar(latencia / 100)
+
+    assert cnes.HedgePolicy(habilitado=False, percentil=0.9).atraso(controle) is None
+    assert cnes.HedgePolicy(habilitado=True, percentil=0.9).atraso(controle) == pytest.approx(0.19)
+    # Sem latências suficientes, não há referência para a cópia
+    assert cnes.HedgePolicy(habilitado=True).atraso(cnes.AdaptiveTimeout()) is None
+
+
+@pytest.mark.parametrize('percentil', [0, 1, 1.5])
+def test_percentil_invalido(percentil):
+    with pytest.raises(ValueError):
+        cnes.HedgePolicy(percentil=percentil)
+
+
+def test_espera_prioritaria_passa_a_frente_das_comuns():
+    async def executar():
+        controlador = cnes.AdaptiveConcurrencyController(1, adaptativo=False)
+        assert controlador.tentar_ocupar()
+        assert not controlador.tentar_ocupar()
+        ordem = []
+
+        async def comum():
+            async with controlador:
+                ordem.append('comum')
+
+        async def prioritaria():
+            await controlador.ocupar_com_prioridade()
+            ordem.append('prioritaria')
+            await controlador.liberar()
+
+        # A requisição comum começa a esperar antes da prioritária
+        tarefa_comum = asyncio.create_task(comum())
+        await asyncio.sleep(0)
+        tarefa_prioritaria = asyncio.create_task(prioritaria())
+        await asyncio.sleep(0)
+
+        await controlador.liberar()
+        await asyncio.wait_for(asyncio.gather(tarefa_comum, tarefa_prioritaria), 1)
+        return ordem, controlador.em_uso
+
+    assert asyncio.run(executar()) == (['prioritaria', 'comum'], 0)
+
+
+def test_vaga_reservada_nao_e_ocupada_por_tentar_ocupar():
+    async def executar():
+        controlador = cnes.AdaptiveConcurrencyController(2, adaptativo=False)
+        assert controlador.tentar_ocupar() and controlador.tentar_ocupar()
+        espera = asyncio.create_task(controlador.ocupar_com_prioridade())
+        await asyncio.sleep(0)
+
+        await controlador.liberar()
+        # A vaga liberada está reservada para a espera prioritária
+        livre_para_comuns = controlador.tentar_ocupar()
+        await asyncio.wait_for(espera, 1)
+        return livre_para_comuns, controlador.em_uso
+
+    assert asyncio.run(executar()) == (False, 2)
+
+
+def test_copias_cortam_a_cauda_dentro_do_orcamento(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=10, hedge=True, hedge_percentil=0.9, hedge_orcamento=0.2)
+        resultado = await automator.processar_lista_codigos(codigos_estado[:200])
+        return resultado, automator.texto_metricas()
+
+    resultado, texto = com_mock(executar, quantidade=200, latencia_p50_ms=2, latencia_p95_ms=40)
+
+    assert resultado['resumo']['total_sucessos'] == 200
+    hedge = resultado['metadados']['configuracao_performance']['hedge']
+    assert hedge['disparados'] > 0
+    assert hedge['vencedores'] > 0
+    assert hedge['disparados'] <= 0.2 * hedge['requisicoes']
+    estatisticas = resultado['metadados']['estatisticas']
+    assert (estatisticas['hedges'], estatisticas['hedges_vencedores']) == (hedge['disparados'], hedge['vencedores'])
+    # Cada cópia deixa uma requisição descartada (a perdedora) nas métricas
+    metricas = resultado['metadados']['metricas']
+    assert metricas['latencia_por_classe']['descartada']['total'] == hedge['disparados']
+    assert metricas['em_andamento_maximo'] <= 10
+    assert f'cnes_hedges_total{{resultado="disparado"}} {hedge["disparados"]}' in texto.splitlines()
+
+
+def test_sem_hedge_nenhuma_copia(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        return await automatizador(url).processar_lista_codigos(codigos_estado[:40])
+
+    resultado = com_mock(executar, latencia_p50_ms=2, latencia_p95_ms=40)
+
+    assert resultado['metadados']['configuracao_performance']['hedge']['disparados'] == 0
+    assert 'descartada' not in resultado['metadados']['metricas']['latencia_por_classe']
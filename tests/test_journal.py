@@ -0,0 +1,100 @@
+import glob
+import json
+import os
+
+import cnes_automator_fast as cnes
+from conftest import ler_jsonl
+
+
+def test_linha_truncada_e_descartada_ao_reabrir():
+    journal = cnes.CheckpointJournal('journal.jsonl', arquivo_entrada='codigos.json')
+    journal.registrar('0000001', True, {'codigo_cnes': 1}, 1)
+    journal.fechar()
+    with open('journal.jsonl', 'ab') as arquivo:
+        arquivo.write(b'{"tipo": "resultado", "codigo_cnes": "00000')
+
+    journal = cnes.CheckpointJournal('journal.jsonl')
+    journal.registrar('0000002', True, {'codigo_cnes': 2}, 2)
+    journal.fechar()
+
+    entradas = ler_jsonl('journal.jsonl')
+    assert entradas[0]['tipo'] == 'cabecalho' and entradas[0]['arquivo_entrada'] == 'codigos.json'
+    assert [entrada['codigo_cnes'] for entrada in entradas[1:]] == ['0000001', '0000002']
+    journal = cnes.CheckpointJournal('journal.jsonl')
+    journal.fechar()
+    assert set(journal.concluidos) == {'0000001', '0000002'}
+
+
+def test_apenas_resultados_definitivos_dispensam_nova_consulta():
+    def entrada(sucesso, classe_erro=None, **extras):
+        return {'sucesso': sucesso, 'registro': {'classe_erro': classe_erro}, **extras}
+
+    assert cnes.CheckpointJournal.eh_definitivo(entrada(True))
+    assert cnes.CheckpointJournal.eh_definitivo(entrada(False, 'nao_encontrado'))
+    assert not cnes.CheckpointJournal.eh_definitivo(entrada(False, 'http'))
+    assert not cnes.CheckpointJournal.eh_definitivo(entrada(False, 'timeout'))
+    assert not cnes.CheckpointJournal.eh_definitivo(entrada(True, definitivo=False))
+
+
+def test_novo_arquivo_nao_reaproveita_journal_existente():
+    primeiro = cnes.CheckpointJournal.novo_arquivo()
+    open(primeiro, 'w').close()
+
+    assert cnes.CheckpointJournal.novo_arquivo() != primeiro
+
+
+def test_retomada_consulta_so_os_pendentes_e_os_erros_transitorios(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:20] + ['9999999']
+
+    async def primeira_execucao(servidor, url):
+        journal = cnes.CheckpointJournal('journal.jsonl')
+        automator = automatizador(url, retry_policy=cnes.RetryPolicy(max_tentativas=1), disjuntor=False)
+        # Execução interrompida depois dos 10 primeiros códigos, com alguns 503
+        resultado = await automator.processar_lista_codigos(codigos[:10] + ['9999999'], journal=journal)
+        journal.fechar()
+        return resultado
+
+    async def retomada(servidor, url):
+        journal = cnes.CheckpointJournal('journal.jsonl')
+        resultado = await automatizador(url).processar_lista_codigos(codigos, journal=journal)
+        journal.fechar()
+        return resultado
+
+    primeira = com_mock(primeira_execucao, taxa_5xx=0.3)
+    transitorios = [erro['codigo_cnes'] for erro in primeira['erros'] if erro['status_code'] == 503]
+    assert transitorios
+
+    resultado = com_mock(retomada)
+
+    retomados = resultado['metadados']['journal']['codigos_retomados']
+    assert retomados == 11 - len(transitorios)
+    assert resultado['metadados']['estatisticas']['total_requisicoes'] == 10 + len(transitorios)
+    assert resultado['resumo']['total_sucessos'] == 20
+    assert [erro['codigo_cnes'] for erro in resultado['erros']] == ['9999999']
+
+
+def test_subcomando_resume_conclui_execucao_interrompida_pelo_prazo(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(latencia_p50_ms=100, latencia_p95_ms=100)
+    comuns = ['--url-api', url, '--cache-validade-horas', '0', '-c', '2', '-y']
+    arquivo_codigos(40)
+
+    parser = cnes.criar_parser()
+    assert not cnes.executar_subcomando(parser.parse_args(['fetch', 'codigos.json', '--prazo-segundos', '0.5'] + comuns))
+    journals = glob.glob('cnes_journal_codigos*.jsonl')
+    assert len(journals) == 1
+    journal = cnes.CheckpointJournal(journals[0])
+    journal.fechar()
+    concluidos_antes = len(journal.concluidos)
+    assert 0 < concluidos_antes < 40
+
+    for saida in glob.glob('cnes_resultados_codigos_*.json'):
+        os.remove(saida)
+    assert cnes.executar_subcomando(parser.parse_args(['resume', journals[0]] + comuns))
+
+    assert not os.path.exists(journals[0])
+    saidas = glob.glob('cnes_resultados_codigos_*.json')
+    with open(saidas[0], 'r', encoding='utf-8') as arquivo:
+        saida = json.load(arquivo)
+    assert len(saida['estabelecimentos']) == 40
+    assert saida['metadados']['journal']['codigos_retomados'] == concluidos_antes
+    assert saida['metadados']['codigos_nao_concluidos'] == []
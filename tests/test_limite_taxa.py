@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def test_token_bucket_respeita_a_taxa_depois_da_rajada():
+    limitador = cnes.TokenBucketRateLimiter(20, capacidade=2)
+
+    async def adquirir(quantidade):
+        inicio = time.monotonic()
+        for _ in range(quantidade):
+            await limitador.adquirir()
+        return time.monotonic() - inicio
+
+    # 2 tokens da rajada + 6 a 20/s
+    assert asyncio.run(adquirir(8)) >= 0.25
+    assert limitador.tempo_total_espera > 0
+
+
+def test_token_bucket_tentar_adquirir_nao_espera():
+    limitador = cnes.TokenBucketRateLimiter(1, capacidade=1)
+
+    assert limitador.tentar_adquirir()
+    assert not limitador.tentar_adquirir()
+
+
+def test_token_bucket_rejeita_taxa_invalida():
+    with pytest.raises(ValueError):
+        cnes.TokenBucketRateLimiter(0)
+
+
+def test_aimd_aumenta_em_janela_saudavel_e_reduz_em_congestionamento():
+    controlador = cnes.AdaptiveConcurrencyController(4, limite_minimo=1, limite_maximo=8)
+
+    for _ in range(4):
+        controlador.registrar_resposta(200, 1.0)
+    assert int(controlador.limite) == 5
+
+    controlador.registrar_resposta(503, 1.0)
+    assert int(controlador.limite) == 2
+    # A mesma rajada de falhas (dentro da janela de latência) reduz uma vez só
+    controlador.registrar_resposta(None, 1.0)
+    controlador.registrar_resposta(429, 1.0)
+    assert int(controlador.limite) == 2
+    assert controlador.resumo()['reducoes'] == 1
+    assert controlador.resumo()['maior_limite_atingido'] == 5
+
+
+def test_aimd_nao_passa_dos_limites():
+    controlador = cnes.AdaptiveConcurrencyController(2, limite_minimo=2, limite_maximo=3)
+
+    for _ in range(20):
+        controlador.registrar_resposta(404, 0.1)
+    assert int(controlador.limite) == 3
+
+    controlador.ultima_reducao = float('-inf')
+    controlador.registrar_resposta(503, 0.1)
+    assert int(controlador.limite) == 2
+
+
+def test_concorrencia_fixa_nunca_muda():
+    controlador = cnes.AdaptiveConcurrencyController(4, adaptativo=False)
+
+    for _ in range(10):
+        controlador.registrar_resposta(200, 0.1)
+    controlador.registrar_resposta(503, 0.1)
+    assert int(controlador.limite) == 4
+
+
+def test_automatizador_respeita_requisicoes_por_segundo(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:30]
+
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=10, requests_per_second=20)
+        inicio = time.monotonic()
+        resultado = await automator.processar_lista_codigos(codigos)
+        return resultado, time.monotonic() - inicio
+
+    resultado, duracao = com_mock(executar)
+
+    assert resultado['resumo']['total_sucessos'] == 30
+    # Rajada de 20 tokens e os 10 restantes a 20/s
+    assert duracao >= 0.45
+    limite_taxa = resultado['metadados']['configuracao_performance']['limite_taxa']
+    assert limite_taxa['requisicoes_por_segundo_alvo'] == 20
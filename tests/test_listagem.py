@@ -0,0 +1,116 @@
+import glob
+import json
+
+import cnes_automator_fast as cnes
+
+TELEFONE = 'numero_telefone_estabelecimento'
+
+
+def falhar_consultas_individuais(monkeypatch):
+    """
+    Faz o mock responder 503 às consultas por código, mantendo a listagem funcionando
+    """
+    responder = cnes.MockCNESServer._responder
+
+    async def responder_sem_detalhe(self, request):
+        from aiohttp import web
+        if 'codigo' in request.match_info:
+            self.contagens['requisicoes'] += 1
+            return web.json_response({'detail': 'Service Unavailable'}, status=503)
+        return await responder(self, request)
+
+    monkeypatch.setattr(cnes.MockCNESServer, '_responder', responder_sem_detalhe)
+    return lambda: monkeypatch.setattr(cnes.MockCNESServer, '_responder', responder)
+
+
+def test_listagem_pagina_ate_o_fim_sem_duplicatas(com_mock, automatizador):
+    async def executar(servidor, url):
+        automator = automatizador(url, limite_pagina=7, concurrent_requests=3, complementar_listagem=False)
+        return await automator.processar_listagem({'codigo_uf': 11})
+
+    resultado = com_mock(executar)
+
+    codigos = [estabelecimento.codigo_cnes for estabelecimento in resultado['estabelecimentos']]
+    assert len(codigos) == len(set(codigos)) == 40
+    listagem = resultado['metadados']['listagem']
+    assert listagem['concluida']
+    assert listagem['registros_recebidos'] == 40
+    assert listagem['paginas'] >= 6
+    assert listagem['complementados'] == 0
+    # Uma requisição por página, nenhuma por código
+    assert resultado['metadados']['estatisticas']['tentativas'] == listagem['paginas']
+
+
+def test_listagem_por_municipio(com_mock, automatizador):
+    async def executar(servidor, url):
+        municipio = servidor._registros_listagem[0]['codigo_municipio']
+        esperados = {registro['codigo_cnes'] for registro in servidor._registros_listagem
+                     if registro['codigo_municipio'] == municipio}
+        resultado = await automatizador(url, limite_pagina=5).processar_listagem({'codigo_municipio': municipio})
+        return esperados, resultado
+
+    esperados, resultado = com_mock(executar)
+
+    assert {int(estabelecimento.codigo_cnes) for estabelecimento in resultado['estabelecimentos']} == esperados
+
+
+def test_campos_fora_da_listagem_vem_da_consulta_individual(com_mock, automatizador):
+    async def executar(servidor, url):
+        automator = automatizador(url, limite_pagina=10, campos_detalhe=[TELEFONE])
+        return await automator.processar_listagem({'codigo_uf': 11})
+
+    resultado = com_mock(executar, campos_fora_da_listagem=(TELEFONE,))
+
+    assert resultado['metadados']['listagem']['complementados'] == 40
+    registro = resultado['estabelecimentos'][0].para_dict()
+    assert registro[TELEFONE] == '(69)3441-1234'
+    assert registro['_metadata']['origem'] == 'listagem+detalhe'
+
+
+def test_complemento_com_falha_transitoria_e_refeito_na_retomada(com_mock, automatizador, monkeypatch):
+    restaurar = falhar_consultas_individuais(monkeypatch)
+
+    async def executar(servidor, url):
+        journal = cnes.CheckpointJournal('journal.jsonl')
+        try:
+            # Sem disjuntor: os 503 das consultas individuais o abririam e pausariam a execução
+            automator = automatizador(url, limite_pagina=10, campos_detalhe=[TELEFONE], disjuntor=False,
+                                      retry_policy=cnes.RetryPolicy(max_tentativas=2, atraso_base=0.01))
+            return await automator.processar_listagem({'codigo_uf': 11}, journal=journal)
+        finally:
+            journal.fechar()
+
+    opcoes_mock = {'quantidade': 20, 'campos_fora_da_listagem': (TELEFONE,)}
+    primeira = com_mock(executar, **opcoes_mock)
+
+    # Sem o complemento, os estabelecimentos são gravados só com os dados da listagem
+    assert primeira['metadados']['listagem']['complementos_falhos'] == 20
+    assert primeira['resumo']['total_sucessos'] == 20
+    assert all(estabelecimento.get(TELEFONE) is None for estabelecimento in primeira['estabelecimentos'])
+    journal = cnes.CheckpointJournal('journal.jsonl')
+    journal.fechar()
+    assert not any(cnes.CheckpointJournal.eh_definitivo(entrada) for entrada in journal.concluidos.values())
+
+    restaurar()
+    segunda = com_mock(executar, **opcoes_mock)
+
+    assert segunda['metadados']['journal']['codigos_retomados'] == 0
+    assert segunda['metadados']['listagem']['complementados'] == 20
+    assert all(estabelecimento.get(TELEFONE) for estabelecimento in segunda['estabelecimentos'])
+
+
+def test_subcomando_fetch_por_uf(mock_em_processo):
+    url = mock_em_processo(25)
+
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['fetch', '--uf', '11', '--limite-pagina', '4', '--sem-complemento', '--url-api', url,
+         '--cache-validade-horas', '0', '-y']
+    ))
+
+    saidas = glob.glob('cnes_resultados_uf11_*.json')
+    assert len(saidas) == 1
+    with open(saidas[0], 'r', encoding='utf-8') as arquivo:
+        saida = json.load(arquivo)
+    assert len(saida['estabelecimentos']) == 25
+    assert saida['metadados']['listagem']['filtros'] == {'codigo_uf': 11}
+    assert not glob.glob('cnes_journal_*')
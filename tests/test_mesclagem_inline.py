@@ -0,0 +1,55 @@
+import glob
+import json
+
+import cnes_automator_fast as cnes
+from conftest import ARQUIVO_MACRORREGIAO
+
+
+def ler_saida(padrao):
+    arquivos = glob.glob(padrao)
+    assert len(arquivos) == 1, arquivos
+    with open(arquivos[0], 'r', encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def test_registros_sao_mesclados_durante_a_consulta(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:20]
+
+    async def executar(servidor, url):
+        automator = automatizador(url, merger=cnes.CNESMacrorregiaeMerger(ARQUIVO_MACRORREGIAO))
+        return await automator.processar_lista_codigos(codigos)
+
+    resultado = com_mock(executar)
+
+    assert len(resultado['estabelecimentos']) == 20
+    for estabelecimento in resultado['estabelecimentos']:
+        assert estabelecimento.mesclado
+        assert estabelecimento.dados_macrorregiao['codigo_municipio'] == estabelecimento.get('codigo_municipio')
+    metadados = resultado['metadados_mesclagem']
+    assert metadados['modo_mesclagem'] == 'durante_consulta'
+    assert metadados['estatisticas']['mesclagens_bem_sucedidas'] == 20
+
+
+def test_run_equivale_a_fetch_seguido_de_merge(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(20, taxa_404=0.1)
+    arquivo_codigos(20)
+    comuns = ['--url-api', url, '--cache-validade-horas', '0', '--macrorregiao', ARQUIVO_MACRORREGIAO, '-y']
+    parser = cnes.criar_parser()
+
+    assert cnes.executar_subcomando(parser.parse_args(['run', 'codigos.json', '--diretorio-saida', 'run'] + comuns))
+    assert cnes.executar_subcomando(parser.parse_args(['fetch', 'codigos.json', '--diretorio-saida', 'fetch'] + comuns))
+    saida_fetch = glob.glob('fetch/cnes_resultados_codigos_*.json')[0]
+    assert cnes.executar_subcomando(parser.parse_args(['merge', saida_fetch, '--diretorio-saida', 'merge'] + comuns))
+
+    inline = ler_saida('run/cnes_com_macrorregiao_codigos_*.json')
+    em_arquivo = ler_saida('merge/cnes_resultados_codigos_*_com_macrorregiao.json')
+
+    def por_codigo(registros):
+        return {registro['codigo_cnes']: registro for registro in registros}
+
+    assert inline['estabelecimentos_com_macrorregiao']
+    assert por_codigo(inline['estabelecimentos_com_macrorregiao']) == por_codigo(em_arquivo['estabelecimentos_com_macrorregiao'])
+    assert (sorted(erro['codigo_cnes'] for erro in inline['erros_originais'])
+            == sorted(erro['codigo_cnes'] for erro in em_arquivo['erros_originais']))
+    assert inline['metadados_mesclagem']['estatisticas']['mesclagens_bem_sucedidas'] \
+        == em_arquivo['metadados_mesclagem']['estatisticas']['mesclagens_bem_sucedidas']
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+import cnes_automator_fast as cnes
+from conftest import ARQUIVO_MACRORREGIAO
+
+
+@pytest.fixture
+def merger():
+    return cnes.CNESMacrorregiaeMerger(ARQUIVO_MACRORREGIAO)
+
+
+def mensagens(caplog):
+    return [registro for registro in caplog.records if registro.name == 'CNESMacrorregiaeMerger']
+
+
+def test_mesclagem_nao_registra_log_por_registro(merger, caplog):
+    caplog.set_level(logging.INFO, logger='CNESMacrorregiaeMerger')
+
+    for numero in range(1000):
+        merger.mesclar_dados_unidade({'codigo_cnes': numero, 'codigo_municipio': 110001})
+    for codigo_municipio in range(30):
+        merger.mesclar_dados_unidade({'codigo_cnes': 0, 'codigo_municipio': 900000 + codigo_municipio})
+        merger.mesclar_dados_unidade({'codigo_cnes': 0, 'codigo_municipio': 900000 + codigo_municipio})
+
+    # Só os primeiros municípios não encontrados são avisados individualmente
+    assert len(mensagens(caplog)) == cnes.CNESMacrorregiaeMerger.LIMITE_AVISOS_INDIVIDUAIS
+
+    caplog.clear()
+    merger.registrar_resumo_logs()
+    resumo, nao_encontrados = [registro.getMessage() for registro in mensagens(caplog)]
+    assert '1000' in resumo and '60' in resumo
+    assert '30 códigos de município não encontrados' in nao_encontrados
+    assert 'e mais 10' in nao_encontrados
+    assert merger.total_mesclados_log == 0 and merger.municipios_nao_encontrados_log == {}
+
+
+def test_bloco_de_macrorregiao_e_compartilhado_por_municipio(merger):
+    primeira = merger.mesclar_dados_unidade({'codigo_cnes': 1, 'codigo_municipio': 110001, '_metadata': {}})
+    segunda = merger.mesclar_dados_unidade({'codigo_cnes': 2, 'codigo_municipio': '110001'})
+
+    assert primeira['dados_macrorregiao'] is segunda['dados_macrorregiao']
+    assert primeira['dados_macrorregiao']['codigo_municipio'] == 110001
+    assert '_metadata' not in primeira
+
+
+def test_copiar_define_se_o_registro_recebido_e_alterado(merger):
+    lido_do_arquivo = {'codigo_cnes': 1, 'codigo_municipio': 110001}
+    da_api = {'codigo_cnes': 2, 'codigo_municipio': 110001}
+
+    assert merger.mesclar_dados_unidade(lido_do_arquivo, copiar=False) is lido_do_arquivo
+    assert 'dados_macrorregiao' in lido_do_arquivo
+    assert merger.mesclar_dados_unidade(da_api) is not da_api
+    assert 'dados_macrorregiao' not in da_api
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import cnes_automator_fast as cnes
+from conftest import ARQUIVO_MACRORREGIAO
+
+
+def eventos(arquivo, **opcoes):
+    leitor = cnes.IncrementalJSONReader(arquivo, **opcoes)
+    try:
+        return list(leitor.eventos())
+    finally:
+        leitor.fechar()
+
+
+def test_leitor_emite_itens_e_blocos_com_blocos_pequenos():
+    documento = {
+        'estabelecimentos': [{'nome': 'UNIDADE SÃO JOÃO', 'numero': 12345}, {'nome': 'POSTO Ç', 'numero': -1.5}],
+        'erros': [],
+        'metadados': {'fonte_api': 'mock', 'lista': [1, 2, 3]},
+        'resumo': 7
+    }
+    with open('resultados.json', 'w', encoding='utf-8') as arquivo:
+        json.dump(documento, arquivo, ensure_ascii=False, indent=2)
+
+    # Blocos de 3 bytes cortam números, strings e caracteres UTF-8 no meio
+    assert eventos('resultados.json', tamanho_bloco=3) == [
+        ('item', 'estabelecimentos', documento['estabelecimentos'][0]),
+        ('item', 'estabelecimentos', documento['estabelecimentos'][1]),
+        ('bloco', 'metadados', documento['metadados']),
+        ('bloco', 'resumo', 7)
+    ]
+
+
+def test_leitor_aceita_lista_no_nivel_superior_e_jsonl():
+    with open('lista.json', 'w', encoding='utf-8') as arquivo:
+        json.dump([{'codigo_cnes': 1}, {'codigo_cnes': 2}], arquivo)
+    with open('lista.jsonl', 'w', encoding='utf-8') as arquivo:
+        arquivo.write('{"codigo_cnes": 1}\n\n{"codigo_cnes": 2}\n')
+
+    assert [valor for _, _, valor in eventos('lista.json')] == [{'codigo_cnes': 1}, {'codigo_cnes': 2}]
+    assert eventos('lista.jsonl') == [('item', 'estabelecimentos', {'codigo_cnes': 1}),
+                                      ('item', 'estabelecimentos', {'codigo_cnes': 2})]
+
+
+def test_leitor_rejeita_json_invalido():
+    with open('invalido.json', 'w', encoding='utf-8') as arquivo:
+        arquivo.write('{"estabelecimentos": [{"codigo_cnes": 1} {"codigo_cnes": 2}]}')
+
+    with pytest.raises(ValueError):
+        eventos('invalido.json')
+
+
+@pytest.mark.parametrize('extensao', ['json', 'jsonl'])
+def test_mesclagem_de_arquivo_gravado(extensao):
+    escritor = cnes.StreamingResultWriter(f'resultados.{extensao}')
+    escritor.escrever_estabelecimento({'codigo_cnes': 1, 'codigo_municipio': 110001, '_metadata': {'origem': 'api'}})
+    escritor.escrever_estabelecimento({'codigo_cnes': 2, 'codigo_municipio': 999999})
+    escritor.escrever_erro({'codigo_cnes': '9999999', 'status_code': 404})
+    escritor.finalizar({'fonte_api': 'mock'})
+
+    merger = cnes.CNESMacrorregiaeMerger(ARQUIVO_MACRORREGIAO)
+    resultado = merger.mesclar_arquivo_resultados(f'resultados.{extensao}', 'mesclado.json')
+
+    with open('mesclado.json', 'r', encoding='utf-8') as arquivo:
+        mesclado = json.load(arquivo)
+    encontrado, sem_municipio = mesclado['estabelecimentos_com_macrorregiao']
+    assert '_metadata' not in encontrado
+    assert encontrado['dados_macrorregiao']['regiao_saude'] == 'ZONA DA MATA'
+    assert sem_municipio['dados_macrorregiao'] is None
+    assert mesclado['erros_originais'] == [{'codigo_cnes': '9999999', 'status_code': 404}]
+    assert mesclado['metadados_originais'] == {'fonte_api': 'mock'}
+    estatisticas = resultado['metadados_mesclagem']['estatisticas']
+    assert (estatisticas['mesclagens_bem_sucedidas'], estatisticas['mesclagens_falharam']) == (1, 1)
+    assert estatisticas['codigos_municipio_nao_encontrados'] == ['999999']
@@ -0,0 +1,109 @@
+import gzip
+import zlib
+
+import aiohttp
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def test_percentis_do_histograma_interpolam_no_intervalo():
+    histograma = cnes.LatencyHistogram((0.01, 0.1, 1.0))
+    for valor in [0.005] * 50 + [0.05] * 45 + [0.5] * 5:
+        histograma.registrar(valor)
+
+    assert histograma.percentil(0.5) == pytest.approx(0.01)
+    assert 0.01 < histograma.percentil(0.95) <= 0.1
+    # Nunca acima do máximo observado
+    assert histograma.percentil(0.99) <= 0.5
+    resumo = histograma.resumo()
+    assert resumo['buckets'] == {'0.01': 50, '0.1': 95, '1': 100, '+Inf': 100}
+    assert resumo['maxima_ms'] == 500.0
+    assert cnes.LatencyHistogram().percentil(0.5) is None
+
+
+def test_histograma_reconstruido_do_resumo_soma_com_outro():
+    primeiro, segundo = cnes.LatencyHistogram(), cnes.LatencyHistogram()
+    for valor in (0.003, 0.02, 0.2):
+        primeiro.registrar(valor)
+    for valor in (0.04, 20.0):
+        segundo.registrar(valor)
+
+    somado = cnes.LatencyHistogram.de_resumo(primeiro.resumo())
+    somado.somar(cnes.LatencyHistogram.de_resumo(segundo.resumo()))
+
+    assert somado.contagens == [a + b for a, b in zip(primeiro.contagens, segundo.contagens)]
+    assert somado.total == 5
+    assert somado.maximo == 20.0
+
+
+def test_linhas_prometheus_acumulam_os_buckets():
+    histograma = cnes.LatencyHistogram((0.1, 1.0))
+    histograma.registrar(0.05)
+    histograma.registrar(2.0)
+
+    assert histograma.linhas_prometheus('cnes_teste', 'classe="2xx"') == [
+        'cnes_teste_bucket{classe="2xx",le="0.1"} 1',
+        'cnes_teste_bucket{classe="2xx",le="1"} 1',
+        'cnes_teste_bucket{classe="2xx",le="+Inf"} 2',
+        'cnes_teste_sum{classe="2xx"} 2.050000',
+        'cnes_teste_count{classe="2xx"} 2'
+    ]
+
+
+@pytest.mark.parametrize('codificacao, comprimir', [
+    ('gzip', gzip.compress),
+    ('deflate', zlib.compress),
+    ('deflate', lambda corpo: zlib.compress(corpo)[2:-4]),
+    (None, lambda corpo: corpo)
+], ids=['gzip', 'deflate', 'deflate_cru', 'identity'])
+def test_descomprimir_corpo(codificacao, comprimir):
+    corpo = b'{"codigo_cnes": 2000733}' * 20
+
+    assert cnes.descomprimir_corpo(comprimir(corpo), codificacao) == corpo
+
+
+def test_codificacao_nao_suportada():
+    with pytest.raises(ValueError):
+        cnes.descomprimir_corpo(b'...', 'zstd-desconhecido')
+
+
+def test_metricas_da_execucao_separam_por_classe_e_medem_a_compressao(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        return await automatizador(url, concurrent_requests=4).processar_lista_codigos(codigos_estado[:30] + ['9999999'])
+
+    resultado = com_mock(executar, taxa_404=0.0)
+
+    metricas = resultado['metadados']['metricas']
+    assert metricas['latencia_por_classe']['2xx']['total'] == 30
+    assert metricas['latencia_por_classe']['4xx']['total'] == 1
+    assert metricas['em_andamento_maximo'] <= 4
+    assert metricas['compressao']['respostas_comprimidas'] == 30
+    assert metricas['compressao']['bytes_economizados'] > 0
+    # Com keep-alive, a maior parte das requisições reaproveita as conexões abertas
+    assert metricas['conexoes']['reutilizadas'] > metricas['conexoes']['novas']
+    assert metricas['tempo_primeiro_resultado_ms'] is not None
+
+
+def test_endpoint_metrics_no_formato_do_prometheus(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url)
+        await automator.processar_lista_codigos(codigos_estado[:10])
+        endpoint = cnes.MetricsServer(automator.texto_metricas, 0)
+        url_metricas = await endpoint.iniciar()
+        try:
+            async with aiohttp.ClientSession() as sessao:
+                async with sessao.get(url_metricas) as resposta:
+                    return resposta.status, resposta.headers['Content-Type'], await resposta.text()
+        finally:
+            await endpoint.parar()
+
+    status, tipo, texto = com_mock(executar)
+
+    assert status == 200
+    assert tipo.startswith('text/plain')
+    linhas = texto.splitlines()
+    assert 'cnes_requisicao_duracao_segundos_count{classe="2xx"} 10' in linhas
+    assert 'cnes_codigos_total{resultado="sucessos"} 10' in linhas
+    assert 'cnes_disjuntor_estado{estado="fechado"} 1' in linhas
+    assert all(linha.startswith('# TYPE ') or ' ' in linha for linha in linhas)
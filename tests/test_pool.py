@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+@pytest.fixture
+def pico_em_andamento(monkeypatch):
+    """
+    Conta, no mock, o maior número de requisições atendidas ao mesmo tempo
+    """
+    contagem = {'atual': 0, 'pico': 0}
+    responder = cnes.MockCNESServer._responder
+
+    async def responder_contando(self, request):
+        contagem['atual'] += 1
+        contagem['pico'] = max(contagem['pico'], contagem['atual'])
+        try:
+            return await responder(self, request)
+        finally:
+            contagem['atual'] -= 1
+
+    monkeypatch.setattr(cnes.MockCNESServer, '_responder', responder_contando)
+    return contagem
+
+
+@pytest.mark.parametrize('modo', cnes.CNESAPIAutomator.MODOS_PROCESSAMENTO)
+def test_processa_todos_os_codigos_sem_passar_do_limite(com_mock, automatizador, codigos_estado,
+                                                        pico_em_andamento, modo):
+    codigos = codigos_estado[:40]
+
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=4, modo_processamento=modo,
+                                  delay_between_batches=0.01)
+        return await automator.processar_lista_codigos(codigos)
+
+    resultado = com_mock(executar, latencia_p50_ms=20, latencia_p95_ms=20)
+
+    assert resultado['resumo']['total_sucessos'] == 40
+    assert resultado['resumo']['total_erros'] == 0
+    assert sorted(e.codigo_cnes for e in resultado['estabelecimentos']) == sorted(codigos)
+    # Cada registro guarda a posição do código na lista de entrada
+    for estabelecimento in resultado['estabelecimentos']:
+        assert codigos[estabelecimento.indice_processamento - 1] == estabelecimento.codigo_cnes
+    assert 1 < pico_em_andamento['pico'] <= 4
+
+
+def test_pool_nao_espera_a_requisicao_mais_lenta_de_cada_lote(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:40]
+
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=8)
+        return await automator.processar_lista_codigos(codigos)
+
+    resultado = com_mock(executar, latencia_p50_ms=10, latencia_p95_ms=60)
+
+    comparativo = resultado['metadados']['configuracao_performance']['comparativo_modo_lotes']
+    vazao_pool = resultado['metadados']['configuracao_performance']['requisicoes_por_segundo']
+    assert resultado['resumo']['total_sucessos'] == 40
+    assert vazao_pool > comparativo['requisicoes_por_segundo_estimadas']
+
+
+def test_codigo_inexistente_vira_erro_sem_interromper_os_demais(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:10] + ['9999999']
+
+    async def executar(servidor, url):
+        return await automatizador(url, concurrent_requests=3).processar_lista_codigos(codigos)
+
+    resultado = com_mock(executar)
+
+    assert resultado['resumo']['total_sucessos'] == 10
+    assert [erro['codigo_cnes'] for erro in resultado['erros']] == ['9999999']
+    assert resultado['erros'][0]['status_code'] == 404
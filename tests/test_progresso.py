@@ -0,0 +1,116 @@
+import logging
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(cnes.time, 'monotonic', relogio)
+    return relogio
+
+
+def test_update_so_exibe_uma_vez_por_intervalo(relogio):
+    estados = []
+    progresso = cnes.ProgressTracker(1000, interativo=False, intervalo=1.0, observadores=[estados.append])
+
+    for processados in range(1, 500):
+        progresso.update(processados)
+    assert estados == []
+
+    relogio.agora += 1.0
+    progresso.update(500)
+    progresso.update(501)
+    assert [estado['processados'] for estado in estados] == [500]
+
+    # O último item sempre atualiza, mesmo dentro do intervalo
+    progresso.update(1000)
+    assert estados[-1]['percentual'] == 100.0
+
+
+def test_taxa_ewma_acompanha_a_velocidade_recente(relogio):
+    progresso = cnes.ProgressTracker(10000, interativo=False, intervalo=1.0, constante_tempo=5.0)
+    processados = 0
+    for _ in range(20):
+        relogio.agora += 1.0
+        processados += 100
+        progresso.update(processados)
+    assert progresso.taxa_ewma == pytest.approx(100.0)
+
+    relogio.agora += 1.0
+    progresso.update(processados + 10)
+    # Um intervalo lento puxa a média, mas não a derruba de uma vez
+    assert 10.0 < progresso.taxa_ewma < 100.0
+
+    for _ in range(30):
+        relogio.agora += 1.0
+        processados += 10
+        progresso.update(processados + 10)
+    assert progresso.taxa_ewma == pytest.approx(10.0, rel=0.05)
+    estado = progresso.estado()
+    assert estado['eta_segundos'] == pytest.approx((10000 - processados - 10) / progresso.taxa_ewma, rel=0.01)
+
+
+def test_sem_terminal_registra_linhas_de_log(relogio, caplog, capsys):
+    caplog.set_level(logging.INFO)
+    progresso = cnes.ProgressTracker(10, "Consultando", interativo=False, intervalo=1.0)
+
+    relogio.agora += 2.0
+    progresso.update(4, success_count=3, error_count=1)
+    progresso.update(10, success_count=9, error_count=1)
+    progresso.finish()
+
+    mensagens = [registro.getMessage() for registro in caplog.records]
+    assert 'Consultando | processados=4/10 percentual=40.0 taxa=2.0/s eta=0:00:03 sucessos=3 erros=1' in mensagens
+    assert any('concluido total=10' in mensagem for mensagem in mensagens)
+    assert capsys.readouterr().out == ''
+
+
+def test_terminal_reescreve_a_barra(relogio, capsys):
+    progresso = cnes.ProgressTracker(10, "Consultando", interativo=True)
+
+    relogio.agora += 1.0
+    progresso.update(5)
+
+    saida = capsys.readouterr().out
+    assert saida.startswith('\rConsultando: |' + '█' * 20 + '░' * 20 + '| 5/10 (50.0%)')
+    assert not saida.endswith('\n')
+
+
+def test_observador_com_erro_nao_interrompe(relogio, caplog):
+    def falhar(estado):
+        raise RuntimeError('painel fora do ar')
+
+    estados = []
+    progresso = cnes.ProgressTracker(2, interativo=False, observadores=[falhar])
+    progresso.adicionar_observador(estados.append)
+
+    progresso.update(2)
+    progresso.finish()
+
+    assert [estado['concluido'] for estado in estados] == [False, True]
+    assert any('painel fora do ar' in registro.getMessage() for registro in caplog.records)
+
+
+def test_observadores_recebem_o_progresso_da_consulta(com_mock, automatizador, codigos_estado):
+    estados = []
+
+    async def executar(servidor, url):
+        automator = automatizador(url, observadores_progresso=[estados.append])
+        return await automator.processar_lista_codigos(codigos_estado[:20] + ['9999999'])
+
+    com_mock(executar)
+
+    final = estados[-1]
+    assert final['concluido']
+    assert (final['processados'], final['sucessos'], final['erros']) == (21, 20, 1)
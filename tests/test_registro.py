@@ -0,0 +1,78 @@
+import pytest
+
+import cnes_automator_fast as cnes
+
+URL = 'http://127.0.0.1/cnes/estabelecimentos'
+DADOS = {'codigo_cnes': 2000733, 'codigo_municipio': 110001, 'nome_fantasia': 'UBS CENTRO', 'natureza': None}
+
+
+@pytest.fixture(params=[None, ['nome_fantasia', 'natureza', 'telefone']], ids=['sem_projecao', 'com_projecao'])
+def registro(request):
+    campos = cnes.EstabelecimentoCNES.projetar_campos(request.param)
+    return cnes.EstabelecimentoCNES('2000733', dict(DADOS), URL, campos=campos)
+
+
+def test_get_segue_a_semantica_de_dict_get(registro):
+    assert registro.get('nome_fantasia') == 'UBS CENTRO'
+    # Um null da API não é trocado pelo padrão
+    assert registro.get('natureza', 'padrão') is None
+    assert registro.get('telefone', 'padrão') == 'padrão'
+    assert registro.get('telefone') is None
+
+
+def test_campo_fora_da_projecao_usa_o_padrao():
+    campos = cnes.EstabelecimentoCNES.projetar_campos(['nome_fantasia'])
+    registro = cnes.EstabelecimentoCNES('2000733', dict(DADOS), URL, campos=campos)
+
+    assert campos == ('codigo_cnes', 'codigo_municipio', 'nome_fantasia')
+    assert registro.get('natureza', 'padrão') == 'padrão'
+    assert registro.para_dict(incluir_metadata=False) == {
+        'codigo_cnes': 2000733, 'codigo_municipio': 110001, 'nome_fantasia': 'UBS CENTRO'
+    }
+
+
+def test_projecao_grava_campos_ausentes_como_null():
+    campos = cnes.EstabelecimentoCNES.projetar_campos(['telefone'])
+    registro = cnes.EstabelecimentoCNES('2000733', dict(DADOS), URL, campos=campos)
+
+    assert registro.para_dict(incluir_metadata=False)['telefone'] is None
+
+
+def test_para_dict_e_de_dict_ida_e_volta(registro):
+    registro.registrar_tentativas([{'status_code': 503, 'classe_erro': 'http', 'latencia_ms': 12.5},
+                                   {'status_code': 200, 'classe_erro': None, 'latencia_ms': 8.0}])
+    registro.indice_processamento = 7
+
+    dados = registro.para_dict()
+    metadata = dados['_metadata']
+    assert metadata['url_consultada'] == f'{URL}/2000733'
+    assert metadata['retentativas'] == 1
+
+    copia = cnes.EstabelecimentoCNES.de_dict(dados, URL, registro.campos)
+    assert copia.para_dict() == registro.para_dict()
+    assert copia.indice_processamento == 7
+
+
+def test_registro_mesclado_troca_metadata_pela_macrorregiao(registro):
+    registro.mesclado = True
+    registro.dados_macrorregiao = {'regiao_saude': 'ZONA DA MATA'}
+
+    dados = registro.para_dict()
+    assert '_metadata' not in dados
+    assert dados['dados_macrorregiao'] == {'regiao_saude': 'ZONA DA MATA'}
+
+
+def test_registros_da_mesma_projecao_compartilham_os_campos(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, campos=['nome_fantasia', 'codigo_tipo_unidade'])
+        return await automator.processar_lista_codigos(codigos_estado[:5])
+
+    resultado = com_mock(executar)
+
+    estabelecimentos = resultado['estabelecimentos']
+    assert all(estabelecimento.campos is estabelecimentos[0].campos for estabelecimento in estabelecimentos)
+    assert set(estabelecimentos[0].para_dict(incluir_metadata=False)) == {
+        'codigo_cnes', 'codigo_municipio', 'nome_fantasia', 'codigo_tipo_unidade'
+    }
+    with pytest.raises(AttributeError):
+        estabelecimentos[0].atributo_novo = 1
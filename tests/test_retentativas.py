@@ -0,0 +1,96 @@
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def falha(classe_erro, status=None):
+    return cnes.ResultadoTentativa(False, {}, status, classe_erro)
+
+
+@pytest.mark.parametrize('resultado, retentar', [
+    (falha('nao_encontrado', 404), False),
+    (falha('json_invalido', 200), False),
+    (falha('timeout'), True),
+    (falha('conexao'), True),
+    (falha('http', 503), True),
+    (falha('http', 429), True),
+    (falha('http', 500), False),
+    (cnes.ResultadoTentativa(True, {}, 200), False),
+])
+def test_deve_retentar_por_classe_de_erro(resultado, retentar):
+    assert cnes.RetryPolicy(max_tentativas=3).deve_retentar(resultado, 1) is retentar
+
+
+def test_nao_retenta_depois_da_ultima_tentativa():
+    politica = cnes.RetryPolicy(max_tentativas=3)
+
+    assert politica.deve_retentar(falha('timeout'), 2)
+    assert not politica.deve_retentar(falha('timeout'), 3)
+
+
+def test_atraso_exponencial_com_jitter_e_teto():
+    politica = cnes.RetryPolicy(atraso_base=0.5, atraso_maximo=4.0)
+    random.seed(1)
+
+    for tentativa, teto in ((1, 0.5), (2, 1.0), (3, 2.0), (10, 4.0)):
+        atrasos = [politica.calcular_atraso(tentativa) for _ in range(200)]
+        assert all(0 <= atraso <= teto for atraso in atrasos)
+        assert max(atrasos) > teto / 2
+
+
+def test_retry_after_e_atraso_minimo_limitado():
+    politica = cnes.RetryPolicy(atraso_base=0.1, retry_after_maximo=10.0)
+
+    assert politica.calcular_atraso(1, retry_after=3.0) >= 3.0
+    assert politica.calcular_atraso(1, retry_after=600.0) == 10.0
+    assert cnes.RetryPolicy(respeitar_retry_after=False, atraso_base=0.1).calcular_atraso(1, 3.0) <= 0.1
+
+
+def test_interpretar_retry_after():
+    futuro = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+
+    assert cnes.RetryPolicy.interpretar_retry_after('5') == 5.0
+    assert 25 <= cnes.RetryPolicy.interpretar_retry_after(futuro) <= 30
+    assert cnes.RetryPolicy.interpretar_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert cnes.RetryPolicy.interpretar_retry_after('amanhã') is None
+    assert cnes.RetryPolicy.interpretar_retry_after(None) is None
+
+
+def test_falhas_transitorias_sao_recuperadas(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:40]
+
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=4, disjuntor=False,
+                                  retry_policy=cnes.RetryPolicy(max_tentativas=8, atraso_base=0.001))
+        return await automator.processar_lista_codigos(codigos)
+
+    resultado = com_mock(executar, taxa_5xx=0.3)
+
+    estatisticas = resultado['metadados']['estatisticas']
+    assert resultado['resumo']['total_sucessos'] == 40
+    assert estatisticas['retentativas'] > 0
+    assert estatisticas['recuperados_apos_retentativa'] > 0
+    assert estatisticas['retentativas_esgotadas'] == 0
+
+
+def test_retentativas_esgotadas_guardam_o_historico(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:5]
+
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=2, disjuntor=False,
+                                  retry_policy=cnes.RetryPolicy(max_tentativas=2, atraso_base=0.001))
+        return await automator.processar_lista_codigos(codigos)
+
+    resultado = com_mock(executar, taxa_5xx=1.0)
+
+    estatisticas = resultado['metadados']['estatisticas']
+    assert resultado['resumo']['total_erros'] == 5
+    assert estatisticas['tentativas'] == 10
+    assert estatisticas['retentativas_esgotadas'] == 5
+    for erro in resultado['erros']:
+        assert erro['status_code'] == 503
+        assert [tentativa['tentativa'] for tentativa in erro['tentativas']] == [1, 2]
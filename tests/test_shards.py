@@ -0,0 +1,121 @@
+import argparse
+import glob
+import json
+import os
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def codigos_da_saida(caminho):
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return sorted(cnes.normalizar_codigo_cnes(registro['codigo_cnes'])
+                      for registro in json.load(arquivo)['estabelecimentos'])
+
+
+def test_indice_shard_estavel_e_independe_da_forma_do_codigo(codigos_estado):
+    assert cnes.indice_shard(2000733, 4) == cnes.indice_shard('2000733', 4) == cnes.indice_shard(' 2000733', 4)
+
+    por_shard = {}
+    for codigo in codigos_estado[:200]:
+        por_shard.setdefault(cnes.indice_shard(codigo, 4), []).append(codigo)
+    assert sorted(por_shard) == [1, 2, 3, 4]
+    assert all(len(codigos) > 20 for codigos in por_shard.values())
+
+
+@pytest.mark.parametrize('valor', ['0/4', '5/4', '2', 'a/b'])
+def test_shard_invalido(valor):
+    with pytest.raises(argparse.ArgumentTypeError):
+        cnes.interpretar_shard(valor)
+
+
+def test_carregar_codigos_do_shard(arquivo_codigos, automatizador, codigos_estado):
+    arquivo_codigos(40)
+    automator = automatizador('http://127.0.0.1:1')
+
+    shards = [automator.carregar_codigos_cnes('codigos.json', shard=(indice, 3)) for indice in (1, 2, 3)]
+
+    assert sorted(sum(shards, [])) == sorted(codigos_estado[:40])
+    assert all(cnes.indice_shard(codigo, 3) == 2 for codigo in shards[1])
+
+
+def test_combine_das_saidas_dos_shards_igual_a_execucao_completa(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(40)
+    arquivo_codigos(40)
+    comuns = ['--url-api', url, '--cache-validade-horas', '0', '-y']
+    parser = cnes.criar_parser()
+
+    assert cnes.executar_subcomando(parser.parse_args(['fetch', 'codigos.json', '--diretorio-saida', 'completa'] + comuns))
+    for indice in (1, 2):
+        assert cnes.executar_subcomando(parser.parse_args(
+            ['fetch', 'codigos.json', '--shard', f'{indice}/2', '--formato-saida', 'jsonl',
+             '--diretorio-saida', 'shards'] + comuns
+        ))
+    saidas_shards = sorted(glob.glob('shards/cnes_resultados_codigos_shard*de2_*.jsonl'))
+    assert len(saidas_shards) == 2
+    assert not glob.glob('shards/cnes_journal_*')
+
+    assert cnes.executar_subcomando(parser.parse_args(['combine', *saidas_shards, '--diretorio-saida', 'combinada'] + comuns))
+
+    combinada = glob.glob('combinada/cnes_resultados_codigos_*.json')[0]
+    assert codigos_da_saida(combinada) == codigos_da_saida(glob.glob('completa/cnes_resultados_codigos_*.json')[0])
+    with open(combinada, 'r', encoding='utf-8') as arquivo:
+        saida = json.load(arquivo)
+    assert saida['resumo']['total_sucessos'] == 40
+    assert [shard['arquivo'] for shard in saida['metadados']['shards']] == saidas_shards
+    assert sum(shard['registros'] for shard in saida['metadados']['shards']) == 40
+
+
+def test_combine_com_delta(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(20)
+    arquivo_codigos(20)
+    comuns = ['--url-api', url, '--cache-validade-horas', '0', '-y']
+    parser = cnes.criar_parser()
+    for indice in (1, 2):
+        assert cnes.executar_subcomando(parser.parse_args(
+            ['fetch', 'codigos.json', '--shard', f'{indice}/2', '--formato-saida', 'jsonl',
+             '--diretorio-saida', 'shards'] + comuns
+        ))
+    saidas_shards = sorted(glob.glob('shards/cnes_resultados_codigos_shard*.jsonl'))
+
+    for diretorio in ('primeira', 'segunda'):
+        assert cnes.executar_subcomando(parser.parse_args(
+            ['combine', *saidas_shards, '--delta', '--diretorio-saida', diretorio] + comuns
+        ))
+
+    with open(glob.glob('primeira/cnes_delta_codigos_*_manifesto.json')[0], 'r', encoding='utf-8') as arquivo:
+        assert json.load(arquivo)['novos'] == 20
+    with open(glob.glob('segunda/cnes_delta_codigos_*_manifesto.json')[0], 'r', encoding='utf-8') as arquivo:
+        manifesto = json.load(arquivo)
+    # O escopo do snapshot é o da lista, deduzido do nome das saídas dos shards
+    assert manifesto['escopo'] == 'fetch:codigos'
+    assert (manifesto['novos'], manifesto['inalterados'], manifesto['removidos']) == (0, 20, 0)
+
+
+def test_combine_recusa_fetch_misturado_com_run():
+    for nome, chave in (('cnes_resultados_a.json', 'estabelecimentos'),
+                        ('cnes_com_macrorregiao_a.json', 'estabelecimentos_com_macrorregiao')):
+        with open(nome, 'w', encoding='utf-8') as arquivo:
+            json.dump({chave: [{'codigo_cnes': 1}]}, arquivo)
+
+    assert not cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['combine', 'cnes_resultados_a.json', 'cnes_com_macrorregiao_a.json', '-y']
+    ))
+
+
+def test_processos_locais_dividem_e_juntam(mock_em_processo, arquivo_codigos):
+    url = mock_em_processo(30)
+    arquivo_codigos(30)
+
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['fetch', 'codigos.json', '--processos', '2', '--url-api', url, '--cache-validade-horas', '0', '-y']
+    ))
+
+    saidas = glob.glob('cnes_resultados_codigos_*.json')
+    assert len(saidas) == 1
+    assert len(codigos_da_saida(saidas[0])) == 30
+    with open(saidas[0], 'r', encoding='utf-8') as arquivo:
+        assert len(json.load(arquivo)['metadados']['shards']) == 2
+    # Saídas intermediárias, journals e logs dos shards são apagados
+    assert not [nome for nome in os.listdir('.') if nome.startswith('cnes_shards_')]
@@ -0,0 +1,66 @@
+import sqlite3
+
+import cnes_automator_fast as cnes
+from conftest import ARQUIVO_MACRORREGIAO
+
+
+def gravar(registros, erros=(), registros_por_transacao=1000):
+    escritor = cnes.SQLiteResultWriter('cnes.sqlite3', registros_por_transacao=registros_por_transacao)
+    for registro in registros:
+        escritor.escrever_estabelecimento(registro)
+    for erro in erros:
+        escritor.escrever_erro(erro)
+    return escritor.finalizar({'fonte_api': 'mock'}, {'total_sucessos': len(registros)})
+
+
+def consultar(sql, *parametros):
+    with sqlite3.connect('cnes.sqlite3') as conexao:
+        return conexao.execute(sql, parametros).fetchall()
+
+
+def test_upsert_atualiza_no_lugar_e_mantem_colunas_ausentes():
+    gravar([{'codigo_cnes': 1, 'codigo_municipio': 110001, 'telefone': '3441-1234'},
+            {'codigo_cnes': 2, 'codigo_municipio': 110002}])
+    verificacao = gravar([{'codigo_cnes': '0000001', 'codigo_municipio': 110003}, {'codigo_cnes': 3}])
+
+    assert consultar('SELECT codigo_cnes, codigo_municipio, telefone FROM estabelecimentos ORDER BY codigo_cnes') == [
+        ('0000001', 110003, '3441-1234'), ('0000002', 110002, None), ('0000003', None, None)
+    ]
+    assert (verificacao['novos_no_banco'], verificacao['total_no_banco']) == (1, 3)
+    assert verificacao['execucao_id'] == 2
+
+
+def test_codigo_consultado_com_sucesso_sai_da_tabela_de_erros():
+    gravar([], [{'codigo_cnes': '0000001', 'status_code': 503, 'classe_erro': 'http', 'erro': 'HTTP 503'}])
+    assert consultar('SELECT codigo_cnes, status_code FROM erros') == [('0000001', 503)]
+
+    verificacao = gravar([{'codigo_cnes': 1}])
+
+    assert consultar('SELECT COUNT(*) FROM erros') == [(0,)]
+    assert verificacao['erros_no_banco'] == 0
+
+
+def test_consultas_por_regiao_usam_indice():
+    gravar([{'codigo_cnes': numero, 'codigo_municipio': 110001,
+             'dados_macrorregiao': {'codigo_regiao_saude': '11005', 'codigo_macrorregiao_saude': '1101'}}
+            for numero in range(10)], registros_por_transacao=3)
+
+    plano = ' '.join(linha[-1] for linha in consultar(
+        'EXPLAIN QUERY PLAN SELECT * FROM estabelecimentos WHERE codigo_regiao_saude = ?', '11005'
+    ))
+    assert 'idx_estabelecimentos_codigo_regiao_saude' in plano
+    assert consultar('SELECT COUNT(*) FROM estabelecimentos WHERE codigo_macrorregiao_saude = ?', '1101') == [(10,)]
+
+
+def test_run_grava_estabelecimentos_mesclados_no_banco(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, merger=cnes.CNESMacrorregiaeMerger(ARQUIVO_MACRORREGIAO))
+        destino = cnes.CNESMacrorregiaeMerger.criar_destino('cnes.sqlite3')
+        return await automator.processar_lista_codigos(codigos_estado[:15] + ['9999999'], destino=destino)
+
+    resultado = com_mock(executar)
+
+    assert resultado['verificacao']['total_no_banco'] == 15
+    assert consultar('SELECT COUNT(*) FROM estabelecimentos WHERE regiao_saude IS NOT NULL') == [(15,)]
+    assert consultar('SELECT codigo_cnes, status_code FROM erros') == [('9999999', 404)]
+    assert consultar('SELECT tipo FROM execucoes') == [('metadados_mesclagem',)]
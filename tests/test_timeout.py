@@ -0,0 +1,100 @@
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+def alimentar(controle, latencias, cortada=False):
+    for latencia in latencias:
+        controle.registrar(latencia, cortada=cortada)
+
+
+def test_teto_ate_juntar_amostras_minimas():
+    controle = cnes.AdaptiveTimeout(piso=0.5, teto=15.0, amostras_minimas=20)
+    alimentar(controle, [0.1] * 19)
+
+    assert controle.calcular() == 15.0
+    alimentar(controle, [0.1])
+    assert controle.calcular() == 0.5
+
+
+def test_percentil_vezes_multiplicador_entre_piso_e_teto():
+    controle = cnes.AdaptiveTimeout(piso=0.5, teto=15.0, percentil=0.99, multiplicador=3.0)
+    alimentar(controle, [0.2] * 99 + [0.8])
+
+    assert controle.calcular() == pytest.approx(2.4)
+    assert controle.resumo()['percentil_observado_ms'] == 800.0
+
+    alimentar(controle, [20.0] * 100)
+    assert controle.calcular() == 15.0
+
+
+def test_tentativa_depois_de_um_corte_usa_o_dobro():
+    controle = cnes.AdaptiveTimeout(piso=1.0, teto=10.0)
+    alimentar(controle, [0.1] * 20)
+
+    assert [controle.calcular(cortes) for cortes in (0, 1, 2, 5)] == [1.0, 2.0, 4.0, 10.0]
+
+
+def test_muitos_cortes_dobram_o_timeout():
+    controle = cnes.AdaptiveTimeout(piso=1.0, teto=10.0, taxa_cortes_maxima=0.05)
+    alimentar(controle, [0.1] * 30)
+    assert controle.calcular() == 1.0
+
+    # Os cortes não entram no percentil, mas indicam que a API ficou lenta
+    alimentar(controle, [None] * 10, cortada=True)
+    assert controle.calcular() == 2.0
+    alimentar(controle, [None] * 10, cortada=True)
+    assert controle.calcular() == 4.0
+    assert controle.resumo()['cortes'] == 20
+
+
+def test_sem_adaptacao_o_timeout_e_o_teto():
+    controle = cnes.AdaptiveTimeout(piso=1.0, teto=10.0, adaptativo=False, percentil_hedge=0.5)
+    alimentar(controle, [0.1] * 50)
+
+    assert controle.calcular() == 10.0
+    # A referência do hedge continua sendo calculada
+    assert controle.referencia_hedge == pytest.approx(0.1)
+
+
+def test_timeouts_invalidos():
+    with pytest.raises(ValueError):
+        cnes.AdaptiveTimeout(piso=5.0, teto=1.0)
+
+
+def test_requisicoes_travadas_sao_cortadas_e_retentadas(com_mock, automatizador, codigos_estado):
+    async def executar(servidor, url):
+        automator = automatizador(url, concurrent_requests=10, timeout_minimo=0.1, timeout_maximo=3.0,
+                                  retry_policy=cnes.RetryPolicy(max_tentativas=5, atraso_base=0.01))
+        return await automator.processar_lista_codigos(codigos_estado[:100])
+
+    resultado = com_mock(executar, quantidade=100, taxa_timeout=0.1, atraso_timeout_s=1.0)
+
+    assert resultado['resumo']['total_sucessos'] == 100
+    timeout = resultado['metadados']['configuracao_performance']['timeout']
+    assert timeout['cortes'] > 0
+    assert timeout['timeout_atual_segundos'] < 1.0
+    assert resultado['metadados']['estatisticas']['retentativas'] >= timeout['cortes']
+
+
+def test_prazo_informa_os_codigos_nao_concluidos(com_mock, automatizador, codigos_estado):
+    codigos = codigos_estado[:40]
+
+    async def executar(servidor, url):
+        journal = cnes.CheckpointJournal('journal.jsonl')
+        try:
+            automator = automatizador(url, concurrent_requests=2, prazo_segundos=0.4)
+            return await automator.processar_lista_codigos(codigos, journal=journal)
+        finally:
+            journal.fechar()
+
+    resultado = com_mock(executar, latencia_p50_ms=50, latencia_p95_ms=50)
+
+    nao_concluidos = resultado['metadados']['codigos_nao_concluidos']
+    assert nao_concluidos
+    assert resultado['resumo']['total_nao_concluidos'] == len(nao_concluidos)
+    assert resultado['resumo']['total_sucessos'] + len(nao_concluidos) == 40
+    assert resultado['metadados']['tempo_execucao_segundos'] < 2.0
+    journal = cnes.CheckpointJournal('journal.jsonl')
+    journal.fechar()
+    assert not set(journal.concluidos) & set(nao_concluidos)
@@ -0,0 +1,82 @@
+import glob
+import json
+
+import pytest
+
+import cnes_automator_fast as cnes
+
+
+@pytest.mark.parametrize('valor, esperado', [
+    ('2000733', '2000733'),
+    (800635, '0800635'),
+    (' 0800635 ', '0800635'),
+    (2000733.0, '2000733'),
+    ('1', '0000001')
+])
+def test_codigos_validos_sao_completados_para_7_digitos(valor, esperado):
+    assert cnes.validar_codigo_cnes(valor) == (esperado, None)
+
+
+@pytest.mark.parametrize('valor, motivo', [
+    (None, 'tipo inválido (NoneType)'),
+    (True, 'tipo inválido (bool)'),
+    ({'codigo': 1}, 'tipo inválido (dict)'),
+    (12.5, 'número não inteiro'),
+    (-2000733, 'número negativo'),
+    ('  ', 'vazio'),
+    ('20007A3', 'contém caracteres não numéricos'),
+    ('２０００７３３', 'contém caracteres não numéricos'),
+    ('20007331', 'mais de 7 dígitos'),
+    ('0000000', 'código zerado')
+])
+def test_valores_impossiveis_sao_rejeitados(valor, motivo):
+    assert cnes.validar_codigo_cnes(valor) == (None, motivo)
+
+
+def test_normalizar_mantem_o_que_nao_e_numerico():
+    assert cnes.normalizar_codigo_cnes(800635) == '0800635'
+    assert cnes.normalizar_codigo_cnes(' ABC ') == 'ABC'
+
+
+@pytest.mark.parametrize('conteudo', [
+    lambda codigos: codigos,
+    lambda codigos: [{'codigo_cnes': codigo} for codigo in codigos],
+    lambda codigos: {'estabelecimentos': [{'codigo_cnes': codigo} for codigo in codigos]},
+    lambda codigos: {'codigos': codigos}
+], ids=['lista', 'lista_de_objetos', 'estabelecimentos', 'codigos'])
+def test_carregar_valida_e_remove_duplicatas(conteudo, automatizador):
+    with open('entrada.json', 'w', encoding='utf-8') as arquivo:
+        json.dump(conteudo([800635, '2000733', '0800635', 'X', None, '2000733', 12.5]), arquivo)
+    automator = automatizador('http://127.0.0.1:1')
+
+    assert automator.carregar_codigos_cnes('entrada.json') == ['0800635', '2000733']
+    assert automator.codigos_rejeitados == [
+        {'valor': 'X', 'motivo': 'contém caracteres não numéricos'},
+        {'valor': None, 'motivo': 'tipo inválido (NoneType)'},
+        {'valor': 12.5, 'motivo': 'número não inteiro'}
+    ]
+
+
+def test_arquivo_sem_codigo_valido(automatizador):
+    with open('entrada.json', 'w', encoding='utf-8') as arquivo:
+        json.dump(['', '0000000'], arquivo)
+
+    with pytest.raises(ValueError):
+        automatizador('http://127.0.0.1:1').carregar_codigos_cnes('entrada.json')
+
+
+def test_rejeitados_nao_chegam_a_api(mock_em_processo, codigos_estado):
+    url = mock_em_processo(10)
+    with open('codigos.json', 'w', encoding='utf-8') as arquivo:
+        json.dump([int(codigo) for codigo in codigos_estado[:10]] + ['ABC', -1, '12345678'], arquivo)
+
+    assert cnes.executar_subcomando(cnes.criar_parser().parse_args(
+        ['fetch', 'codigos.json', '--url-api', url, '--cache-validade-horas', '0', '-y']
+    ))
+
+    with open(glob.glob('cnes_resultados_codigos_*.json')[0], 'r', encoding='utf-8') as arquivo:
+        saida = json.load(arquivo)
+    assert len(saida['estabelecimentos']) == 10
+    assert saida['erros'] == []
+    assert saida['metadados']['estatisticas']['tentativas'] == 10
+    assert [rejeitado['valor'] for rejeitado in saida['metadados']['codigos_rejeitados']] == ['ABC', -1, '12345678']